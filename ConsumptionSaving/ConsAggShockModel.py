@@ -12,8 +12,8 @@ import scipy.stats as stats
 from HARKinterpolation import LinearInterp, LinearInterpOnInterp1D, ConstantFunction, IdentityFunction,\
                               VariableLowerBoundFunc2D, BilinearInterp, LowerEnvelope2D, UpperEnvelope
 from HARKutilities import CRRAutility, CRRAutilityP, CRRAutilityPP, CRRAutilityP_inv,\
-                          CRRAutility_invP, CRRAutility_inv, combineIndepDstns,\
-                          approxMeanOneLognormal
+                          CRRAutility_invP, CRRAutility_inv, approxMeanOneLognormal,\
+                          ProductDistribution
 from HARKsimulation import drawDiscrete, drawUniform
 from ConsIndShockModel import ConsumerSolution, IndShockConsumerType
 from HARKcore import HARKobject, Market, AgentType
@@ -156,7 +156,8 @@ class AggShockConsumerType(IndShockConsumerType):
         
     def addAggShkDstn(self,AggShkDstn):
         '''
-        Updates attribute IncomeDstn by combining idiosyncratic shocks with aggregate shocks.
+        Updates attribute IncomeDstn by combining idiosyncratic shocks with aggregate shocks,
+        as a ProductDistribution that keeps the two independent factors separate.
         
         Parameters
         ----------
@@ -173,7 +174,7 @@ class AggShockConsumerType(IndShockConsumerType):
             self.IncomeDstn = self.IncomeDstnWithoutAggShocks
         else:
             self.IncomeDstnWithoutAggShocks = self.IncomeDstn
-        self.IncomeDstn = [combineIndepDstns(self.IncomeDstn[t],AggShkDstn) for t in range(self.T_cycle)]
+        self.IncomeDstn = [ProductDistribution(self.IncomeDstn[t],AggShkDstn) for t in range(self.T_cycle)]
         
         
     def simBirth(self,which_agents):
@@ -388,7 +389,7 @@ class AggShockMarkovConsumerType(AggShockConsumerType):
         IncomeDstnOut = []
         N = self.MrkvArray.shape[0]
         for t in range(self.T_cycle):
-            IncomeDstnOut.append([combineIndepDstns(self.IncomeDstn[t][n],AggShkDstn[n]) for n in range(N)])
+            IncomeDstnOut.append([ProductDistribution(self.IncomeDstn[t][n],AggShkDstn[n]) for n in range(N)])
         self.IncomeDstn = IncomeDstnOut
             
     
@@ -519,12 +520,13 @@ def solveConsAggShock(solution_next,IncomeDstn,LivPrb,DiscFac,CRRA,PermGroFac,
     ----------
     solution_next : ConsumerSolution
         The solution to the succeeding one period problem.
-    IncomeDstn : [np.array]
+    IncomeDstn : [np.array] or ProductDistribution
         A list containing five arrays of floats, representing a discrete
         approximation to the income process between the period being solved
         and the one immediately following (in solution_next). Order: event
         probabilities, idisyncratic permanent shocks, idiosyncratic transitory
-        shocks, aggregate permanent shocks, aggregate transitory shocks.
+        shocks, aggregate permanent shocks, aggregate transitory shocks.  As a
+        ProductDistribution, its independent factors are kept on separate axes.
     LivPrb : float
         Survival probability; likelihood of being alive at the beginning of
         the succeeding period.    
@@ -564,60 +566,51 @@ def solveConsAggShock(solution_next,IncomeDstn,LivPrb,DiscFac,CRRA,PermGroFac,
     vPfuncNext = solution_next.vPfunc
     mNrmMinNext = solution_next.mNrmMin
     
-    # Unpack the income shocks
-    ShkPrbsNext  = IncomeDstn[0]
-    PermShkValsNext = IncomeDstn[1]
-    TranShkValsNext = IncomeDstn[2]
-    PermShkAggValsNext = IncomeDstn[3]
-    TranShkAggValsNext = IncomeDstn[4]
-    ShkCount = ShkPrbsNext.size
-        
-    # Make the grid of end-of-period asset values, and a tiled version
+    # Unpack the income shocks, with each independent factor of their distribution
+    # (such as idiosyncratic and aggregate shocks) on its own axis
+    if not isinstance(IncomeDstn,ProductDistribution):
+        IncomeDstn = ProductDistribution(IncomeDstn)
+    PermShkValsNext, TranShkValsNext, PermShkAggValsNext, TranShkAggValsNext = IncomeDstn.broadcastValues(lead=2)
+    ShkAxes = (1,)*len(IncomeDstn.shape)
+        
+    # Make the grid of end-of-period asset values, and a reshaped version
     aNrmNow = aXtraGrid
     aCount = aNrmNow.size
     Mcount = Mgrid.size
-    aXtra_tiled = np.tile(np.reshape(aNrmNow,(1,aCount,1)),(Mcount,1,ShkCount))
-    
-    # Make tiled versions of the income shocks
-    # Dimension order: Mnow, aNow, Shk
-    ShkPrbsNext_tiled = np.tile(np.reshape(ShkPrbsNext,(1,1,ShkCount)),(Mcount,aCount,1))
-    PermShkValsNext_tiled = np.tile(np.reshape(PermShkValsNext,(1,1,ShkCount)),(Mcount,aCount,1))
-    TranShkValsNext_tiled = np.tile(np.reshape(TranShkValsNext,(1,1,ShkCount)),(Mcount,aCount,1))
-    PermShkAggValsNext_tiled = np.tile(np.reshape(PermShkAggValsNext,(1,1,ShkCount)),(Mcount,aCount,1))
-    TranShkAggValsNext_tiled = np.tile(np.reshape(TranShkAggValsNext,(1,1,ShkCount)),(Mcount,aCount,1))
+    aXtra_shaped = np.reshape(aNrmNow,(1,aCount) + ShkAxes)
     
+    # Dimension order: Mnow, aNow, then one axis per factor of the shock distribution.
+    # Arrays only span the axes they vary along, and broadcast over the others.
     # Calculate returns to capital and labor in the next period
-    AaggNow_tiled = np.tile(np.reshape(AFunc(Mgrid),(Mcount,1,1)),(1,aCount,ShkCount))
-    kNext_array = AaggNow_tiled/(PermGroFacAgg*PermShkAggValsNext_tiled) # Next period's aggregate capital to labor ratio
-    kNextEff_array = kNext_array/TranShkAggValsNext_tiled # Same thing, but account for *transitory* shock
+    AaggNow_shaped = np.reshape(AFunc(Mgrid),(Mcount,1) + ShkAxes)
+    kNext_array = AaggNow_shaped/(PermGroFacAgg*PermShkAggValsNext) # Next period's aggregate capital to labor ratio
+    kNextEff_array = kNext_array/TranShkAggValsNext # Same thing, but account for *transitory* shock
     R_array = Rfunc(kNextEff_array) # Interest factor on aggregate assets
     Reff_array = R_array/LivPrb # Effective interest factor on individual assets *for survivors*
-    wEff_array = wFunc(kNextEff_array)*TranShkAggValsNext_tiled # Effective wage rate (accounts for labor supply)
-    PermShkTotal_array = PermGroFac*PermGroFacAgg*PermShkValsNext_tiled*PermShkAggValsNext_tiled # total / combined permanent shock
+    wEff_array = wFunc(kNextEff_array)*TranShkAggValsNext # Effective wage rate (accounts for labor supply)
+    PermShkTotal_array = PermGroFac*PermGroFacAgg*PermShkValsNext*PermShkAggValsNext # total / combined permanent shock
     Mnext_array = kNext_array*R_array + wEff_array # next period's aggregate market resources
     
     # Find the natural borrowing constraint for each value of M in the Mgrid.
     # There is likely a faster way to do this, but someone needs to do the math:
     # is aNrmMin determined by getting the worst shock of all four types?
-    aNrmMin_candidates = PermGroFac*PermGroFacAgg*PermShkValsNext_tiled[:,0,:]*PermShkAggValsNext_tiled[:,0,:]/Reff_array[:,0,:]*\
-                         (mNrmMinNext(Mnext_array[:,0,:]) - wEff_array[:,0,:]*TranShkValsNext_tiled[:,0,:])
-    aNrmMin_vec = np.max(aNrmMin_candidates,axis=1)
+    aNrmMin_candidates = PermShkTotal_array/Reff_array*(mNrmMinNext(Mnext_array) - wEff_array*TranShkValsNext)
+    aNrmMin_vec = np.max(np.reshape(aNrmMin_candidates,(Mcount,-1)),axis=1)
     BoroCnstNat_vec = aNrmMin_vec
-    aNrmMin_tiled = np.tile(np.reshape(aNrmMin_vec,(Mcount,1,1)),(1,aCount,ShkCount))
-    aNrmNow_tiled = aNrmMin_tiled + aXtra_tiled
+    aNrmNow_shaped = np.reshape(aNrmMin_vec,(Mcount,1) + ShkAxes) + aXtra_shaped
     
     # Calculate market resources next period (and a constant array of capital-to-labor ratio)   
-    mNrmNext_array = Reff_array*aNrmNow_tiled/PermShkTotal_array + TranShkValsNext_tiled*wEff_array
+    mNrmNext_array = Reff_array*aNrmNow_shaped/PermShkTotal_array + TranShkValsNext*wEff_array
             
     # Find marginal value next period at every income shock realization and every aggregate market resource gridpoint
-    vPnext_array = Reff_array*PermShkTotal_array**(-CRRA)*vPfuncNext(mNrmNext_array,Mnext_array)
+    vPnext_array = Reff_array*PermShkTotal_array**(-CRRA)*vPfuncNext(mNrmNext_array,np.broadcast_to(Mnext_array,mNrmNext_array.shape))
     
     # Calculate expectated marginal value at the end of the period at every asset gridpoint
-    EndOfPrdvP = DiscFac*LivPrb*np.sum(vPnext_array*ShkPrbsNext_tiled,axis=2)
+    EndOfPrdvP = DiscFac*LivPrb*IncomeDstn.expectation(vPnext_array)
     
     # Calculate optimal consumption from each asset gridpoint
     cNrmNow = EndOfPrdvP**(-1.0/CRRA)
-    mNrmNow = aNrmNow_tiled[:,:,0] + cNrmNow
+    mNrmNow = np.reshape(aNrmNow_shaped,(Mcount,aCount)) + cNrmNow
     
     # Loop through the values in Mgrid and make a linear consumption function for each
     cFuncBaseByM_list = []
@@ -665,12 +658,13 @@ def solveConsAggMarkov(solution_next,IncomeDstn,LivPrb,DiscFac,CRRA,MrkvArray,
     ----------
     solution_next : ConsumerSolution
         The solution to the succeeding one period problem.
-    IncomeDstn : [[np.array]]
+    IncomeDstn : [[np.array]] or [ProductDistribution]
         A list of lists, each containing five arrays of floats, representing a
         discrete approximation to the income process between the period being
         solved and the one immediately following (in solution_next). Order: event
         probabilities, idisyncratic permanent shocks, idiosyncratic transitory
-        shocks, aggregate permanent shocks, aggregate transitory shocks.
+        shocks, aggregate permanent shocks, aggregate transitory shocks.  Each
+        can also be a ProductDistribution, as in solveConsAggShock.
     LivPrb : float
         Survival probability; likelihood of being alive at the beginning of
         the succeeding period.    
@@ -726,22 +720,14 @@ def solveConsAggMarkov(solution_next,IncomeDstn,LivPrb,DiscFac,CRRA,MrkvArray,
         vPfuncNext = solution_next.vPfunc[j]
         mNrmMinNext = solution_next.mNrmMin[j]
         
-        # Unpack the income shocks
-        ShkPrbsNext  = IncomeDstn[j][0]
-        PermShkValsNext = IncomeDstn[j][1]
-        TranShkValsNext = IncomeDstn[j][2]
-        PermShkAggValsNext = IncomeDstn[j][3]
-        TranShkAggValsNext = IncomeDstn[j][4]
-        ShkCount = ShkPrbsNext.size
-        aXtra_tiled = np.tile(np.reshape(aXtraGrid,(1,aCount,1)),(Mcount,1,ShkCount))
-        
-        # Make tiled versions of the income shocks
-        # Dimension order: Mnow, aNow, Shk
-        ShkPrbsNext_tiled = np.tile(np.reshape(ShkPrbsNext,(1,1,ShkCount)),(Mcount,aCount,1))
-        PermShkValsNext_tiled = np.tile(np.reshape(PermShkValsNext,(1,1,ShkCount)),(Mcount,aCount,1))
-        TranShkValsNext_tiled = np.tile(np.reshape(TranShkValsNext,(1,1,ShkCount)),(Mcount,aCount,1))
-        PermShkAggValsNext_tiled = np.tile(np.reshape(PermShkAggValsNext,(1,1,ShkCount)),(Mcount,aCount,1))
-        TranShkAggValsNext_tiled = np.tile(np.reshape(TranShkAggValsNext,(1,1,ShkCount)),(Mcount,aCount,1))
+        # Unpack the income shocks, with each independent factor of their distribution
+        # on its own axis; dimension order: Mnow, aNow, then one axis per factor
+        IncomeDstnNext = IncomeDstn[j]
+        if not isinstance(IncomeDstnNext,ProductDistribution):
+            IncomeDstnNext = ProductDistribution(IncomeDstnNext)
+        PermShkValsNext, TranShkValsNext, PermShkAggValsNext, TranShkAggValsNext = IncomeDstnNext.broadcastValues(lead=2)
+        ShkAxes = (1,)*len(IncomeDstnNext.shape)
+        aXtra_shaped = np.reshape(aXtraGrid,(1,aCount) + ShkAxes)
         
         # Make a tiled grid of end-of-period aggregate assets.  These lines use
         # next prd state j's aggregate saving rule to get a relevant set of Aagg,
@@ -756,35 +742,33 @@ def solveConsAggMarkov(solution_next,IncomeDstn,LivPrb,DiscFac,CRRA,MrkvArray,
         # conditional marginal value functions are constructed is not relevant
         # to the values at which it will actually be evaluated.
         AaggGrid = AFunc[j](Mgrid)
-        AaggNow_tiled = np.tile(np.reshape(AaggGrid,(Mcount,1,1)),(1,aCount,ShkCount))
+        AaggNow_shaped = np.reshape(AaggGrid,(Mcount,1) + ShkAxes)
         
         # Calculate returns to capital and labor in the next period
-        kNext_array = AaggNow_tiled/(PermGroFacAgg[j]*PermShkAggValsNext_tiled) # Next period's aggregate capital to labor ratio
-        kNextEff_array = kNext_array/TranShkAggValsNext_tiled # Same thing, but account for *transitory* shock
+        kNext_array = AaggNow_shaped/(PermGroFacAgg[j]*PermShkAggValsNext) # Next period's aggregate capital to labor ratio
+        kNextEff_array = kNext_array/TranShkAggValsNext # Same thing, but account for *transitory* shock
         R_array = Rfunc(kNextEff_array) # Interest factor on aggregate assets
         Reff_array = R_array/LivPrb # Effective interest factor on individual assets *for survivors*
-        wEff_array = wFunc(kNextEff_array)*TranShkAggValsNext_tiled # Effective wage rate (accounts for labor supply)
-        PermShkTotal_array = PermGroFac*PermGroFacAgg[j]*PermShkValsNext_tiled*PermShkAggValsNext_tiled # total / combined permanent shock
+        wEff_array = wFunc(kNextEff_array)*TranShkAggValsNext # Effective wage rate (accounts for labor supply)
+        PermShkTotal_array = PermGroFac*PermGroFacAgg[j]*PermShkValsNext*PermShkAggValsNext # total / combined permanent shock
         Mnext_array = kNext_array*R_array + wEff_array # next period's aggregate market resources
         
         # Find the natural borrowing constraint for each value of M in the Mgrid.
         # There is likely a faster way to do this, but someone needs to do the math:
         # is aNrmMin determined by getting the worst shock of all four types?
-        aNrmMin_candidates = PermGroFac*PermGroFacAgg[j]*PermShkValsNext_tiled[:,0,:]*PermShkAggValsNext_tiled[:,0,:]/Reff_array[:,0,:]*\
-                             (mNrmMinNext(Mnext_array[:,0,:]) - wEff_array[:,0,:]*TranShkValsNext_tiled[:,0,:])
-        aNrmMin_vec = np.max(aNrmMin_candidates,axis=1)
+        aNrmMin_candidates = PermShkTotal_array/Reff_array*(mNrmMinNext(Mnext_array) - wEff_array*TranShkValsNext)
+        aNrmMin_vec = np.max(np.reshape(aNrmMin_candidates,(Mcount,-1)),axis=1)
         BoroCnstNat_vec = aNrmMin_vec
-        aNrmMin_tiled = np.tile(np.reshape(aNrmMin_vec,(Mcount,1,1)),(1,aCount,ShkCount))
-        aNrmNow_tiled = aNrmMin_tiled + aXtra_tiled
+        aNrmNow_shaped = np.reshape(aNrmMin_vec,(Mcount,1) + ShkAxes) + aXtra_shaped
         
         # Calculate market resources next period (and a constant array of capital-to-labor ratio)   
-        mNrmNext_array = Reff_array*aNrmNow_tiled/PermShkTotal_array + TranShkValsNext_tiled*wEff_array
+        mNrmNext_array = Reff_array*aNrmNow_shaped/PermShkTotal_array + TranShkValsNext*wEff_array
                 
         # Find marginal value next period at every income shock realization and every aggregate market resource gridpoint
-        vPnext_array = Reff_array*PermShkTotal_array**(-CRRA)*vPfuncNext(mNrmNext_array,Mnext_array)
+        vPnext_array = Reff_array*PermShkTotal_array**(-CRRA)*vPfuncNext(mNrmNext_array,np.broadcast_to(Mnext_array,mNrmNext_array.shape))
         
         # Calculate expectated marginal value at the end of the period at every asset gridpoint
-        EndOfPrdvP = DiscFac*LivPrb*np.sum(vPnext_array*ShkPrbsNext_tiled,axis=2)
+        EndOfPrdvP = DiscFac*LivPrb*IncomeDstnNext.expectation(vPnext_array)
         
         # Make the conditional end-of-period marginal value function
         BoroCnstNat = LinearInterp(np.insert(AaggGrid,0,0.0),np.insert(BoroCnstNat_vec,0,0.0))
@@ -942,8 +926,8 @@ class CobbDouglasEconomy(Market):
         self.RfreeSS = (1.0 + self.CapShare*self.kSS**(self.CapShare-1.0) - self.DeprFac)
         self.MSS = self.kSS*self.RfreeSS + self.wRteSS
         self.convertKtoY = lambda KtoY : KtoY**(1.0/(1.0 - self.CapShare)) # converts K/Y to K/L
-        self.Rfunc = lambda k : (1.0 + self.CapShare*k**(self.CapShare-1.0) - self.DeprFac)
-        self.wFunc = lambda k : ((1.0-self.CapShare)*k**(self.CapShare))
+        self.Rfunc = CobbDouglasInterestFactor(self.CapShare,self.DeprFac)
+        self.wFunc = CobbDouglasWageRate(self.CapShare)
         self.KtoLnow_init = self.kSS
         self.MaggNow_init = self.kSS
         self.AaggNow_init = self.kSS
@@ -988,7 +972,7 @@ class CobbDouglasEconomy(Market):
         '''
         self.TranShkAggDstn = approxMeanOneLognormal(sigma=self.TranShkAggStd,N=self.TranShkAggCount)
         self.PermShkAggDstn = approxMeanOneLognormal(sigma=self.PermShkAggStd,N=self.PermShkAggCount)
-        self.AggShkDstn = combineIndepDstns(self.PermShkAggDstn,self.TranShkAggDstn)
+        self.AggShkDstn = ProductDistribution(self.PermShkAggDstn,self.TranShkAggDstn)
         
     def reset(self):
         '''
@@ -1200,7 +1184,7 @@ class SmallOpenEconomy(Market):
         '''
         self.TranShkAggDstn = approxMeanOneLognormal(sigma=self.TranShkAggStd,N=self.TranShkAggCount)
         self.PermShkAggDstn = approxMeanOneLognormal(sigma=self.PermShkAggStd,N=self.PermShkAggCount)
-        self.AggShkDstn = combineIndepDstns(self.PermShkAggDstn,self.TranShkAggDstn)
+        self.AggShkDstn = ProductDistribution(self.PermShkAggDstn,self.TranShkAggDstn)
         
     def millRule(self):
         '''
@@ -1398,7 +1382,7 @@ class CobbDouglasMarkovEconomy(CobbDouglasEconomy):
         for i in range(StateCount):
             TranShkAggDstn.append(approxMeanOneLognormal(sigma=self.TranShkAggStd[i],N=self.TranShkAggCount))
             PermShkAggDstn.append(approxMeanOneLognormal(sigma=self.PermShkAggStd[i],N=self.PermShkAggCount))
-            AggShkDstn.append(combineIndepDstns(PermShkAggDstn[-1],TranShkAggDstn[-1]))
+            AggShkDstn.append(ProductDistribution(PermShkAggDstn[-1],TranShkAggDstn[-1]))
             
         self.TranShkAggDstn = TranShkAggDstn
         self.PermShkAggDstn = PermShkAggDstn
@@ -1687,6 +1671,60 @@ class CobbDouglasAggVars(HARKobject):
         self.PermShkAggNow = PermShkAggNow
         self.TranShkAggNow = TranShkAggNow
         
+class CobbDouglasInterestFactor(HARKobject):
+    '''
+    The interest factor as a function of the capital to labor ratio in a Cobb-Douglas
+    economy.  A class rather than a lambda so that agent types holding it (as Rfunc)
+    can be pickled, e.g. to be sent to an AgentPool.
+    '''
+    def __init__(self,CapShare,DeprFac):
+        '''
+        Make a new instance of CobbDouglasInterestFactor.
+        
+        Parameters
+        ----------
+        CapShare : float
+            Capital's share of output.
+        DeprFac : float
+            Depreciation factor of capital.
+            
+        Returns
+        -------
+        None
+        '''
+        self.CapShare = CapShare
+        self.DeprFac  = DeprFac
+        self.distance_criteria = ['CapShare','DeprFac']
+        
+    def __call__(self,k):
+        return (1.0 + self.CapShare*k**(self.CapShare-1.0) - self.DeprFac)
+    
+    
+class CobbDouglasWageRate(HARKobject):
+    '''
+    The wage rate as a function of the capital to labor ratio in a Cobb-Douglas
+    economy; see CobbDouglasInterestFactor.
+    '''
+    def __init__(self,CapShare):
+        '''
+        Make a new instance of CobbDouglasWageRate.
+        
+        Parameters
+        ----------
+        CapShare : float
+            Capital's share of output.
+            
+        Returns
+        -------
+        None
+        '''
+        self.CapShare = CapShare
+        self.distance_criteria = ['CapShare']
+        
+    def __call__(self,k):
+        return ((1.0-self.CapShare)*k**(self.CapShare))
+    
+
 class AggregateSavingRule(HARKobject):
     '''
     A class to represent agent beliefs about aggregate saving at the end of this period (AaggNow) as
@@ -18,16 +18,19 @@ sys.path.insert(0, os.path.abspath('../'))
 sys.path.insert(0, os.path.abspath('./'))
 
 from copy import copy, deepcopy
+from operator import attrgetter
 import numpy as np
 from scipy.optimize import newton
 from HARKcore import AgentType, Solution, NullFunc, HARKobject
 from HARKutilities import warnings  # Because of "patch" to warnings modules
-from HARKinterpolation import CubicInterp, LowerEnvelope, LinearInterp
-from HARKsimulation import drawDiscrete, drawBernoulli, drawLognormal, drawUniform
+from HARKinterpolation import CubicInterp, LowerEnvelope, LinearInterp, makeLinearInterpStack, \
+                              LinearInterpStack, evalFlat
+from HARKsimulation import drawDiscrete, drawBernoulli, drawLognormal, drawUniform, \
+                         drawUniformByIndex, makeAliasTableStack, drawDiscreteStacked
 from HARKutilities import approxMeanOneLognormal, addDiscreteOutcomeConstantMean,\
                           combineIndepDstns, makeGridExpMult, CRRAutility, CRRAutilityP, \
                           CRRAutilityPP, CRRAutilityP_inv, CRRAutility_invP, CRRAutility_inv, \
-                          CRRAutilityP_invP
+                          CRRAutilityP_invP, memoize
 
 utility       = CRRAutility
 utilityP      = CRRAutilityP
@@ -147,6 +150,7 @@ class ValueFunc(HARKobject):
     '''
     A class for representing a value function.  The underlying interpolation is
     in the space of (m,u_inv(v)); this class "re-curves" to the value function.
+    Arrays are evaluated through the flatForm of the interpolation (see evalFlat).
     '''
     distance_criteria = ['func','CRRA']
     
@@ -169,7 +173,7 @@ class ValueFunc(HARKobject):
         self.func = deepcopy(vFuncNvrs)
         self.CRRA = CRRA
         
-    def __call__(self,m):
+    def __call__(self,m,sorted_x=False):
         '''
         Evaluate the value function at given levels of market resources m.
         
@@ -178,6 +182,9 @@ class ValueFunc(HARKobject):
         m : float or np.array
             Market resources (normalized by permanent income) whose value is to
             be found.
+        sorted_x : boolean
+            Optional indicator that m is sorted in increasing order along its
+            last axis, as in HARKinterpolator1D.__call__.
             
         Returns
         -------
@@ -185,13 +192,15 @@ class ValueFunc(HARKobject):
             Lifetime value of beginning this period with market resources m; has
             same size as input m.
         '''
-        return utility(self.func(m),gam=self.CRRA)
+        return utility(evalFlat(self.func,m,sorted_x=sorted_x),gam=self.CRRA)
 
      
 class MargValueFunc(HARKobject):
     '''
     A class for representing a marginal value function in models where the
     standard envelope condition of v'(m) = u'(c(m)) holds (with CRRA utility).
+    Arrays are evaluated through the flatForm of the consumption function (see
+    evalFlat), so that an envelope of LinearInterps is a single interpolation.
     '''
     distance_criteria = ['cFunc','CRRA']
     
@@ -216,7 +225,7 @@ class MargValueFunc(HARKobject):
         self.cFunc = deepcopy(cFunc)
         self.CRRA = CRRA
         
-    def __call__(self,m):
+    def __call__(self,m,sorted_x=False):
         '''
         Evaluate the marginal value function at given levels of market resources m.
         
@@ -225,6 +234,9 @@ class MargValueFunc(HARKobject):
         m : float or np.array
             Market resources (normalized by permanent income) whose marginal
             value is to be found.
+        sorted_x : boolean
+            Optional indicator that m is sorted in increasing order along its
+            last axis, as in HARKinterpolator1D.__call__.
             
         Returns
         -------
@@ -232,9 +244,9 @@ class MargValueFunc(HARKobject):
             Marginal lifetime value of beginning this period with market
             resources m; has same size as input m.
         '''
-        return utilityP(self.cFunc(m),gam=self.CRRA)
+        return utilityP(evalFlat(self.cFunc,m,sorted_x=sorted_x),gam=self.CRRA)
         
-    def derivative(self,m):
+    def derivative(self,m,sorted_x=False):
         '''
         Evaluate the derivative of the marginal value function at given levels
         of market resources m; this is the marginal marginal value function.
@@ -244,6 +256,9 @@ class MargValueFunc(HARKobject):
         m : float or np.array
             Market resources (normalized by permanent income) whose marginal
             marginal value is to be found.
+        sorted_x : boolean
+            Optional indicator that m is sorted in increasing order along its
+            last axis, as in HARKinterpolator1D.__call__.
             
         Returns
         -------
@@ -251,7 +266,7 @@ class MargValueFunc(HARKobject):
             Marginal marginal lifetime value of beginning this period with market
             resources m; has same size as input m.
         '''
-        c, MPC = self.cFunc.eval_with_derivative(m)
+        c, MPC = evalFlat(self.cFunc,m,derivative=True,sorted_x=sorted_x)
         return MPC*utilityPP(c,gam=self.CRRA)
         
         
@@ -259,6 +274,8 @@ class MargMargValueFunc(HARKobject):
     '''
     A class for representing a marginal marginal value function in models where
     the standard envelope condition of v'(m) = u'(c(m)) holds (with CRRA utility).
+    Arrays are evaluated through the flatForm of the consumption function (see
+    evalFlat), so that an envelope of LinearInterps is a single interpolation.
     '''
     distance_criteria = ['cFunc','CRRA']
     
@@ -283,7 +300,7 @@ class MargMargValueFunc(HARKobject):
         self.cFunc = deepcopy(cFunc)
         self.CRRA = CRRA
         
-    def __call__(self,m):
+    def __call__(self,m,sorted_x=False):
         '''
         Evaluate the marginal marginal value function at given levels of market
         resources m.
@@ -293,6 +310,9 @@ class MargMargValueFunc(HARKobject):
         m : float or np.array
             Market resources (normalized by permanent income) whose marginal
             marginal value is to be found.
+        sorted_x : boolean
+            Optional indicator that m is sorted in increasing order along its
+            last axis, as in HARKinterpolator1D.__call__.
             
         Returns
         -------
@@ -300,7 +320,7 @@ class MargMargValueFunc(HARKobject):
             Marginal marginal lifetime value of beginning this period with market
             resources m; has same size as input m.
         '''
-        c, MPC = self.cFunc.eval_with_derivative(m)
+        c, MPC = evalFlat(self.cFunc,m,derivative=True,sorted_x=sorted_x)
         return MPC*utilityPP(c,gam=self.CRRA)
 
 
@@ -809,7 +829,8 @@ class ConsIndShockSolverBasic(ConsIndShockSetup):
         '''
         Calculate end-of-period marginal value of assets at each point in aNrmNow.
         Does so by taking a weighted sum of next period marginal values across
-        income shocks (in a preconstructed grid self.mNrmNext).
+        income shocks (in a preconstructed grid self.mNrmNext, each row of which
+        increases with aNrmNow).
         
         Parameters
         ----------
@@ -823,7 +844,7 @@ class ConsIndShockSolverBasic(ConsIndShockSetup):
 
         EndOfPrdvP  = self.DiscFacEff*self.Rfree*self.PermGroFac**(-self.CRRA)*np.sum(
                       self.PermShkVals_temp**(-self.CRRA)*
-                      self.vPfuncNext(self.mNrmNext)*self.ShkPrbs_temp,axis=0)
+                      self.vPfuncNext(self.mNrmNext,sorted_x=True)*self.ShkPrbs_temp,axis=0)
         return EndOfPrdvP
                     
 
@@ -884,7 +905,7 @@ class ConsIndShockSolverBasic(ConsIndShockSetup):
         cFuncNowUnc = interpolator(mNrm,cNrm)
 
         # Combine the constrained and unconstrained functions into the true consumption function
-        cFuncNow = LowerEnvelope(cFuncNowUnc,self.cFuncNowCnst)
+        cFuncNow = LowerEnvelope(cFuncNowUnc,self.cFuncNowCnst,resolve=True)
 
         # Make the marginal value function and the marginal marginal value function
         vPfuncNow = MargValueFunc(cFuncNow,self.CRRA)
@@ -1226,7 +1247,289 @@ def solveConsIndShock(solution_next,IncomeDstn,LivPrb,DiscFac,CRRA,Rfree,PermGro
                                              PermGroFac,BoroCnstArt,aXtraGrid,vFuncBool,CubicBool)
     solver.prepareToSolve()       # Do some preparatory work
     solution_now = solver.solve() # Solve the period
-    return solution_now  
+    return solution_now
+
+
+####################################################################################################
+####################################################################################################
+
+class ConsIndShockSolverBatch(ConsIndShockSolverBasic):
+    '''
+    This class solves a single period of a standard consumption-saving problem
+    (as in ConsIndShockSolverBasic) for many values of DiscFac and CRRA at once.
+    Every intermediate array carries a leading "parameter" axis, and the consump-
+    tion functions for all parameter points are packed into one LinearInterpStack.
+    Linear interpolation only; the value function is not computed.
+
+    The solution_next passed to this solver is a ConsumerSolution whose cFunc is
+    a LinearInterpStack and whose mNrmMin, hNrm, MPCmin and MPCmax are arrays with
+    one element per parameter point; the solution it returns has the same form.
+    Marginal value is computed directly from the consumption function by the
+    envelope condition, so vPfunc is not needed.
+    '''
+    def __init__(self,solution_next,IncomeDstn,LivPrb,DiscFac,CRRA,Rfree,
+                      PermGroFac,BoroCnstArt,aXtraGrid):
+        '''
+        Constructor for a new batched solver for problems with income subject to
+        permanent and transitory shocks.  Inputs are as for ConsIndShockSetup,
+        except that DiscFac and CRRA are arrays with one element per parameter
+        point and there are no vFuncBool or CubicBool inputs.
+
+        Returns
+        -------
+        None
+        '''
+        ConsIndShockSetup.__init__(self,solution_next,IncomeDstn,LivPrb,
+                                   np.asarray(DiscFac,dtype=float),np.asarray(CRRA,dtype=float),
+                                   Rfree,PermGroFac,BoroCnstArt,aXtraGrid,False,False)
+
+    def setAndUpdateValues(self,solution_next,IncomeDstn,LivPrb,DiscFac):
+        '''
+        Unpacks some of the inputs (and calculates simple objects based on them),
+        storing the results in self for use by other methods.  Identical to the
+        method in ConsIndShockSetup (whose formulas apply elementwise across the
+        parameter points), but also stores next period's consumption function.
+
+        Parameters
+        ----------
+        solution_next : ConsumerSolution
+            The batched solution to next period's one period problem.
+        IncomeDstn : [np.array]
+            A list containing three arrays of floats, representing a discrete
+            approximation to the income process between the period being solved
+            and the one immediately following (in solution_next). Order: event
+            probabilities, permanent shocks, transitory shocks.
+        LivPrb : float
+            Survival probability; likelihood of being alive at the beginning of
+            the succeeding period.
+        DiscFac : np.array
+            Intertemporal discount factors for future utility.
+
+        Returns
+        -------
+        None
+        '''
+        ConsIndShockSetup.setAndUpdateValues(self,solution_next,IncomeDstn,LivPrb,DiscFac)
+        self.cFuncNext = solution_next.cFunc
+
+    def defBoroCnst(self,BoroCnstArt):
+        '''
+        Defines the constrained portion of the consumption function for each
+        parameter point, stored as the gridpoints of a two point upper bound in
+        the attributes cap_x and cap_y.  Uses the artificial and natural borrowing
+        constraints.
+
+        Parameters
+        ----------
+        BoroCnstArt : float or None
+            Borrowing constraint for the minimum allowable assets to end the
+            period with.  If it is less than the natural borrowing constraint,
+            then it is irrelevant; BoroCnstArt=None indicates no artificial bor-
+            rowing constraint.
+
+        Returns
+        -------
+        none
+        '''
+        # Calculate the minimum allowable value of money resources in this period
+        self.BoroCnstNat = (self.solution_next.mNrmMin - self.TranShkMinNext)*\
+                           (self.PermGroFac*self.PermShkMinNext)/self.Rfree
+        if BoroCnstArt is None:
+            self.mNrmMinNow = self.BoroCnstNat
+        else:
+            self.mNrmMinNow = np.maximum(self.BoroCnstNat,BoroCnstArt)
+        self.MPCmaxEff = np.where(self.BoroCnstNat < self.mNrmMinNow,1.0,self.MPCmaxNow)
+
+        # Define the borrowing constraint (limiting consumption function)
+        self.cap_x = np.vstack((self.mNrmMinNow,self.mNrmMinNow+1)).transpose()
+        self.cap_y = np.tile(np.array([0.0, 1.0]),(self.mNrmMinNow.size,1))
+
+    def prepareToCalcEndOfPrdvP(self):
+        '''
+        Prepare to calculate end-of-period marginal value by creating an array
+        of market resources that the agent could have next period, considering
+        the grid of end-of-period assets and the distribution of shocks he might
+        experience next period.  Arrays are shaped (parameter,shock,asset) and
+        are broadcast rather than tiled.
+
+        Parameters
+        ----------
+        none
+
+        Returns
+        -------
+        aNrmNow : np.array
+            A 2D array of end-of-period assets, one row per parameter point; also
+            stored as attribute of self.
+        '''
+        aNrmNow = np.asarray(self.aXtraGrid)[np.newaxis,:] + self.BoroCnstNat[:,np.newaxis]
+
+        # Put the income shocks into useful shapes
+        PermShkVals_temp  = self.PermShkValsNext[np.newaxis,:,np.newaxis]
+        TranShkVals_temp  = self.TranShkValsNext[np.newaxis,:,np.newaxis]
+        ShkPrbs_temp      = self.ShkPrbsNext[np.newaxis,:,np.newaxis]
+
+        # Get cash on hand next period
+        mNrmNext          = self.Rfree/(self.PermGroFac*PermShkVals_temp)*aNrmNow[:,np.newaxis,:] + TranShkVals_temp
+
+        # Store and report the results
+        self.PermShkVals_temp  = PermShkVals_temp
+        self.ShkPrbs_temp      = ShkPrbs_temp
+        self.mNrmNext          = mNrmNext
+        self.aNrmNow           = aNrmNow
+        return aNrmNow
+
+    def calcEndOfPrdvP(self):
+        '''
+        Calculate end-of-period marginal value of assets at each point in aNrmNow
+        for each parameter point.  Next period's marginal value is found from the
+        stacked consumption functions by the envelope condition, in a single call.
+
+        Parameters
+        ----------
+        none
+
+        Returns
+        -------
+        EndOfPrdvP : np.array
+            A 2D array of end-of-period marginal value of assets, one row per
+            parameter point.
+        '''
+        CRRA_temp   = self.CRRA[:,np.newaxis,np.newaxis]
+        vPnext      = utilityP(self.cFuncNext(self.mNrmNext),gam=CRRA_temp)
+        EndOfPrdvP  = (self.DiscFacEff*self.Rfree*self.PermGroFac**(-self.CRRA))[:,np.newaxis]*np.sum(
+                      self.PermShkVals_temp**(-CRRA_temp)*vPnext*self.ShkPrbs_temp,axis=1)
+        return EndOfPrdvP
+
+    def getPointsForInterpolation(self,EndOfPrdvP,aNrmNow):
+        '''
+        Finds interpolation points (c,m) for the consumption function at each
+        parameter point.
+
+        Parameters
+        ----------
+        EndOfPrdvP : np.array
+            Array of end-of-period marginal values, one row per parameter point.
+        aNrmNow : np.array
+            Array of end-of-period asset values that yield the marginal values
+            in EndOfPrdvP.
+
+        Returns
+        -------
+        c_for_interpolation : np.array
+            Consumption points for interpolation, one row per parameter point.
+        m_for_interpolation : np.array
+            Corresponding market resource points for interpolation.
+        '''
+        cNrmNow = utilityP_inv(EndOfPrdvP,gam=self.CRRA[:,np.newaxis])
+        mNrmNow = cNrmNow + aNrmNow
+
+        # Limiting consumption is zero as m approaches mNrmMin
+        c_for_interpolation = np.insert(cNrmNow,0,0.,axis=-1)
+        m_for_interpolation = np.hstack((self.BoroCnstNat[:,np.newaxis],mNrmNow))
+
+        # Store these for later use
+        self.cNrmNow = cNrmNow
+        self.mNrmNow = mNrmNow
+
+        return c_for_interpolation,m_for_interpolation
+
+    def usePointsForInterpolation(self,cNrm,mNrm,interpolator):
+        '''
+        Constructs a basic batched solution for this period, including the stacked
+        consumption functions (bounded above by the borrowing constraint).
+
+        Parameters
+        ----------
+        cNrm : np.array
+            (Normalized) consumption points for interpolation.
+        mNrm : np.array
+            (Normalized) corresponding market resource points for interpolation.
+        interpolator : function
+            A function that constructs and returns the stacked consumption functions.
+
+        Returns
+        -------
+        solution_now : ConsumerSolution
+            The batched solution to this period's consumption-saving problem, with
+            stacked consumption functions and an array of minimum m.
+        '''
+        cFuncNow = interpolator(mNrm,cNrm)
+        solution_now = ConsumerSolution(cFunc=cFuncNow, mNrmMin=self.mNrmMinNow)
+        return solution_now
+
+    def makeLinearcFunc(self,mNrm,cNrm):
+        '''
+        Makes stacked linear interpolations to represent the consumption function
+        at each parameter point, bounded above by the borrowing constraint.
+
+        Parameters
+        ----------
+        mNrm : np.array
+            Corresponding market resource points for interpolation.
+        cNrm : np.array
+            Consumption points for interpolation.
+
+        Returns
+        -------
+        cFuncNow : LinearInterpStack
+            The consumption functions for this period.
+        '''
+        cFuncNow = LinearInterpStack(mNrm,cNrm,self.MPCminNow*self.hNrmNow,self.MPCminNow,
+                                     cap_x=self.cap_x,cap_y=self.cap_y)
+        return cFuncNow
+
+
+def solveConsIndShockBatch(solution_next,IncomeDstn,LivPrb,DiscFac,CRRA,Rfree,PermGroFac,
+                                BoroCnstArt,aXtraGrid):
+    '''
+    Solves a single period consumption-saving problem with CRRA utility and risky
+    income (subject to permanent and transitory shocks) for many values of the
+    discount factor and risk aversion at once, using linear interpolation.
+
+    Parameters
+    ----------
+    solution_next : ConsumerSolution
+        The batched solution to next period's one period problem; see
+        ConsIndShockSolverBatch.
+    IncomeDstn : [np.array]
+        A list containing three arrays of floats, representing a discrete
+        approximation to the income process between the period being solved
+        and the one immediately following (in solution_next). Order: event
+        probabilities, permanent shocks, transitory shocks.
+    LivPrb : float
+        Survival probability; likelihood of being alive at the beginning of
+        the succeeding period.
+    DiscFac : np.array
+        Intertemporal discount factors for future utility, one per point.
+    CRRA : np.array
+        Coefficients of relative risk aversion, one per point.
+    Rfree : float
+        Risk free interest factor on end-of-period assets.
+    PermGroFac : float
+        Expected permanent income growth factor at the end of this period.
+    BoroCnstArt: float or None
+        Borrowing constraint for the minimum allowable assets to end the
+        period with.  If it is less than the natural borrowing constraint,
+        then it is irrelevant; BoroCnstArt=None indicates no artificial bor-
+        rowing constraint.
+    aXtraGrid: np.array
+        Array of "extra" end-of-period asset values-- assets above the
+        absolute minimum acceptable level.
+
+    Returns
+    -------
+    solution_now : ConsumerSolution
+        The batched solution to the single period consumption-saving problem.
+        Its cFunc is a LinearInterpStack; mNrmMin, hNrm, MPCmin and MPCmax are
+        arrays with one element per parameter point.
+    '''
+    solver = ConsIndShockSolverBatch(solution_next,IncomeDstn,LivPrb,DiscFac,CRRA,
+                                     Rfree,PermGroFac,BoroCnstArt,aXtraGrid)
+    solver.prepareToSolve()       # Do some preparatory work
+    solution_now = solver.solve() # Solve the period
+    solution_now.hNrm = solution_now.hNrm*np.ones_like(solution_now.MPCmin)
+    return solution_now
 
 
 ####################################################################################################
@@ -1644,14 +1947,84 @@ class PerfForesightConsumerType(AgentType):
         -------
         None
         '''
-        cNrmNow = np.zeros(self.AgentCount) + np.nan
-        MPCnow  = np.zeros(self.AgentCount) + np.nan
-        for t in range(self.T_cycle):
-            these = t == self.t_cycle
-            cNrmNow[these], MPCnow[these] = self.solution[t].cFunc.eval_with_derivative(self.mNrmNow[these])
+        if not self.cFuncBankIsCurrent():
+            self.makecFuncBank()
+        if self.cFuncBank is not None: # Evaluate all agents at once, keyed on t_cycle
+            cNrmNow, MPCnow = self.cFuncBank.eval_with_derivative(self.mNrmNow,self.t_cycle)
+        else:
+            cNrmNow = np.zeros(self.AgentCount) + np.nan
+            MPCnow  = np.zeros(self.AgentCount) + np.nan
+            for t in range(self.T_cycle):
+                these = t == self.t_cycle
+                cNrmNow[these], MPCnow[these] = self.solution[t].cFunc.eval_with_derivative(self.mNrmNow[these])
         self.cNrmNow = cNrmNow
         self.MPCnow = MPCnow
         return None
+
+    def postSolve(self):
+        '''
+        Packs the solved consumption functions into a "bank" for simulation; see
+        makecFuncBank.
+
+        Parameters
+        ----------
+        none
+
+        Returns
+        -------
+        none
+        '''
+        AgentType.postSolve(self)
+        self.makecFuncBank()
+
+    def makecFuncBank(self):
+        '''
+        Packs the consumption functions of the T_cycle periods that agents can be
+        in (t_cycle) into a single LinearInterpStack, stored in the attribute
+        cFuncBank with one row per period in chronological order, so that
+        getControls can find consumption and the MPC for all agents in one
+        vectorized call keyed on t_cycle.  (An infinite horizon model with one
+        period per cycle gets a bank of one row, which every agent uses.)  This
+        works when each cFunc is a LinearInterp or the lower envelope of a
+        LinearInterp and a linear borrowing constraint, as made by the linear
+        spline solvers; otherwise cFuncBank is set to None and getControls loops
+        over periods.
+
+        Parameters
+        ----------
+        none
+
+        Returns
+        -------
+        none
+        '''
+        solution = self.solution if self.time_flow else self.solution[::-1]
+        self.cFuncBankSource = [solution_t.cFunc for solution_t in solution]
+        try:
+            self.cFuncBank = makeLinearInterpStack(self.cFuncBankSource[:self.T_cycle])
+        except ValueError:
+            self.cFuncBank = None
+
+    def cFuncBankIsCurrent(self):
+        '''
+        Checks whether cFuncBank was made from the consumption functions currently
+        in the solution held by this instance (as of the current flow of time),
+        comparing each period's cFunc by identity.
+
+        Parameters
+        ----------
+        none
+
+        Returns
+        -------
+        is_current : boolean
+            True if cFuncBank can be used in place of the solution's cFuncs.
+        '''
+        if not hasattr(self,'cFuncBankSource'):
+            return False
+        solution = self.solution if self.time_flow else self.solution[::-1]
+        return len(self.cFuncBankSource) == len(solution) and \
+               all(cFunc is solution_t.cFunc for cFunc, solution_t in zip(self.cFuncBankSource,solution))
         
     def getPostStates(self):
         '''
@@ -1778,6 +2151,7 @@ class IndShockConsumerType(PerfForesightConsumerType):
         self.PermShkDstn = PermShkDstn
         self.TranShkDstn = TranShkDstn
         self.addToTimeVary('IncomeDstn','PermShkDstn','TranShkDstn')
+        self.makeIncShkAliasTable()
         if not original_time:
             self.timeRev()
             
@@ -1817,7 +2191,9 @@ class IndShockConsumerType(PerfForesightConsumerType):
     def getShocks(self):
         '''
         Gets permanent and transitory income shocks for this period.  Samples from IncomeDstn for
-        each period in the cycle.
+        each period in the cycle, drawing event indices for all agents at once from alias tables
+        (see makeIncShkAliasTable).  Each agent's draw depends only on the simulation seed, the
+        period and the agent's own index, not on how agents are grouped by t_cycle.
         
         Parameters
         ----------
@@ -1827,34 +2203,20 @@ class IndShockConsumerType(PerfForesightConsumerType):
         -------
         None
         '''
-        PermShkNow = np.zeros(self.AgentCount) # Initialize shock arrays
-        TranShkNow = np.zeros(self.AgentCount)
+        if not self.incShkAliasTableIsCurrent():
+            self.makeIncShkAliasTable()
+        AliasPrb, AliasIdx, Counts = self.IncShkAliasTable
         newborn = self.t_age == 0
-        for t in range(self.T_cycle):
-            these = t == self.t_cycle
-            N = np.sum(these)
-            if N > 0:
-                IncomeDstnNow    = self.IncomeDstn[t-1] # set current income distribution
-                PermGroFacNow    = self.PermGroFac[t-1] # and permanent growth factor
-                Indices          = np.arange(IncomeDstnNow[0].size) # just a list of integers
-                # Get random draws of income shocks from the discrete distribution
-                EventDraws       = drawDiscrete(N,X=Indices,P=IncomeDstnNow[0],exact_match=False,seed=self.RNG.randint(0,2**31-1))
-                PermShkNow[these] = IncomeDstnNow[1][EventDraws]*PermGroFacNow # permanent "shock" includes expected growth
-                TranShkNow[these] = IncomeDstnNow[2][EventDraws]
-        
-        # That procedure used the *last* period in the sequence for newborns, but that's not right
-        # Redraw shocks for newborns, using the *first* period in the sequence.  Approximation.
-        N = np.sum(newborn)
-        if N > 0:
-            these = newborn
-            IncomeDstnNow    = self.IncomeDstn[0] # set current income distribution
-            PermGroFacNow    = self.PermGroFac[0] # and permanent growth factor
-            Indices          = np.arange(IncomeDstnNow[0].size) # just a list of integers
-            # Get random draws of income shocks from the discrete distribution
-            EventDraws       = drawDiscrete(N,X=Indices,P=IncomeDstnNow[0],exact_match=False,seed=self.RNG.randint(0,2**31-1))
-            PermShkNow[these] = IncomeDstnNow[1][EventDraws]*PermGroFacNow # permanent "shock" includes expected growth
-            TranShkNow[these] = IncomeDstnNow[2][EventDraws]
-#        PermShkNow[newborn] = 1.0
+
+        # Agents draw from the distribution for their period in the cycle (t_cycle has already
+        # advanced, so look back one).  Newborns use the *first* period in the sequence.  Approximation.
+        rows = self.t_cycle - 1
+        rows[rows < 0] += len(self.IncomeDstn)
+        rows[newborn] = 0
+        base_draws = drawUniformByIndex(np.arange(self.AgentCount),seed=self.RNG.randint(0,2**31-1))
+        EventDraws = drawDiscreteStacked(rows,AliasPrb,AliasIdx,Counts,base_draws)
+        PermShkNow = self.IncShkPermVals[rows,EventDraws]*np.asarray(self.PermGroFac)[rows] # permanent "shock" includes expected growth
+        TranShkNow = self.IncShkTranVals[rows,EventDraws]
         TranShkNow[newborn] = 1.0
               
         # Store the shocks in self
@@ -1862,7 +2224,51 @@ class IndShockConsumerType(PerfForesightConsumerType):
         self.EmpNow[TranShkNow == self.IncUnemp] = False
         self.PermShkNow = PermShkNow
         self.TranShkNow = TranShkNow
-            
+
+    def makeIncShkAliasTable(self):
+        '''
+        Makes alias tables for drawing from the discrete income distribution of each period in
+        IncomeDstn (in its current order), stored in the attribute IncShkAliasTable, along with
+        padded arrays of the permanent and transitory shock values in IncShkPermVals and
+        IncShkTranVals (one row per period).  Called by update and, if IncomeDstn has been
+        replaced or reordered since, by getShocks.
+        
+        Parameters
+        ----------
+        None
+        
+        Returns
+        -------
+        None
+        '''
+        self.IncShkAliasTable = makeAliasTableStack([IncomeDstn_t[0] for IncomeDstn_t in self.IncomeDstn])
+        ValueArrays = packDiscreteValues(self.IncomeDstn)
+        self.IncShkPermVals = ValueArrays[0]
+        self.IncShkTranVals = ValueArrays[1]
+        self.IncShkAliasSource = list(self.IncomeDstn)
+
+    def incShkAliasTableIsCurrent(self):
+        '''
+        Checks whether IncShkAliasTable was made from the income distributions currently held
+        in IncomeDstn, in the same order.
+        
+        Parameters
+        ----------
+        None
+        
+        Returns
+        -------
+        is_current : boolean
+            True if the alias tables can be used to draw income shocks.
+        '''
+        if not hasattr(self,'IncShkAliasSource'):
+            return False
+        if len(self.IncShkAliasSource) != len(self.IncomeDstn):
+            return False
+        for source_t, IncomeDstn_t in zip(self.IncShkAliasSource,self.IncomeDstn):
+            if source_t is not IncomeDstn_t:
+                return False
+        return True
                 
     def calcBoundingValues(self):
         '''
@@ -1983,7 +2389,233 @@ class IndShockConsumerType(PerfForesightConsumerType):
     def preSolve(self):
         PerfForesightConsumerType.preSolve(self)
         self.updateSolutionTerminal()
-    
+
+    def getSolutionVectors(self,solution):
+        '''
+        Represents a one period solution of the linear spline model (CubicBool and
+        vFuncBool both False) as two vectors, for accelerating an infinite horizon
+        solution (see solveAgent).  The first holds log consumption at the nodes of
+        the unconstrained consumption function (after the first, where consumption
+        is zero); the nodes are at fixed end-of-period asset levels, and logs keep
+        extrapolated consumption positive.  The second holds human wealth and the
+        inverses of the bounding MPCs, which follow their own linear recursions.
+        
+        Parameters
+        ----------
+        solution : ConsumerSolution
+            A one period solution.
+            
+        Returns
+        -------
+        vectors : [np.array] or None
+            Log consumption at each node but the first, then hNrm, 1/MPCmin and
+            1/MPCmax; or None if the solution is not of this form.
+        '''
+        if self.CubicBool or self.vFuncBool or self.solveOnePeriod is not solveConsIndShock:
+            return None
+        cFunc = solution.cFunc
+        if not isinstance(cFunc,LowerEnvelope) or not isinstance(cFunc.functions[0],LinearInterp):
+            return None
+        cNrm = cFunc.functions[0].y_list
+        if cNrm[0] != 0.0 or np.any(cNrm[1:] <= 0.0):
+            return None
+        return [np.log(cNrm[1:]),np.array([solution.hNrm,1.0/solution.MPCmin,1.0/solution.MPCmax])]
+        
+    def makeSolutionFromVectors(self,vectors,solution):
+        '''
+        Makes a one period solution from log consumption at the nodes of the
+        unconstrained consumption function of another solution (keeping that
+        solution's end-of-period asset nodes and borrowing constraint), human wealth
+        and the inverse bounding MPCs.  Inverse of getSolutionVectors.
+        
+        Parameters
+        ----------
+        vectors : [np.array]
+            Log consumption at each node but the first; hNrm, 1/MPCmin and 1/MPCmax.
+        solution : ConsumerSolution
+            The solution to use as a template.
+            
+        Returns
+        -------
+        solution_new : ConsumerSolution or None
+            The new solution, or None if the consumption levels do not yield
+            increasing market resources at the nodes, or the human wealth and MPCs
+            are out of bounds.
+        '''
+        cNrm = np.concatenate(([0.0],np.exp(vectors[0])))
+        hNrm = vectors[1][0]
+        MPCmin, MPCmax = 1.0/vectors[1][1:]
+        cFuncUnc = solution.cFunc.functions[0]
+        mNrm = cFuncUnc.x_list - cFuncUnc.y_list + cNrm
+        if np.any(np.diff(mNrm) <= 0.0) or hNrm < 0.0 or not (0.0 < MPCmin <= MPCmax <= 1.0):
+            return None
+        cFuncUncNew = LinearInterp(mNrm,cNrm,MPCmin*hNrm,MPCmin)
+        cFuncNew = LowerEnvelope(cFuncUncNew,solution.cFunc.functions[1],resolve=True)
+        solution_new = ConsumerSolution(cFunc=cFuncNew, vPfunc=MargValueFunc(cFuncNew,self.CRRA),
+                                        mNrmMin=solution.mNrmMin, hNrm=hNrm,
+                                        MPCmin=MPCmin, MPCmax=MPCmax)
+        return solution_new
+
+    def solveBatch(self,DiscFac,CRRA,verbose=False):
+        '''
+        Solve this type's model for many values of the discount factor and risk
+        aversion at once, without changing this instance's own parameters or
+        solution.  When this type uses the linear spline solver without the
+        value function (CubicBool and vFuncBool both False), all parameter points
+        are solved together by solveConsIndShockBatch, carrying a parameter axis
+        through every period; points of an infinite horizon model drop out of
+        the batch as they converge.  Otherwise each point is solved in turn.
+        DiscFac and CRRA must be time invariant for this type.
+
+        Parameters
+        ----------
+        DiscFac : np.array or float
+            Intertemporal discount factors, one per parameter point.
+        CRRA : np.array or float
+            Coefficients of relative risk aversion, one per parameter point.
+            DiscFac and CRRA are broadcast against each other.
+        verbose : boolean
+            If True, solution progress is printed to screen.
+
+        Returns
+        -------
+        solutions : [[ConsumerSolution]]
+            A list with one element per parameter point, each of which is a list
+            of solutions ordered as self.solution would be by self.solve().
+        '''
+        DiscFac, CRRA = np.broadcast_arrays(np.atleast_1d(np.asarray(DiscFac,dtype=float)),
+                                            np.atleast_1d(np.asarray(CRRA,dtype=float)))
+        PointCount = DiscFac.size
+        if self.CubicBool or self.vFuncBool or self.solveOnePeriod is not solveConsIndShock:
+            return self._solveBatchByPoint(DiscFac,CRRA,verbose)
+
+        # Make the terminal solution for each point, and the batched terminal solution
+        original_time = self.time_flow
+        self.timeRev()
+        solution_terminal = []
+        for p in xrange(PointCount):
+            solution_p = deepcopy(self.solution_terminal)
+            solution_p.vFunc   = ValueFunc(self.cFunc_terminal_,CRRA[p])
+            solution_p.vPfunc  = MargValueFunc(self.cFunc_terminal_,CRRA[p])
+            solution_p.vPPfunc = MargMargValueFunc(self.cFunc_terminal_,CRRA[p])
+            solution_terminal.append(solution_p)
+        solution_last = ConsumerSolution(cFunc=makeLinearInterpStack([s.cFunc for s in solution_terminal]),
+                                         mNrmMin=np.array([s.mNrmMin for s in solution_terminal]),
+                                         hNrm=np.array([s.hNrm for s in solution_terminal]),
+                                         MPCmin=np.array([s.MPCmin for s in solution_terminal]),
+                                         MPCmax=np.array([s.MPCmax for s in solution_terminal]))
+
+        # Get the period-by-period inputs to the batched solver
+        getInput = lambda name,t : getattr(self,name)[t] if name in self.time_vary else getattr(self,name)
+        T = len(getattr(self,self.time_vary[0])) if len(self.time_vary) > 0 else 1
+        infinite_horizon = self.cycles == 0
+        cycles_left = self.cycles
+
+        # Initialize the solution lists, then loop over cycles
+        solutions = [[] for p in xrange(PointCount)]
+        if not self.pseudo_terminal and not infinite_horizon:
+            for p in xrange(PointCount):
+                solutions[p].append(solution_terminal[p])
+        active = np.arange(PointCount)
+        completed_cycles = 0
+        max_cycles = 5000 # escape clause
+        go = True
+        while go:
+            # Solve one cycle for every point that has not yet converged
+            solution_cycle = []
+            solution_next = solution_last
+            for t in xrange(T):
+                solution_next = solveConsIndShockBatch(solution_next,getInput('IncomeDstn',t),
+                                    getInput('LivPrb',t),DiscFac[active],CRRA[active],getInput('Rfree',t),
+                                    getInput('PermGroFac',t),getInput('BoroCnstArt',t),getInput('aXtraGrid',t))
+                solution_cycle.append(solution_next)
+            solution_now = solution_cycle[-1]
+
+            # Check for termination, recording the cycle if the horizon is finite
+            if infinite_horizon:
+                if completed_cycles > 0:
+                    solution_distance = solution_now.cFunc.rowDistance(solution_last.cFunc)
+                    done = solution_distance <= self.tolerance
+                    if completed_cycles >= max_cycles:
+                        done[:] = True
+                else: # Assume solution does not converge after only one cycle
+                    solution_distance = 100.0*np.ones(active.size)
+                    done = np.zeros(active.size,dtype=bool)
+                for j in np.where(done)[0]:
+                    solutions[active[j]] = [self._unpackBatchSolution(s,j,CRRA[active[j]]) for s in solution_cycle]
+                keep = np.logical_not(done)
+                active = active[keep]
+                go = active.size > 0
+                if go and np.any(done):
+                    solution_now = self._getBatchSolutionRows(solution_now,np.where(keep)[0])
+            else:
+                for p in xrange(PointCount):
+                    solutions[p] += [self._unpackBatchSolution(s,p,CRRA[p]) for s in solution_cycle]
+                cycles_left += -1
+                go = cycles_left > 0
+            solution_last = solution_now
+            completed_cycles += 1
+
+            if verbose:
+                if infinite_horizon:
+                    print('Finished cycle #' + str(completed_cycles) + ', ' + str(active.size) +
+                          ' points left, max solution distance = ' + str(np.max(solution_distance)))
+                else:
+                    print('Finished cycle #' + str(completed_cycles) + ' of ' + str(self.cycles) + '.')
+
+        # Put the solutions in chronological order if time flows that way for this instance
+        if original_time:
+            self.timeFwd()
+            for p in xrange(PointCount):
+                solutions[p].reverse()
+        return solutions
+
+    def _unpackBatchSolution(self,solution,j,CRRA):
+        '''
+        Extract the ordinary single period solution for one point from a batched
+        solution made by solveConsIndShockBatch.
+        '''
+        cFunc = solution.cFunc.unstack(j)
+        return ConsumerSolution(cFunc=cFunc, vPfunc=MargValueFunc(cFunc,CRRA),
+                                mNrmMin=solution.mNrmMin[j], hNrm=solution.hNrm[j],
+                                MPCmin=solution.MPCmin[j], MPCmax=solution.MPCmax[j])
+
+    def _getBatchSolutionRows(self,solution,which):
+        '''
+        Make a batched solution that includes only the parameter points in which.
+        '''
+        return ConsumerSolution(cFunc=solution.cFunc.getRows(which), mNrmMin=solution.mNrmMin[which],
+                                hNrm=solution.hNrm[which], MPCmin=solution.MPCmin[which],
+                                MPCmax=solution.MPCmax[which])
+
+    def _solveBatchByPoint(self,DiscFac,CRRA,verbose):
+        '''
+        Solve this type's model at each parameter point in turn with the ordinary
+        solver, restoring this instance's own parameters and solution afterward.
+        Used by solveBatch when the batched solver does not apply.
+        '''
+        DiscFac_orig = self.DiscFac
+        CRRA_orig = self.CRRA
+        time_vary_orig = copy(self.time_vary)
+        had_solution = hasattr(self,'solution')
+        if had_solution:
+            solution_orig = self.solution
+        solutions = []
+        for p in xrange(DiscFac.size):
+            self.DiscFac = DiscFac[p]
+            self.CRRA = CRRA[p]
+            self.solve(verbose)
+            solutions.append(self.solution)
+        self.DiscFac = DiscFac_orig
+        self.CRRA = CRRA_orig
+        self.time_vary = time_vary_orig
+        self.updateSolutionTerminal()
+        if had_solution:
+            self.solution = solution_orig
+        else:
+            del self.solution
+        return solutions
+
     def checkConditions(self,verbose=False):                      
         '''
         This method checks whether the instance's type satisfies the growth impatiance condition 
@@ -2203,6 +2835,8 @@ class KinkedRconsumerType(IndShockConsumerType):
 # = Functions for generating discrete income processes and simulated income shocks =
 # ==================================================================================
 
+@memoize(key=attrgetter('PermShkStd','PermShkCount','TranShkStd','TranShkCount','T_cycle',
+                        'T_retire','UnempPrb','IncUnemp','UnempPrbRet','IncUnempRet'))
 def constructLognormalIncomeProcessUnemployment(parameters):
     '''
     Generates a list of discrete approximations to the income process for each
@@ -2217,6 +2851,10 @@ def constructLognormalIncomeProcessUnemployment(parameters):
     Note 1: All time in this function runs forward, from t=0 to t=T
     
     Note 2: All parameters are passed as attributes of the input parameters.
+    
+    Note 3: The output is memoized on the values of those attributes, and each
+    distinct working period is made once by makeWorkingIncomeDstn, so periods and
+    agents with the same income shocks share their arrays.
 
     Parameters (passed as attributes of the input parameters)
     ----------
@@ -2288,24 +2926,71 @@ def constructLognormalIncomeProcessUnemployment(parameters):
             TranShkValsRet  = np.array([1.0])
             ShkPrbsRet      = np.array([1.0])
         IncomeDstnRet = [ShkPrbsRet,PermShkValsRet,TranShkValsRet]
+        PermShkDstnRet = [np.array([1.0]),np.array([1.0])]
+        TranShkDstnRet = [ShkPrbsRet,TranShkValsRet]
 
-    # Loop to fill in the list of IncomeDstn random variables.
+    # Loop to fill in the list of IncomeDstn random variables.  Periods with the
+    # same shock standard deviations share the arrays of one distribution.
+    WorkingDstns = {}
     for t in range(T_cycle): # Iterate over all periods, counting forward
 
         if T_retire > 0 and t >= T_retire:
             # Then we are in the "retirement period" and add a retirement income object.
-            IncomeDstn.append(deepcopy(IncomeDstnRet))
-            PermShkDstn.append([np.array([1.0]),np.array([1.0])])
-            TranShkDstn.append([ShkPrbsRet,TranShkValsRet])
+            IncomeDstn.append(list(IncomeDstnRet))
+            PermShkDstn.append(list(PermShkDstnRet))
+            TranShkDstn.append(list(TranShkDstnRet))
         else:
             # We are in the "working life" periods.
-            TranShkDstn_t    = approxMeanOneLognormal(N=TranShkCount, sigma=TranShkStd[t], tail_N=0)
-            if UnempPrb > 0:
-                TranShkDstn_t = addDiscreteOutcomeConstantMean(TranShkDstn_t, p=UnempPrb, x=IncUnemp)
-            PermShkDstn_t    = approxMeanOneLognormal(N=PermShkCount, sigma=PermShkStd[t], tail_N=0)
-            IncomeDstn.append(combineIndepDstns(PermShkDstn_t,TranShkDstn_t)) # mix the independent distributions
-            PermShkDstn.append(PermShkDstn_t)
-            TranShkDstn.append(TranShkDstn_t)
+            ShkStds = (PermShkStd[t],TranShkStd[t])
+            if ShkStds not in WorkingDstns:
+                WorkingDstns[ShkStds] = makeWorkingIncomeDstn(PermShkStd[t],PermShkCount,TranShkStd[t],
+                                                              TranShkCount,UnempPrb,IncUnemp)
+            IncomeDstn_t, PermShkDstn_t, TranShkDstn_t = WorkingDstns[ShkStds]
+            IncomeDstn.append(list(IncomeDstn_t))
+            PermShkDstn.append(list(PermShkDstn_t))
+            TranShkDstn.append(list(TranShkDstn_t))
+    return IncomeDstn, PermShkDstn, TranShkDstn
+
+
+@memoize
+def makeWorkingIncomeDstn(PermShkStd,PermShkCount,TranShkStd,TranShkCount,UnempPrb,IncUnemp):
+    '''
+    Makes the discrete approximation to the income process in one working period
+    for constructLognormalIncomeProcessUnemployment: mean one lognormal permanent
+    and transitory shocks, with a point mass at IncUnemp with probability UnempPrb
+    added to the transitory shocks.  The output is memoized, so that periods and
+    agents with the same shocks share the same arrays.
+    
+    Parameters
+    ----------
+    PermShkStd : float
+        Standard deviation of log permanent income shocks.
+    PermShkCount : int
+        The number of points in the discrete approximation to the permanent shocks.
+    TranShkStd : float
+        Standard deviation of log transitory income shocks.
+    TranShkCount : int
+        The number of points in the discrete approximation to the transitory shocks.
+    UnempPrb : float
+        The probability of becoming unemployed.
+    IncUnemp : float
+        Transitory income received when unemployed.
+        
+    Returns
+    -------
+    IncomeDstn : [np.array]
+        Discrete approximation to the income process, as probabilities, permanent
+        shocks, and transitory shocks.
+    PermShkDstn : [np.array]
+        Discrete approximation to the permanent income shocks.
+    TranShkDstn : [np.array]
+        Discrete approximation to the transitory income shocks.
+    '''
+    TranShkDstn = approxMeanOneLognormal(N=TranShkCount, sigma=TranShkStd, tail_N=0)
+    if UnempPrb > 0:
+        TranShkDstn = addDiscreteOutcomeConstantMean(TranShkDstn, p=UnempPrb, x=IncUnemp)
+    PermShkDstn = approxMeanOneLognormal(N=PermShkCount, sigma=PermShkStd, tail_N=0)
+    IncomeDstn = combineIndepDstns(PermShkDstn,TranShkDstn) # mix the independent distributions
     return IncomeDstn, PermShkDstn, TranShkDstn
     
 
@@ -2340,7 +3025,35 @@ def applyFlatIncomeTax(IncomeDstn,tax_rate,T_retire,unemployed_indices=[],transi
                 if j not in unemployed_indices:
                     IncomeDstn_new[t][i][j] = IncomeDstn[t][i][j]*(1-tax_rate)
     return IncomeDstn_new
-   
+
+
+def packDiscreteValues(DstnList):
+    '''
+    Packs the outcome values of a list of discrete distributions (each in the
+    form [probabilities, values_1, values_2, ...]) into padded 2D arrays with one
+    row per distribution, for drawing shocks for many agents at once.  Padding
+    entries are zero; they are never drawn.
+
+    Parameters
+    ----------
+    DstnList : [[np.array]]
+        List of discrete distributions, such as IncomeDstn for a one state model.
+
+    Returns
+    -------
+    ValueArrays : [np.array]
+        List of 2D arrays, one for each set of outcome values in the distributions
+        (for an income distribution: permanent shocks, then transitory shocks).
+    '''
+    Counts = [Dstn[0].size for Dstn in DstnList]
+    ValueArrays = []
+    for i in range(1,len(DstnList[0])):
+        ValueArray = np.zeros((len(DstnList),max(Counts)))
+        for j in range(len(DstnList)):
+            ValueArray[j,:Counts[j]] = DstnList[j][i]
+        ValueArrays.append(ValueArray)
+    return ValueArrays
+
 # =======================================================
 # ================ Other useful functions ===============
 # =======================================================
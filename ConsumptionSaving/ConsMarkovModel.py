@@ -9,11 +9,13 @@ sys.path.insert(0,'../')
 
 from copy import deepcopy
 import numpy as np
-from ConsIndShockModel import ConsIndShockSolver, ValueFunc, MargValueFunc, ConsumerSolution, IndShockConsumerType
+from ConsIndShockModel import ConsIndShockSolver, ValueFunc, MargValueFunc, ConsumerSolution, IndShockConsumerType, \
+                              packDiscreteValues
 from ConsAggShockModel import AggShockConsumerType
 from HARKutilities import combineIndepDstns, warnings  # Because of "patch" to warnings modules
 from HARKcore import Market, HARKobject
-from HARKsimulation import drawDiscrete, drawUniform
+from HARKsimulation import drawDiscrete, drawUniform, drawUniformByIndex, makeAliasTableStack, \
+                          drawDiscreteStacked
 from HARKinterpolation import CubicInterp, LowerEnvelope, LinearInterp
 from HARKutilities import CRRAutility, CRRAutilityP, CRRAutilityPP, CRRAutilityP_inv, \
                           CRRAutility_invP, CRRAutility_inv, CRRAutilityP_invP
@@ -472,7 +474,7 @@ class ConsMarkovSolver(ConsIndShockSolver):
             self.cFuncNowCnst = LinearInterp([self.mNrmMin_list[i], self.mNrmMin_list[i]+1.0],
                                              [0.0,1.0])
             cFuncNowUnc       = interpfunc(mNrm[i,:],cNrm[i,:])
-            cFuncNow          = LowerEnvelope(cFuncNowUnc,self.cFuncNowCnst)
+            cFuncNow          = LowerEnvelope(cFuncNowUnc,self.cFuncNowCnst,resolve=True)
 
             # Make the marginal value function and pack up the current-state-conditional solution
             vPfuncNow     = MargValueFunc(cFuncNow,self.CRRA)
@@ -817,7 +819,8 @@ class MarkovConsumerType(IndShockConsumerType):
     def getShocks(self):
         '''
         Gets new Markov states and permanent and transitory income shocks for this period.  Samples
-        from IncomeDstn for each period-state in the cycle.
+        from IncomeDstn for each period-state in the cycle, drawing event indices for all agents at
+        once from alias tables (see makeIncShkAliasTable).
         
         Parameters
         ----------
@@ -834,37 +837,82 @@ class MarkovConsumerType(IndShockConsumerType):
             base_draws = self.RNG.permutation(np.arange(self.AgentCount,dtype=float)/self.AgentCount + 1.0/(2*self.AgentCount))
         newborn = self.t_age == 0 # Don't change Markov state for those who were just born (unless global_markov)
         MrkvPrev = self.MrkvNow
-        MrkvNow = np.zeros(self.AgentCount,dtype=int)
-        for t in range(self.T_cycle):
-            Cutoffs = np.cumsum(self.MrkvArray[t],axis=1)
-            for j in range(self.MrkvArray[t].shape[0]):
-                these = np.logical_and(self.t_cycle == t,MrkvPrev == j)
-                MrkvNow[these] = np.searchsorted(Cutoffs[j,:],base_draws[these]).astype(int)
+        Cutoffs = np.cumsum(np.array(self.MrkvArray),axis=2)[self.t_cycle,MrkvPrev,:] # Transition cutoffs for each agent
+        MrkvNow = np.sum(Cutoffs < base_draws[:,np.newaxis],axis=1)
         if not self.global_markov:
                 MrkvNow[newborn] = MrkvPrev[newborn]
         self.MrkvNow = MrkvNow.astype(int)        
         
-        # Now get income shocks for each consumer, by cycle-time and discrete state
-        PermShkNow = np.zeros(self.AgentCount) # Initialize shock arrays
-        TranShkNow = np.zeros(self.AgentCount)
-        for t in range(self.T_cycle):
-            for j in range(self.MrkvArray[t].shape[0]):
-                these = np.logical_and(t == self.t_cycle, j == MrkvNow)
-                N = np.sum(these)
-                if N > 0:
-                    IncomeDstnNow    = self.IncomeDstn[t-1][j] # set current income distribution
-                    PermGroFacNow    = self.PermGroFac[t-1][j] # and permanent growth factor
-                    Indices          = np.arange(IncomeDstnNow[0].size) # just a list of integers
-                    # Get random draws of income shocks from the discrete distribution
-                    EventDraws       = drawDiscrete(N,X=Indices,P=IncomeDstnNow[0],exact_match=False,seed=self.RNG.randint(0,2**31-1))
-                    PermShkNow[these] = IncomeDstnNow[1][EventDraws]*PermGroFacNow # permanent "shock" includes expected growth
-                    TranShkNow[these] = IncomeDstnNow[2][EventDraws]
-        newborn = self.t_age == 0 
+        # Now get income shocks for each consumer, by cycle-time and discrete state, all at once
+        if not self.incShkAliasTableIsCurrent():
+            self.makeIncShkAliasTable()
+        AliasPrb, AliasIdx, Counts = self.IncShkAliasTable
+        t_prev = self.t_cycle - 1 # Time has already advanced, so look back one
+        t_prev[t_prev < 0] += len(self.IncomeDstn)
+        rows = self.IncShkRowStart[t_prev] + self.MrkvNow
+        base_draws = drawUniformByIndex(np.arange(self.AgentCount),seed=self.RNG.randint(0,2**31-1))
+        EventDraws = drawDiscreteStacked(rows,AliasPrb,AliasIdx,Counts,base_draws)
+        PermGroFac = np.concatenate([np.asarray(PermGroFac_t,dtype=float) for PermGroFac_t in self.PermGroFac])
+        PermShkNow = self.IncShkPermVals[rows,EventDraws]*PermGroFac[rows] # permanent "shock" includes expected growth
+        TranShkNow = self.IncShkTranVals[rows,EventDraws]
         PermShkNow[newborn] = 1.0
         TranShkNow[newborn] = 1.0
         self.PermShkNow = PermShkNow
         self.TranShkNow = TranShkNow
         
+    def makeIncShkAliasTable(self):
+        '''
+        Makes alias tables for drawing from the discrete income distribution of each period-state
+        in IncomeDstn, stacked with one row per period-state; the rows for period t start at
+        IncShkRowStart[t].  See IndShockConsumerType.makeIncShkAliasTable.  If IncomeDstn does not
+        (yet) hold a list of distributions by Markov state for each period, as when update() has
+        just made a single state one, nothing is made and getShocks will try again later.
+        
+        Parameters
+        ----------
+        None
+        
+        Returns
+        -------
+        None
+        '''
+        if isinstance(self.IncomeDstn[0][0],np.ndarray): # Not specified by Markov state
+            self.IncShkAliasSource = None
+            return
+        DstnList = [IncomeDstn_tj for IncomeDstn_t in self.IncomeDstn for IncomeDstn_tj in IncomeDstn_t]
+        self.IncShkAliasTable = makeAliasTableStack([IncomeDstn_tj[0] for IncomeDstn_tj in DstnList])
+        ValueArrays = packDiscreteValues(DstnList)
+        self.IncShkPermVals = ValueArrays[0]
+        self.IncShkTranVals = ValueArrays[1]
+        self.IncShkRowStart = np.cumsum([0] + [len(IncomeDstn_t) for IncomeDstn_t in self.IncomeDstn[:-1]])
+        self.IncShkAliasSource = [list(IncomeDstn_t) for IncomeDstn_t in self.IncomeDstn]
+        
+    def incShkAliasTableIsCurrent(self):
+        '''
+        Checks whether IncShkAliasTable was made from the income distributions currently held
+        in IncomeDstn, in the same order.
+        
+        Parameters
+        ----------
+        None
+        
+        Returns
+        -------
+        is_current : boolean
+            True if the alias tables can be used to draw income shocks.
+        '''
+        if getattr(self,'IncShkAliasSource',None) is None:
+            return False
+        if len(self.IncShkAliasSource) != len(self.IncomeDstn):
+            return False
+        for source_t, IncomeDstn_t in zip(self.IncShkAliasSource,self.IncomeDstn):
+            if len(source_t) != len(IncomeDstn_t):
+                return False
+            for source_tj, IncomeDstn_tj in zip(source_t,IncomeDstn_t):
+                if source_tj is not IncomeDstn_tj:
+                    return False
+        return True
+        
     def readShocks(self):
         '''
         A slight modification of AgentType.readShocks that makes sure that MrkvNow is int, not float.
@@ -14,7 +14,7 @@ from HARKsimulation import drawLognormal
 from ConsIndShockModel import ConsumerSolution
 from HARKinterpolation import BilinearInterpOnInterp1D, TrilinearInterp, BilinearInterp, CubicInterp,\
                               LinearInterp, LowerEnvelope3D, UpperEnvelope, LinearInterpOnInterp1D,\
-                              VariableLowerBoundFunc3D
+                              VariableLowerBoundFunc3D, evalWithGradient
 from ConsPersistentShockModel import ConsPersistentShockSolver, PersistentShockConsumerType,\
                                      ValueFunc2D, MargValueFunc2D, MargMargValueFunc2D, \
                                      VariableLowerBoundFunc2D
@@ -158,8 +158,7 @@ class MedShockPolicyFunc(HARKobject):
             Derivative of medical care with respect to market resources for each
             point in (xLvl,MedShk).    
         '''
-        xLvl = self.xFunc(mLvl,pLvl,MedShk)
-        dxdm = self.xFunc.derivativeX(mLvl,pLvl,MedShk)
+        xLvl, dxdm, dxdp, dxdShk = evalWithGradient(self.xFunc,mLvl,pLvl,MedShk)
         dcdx = self.cFunc.derivativeX(xLvl,MedShk)
         dcdm = dxdm*dcdx
         dMeddm = (dxdm - dcdm)/self.MedPrice
@@ -189,8 +188,7 @@ class MedShockPolicyFunc(HARKobject):
             Derivative of medical care with respect to permanent income for each
             point in (xLvl,MedShk).    
         '''
-        xLvl = self.xFunc(mLvl,pLvl,MedShk)
-        dxdp = self.xFunc.derivativeY(mLvl,pLvl,MedShk)
+        xLvl, dxdm, dxdp, dxdShk = evalWithGradient(self.xFunc,mLvl,pLvl,MedShk)
         dcdx = self.cFunc.derivativeX(xLvl,MedShk)
         dcdp = dxdp*dcdx
         dMeddp = (dxdp - dcdp)/self.MedPrice
@@ -220,10 +218,9 @@ class MedShockPolicyFunc(HARKobject):
             Derivative of medical care with respect to medical need for each
             point in (xLvl,MedShk).    
         '''
-        xLvl = self.xFunc(mLvl,pLvl,MedShk)
-        dxdShk = self.xFunc.derivativeZ(mLvl,pLvl,MedShk)
-        dcdx = self.cFunc.derivativeX(xLvl,MedShk)
-        dcdShk = dxdShk*dcdx + self.cFunc.derivativeY(xLvl,MedShk)
+        xLvl, dxdm, dxdp, dxdShk = evalWithGradient(self.xFunc,mLvl,pLvl,MedShk)
+        dcdx, dcdShkDirect = evalWithGradient(self.cFunc,xLvl,MedShk)[1:]
+        dcdShk = dxdShk*dcdx + dcdShkDirect
         dMeddShk = (dxdShk - dcdShk)/self.MedPrice
         return dcdShk,dMeddShk
         
@@ -299,8 +296,7 @@ class cThruXfunc(HARKobject):
             Derivative of consumption with respect to market resources for each
             point in (xLvl,MedShk).
         '''
-        xLvl = self.xFunc(mLvl,pLvl,MedShk)
-        dxdm = self.xFunc.derivativeX(mLvl,pLvl,MedShk)
+        xLvl, dxdm, dxdp, dxdShk = evalWithGradient(self.xFunc,mLvl,pLvl,MedShk)
         dcdx = self.cFunc.derivativeX(xLvl,MedShk)
         dcdm = dxdm*dcdx
         return dcdm
@@ -326,8 +322,7 @@ class cThruXfunc(HARKobject):
             Derivative of consumption with respect to permanent income for each
             point in (xLvl,MedShk).
         '''
-        xLvl = self.xFunc(mLvl,pLvl,MedShk)
-        dxdp = self.xFunc.derivativeY(mLvl,pLvl,MedShk)
+        xLvl, dxdm, dxdp, dxdShk = evalWithGradient(self.xFunc,mLvl,pLvl,MedShk)
         dcdx = self.cFunc.derivativeX(xLvl,MedShk)
         dcdp = dxdp*dcdx
         return dcdp
@@ -353,10 +348,9 @@ class cThruXfunc(HARKobject):
             Derivative of consumption with respect to medical need for each
             point in (xLvl,MedShk).
         '''
-        xLvl = self.xFunc(mLvl,pLvl,MedShk)
-        dxdShk = self.xFunc.derivativeZ(mLvl,pLvl,MedShk)
-        dcdx = self.cFunc.derivativeX(xLvl,MedShk)
-        dcdShk = dxdShk*dcdx + self.cFunc.derivativeY(xLvl,MedShk)
+        xLvl, dxdm, dxdp, dxdShk = evalWithGradient(self.xFunc,mLvl,pLvl,MedShk)
+        dcdx, dcdShkDirect = evalWithGradient(self.cFunc,xLvl,MedShk)[1:]
+        dcdShk = dxdShk*dcdx + dcdShkDirect
         return dcdShk
 
 class MedThruXfunc(HARKobject):
@@ -436,8 +430,7 @@ class MedThruXfunc(HARKobject):
             Derivative of medical care with respect to market resources for each
             point in (xLvl,MedShk).    
         '''
-        xLvl = self.xFunc(mLvl,pLvl,MedShk)
-        dxdm = self.xFunc.derivativeX(mLvl,pLvl,MedShk)
+        xLvl, dxdm, dxdp, dxdShk = evalWithGradient(self.xFunc,mLvl,pLvl,MedShk)
         dcdx = self.cFunc.derivativeX(xLvl,MedShk)
         dcdm = dxdm*dcdx
         dMeddm = (dxdm - dcdm)/self.MedPrice
@@ -464,8 +457,7 @@ class MedThruXfunc(HARKobject):
             Derivative of medical care with respect to permanent income for each
             point in (xLvl,MedShk).    
         '''
-        xLvl = self.xFunc(mLvl,pLvl,MedShk)
-        dxdp = self.xFunc.derivativeY(mLvl,pLvl,MedShk)
+        xLvl, dxdm, dxdp, dxdShk = evalWithGradient(self.xFunc,mLvl,pLvl,MedShk)
         dMeddp = (dxdp - dxdp*self.cFunc.derivativeX(xLvl,MedShk))/self.MedPrice
         return dMeddp
         
@@ -490,10 +482,9 @@ class MedThruXfunc(HARKobject):
             Derivative of medical care with respect to medical need for each
             point in (xLvl,MedShk).    
         '''
-        xLvl = self.xFunc(mLvl,pLvl,MedShk)
-        dxdShk = self.xFunc.derivativeZ(mLvl,pLvl,MedShk)
-        dcdx = self.cFunc.derivativeX(xLvl,MedShk)
-        dcdShk = dxdShk*dcdx + self.cFunc.derivativeY(xLvl,MedShk)
+        xLvl, dxdm, dxdp, dxdShk = evalWithGradient(self.xFunc,mLvl,pLvl,MedShk)
+        dcdx, dcdShkDirect = evalWithGradient(self.cFunc,xLvl,MedShk)[1:]
+        dcdShk = dxdShk*dcdx + dcdShkDirect
         dMeddShk = (dxdShk - dcdShk)/self.MedPrice
         return dMeddShk
         
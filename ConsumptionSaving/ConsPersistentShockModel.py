@@ -15,7 +15,8 @@ import numpy as np
 from HARKcore import HARKobject
 from HARKutilities import warnings  # Because of "patch" to warnings modules
 from HARKinterpolation import LowerEnvelope2D, BilinearInterp, Curvilinear2DInterp,\
-                              LinearInterpOnInterp1D, LinearInterp, CubicInterp, VariableLowerBoundFunc2D
+                              LinearInterpOnInterp1D, LinearInterp, CubicInterp, VariableLowerBoundFunc2D,\
+                              evalWithGradient
 from HARKutilities import CRRAutility, CRRAutilityP, CRRAutilityPP, CRRAutilityP_inv,\
                           CRRAutility_invP, CRRAutility_inv, CRRAutilityP_invP,\
                           approxLognormal
@@ -150,8 +151,7 @@ class MargValueFunc2D(HARKobject):
             with market resources m and permanent income p; has same size as inputs
             m and p.
         '''
-        c = self.cFunc(m,p)
-        MPC = self.cFunc.derivativeX(m,p)
+        c, MPC = evalWithGradient(self.cFunc,m,p)[:2]
         return MPC*utilityPP(c,gam=self.CRRA)
         
 class MargMargValueFunc2D(HARKobject):
@@ -201,8 +201,7 @@ class MargMargValueFunc2D(HARKobject):
             Marginal marginal value of beginning this period with market
             resources m and permanent income p; has same size as inputs.
         '''
-        c = self.cFunc(m,p)
-        MPC = self.cFunc.derivativeX(m,p)
+        c, MPC = evalWithGradient(self.cFunc,m,p)[:2]
         return MPC*utilityPP(c,gam=self.CRRA)
         
         
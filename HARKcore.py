@@ -9,9 +9,14 @@ problem by finding a general equilibrium dynamic rule.
 
 from HARKutilities import getArgNames, NullFunc
 from copy import copy, deepcopy
+import os
+import shutil
+import tempfile
 import numpy as np
+from operator import attrgetter
+from types import FunctionType
 from time import clock
-from HARKparallel import multiThreadCommands
+from HARKparallel import multiThreadCommands, ParallelCultivator
   
 def distanceMetric(thing_A,thing_B):
     '''
@@ -44,7 +49,7 @@ def distanceMetric(thing_A,thing_B):
         else:
             distance = float(abs(lenA - lenB))
     # If both inputs are numbers, return their difference        
-    elif (typeA is int or typeB is float) and (typeB is int or typeB is float):
+    elif (typeA is int or typeA is float) and (typeB is int or typeB is float):
         distance = float(abs(thing_A - thing_B)) 
     # If both inputs are array-like, return the maximum absolute difference b/w
     # corresponding elements (if same shape); return largest difference in dimensions
@@ -56,8 +61,8 @@ def distanceMetric(thing_A,thing_B):
             distance = np.max(abs(thing_A.shape - thing_B.shape))
     # If none of the above cases, but the objects are of the same class, call
     # the distance method of one on the other
-    elif thing_A.__class__.__name__ == thing_B.__class__.__name__:
-        if thing_A.__class__.__name__ == 'function':
+    elif thing_A.__class__ is thing_B.__class__:
+        if typeA is FunctionType:
             distance = 0.0
         else:
             distance = thing_A.distance(thing_B)
@@ -211,6 +216,14 @@ class AgentType(HARKobject):
         self.tolerance          = tolerance
         self.seed               = seed
         self.track_vars         = []
+        self.track_dtypes       = {}
+        self.history_backend    = 'memory'
+        self.history_dir        = None
+        self.history_chunk_size = 100
+        self.history            = None
+        self.accelerate         = False
+        self.accelerate_memory  = 5
+        self.solution_cache     = None
         self.poststate_vars     = []
         self.read_shocks        = False
         self.assignParameters(**kwds)
@@ -247,7 +260,7 @@ class AgentType(HARKobject):
         none
         '''
         for name in self.time_vary:
-            exec('self.' + name + '.reverse()')
+            getattr(self,name).reverse()
         self.time_flow = not self.time_flow
 
     def timeFwd(self):
@@ -425,6 +438,48 @@ class AgentType(HARKobject):
         '''
         return None
         
+    def getSolutionVectors(self,solution):
+        '''
+        Represents a one period solution as one or more vectors of numbers in fixed
+        coordinates, for extrapolating successive solutions of an infinite horizon
+        model when self.accelerate is True (see solveAgent).  Each vector is
+        extrapolated separately, so parts of the solution that follow their own
+        recursions (and converge at their own rates) should be separate vectors.
+        Returns None here, meaning that solutions of this type cannot be extrapolated;
+        subclasses that can should overwrite this method and makeSolutionFromVectors.
+        
+        Parameters
+        ----------
+        solution : Solution
+            A one period solution produced by this type's solveOnePeriod.
+            
+        Returns
+        -------
+        vectors : [np.array] or None
+            The solution's coordinates, or None if it can't be represented.
+        '''
+        return None
+        
+    def makeSolutionFromVectors(self,vectors,solution):
+        '''
+        Makes a one period solution from vectors of coordinates, the inverse of
+        getSolutionVectors.  Not implemented here.
+        
+        Parameters
+        ----------
+        vectors : [np.array]
+            Coordinates of the solution to make.
+        solution : Solution
+            A solution of the same kind to use as a template for everything that
+            is not represented in the vector.
+            
+        Returns
+        -------
+        solution_new : Solution or None
+            The new solution, or None if the vector does not describe a valid one.
+        '''
+        return None
+        
     def initializeSim(self):
         '''
         Prepares this AgentType for a new simulation.  Resets the internal random number generator,
@@ -443,7 +498,7 @@ class AgentType(HARKobject):
         all_agents = np.ones(self.AgentCount,dtype=bool)
         blank_array = np.zeros(self.AgentCount)
         for var_name in self.poststate_vars:
-            exec('self.' + var_name + ' = copy(blank_array)')
+            setattr(self,var_name,copy(blank_array))
         self.t_age = np.zeros(self.AgentCount,dtype=int)   # Number of periods since agent entry
         self.t_cycle = np.zeros(self.AgentCount,dtype=int) # Which cycle period each agent is on
         self.simBirth(all_agents)
@@ -506,11 +561,11 @@ class AgentType(HARKobject):
             setattr(self,var_name+'_hist',np.zeros((self.T_sim,self.AgentCount))+np.nan)
         
         # Make and store the history of shocks for each period
+        recordShocks = makeHistoryRecorder(self,self.shock_vars)
         for t in range(self.T_sim):
             self.getMortality()
             self.getShocks()
-            for var_name in self.shock_vars:
-                exec('self.' + var_name + '_hist[self.t_sim,:] = self.' + var_name)
+            recordShocks(self.t_sim)
             self.t_sim += 1
             self.t_age = self.t_age + 1 # Age all consumers by one period
             self.t_cycle = self.t_cycle + 1 # Age all consumers within their cycle
@@ -677,18 +732,24 @@ class AgentType(HARKobject):
         if sim_periods is None:
             sim_periods = self.T_sim
             
+        recordHistory = self.history.makeRecorder(self)
         for t in range(sim_periods):
             self.simOnePeriod()
-            for var_name in self.track_vars:
-                exec('self.' + var_name + '_hist[self.t_sim,:] = self.' + var_name)
+            recordHistory(self.t_sim)
             self.t_sim += 1
+        if not self.history.held:
+            self.history.flush()
             
         if not orig_time:
             self.timeRev()
             
     def clearHistory(self):
         '''
-        Clears the histories of the attributes named in self.track_vars.
+        Clears the histories of the attributes named in self.track_vars, making a new
+        HistoryStore in self.history according to track_dtypes, history_backend,
+        history_dir and history_chunk_size.  The history of each variable X is also
+        put in an attribute named X_hist.  The files of a previous memmap store, if
+        any, are deleted.
         
         Parameters
         ----------
@@ -698,15 +759,703 @@ class AgentType(HARKobject):
         -------
         None
         '''
+        if self.history is not None:
+            self.history.close(delete=True)
+        self.history = HistoryStore(self.track_vars,self.T_sim,self.AgentCount,dtypes=self.track_dtypes,
+                                    backend=self.history_backend,directory=self.history_dir,
+                                    chunk_size=self.history_chunk_size)
         for var_name in self.track_vars:
-            exec('self.' + var_name + '_hist = np.zeros((self.T_sim,self.AgentCount)) + np.nan')
+            setattr(self,var_name + '_hist',self.history.getHistory(var_name))
+        
+
+def makeHistoryRecorder(agent,var_names):
+    '''
+    Makes a function that records the current values of the attributes of agent named
+    in var_names in a given row of the respectively named history arrays (attributes
+    named X_hist).  The attribute getters and history arrays are looked up once, when
+    the recorder is made, rather than every period.
+    
+    Parameters
+    ----------
+    agent : AgentType
+        The agent type whose variables will be recorded; its X_hist arrays must
+        already exist.
+    var_names : [string]
+        Names of the attributes to record.
+        
+    Returns
+    -------
+    recordHistory : function
+        A function of the row t (usually agent.t_sim) that stores each variable
+        X in row t of X_hist.
+    '''
+    targets = [(getattr(agent,var_name + '_hist'),attrgetter(var_name)) for var_name in var_names]
+    def recordHistory(t):
+        for history, getVar in targets:
+            history[t,:] = getVar(agent)
+    return recordHistory
+
+
+class HistoryStore(HARKobject):
+    '''
+    A store for the simulated histories of the variables tracked by an AgentType,
+    with one T x N array per variable.  Each variable can have its own dtype (say,
+    float32 for levels or int8 for discrete states); floating point histories start
+    out as NaN and others as zero.  Histories are held in memory (backend='memory')
+    or in .npy files accessed through numpy.memmap (backend='memmap'), in which case
+    rows are written through an in-memory buffer of chunk_size rows so that long
+    simulations of many agents stream to disk with bounded RAM.  A memmap store
+    that is deep copied gets its own copies of the history files.
+    '''
+    def __init__(self,var_names,T,N,dtypes={},backend='memory',directory=None,chunk_size=100):
+        '''
+        Make a new HistoryStore with blank histories.
+        
+        Parameters
+        ----------
+        var_names : [string]
+            Names of the variables whose histories will be stored.
+        T : int
+            Number of periods (rows) in each history.
+        N : int
+            Number of agents (columns) in each history.
+        dtypes : dict
+            Dictionary mapping variable names to dtypes; variables that are not
+            named here are stored as float64.
+        backend : str
+            Either 'memory' or 'memmap'.
+        directory : str or None
+            For the memmap backend, a directory in which to make a new (uniquely
+            named) subdirectory holding the history files; a system temporary
+            directory is used if None.
+        chunk_size : int
+            For the memmap backend, the number of rows buffered in memory before
+            being written out.
+            
+        Returns
+        -------
+        None
+        '''
+        self.var_names = list(var_names)
+        self.T = T
+        self.N = N
+        self.dtypes = {name : np.dtype(dtypes.get(name,float)) for name in self.var_names}
+        self.backend = backend
+        self.chunk_size = max(int(chunk_size),1)
+        self.held = False # If True, AgentType.simulate leaves buffered rows to be flushed later
+        self.histories = {}
+        if backend == 'memory':
+            self.directory = None
+            for name in self.var_names:
+                self.histories[name] = np.full((T,N),self._fillValue(name),dtype=self.dtypes[name])
+        elif backend == 'memmap':
+            if directory is not None and not os.path.isdir(directory):
+                os.makedirs(directory)
+            self.directory = tempfile.mkdtemp(prefix='HARKhistory',dir=directory)
+            self.buffers = {}
+            for name in self.var_names:
+                history = np.lib.format.open_memmap(os.path.join(self.directory,name + '.npy'),
+                                                    mode='w+',dtype=self.dtypes[name],shape=(T,N))
+                for t0 in range(0,T,self.chunk_size):
+                    history[t0:(t0+self.chunk_size),:] = self._fillValue(name)
+                history.flush()
+                self.histories[name] = history
+                self.buffers[name] = np.empty((min(self.chunk_size,max(T,1)),N),dtype=self.dtypes[name])
+            self.buffer_start = 0
+            self.buffer_rows = 0
+        else:
+            raise ValueError("backend must be 'memory' or 'memmap', not " + str(backend) + '!')
+
+    def __deepcopy__(self,memo):
+        '''
+        Makes a deep copy of this store.  The copy of a memmap store gets a new
+        directory (next to this store's) holding copies of the history files, so
+        that deleting one store's files does not affect the other.
+        '''
+        new = self.__class__.__new__(self.__class__)
+        memo[id(self)] = new
+        if self.backend != 'memmap' or self.directory is None:
+            for name, value in self.__dict__.items():
+                setattr(new,name,deepcopy(value,memo))
+            return new
+        self.flush()
+        for name, value in self.__dict__.items():
+            if name not in ['histories','directory']:
+                setattr(new,name,deepcopy(value,memo))
+        new.directory = tempfile.mkdtemp(prefix='HARKhistory',dir=os.path.dirname(self.directory))
+        new.histories = {}
+        for name in self.var_names:
+            path = os.path.join(new.directory,name + '.npy')
+            shutil.copyfile(os.path.join(self.directory,name + '.npy'),path)
+            new.histories[name] = np.lib.format.open_memmap(path,mode='r+')
+            memo[id(self.histories[name])] = new.histories[name]
+        return new
+
+    def _fillValue(self,var_name):
+        '''
+        Returns the value that blank entries of a history take: NaN for floating
+        point dtypes and zero otherwise.
+        '''
+        if np.issubdtype(self.dtypes[var_name],np.floating):
+            return np.nan
+        return 0
+
+    def record(self,t,values):
+        '''
+        Stores values of the variables in row t of their histories.
+        
+        Parameters
+        ----------
+        t : int
+            Period (row) to record.
+        values : [np.array]
+            Values of the variables to record, in the same order as var_names.
+            
+        Returns
+        -------
+        None
+        '''
+        if self.backend == 'memory':
+            for name, value in zip(self.var_names,values):
+                self.histories[name][t,:] = value
+            return
+        if self.buffer_rows > 0 and (t != self.buffer_start + self.buffer_rows or self.buffer_rows == self.chunk_size):
+            self.flush()
+        if self.buffer_rows == 0:
+            self.buffer_start = t
+        for name, value in zip(self.var_names,values):
+            self.buffers[name][self.buffer_rows,:] = value
+        self.buffer_rows += 1
+
+    def makeRecorder(self,agent):
+        '''
+        Makes a function that records the current values of the attributes of agent
+        named in var_names in a given row of this store (see makeHistoryRecorder).
+        
+        Parameters
+        ----------
+        agent : AgentType
+            The agent type whose variables will be recorded.
+            
+        Returns
+        -------
+        recordHistory : function
+            A function of the row t (usually agent.t_sim) that records each variable.
+        '''
+        if len(self.var_names) == 0:
+            return lambda t : None
+        getVars = attrgetter(*self.var_names)
+        if len(self.var_names) == 1:
+            return lambda t : self.record(t,[getVars(agent)])
+        return lambda t : self.record(t,getVars(agent))
+
+    def flush(self):
+        '''
+        Writes any buffered rows out to the history files (memmap backend only).
+        
+        Parameters
+        ----------
+        None
+        
+        Returns
+        -------
+        None
+        '''
+        if self.backend != 'memmap' or self.buffer_rows == 0:
+            return
+        t0 = self.buffer_start
+        t1 = t0 + self.buffer_rows
+        for name in self.var_names:
+            self.histories[name][t0:t1,:] = self.buffers[name][:self.buffer_rows,:]
+            self.histories[name].flush()
+        self.buffer_rows = 0
+
+    def getHistory(self,var_name):
+        '''
+        Returns the complete T x N history of one variable; for the memmap backend
+        this is a numpy.memmap, which is read from disk as it is used.
+        
+        Parameters
+        ----------
+        var_name : string
+            Name of the variable.
+            
+        Returns
+        -------
+        history : np.array
+            History of the variable, with one row per period.
+        '''
+        self.flush()
+        return self.histories[var_name]
+
+    def getRows(self,var_name,t0=0,t1=None):
+        '''
+        Returns (a copy of) the rows t0 through t1-1 of the history of one variable.
+        
+        Parameters
+        ----------
+        var_name : string
+            Name of the variable.
+        t0 : int
+            First period to return.
+        t1 : int or None
+            One past the last period to return; defaults to T.
+            
+        Returns
+        -------
+        rows : np.array
+            Array of shape (t1-t0,N) with the history of the variable in those periods.
+        '''
+        return np.array(self.getHistory(var_name)[t0:t1,:])
+
+    def iterChunks(self,var_name,t0=0,t1=None,chunk_size=None):
+        '''
+        Iterates over the history of one variable in blocks of consecutive rows, so
+        that it can be processed with bounded memory.
+        
+        Parameters
+        ----------
+        var_name : string
+            Name of the variable.
+        t0 : int
+            First period to read.
+        t1 : int or None
+            One past the last period to read; defaults to T.
+        chunk_size : int or None
+            Number of rows in each block; defaults to the store's chunk_size.
+            
+        Yields
+        ------
+        t_start : int
+            Period of the first row in the block.
+        block : np.array
+            Array with the history of the variable in periods t_start onward.
+        '''
+        if t1 is None:
+            t1 = self.T
+        if chunk_size is None:
+            chunk_size = self.chunk_size
+        history = self.getHistory(var_name)
+        for t_start in range(t0,t1,chunk_size):
+            yield t_start, np.array(history[t_start:min(t_start+chunk_size,t1),:])
+
+    def close(self,delete=False):
+        '''
+        Flushes this store and, if requested, deletes its history files.  On systems
+        that allow it, arrays already taken from the store remain readable.
+        
+        Parameters
+        ----------
+        delete : boolean
+            Whether to delete the directory of history files (memmap backend only).
+            
+        Returns
+        -------
+        None
+        '''
+        self.flush()
+        if delete and self.directory is not None:
+            shutil.rmtree(self.directory,ignore_errors=True)
+            self.directory = None
+
+
+def concatenateHistories(agents,var_name,t0=0,t1=None):
+    '''
+    Returns the history of one variable in periods t0 through t1-1 for all the
+    agents of several AgentTypes, concatenated across types (columns).
+    
+    Parameters
+    ----------
+    agents : [AgentType]
+        Agent types whose histories (in their HistoryStores) will be read.
+    var_name : string
+        Name of the tracked variable.
+    t0 : int
+        First period to read.
+    t1 : int or None
+        One past the last period to read; defaults to the end of the histories.
+        
+    Returns
+    -------
+    history : np.array
+        Array with one row per period and one column per agent.
+    '''
+    return np.concatenate([this_type.history.getRows(var_name,t0,t1) for this_type in agents],axis=1)
+
+
+def averageHistories(agents,var_name,t0=0,t1=None):
+    '''
+    Calculates the average value of one variable in each period across all the
+    agents of several AgentTypes, reading their histories a block of periods at a
+    time so that memory use is bounded.
+    
+    Parameters
+    ----------
+    agents : [AgentType]
+        Agent types whose histories (in their HistoryStores) will be read.
+    var_name : string
+        Name of the tracked variable.
+    t0 : int
+        First period to read.
+    t1 : int or None
+        One past the last period to read; defaults to the end of the histories.
+        
+    Returns
+    -------
+    averages : np.array
+        Array with the cross-sectional average of the variable in each period.
+    '''
+    if t1 is None:
+        t1 = agents[0].history.T
+    totals = np.zeros(t1-t0)
+    count = 0
+    for this_type in agents:
+        for t_start, block in this_type.history.iterChunks(var_name,t0,t1):
+            totals[(t_start-t0):(t_start-t0+block.shape[0])] += np.sum(block,axis=1)
+        count += this_type.history.N
+    return totals/count
+
+
+class AndersonAccelerator(HARKobject):
+    '''
+    Anderson acceleration ("Anderson mixing") of a fixed point iteration x = g(x) on
+    vectors.  Each call to update gives the accelerator an input vector and its
+    image under g, and returns the next point to try: a combination of the last
+    few images whose corresponding residuals g(x)-x combine to (approximately) zero.
+    '''
+    def __init__(self,memory=5):
+        '''
+        Make a new AndersonAccelerator.
+        
+        Parameters
+        ----------
+        memory : int
+            Number of past iterations to combine.
+            
+        Returns
+        -------
+        None
+        '''
+        self.memory = memory
+        self.reset()
+        
+    def reset(self):
+        '''
+        Forgets all past iterations, so that the next update is a plain iteration.
+        '''
+        self.inputs = []
+        self.images = []
+        
+    def update(self,x,gx):
+        '''
+        Records an input vector and its image, returning the extrapolated next point.
+        
+        Parameters
+        ----------
+        x : np.array
+            Input to the fixed point map.
+        gx : np.array
+            Image of x under the fixed point map.
+            
+        Returns
+        -------
+        x_next : np.array
+            Next point to try; just gx if there is not yet enough history.
+        '''
+        if len(self.inputs) > 0 and self.inputs[-1].shape != x.shape:
+            self.reset()
+        self.inputs.append(x)
+        self.images.append(gx)
+        if len(self.inputs) > self.memory + 1:
+            self.inputs.pop(0)
+            self.images.pop(0)
+        if len(self.inputs) < 2:
+            return gx
+        G = np.array(self.images).T
+        F = G - np.array(self.inputs).T
+        dG = np.diff(G,axis=1)
+        dF = np.diff(F,axis=1)
+        gamma = np.linalg.lstsq(dF,F[:,-1],rcond=-1)[0]
+        x_next = gx - np.dot(dG,gamma)
+        if not np.all(np.isfinite(x_next)):
+            self.reset()
+            return gx
+        return x_next
+
+
+class SolutionCache(HARKobject):
+    '''
+    A least recently used cache of converged solutions to infinite horizon models,
+    used to "warm start" solveAgent when an agent type is solved again with nearby
+    parameter values (as in a search over the discount factor).  Solutions are
+    filed by the values of the parameters named in their type's time_inv and
+    time_vary: numeric parameters (numbers and lists or tuples of numbers) locate
+    a solution, and all other parameters are hashed into a "signature" that must
+    match exactly for a solution to be used.  One cache can be shared by several
+    agent types.
+    '''
+    def __init__(self,max_entries=32,max_bytes=2**26):
+        '''
+        Make a new empty SolutionCache.
+        
+        Parameters
+        ----------
+        max_entries : int
+            Maximum number of solutions to keep.
+        max_bytes : int or None
+            Maximum total size of the arrays in the kept solutions, in bytes.
+            
+        Returns
+        -------
+        None
+        '''
+        self.max_entries = max_entries
+        self.max_bytes   = max_bytes
+        self.entries     = [] # (signature, numeric values, solution, size), most recently used last
+        self.total_bytes = 0
+        self.hits        = 0  # Starts made from a cached solution
+        self.misses      = 0  # Starts with no cached solution of the right signature
+        
+    def makeKey(self,agent):
+        '''
+        Makes the key for an agent type's current parameters.
+        
+        Parameters
+        ----------
+        agent : AgentType
+            The agent type about to be solved.
+            
+        Returns
+        -------
+        key : (int, np.array)
+            The hashed signature of the non-numeric parameters and the vector of
+            numeric parameter values.
+        '''
+        signature = []
+        values = []
+        for name in sorted(agent.time_inv) + sorted(agent.time_vary):
+            if name == 'solution':
+                continue
+            value = getattr(agent,name)
+            if isNumeric(value):
+                signature.append((name,np.size(value)))
+                values.append(np.ravel(np.array(value,dtype=float)))
+            else:
+                signature.append((name,hashParameter(value)))
+        values = np.concatenate(values) if len(values) > 0 else np.zeros(0)
+        return (hash(tuple(signature)), values)
+        
+    def findNearest(self,key,count=1):
+        '''
+        Finds the cached solutions with the same signature and the nearest numeric
+        parameter values (by Euclidean distance), marking them as recently used.
+        
+        Parameters
+        ----------
+        key : (int, np.array)
+            A key made by makeKey.
+        count : int
+            Maximum number of solutions to find.
+            
+        Returns
+        -------
+        entries : [(np.array, Solution)]
+            Numeric parameter values and solutions of up to count cached solutions,
+            nearest first; empty if no solution has this signature.
+        '''
+        matches = [(np.sum((entry[1] - key[1])**2),j) for j, entry in enumerate(self.entries)
+                   if entry[0] == key[0] and entry[1].shape == key[1].shape]
+        chosen = [j for dist, j in sorted(matches)[:count]]
+        nearest = [self.entries[j] for j in chosen]
+        self.entries = [entry for j, entry in enumerate(self.entries) if j not in chosen] + nearest[::-1]
+        return [(entry[1],entry[2]) for entry in nearest]
+        
+    def makeStart(self,key,agent):
+        '''
+        Makes a starting point for solving an agent type from the cache.  This is the
+        nearest cached solution, or if the agent's solutions can be represented as
+        vectors (see AgentType.getSolutionVectors) and there is another cached
+        solution, the linear interpolation or extrapolation of the two nearest
+        solutions along the line through their parameters.
+        
+        Parameters
+        ----------
+        key : (int, np.array)
+            A key made by makeKey for the agent's current parameters.
+        agent : AgentType
+            The agent type about to be solved.
+            
+        Returns
+        -------
+        solution : Solution or None
+            The starting point, or None if no solution has this key's signature.
+        '''
+        nearest = self.findNearest(key,count=2)
+        if len(nearest) == 0:
+            self.misses += 1
+            return None
+        self.hits += 1
+        (params_A, solution_A) = nearest[0]
+        if len(nearest) < 2:
+            return solution_A
+        (params_B, solution_B) = nearest[1]
+        vectors_A = agent.getSolutionVectors(solution_A)
+        vectors_B = agent.getSolutionVectors(solution_B)
+        if vectors_A is None or vectors_B is None or len(vectors_A) != len(vectors_B) or \
+                any(a.shape != b.shape for a, b in zip(vectors_A,vectors_B)):
+            return solution_A
+        step = params_B - params_A
+        weight = np.dot(key[1] - params_A,step)/np.dot(step,step)
+        weight = min(max(weight,-1.0),2.0) # Don't extrapolate too far
+        vectors = [a + weight*(b - a) for a, b in zip(vectors_A,vectors_B)]
+        solution = agent.makeSolutionFromVectors(vectors,solution_A)
+        if solution is None:
+            return solution_A
+        return solution
+        
+    def store(self,key,solution):
+        '''
+        Adds a converged solution to the cache (replacing any solution with the same
+        key), then drops least recently used solutions until it is within its caps.
+        
+        Parameters
+        ----------
+        key : (int, np.array)
+            A key made by makeKey.
+        solution : Solution
+            The converged solution for the parameters in key.
+            
+        Returns
+        -------
+        None
+        '''
+        for j in range(len(self.entries)):
+            entry = self.entries[j]
+            if entry[0] == key[0] and entry[1].shape == key[1].shape and np.all(entry[1] == key[1]):
+                self.total_bytes -= entry[3]
+                del self.entries[j]
+                break
+        size = arrayBytes(solution)
+        self.entries.append((key[0],key[1],solution,size))
+        self.total_bytes += size
+        while len(self.entries) > 1 and (len(self.entries) > self.max_entries or
+                (self.max_bytes is not None and self.total_bytes > self.max_bytes)):
+            self.total_bytes -= self.entries.pop(0)[3]
+            
+    def extract(self,key,count=2):
+        '''
+        Makes a new cache with the same caps, holding the cached solutions nearest
+        to the parameters in key.  Used to give each agent type a small cache of its
+        own to carry into another process (see Market.solveAgents).
         
+        Parameters
+        ----------
+        key : (int, np.array)
+            A key made by makeKey.
+        count : int
+            Maximum number of solutions to put in the new cache.
+            
+        Returns
+        -------
+        part : SolutionCache
+            A new cache holding up to count solutions, nearest last.
+        '''
+        part = SolutionCache(max_entries=self.max_entries,max_bytes=self.max_bytes)
+        for values, solution in self.findNearest(key,count)[::-1]:
+            part.store((key[0],values),solution)
+        return part
+        
+    def merge(self,other):
+        '''
+        Stores all of the solutions in another cache in this one, in the other's
+        order of use, replacing any solutions of this cache with the same keys, and
+        adds the other's hits and misses to this cache's.
+        
+        Parameters
+        ----------
+        other : SolutionCache
+            The cache whose solutions are added to this one.
+            
+        Returns
+        -------
+        None
+        '''
+        if other is self:
+            return
+        for entry in list(other.entries):
+            self.store((entry[0],entry[1]),entry[2])
+        self.hits += other.hits
+        self.misses += other.misses
+        
+    def clear(self):
+        '''
+        Empties the cache.
+        '''
+        self.entries = []
+        self.total_bytes = 0
+        
+        
+def isNumeric(value):
+    '''
+    Checks whether a parameter value is a (non-boolean) number or a list or tuple of
+    them, for SolutionCache.
+    '''
+    if isinstance(value,(list,tuple)):
+        return len(value) > 0 and all(isNumeric(item) and not isinstance(item,(list,tuple)) for item in value)
+    return isinstance(value,(int,long,float,np.integer,np.floating)) and not isinstance(value,(bool,np.bool_))
+
+
+def hashParameter(value):
+    '''
+    Makes a hashable summary of a parameter value for SolutionCache: arrays are
+    summarized by their contents, lists and tuples by their elements, and other
+    hashable values by themselves.  Anything else (such as a function object) is
+    identified by its id, so it matches only itself.
+    '''
+    if isinstance(value,np.ndarray):
+        return (value.shape,str(value.dtype),hash(np.ascontiguousarray(value).tostring()))
+    if isinstance(value,(list,tuple)):
+        return tuple(hashParameter(item) for item in value)
+    try:
+        return hash(value)
+    except TypeError:
+        return id(value)
+
+
+def arrayBytes(thing,memo=None):
+    '''
+    Totals the sizes of the numpy arrays referenced by an object, through its
+    attributes and any lists, tuples and dictionaries, counting each array once.
+    '''
+    if memo is None:
+        memo = set()
+    if id(thing) in memo:
+        return 0
+    memo.add(id(thing))
+    if isinstance(thing,np.ndarray):
+        return thing.nbytes
+    if isinstance(thing,(list,tuple)):
+        return sum(arrayBytes(item,memo) for item in thing)
+    if isinstance(thing,dict):
+        return sum(arrayBytes(item,memo) for item in thing.values())
+    if hasattr(thing,'__dict__'):
+        return arrayBytes(thing.__dict__,memo)
+    return 0
+
 
 def solveAgent(agent,verbose):
     '''
     Solve the dynamic model for one agent type.  This function iterates on "cycles"
     of an agent's model either a given number of times or until solution convergence
-    if an infinite horizon model is used (with agent.cycles = 0).
+    if an infinite horizon model is used (with agent.cycles = 0).  In the latter case,
+    if agent.accelerate is True and the agent's solutions can be represented as vectors
+    (see AgentType.getSolutionVectors), the solution passed to each cycle is extrapolated
+    from the last few cycles by Anderson acceleration; the returned solution is always
+    the output of an ordinary cycle.  The number of cycles and final solution distance
+    of an infinite horizon model are stored in agent.solve_cycles and agent.solve_distance.
+    If agent.solution_cache is a SolutionCache, an infinite horizon model starts from
+    the cached converged solutions whose parameters are nearest to the agent's (rather
+    than from solution_terminal), and its own converged solution is added to the cache.
     
     Parameters
     ----------
@@ -736,9 +1485,18 @@ def solveAgent(agent,verbose):
 
     # Initialize the process, then loop over cycles
     solution_last    = agent.solution_terminal
+    cache            = getattr(agent,'solution_cache',None) if infinite_horizon else None
+    if cache is not None:
+        cache_key    = cache.makeKey(agent)
+        solution_warm = cache.makeStart(cache_key,agent)
+        if solution_warm is not None:
+            solution_last = solution_warm
     go               = True
     completed_cycles = 0
     max_cycles       = 5000 # escape clause
+    accelerators     = None
+    if infinite_horizon and getattr(agent,'accelerate',False):
+        accelerators = []
     if verbose:
         t_last = clock()
     while go:
@@ -760,8 +1518,11 @@ def solveAgent(agent,verbose):
             cycles_left += -1
             go = cycles_left > 0
 
-        # Update the "last period solution"
-        solution_last = solution_now
+        # Update the "last period solution", extrapolating it if accelerating
+        solution_next = solution_now
+        if accelerators is not None and go:
+            solution_next = accelerateSolution(agent,accelerators,solution_last,solution_now)
+        solution_last = solution_next
         completed_cycles += 1
         
         # Display progress if requested
@@ -778,6 +1539,10 @@ def solveAgent(agent,verbose):
     # Record the last cycle if horizon is infinite (solution is still empty!)
     if infinite_horizon:
         solution = solution_cycle # PseudoTerminal=False impossible for infinite horizon
+        agent.solve_cycles = completed_cycles
+        agent.solve_distance = solution_distance
+        if cache is not None and solution_distance <= agent.tolerance:
+            cache.store(cache_key,solution_now)
 
     # Restore the direction of time to its original orientation, then return the solution
     if original_time_flow:
@@ -785,6 +1550,48 @@ def solveAgent(agent,verbose):
     return solution
 
 
+def accelerateSolution(agent,accelerators,solution_last,solution_now):
+    '''
+    Extrapolates the next solution to pass to solveOneCycle from the last input and
+    output of a cycle of an infinite horizon model, using an AndersonAccelerator on
+    each of the agent's vectors representing solutions.  Falls back on the ordinary
+    iteration (returning solution_now) whenever either solution can't be represented
+    or the extrapolated vectors do not describe a valid solution.
+    
+    Parameters
+    ----------
+    agent : AgentType
+        The agent type being solved.
+    accelerators : [AndersonAccelerator]
+        The accelerators holding the history of this solution process, one for each
+        vector; more are added as needed.
+    solution_last : Solution
+        The solution passed to the last cycle.
+    solution_now : Solution
+        The solution produced by the last cycle.
+        
+    Returns
+    -------
+    solution_next : Solution
+        The solution to pass to the next cycle.
+    '''
+    x = agent.getSolutionVectors(solution_last)
+    gx = agent.getSolutionVectors(solution_now)
+    if x is None or gx is None or len(x) != len(gx) or any(a.shape != b.shape for a, b in zip(x,gx)):
+        for accelerator in accelerators:
+            accelerator.reset()
+        return solution_now
+    while len(accelerators) < len(gx):
+        accelerators.append(AndersonAccelerator(agent.accelerate_memory))
+    vectors = [accelerator.update(a,b) for accelerator, a, b in zip(accelerators,x,gx)]
+    solution_next = agent.makeSolutionFromVectors(vectors,solution_now)
+    if solution_next is None:
+        for accelerator in accelerators:
+            accelerator.reset()
+        return solution_now
+    return solution_next
+
+
 def solveOneCycle(agent,solution_last):
     '''
     Solve one "cycle" of the dynamic model for one agent type.  This function
@@ -810,7 +1617,7 @@ def solveOneCycle(agent,solution_last):
     # Calculate number of periods per cycle, defaults to 1 if all variables are time invariant
     if len(agent.time_vary) > 0:
         name = agent.time_vary[0]
-        T    = len(eval('agent.' + name))
+        T    = len(getattr(agent,name))
     else:
         T = 1
 
@@ -820,14 +1627,10 @@ def solveOneCycle(agent,solution_last):
         solveOnePeriod = agent.solveOnePeriod
         these_args     = getArgNames(solveOnePeriod)
 
-    # Construct a dictionary to be passed to the solver
-    time_inv_string = ''
-    for name in agent.time_inv:
-        time_inv_string += ' \'' + name + '\' : agent.' +name + ','
-    time_vary_string = ''
-    for name in agent.time_vary:
-        time_vary_string += ' \'' + name + '\' : None,'
-    solve_dict = eval('{' + time_inv_string + time_vary_string + '}')
+    # Construct a dictionary to be passed to the solver, and fetch the time-varying inputs once
+    solve_dict = {name : getattr(agent,name) for name in agent.time_inv}
+    solve_dict.update({name : None for name in agent.time_vary})
+    time_vary_vals = [(name,getattr(agent,name)) for name in agent.time_vary]
 
     # Initialize the solution for this cycle, then iterate on periods
     solution_cycle = []
@@ -839,9 +1642,9 @@ def solveOneCycle(agent,solution_last):
             these_args = getArgNames(solveOnePeriod)
 
         # Update time-varying single period inputs
-        for name in agent.time_vary:
+        for name, vals in time_vary_vals:
             if name in these_args:
-                solve_dict[name] = eval('agent.' + name + '[t]')
+                solve_dict[name] = vals[t]
         solve_dict['solution_next'] = solution_next
         
         # Make a temporary dictionary for this period
@@ -924,10 +1727,22 @@ class Market(HARKobject):
         self.act_T = act_T
         self.tolerance = tolerance
         self.max_loops = 1000
+        self.agent_pool = None
+        self.cultivate_workers = None
+        self.solution_cache = None
         
     def solveAgents(self):
         '''
-        Solves the microeconomic problem for all AgentTypes in this market.
+        Solves the microeconomic problem for all AgentTypes in this market.  If
+        the attribute agent_pool holds an AgentPool (see HARKparallel), the types
+        are solved by its persistent workers, which keep them resident between
+        calls; otherwise they are solved with multiThreadCommands.
+        
+        If the attribute solution_cache holds a SolutionCache, it is shared by all
+        of the types: each type is given its own cache of the nearest solutions to
+        start from, and the solutions the types add to those are collected back
+        into solution_cache afterward.  (The types are copied when they are solved
+        in other processes, so a cache held by the types themselves is not shared.)
         
         Parameters
         ----------
@@ -939,7 +1754,17 @@ class Market(HARKobject):
         '''
         #for this_type in self.agents:
         #    this_type.solve()
-        multiThreadCommands(self.agents,['solve()'])
+        cache = getattr(self,'solution_cache',None)
+        if cache is not None:
+            for agent in self.agents:
+                agent.solution_cache = cache.extract(cache.makeKey(agent))
+        if getattr(self,'agent_pool',None) is not None:
+            self.agent_pool.solveAgents(self.agents)
+        else:
+            multiThreadCommands(self.agents,['solve()'])
+        if cache is not None:
+            for agent in self.agents:
+                cache.merge(agent.solution_cache)
     
     def solve(self):
         '''
@@ -1029,13 +1854,7 @@ class Market(HARKobject):
         none
         '''
         # Make a dictionary of inputs for the millRule
-        reap_vars_string = ''
-        for name in self.reap_vars:
-            reap_vars_string += ' \'' + name + '\' : self.' + name + ','
-        const_vars_string = ''
-        for name in self.const_vars:
-            const_vars_string += ' \'' + name + '\' : self.' + name + ','
-        mill_dict = eval('{' + reap_vars_string + const_vars_string + '}')
+        mill_dict = {name : getattr(self,name) for name in self.reap_vars + self.const_vars}
         
         # Run the millRule and store its output in self
         product = self.millRule(**mill_dict)
@@ -1104,6 +1923,13 @@ class Market(HARKobject):
         '''
         Runs a loop of sow-->cultivate-->reap-->mill act_T times, tracking the
         evolution of variables X named in track_vars in attributes named X_hist.
+        If the attribute cultivate_workers is a number (rather than None), the
+        agents are cultivated in that many worker processes by a ParallelCultivator
+        (see HARKparallel).  Its reaped arrays are then shared with the workers and
+        only valid until the next period, unless the variable is in track_vars; a
+        millRule that keeps one for later must copy it.  The agents' HistoryStores are held for the whole loop,
+        so that their buffered rows are only written out when a buffer fills and
+        once at the end, rather than after every period's simulate(1).
         
         Parameters
         ----------
@@ -1114,12 +1940,52 @@ class Market(HARKobject):
         none
         '''        
         self.reset() # Initialize the state of the market
-        for t in range(self.act_T):
-            self.sow()       # Distribute aggregated information/state to agents
-            self.cultivate() # Agents take action
-            self.reap()      # Collect individual data from agents
-            self.mill()      # Process individual data into aggregate data
-            self.store()     # Record variables of interest
+        self.holdHistories(True)
+        try:
+            if getattr(self,'cultivate_workers',None) is not None:
+                cultivator = ParallelCultivator(self,self.cultivate_workers)
+                try:
+                    for t in range(self.act_T):
+                        cultivator.sow()       # Collect aggregated information/state for agents
+                        cultivator.cultivate() # Agents take action in the worker processes
+                        cultivator.reap()      # Point at individual data in shared memory
+                        self.mill()            # Process individual data into aggregate data
+                        self.store()           # Record variables of interest
+                except:
+                    cultivator.abort()
+                    raise
+                cultivator.finish()
+                return
+            for t in range(self.act_T):
+                self.sow()       # Distribute aggregated information/state to agents
+                self.cultivate() # Agents take action
+                self.reap()      # Collect individual data from agents
+                self.mill()      # Process individual data into aggregate data
+                self.store()     # Record variables of interest
+        finally:
+            self.holdHistories(False)
+            
+    def holdHistories(self,hold):
+        '''
+        Holds or releases the HistoryStores of the agents in this market.  While a
+        store is held, AgentType.simulate does not flush it at the end of each call;
+        releasing it flushes any buffered rows.
+        
+        Parameters
+        ----------
+        hold : boolean
+            Whether to hold (True) or release (False) the stores.
+        
+        Returns
+        -------
+        None
+        '''
+        for this_type in self.agents:
+            history = getattr(this_type,'history',None)
+            if history is not None:
+                history.held = hold
+                if not hold:
+                    history.flush()
             
     def updateDynamics(self):
         '''
@@ -1137,13 +2003,10 @@ class Market(HARKobject):
             Should have attributes named in dyn_vars.  
         '''
         # Make a dictionary of inputs for the dynamics calculator
-        history_vars_string = ''
         arg_names = list(getArgNames(self.calcDynamics))
         if 'self' in arg_names:
             arg_names.remove('self')
-        for name in arg_names:
-            history_vars_string += ' \'' + name + '\' : self.' + name + '_hist,'
-        update_dict = eval('{' + history_vars_string + '}')
+        update_dict = {name : getattr(self,name + '_hist') for name in arg_names}
         
         # Calculate a new dynamic rule and distribute it to the agents in agent_list
         dynamics = self.calcDynamics(**update_dict) # User-defined dynamics calculator
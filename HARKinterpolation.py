@@ -3,16 +3,25 @@ Custom interpolation methods for representing approximations to functions.
 It also includes wrapper classes to enforce standard methods across classes.
 Each interpolation class must have a distance() method that compares itself to
 another instance; this is used in HARKcore's solve() method to check for solution
-convergence.  The interpolator classes currently in this module inherit their
-distance method from HARKobject.
+convergence.  Interpolator classes that report their gridpoints with a method called
+distanceNodes are compared by the sup-norm of their difference (see gridDistance);
+the others inherit their distance method from HARKobject.
 '''
 
 import warnings
+import itertools
 import numpy as np
 from scipy.interpolate import UnivariateSpline
 from HARKcore import HARKobject
+from HARKjit import numba_available, linearInterpKernel, cubicInterpKernel, bilinearInterpKernel,\
+                    bilinearEvalAndGradKernel, walkSectorsKernel
 from copy import deepcopy
 
+# Which implementation of the evaluation kernels of LinearInterp, CubicInterp,
+# BilinearInterp, and Curvilinear2DInterp to use: 'numpy' for array operations,
+# 'numba' for the compiled loops in HARKjit, or 'auto' for Numba if it is installed.
+interp_backend = 'numpy'
+
 def _isscalar(x):
     '''
     Check whether x is if a scalar type, or 0-dim.
@@ -30,13 +39,205 @@ def _isscalar(x):
     return np.isscalar(x) or hasattr(x, 'shape') and x.shape == ()
 
 
+def _useJit():
+    '''
+    Check whether the compiled kernels in HARKjit should be used, according to
+    the module's interp_backend setting.
+    
+    Parameters
+    ----------
+    none
+        
+    Returns
+    -------
+    use_jit : boolean
+        True if the compiled kernels should be used, False otherwise.
+    '''
+    if interp_backend == 'numpy':
+        return False
+    if interp_backend == 'numba' and not numba_available:
+        raise ImportError('numba could not be imported, and is required for interp_backend = "numba".')
+    return numba_available
+
+
+def _jitOutputs(size,flags):
+    '''
+    Makes the output arrays for a compiled kernel in HARKjit: an array of the given
+    size for each output that is wanted, and an empty array for each one that isn't.
+    '''
+    return [np.empty(size if flag else 0) for flag in flags]
+
+
+def _flatArgs(*args):
+    '''
+    Prepares the inputs of an interpolator's evaluation methods as 1D arrays.
+    Inputs that are already contiguous 1D arrays of float64 or float32 are used
+    as they are, without copying (the evaluation methods never write into their
+    inputs); anything else is flattened into a new array.
+    
+    Parameters
+    ----------
+    *args : np.array or float
+        The inputs to be evaluated, all of the same size.
+        
+    Returns
+    -------
+    flat_args : [np.array]
+        The inputs as 1D arrays.
+    shape : tuple
+        The shape of the first input, which is the shape of the output.
+    '''
+    flat_args = []
+    for arg in args:
+        z = np.asarray(arg)
+        if z.ndim != 1 or z.dtype.type not in (np.float64,np.float32) or not z.flags.c_contiguous:
+            z = z.flatten()
+        flat_args.append(z)
+    return flat_args, np.shape(args[0])
+
+
+def _shapeOutput(result,shape,out=None):
+    '''
+    Puts the result of an interpolator's evaluation method in the shape of its
+    inputs, writing it into a caller-provided array if there is one.
+    
+    Parameters
+    ----------
+    result : np.array
+        The 1D result of the evaluation.
+    shape : tuple
+        The shape of the inputs.
+    out : np.array or None
+        An array of the same shape as the inputs to write the result into (and
+        cast to its dtype), or None to return the result itself.
+        
+    Returns
+    -------
+    output : np.array
+        The result in the shape of the inputs; out itself if it was given.
+    '''
+    if out is None:
+        return result.reshape(shape)
+    out[...] = result.reshape(shape)
+    return out
+
+
+def _sortedKwds(shape,sorted_x):
+    '''
+    Makes the keyword arguments that tell a 1D interpolator's evaluation methods
+    that the query points are sorted along their last axis: the length of each
+    sorted row of the flattened points, or nothing if they are not sorted.
+    '''
+    if not sorted_x:
+        return {}
+    return {'row_size' : shape[-1] if len(shape) > 0 else 1}
+
+
+def gridDistance(func_A,func_B,nodes_A,nodes_B,values_A=None,values_B=None):
+    '''
+    Calculates the sup-norm distance between two functions of one or more variables
+    on a common evaluation grid: the tensor product of the union of their nodes in
+    each dimension, restricted to the region where both functions are defined (the
+    overlap of their node ranges).  For functions that are (multi)linear between
+    their nodes this is the exact supremum of their absolute difference over that
+    region.  When the nodes of the two functions are identical and their values at
+    the nodes are given, the values are compared directly without evaluating.
+    
+    Parameters
+    ----------
+    func_A : function
+        A function of as many variables as there are arrays in nodes_A.
+    func_B : function
+        Another function of the same number of variables.
+    nodes_A : (np.array)
+        Sorted arrays of nodes of func_A, one for each dimension.
+    nodes_B : (np.array)
+        Sorted arrays of nodes of func_B, one for each dimension.
+    values_A : np.array or None
+        Values of func_A on the tensor grid of nodes_A, if the function is
+        determined by these values.
+    values_B : np.array or None
+        Values of func_B on the tensor grid of nodes_B, if the function is
+        determined by these values.
+        
+    Returns
+    -------
+    distance : float
+        The largest absolute difference between the functions on the grid; 1000.0
+        if their node ranges do not overlap or only one of them is NaN somewhere.
+    '''
+    same_nodes = all(a.shape == b.shape and np.array_equal(a,b) for a, b in zip(nodes_A,nodes_B))
+    if same_nodes and values_A is not None and values_B is not None:
+        f_A = values_A
+        f_B = values_B
+    else:
+        if same_nodes:
+            grids = nodes_A
+        else:
+            grids = []
+            for a, b in zip(nodes_A,nodes_B):
+                bot = max(a[0],b[0])
+                top = min(a[-1],b[-1])
+                if bot > top:
+                    return 1000.0
+                grid = np.union1d(a,b)
+                grids.append(grid[np.logical_and(grid >= bot, grid <= top)])
+        mesh = np.meshgrid(*grids,indexing='ij')
+        f_A = func_A(*mesh)
+        f_B = func_B(*mesh)
+    diff = np.abs(f_A - f_B)
+    if np.any(np.isnan(diff)):
+        diff[np.logical_and(np.isnan(f_A),np.isnan(f_B))] = 0.0
+        diff[np.isnan(diff)] = 1000.0
+    return float(np.max(diff))
+
+
+def interpolatorDistance(interp_A,interp_B):
+    '''
+    The distance method of HARK's interpolator classes.  If both interpolators report
+    nodes in the same number of dimensions (with a method called distanceNodes), this
+    is the sup-norm distance computed by gridDistance, comparing values at the nodes
+    directly (from a method called distanceValues) for two interpolators of the same
+    class on identical grids.  Otherwise it is the generic distance of HARKobject.
+    
+    Parameters
+    ----------
+    interp_A : HARKobject
+        An interpolator.
+    interp_B : HARKobject
+        Another object to compare it to.
+        
+    Returns
+    -------
+    distance : float
+        The distance between the two.
+    '''
+    nodes_A = interp_A.distanceNodes() if hasattr(interp_A,'distanceNodes') else None
+    nodes_B = interp_B.distanceNodes() if hasattr(interp_B,'distanceNodes') else None
+    if nodes_A is None or nodes_B is None or len(nodes_A) != len(nodes_B):
+        return HARKobject.distance(interp_A,interp_B)
+    values_A = None
+    values_B = None
+    if type(interp_A) is type(interp_B) and hasattr(interp_A,'distanceValues'):
+        values_A = interp_A.distanceValues()
+        values_B = interp_B.distanceValues()
+    return gridDistance(interp_A,interp_B,nodes_A,nodes_B,values_A,values_B)
+
+
 class HARKinterpolator1D(HARKobject):
     '''
     A wrapper class for 1D interpolation methods in HARK.
     '''
     distance_criteria = []
     
-    def __call__(self,x):
+    def distance(self,other):
+        '''
+        Calculates the distance between this interpolator and another object; see
+        interpolatorDistance.
+        '''
+        return interpolatorDistance(self,other)
+    
+    def __call__(self,x,out=None,sorted_x=False):
         '''
         Evaluates the interpolated function at the given input.
         
@@ -44,6 +245,13 @@ class HARKinterpolator1D(HARKobject):
         ----------
         x : np.array or float
             Real values to be evaluated in the interpolated function.
+        out : np.array or None
+            Optional array of the same shape as x to write the output into.
+        sorted_x : boolean
+            Optional indicator that x is sorted in increasing order along its last
+            axis (within each row of a 2D array), so that the segment of each point
+            can be found by merging the rows with the grid (see mergeSearch)
+            rather than by a binary search for each point.
         
         Returns
         -------
@@ -51,10 +259,10 @@ class HARKinterpolator1D(HARKobject):
             The interpolated function evaluated at x: y = f(x), with the same
             shape as x.
         '''
-        z = np.asarray(x)
-        return (self._evaluate(z.flatten())).reshape(z.shape)
+        (xa,), shape = _flatArgs(x)
+        return _shapeOutput(self._evaluate(xa,**_sortedKwds(shape,sorted_x)),shape,out)
         
-    def derivative(self,x):
+    def derivative(self,x,out=None,sorted_x=False):
         '''
         Evaluates the derivative of the interpolated function at the given input.
         
@@ -62,6 +270,10 @@ class HARKinterpolator1D(HARKobject):
         ----------
         x : np.array or float
             Real values to be evaluated in the interpolated function.
+        out : np.array or None
+            Optional array of the same shape as x to write the output into.
+        sorted_x : boolean
+            Optional indicator that x is sorted along its last axis; see __call__.
         
         Returns
         -------
@@ -69,10 +281,10 @@ class HARKinterpolator1D(HARKobject):
             The interpolated function's first derivative evaluated at x:
             dydx = f'(x), with the same shape as x.
         '''
-        z = np.asarray(x)
-        return (self._der(z.flatten())).reshape(z.shape)
+        (xa,), shape = _flatArgs(x)
+        return _shapeOutput(self._der(xa,**_sortedKwds(shape,sorted_x)),shape,out)
         
-    def eval_with_derivative(self,x):
+    def eval_with_derivative(self,x,out=None,sorted_x=False):
         '''
         Evaluates the interpolated function and its derivative at the given input.
         
@@ -80,6 +292,11 @@ class HARKinterpolator1D(HARKobject):
         ----------
         x : np.array or float
             Real values to be evaluated in the interpolated function.
+        out : (np.array,np.array) or None
+            Optional pair of arrays of the same shape as x to write the level and
+            derivative into.
+        sorted_x : boolean
+            Optional indicator that x is sorted along its last axis; see __call__.
         
         Returns
         -------
@@ -90,9 +307,11 @@ class HARKinterpolator1D(HARKobject):
             The interpolated function's first derivative evaluated at x:
             dydx = f'(x), with the same shape as x.
         '''
-        z = np.asarray(x)
-        y, dydx = self._evalAndDer(z.flatten())
-        return y.reshape(z.shape), dydx.reshape(z.shape)
+        (xa,), shape = _flatArgs(x)
+        y, dydx = self._evalAndDer(xa,**_sortedKwds(shape,sorted_x))
+        if out is None:
+            return y.reshape(shape), dydx.reshape(shape)
+        return _shapeOutput(y,shape,out[0]), _shapeOutput(dydx,shape,out[1])
         
     def _evaluate(self,x):
         '''
@@ -119,7 +338,14 @@ class HARKinterpolator2D(HARKobject):
     '''
     distance_criteria = []
     
-    def __call__(self,x,y):
+    def distance(self,other):
+        '''
+        Calculates the distance between this interpolator and another object; see
+        interpolatorDistance.
+        '''
+        return interpolatorDistance(self,other)
+    
+    def __call__(self,x,y,out=None):
         '''
         Evaluates the interpolated function at the given input.
         
@@ -130,6 +356,8 @@ class HARKinterpolator2D(HARKobject):
         y : np.array or float
             Real values to be evaluated in the interpolated function; must be
             the same size as x.
+        out : np.array or None
+            Optional array of the same shape as x to write the output into.
         
         Returns
         -------
@@ -137,11 +365,10 @@ class HARKinterpolator2D(HARKobject):
             The interpolated function evaluated at x,y: fxy = f(x,y), with the
             same shape as x and y.
         '''
-        xa = np.asarray(x)
-        ya = np.asarray(y)
-        return (self._evaluate(xa.flatten(),ya.flatten())).reshape(xa.shape)
+        (xa,ya), shape = _flatArgs(x,y)
+        return _shapeOutput(self._evaluate(xa,ya),shape,out)
         
-    def derivativeX(self,x,y):
+    def derivativeX(self,x,y,out=None):
         '''
         Evaluates the partial derivative of interpolated function with respect
         to x (the first argument) at the given input.
@@ -153,6 +380,8 @@ class HARKinterpolator2D(HARKobject):
         y : np.array or float
             Real values to be evaluated in the interpolated function; must be
             the same size as x.
+        out : np.array or None
+            Optional array of the same shape as x to write the output into.
         
         Returns
         -------
@@ -160,11 +389,10 @@ class HARKinterpolator2D(HARKobject):
             The derivative of the interpolated function with respect to x, eval-
             uated at x,y: dfdx = f_x(x,y), with the same shape as x and y.
         '''
-        xa = np.asarray(x)
-        ya = np.asarray(y)
-        return (self._derX(xa.flatten(),ya.flatten())).reshape(xa.shape)
+        (xa,ya), shape = _flatArgs(x,y)
+        return _shapeOutput(self._derX(xa,ya),shape,out)
         
-    def derivativeY(self,x,y):
+    def derivativeY(self,x,y,out=None):
         '''
         Evaluates the partial derivative of interpolated function with respect
         to y (the second argument) at the given input.
@@ -176,6 +404,8 @@ class HARKinterpolator2D(HARKobject):
         y : np.array or float
             Real values to be evaluated in the interpolated function; must be
             the same size as x.
+        out : np.array or None
+            Optional array of the same shape as x to write the output into.
         
         Returns
         -------
@@ -183,9 +413,35 @@ class HARKinterpolator2D(HARKobject):
             The derivative of the interpolated function with respect to y, eval-
             uated at x,y: dfdx = f_y(x,y), with the same shape as x and y.
         '''
-        xa = np.asarray(x)
-        ya = np.asarray(y)
-        return (self._derY(xa.flatten(),ya.flatten())).reshape(xa.shape)
+        (xa,ya), shape = _flatArgs(x,y)
+        return _shapeOutput(self._derY(xa,ya),shape,out)
+        
+    def eval_with_gradient(self,x,y):
+        '''
+        Evaluates the interpolated function and all of its partial derivatives
+        at the given input, in one pass where the subclass supports it.
+        
+        Parameters
+        ----------
+        x : np.array or float
+            Real values to be evaluated in the interpolated function.
+        y : np.array or float
+            Real values to be evaluated in the interpolated function; must be
+            the same size as x.
+        
+        Returns
+        -------
+        f : np.array or float
+            The interpolated function evaluated at x,y, with the same shape as x.
+        dfdx : np.array or float
+            The derivative of the interpolated function with respect to x, with
+            the same shape as x.
+        dfdy : np.array or float
+            The derivative of the interpolated function with respect to y, with
+            the same shape as x.
+        '''
+        (xa,ya), shape = _flatArgs(x,y)
+        return tuple(result.reshape(shape) for result in self._evalAndGrad(xa,ya))
         
     def _evaluate(self,x,y):
         '''
@@ -204,6 +460,14 @@ class HARKinterpolator2D(HARKobject):
         Interpolated function y-derivative evaluator, to be defined in subclasses.
         '''
         raise NotImplementedError()
+        
+    def _evalAndGrad(self,x,y):
+        '''
+        Returns the level and all partial derivatives of the interpolated function
+        at each value in x,y.  Subclasses that can find them in one pass override
+        this; by default, each is evaluated separately.
+        '''
+        return [self._evaluate(x,y),self._derX(x,y),self._derY(x,y)]
 
         
 class HARKinterpolator3D(HARKobject):
@@ -212,7 +476,14 @@ class HARKinterpolator3D(HARKobject):
     '''
     distance_criteria = []
     
-    def __call__(self,x,y,z):
+    def distance(self,other):
+        '''
+        Calculates the distance between this interpolator and another object; see
+        interpolatorDistance.
+        '''
+        return interpolatorDistance(self,other)
+    
+    def __call__(self,x,y,z,out=None):
         '''
         Evaluates the interpolated function at the given input.
         
@@ -226,6 +497,8 @@ class HARKinterpolator3D(HARKobject):
         z : np.array or float
             Real values to be evaluated in the interpolated function; must be
             the same size as x.
+        out : np.array or None
+            Optional array of the same shape as x to write the output into.
         
         Returns
         -------
@@ -233,12 +506,10 @@ class HARKinterpolator3D(HARKobject):
             The interpolated function evaluated at x,y,z: fxyz = f(x,y,z), with
             the same shape as x, y, and z.
         '''
-        xa = np.asarray(x)
-        ya = np.asarray(y)
-        za = np.asarray(z)
-        return (self._evaluate(xa.flatten(),ya.flatten(),za.flatten())).reshape(xa.shape)
+        (xa,ya,za), shape = _flatArgs(x,y,z)
+        return _shapeOutput(self._evaluate(xa,ya,za),shape,out)
         
-    def derivativeX(self,x,y,z):
+    def derivativeX(self,x,y,z,out=None):
         '''
         Evaluates the partial derivative of the interpolated function with respect
         to x (the first argument) at the given input.
@@ -253,6 +524,8 @@ class HARKinterpolator3D(HARKobject):
         z : np.array or float
             Real values to be evaluated in the interpolated function; must be
             the same size as x.
+        out : np.array or None
+            Optional array of the same shape as x to write the output into.
         
         Returns
         -------
@@ -260,12 +533,10 @@ class HARKinterpolator3D(HARKobject):
             The derivative with respect to x of the interpolated function evaluated
             at x,y,z: dfdx = f_x(x,y,z), with the same shape as x, y, and z.
         '''
-        xa = np.asarray(x)
-        ya = np.asarray(y)
-        za = np.asarray(z)
-        return (self._derX(xa.flatten(),ya.flatten(),za.flatten())).reshape(xa.shape)
+        (xa,ya,za), shape = _flatArgs(x,y,z)
+        return _shapeOutput(self._derX(xa,ya,za),shape,out)
         
-    def derivativeY(self,x,y,z):
+    def derivativeY(self,x,y,z,out=None):
         '''
         Evaluates the partial derivative of the interpolated function with respect
         to y (the second argument) at the given input.
@@ -280,6 +551,8 @@ class HARKinterpolator3D(HARKobject):
         z : np.array or float
             Real values to be evaluated in the interpolated function; must be
             the same size as x.
+        out : np.array or None
+            Optional array of the same shape as x to write the output into.
         
         Returns
         -------
@@ -287,12 +560,10 @@ class HARKinterpolator3D(HARKobject):
             The derivative with respect to y of the interpolated function evaluated
             at x,y,z: dfdy = f_y(x,y,z), with the same shape as x, y, and z.
         '''
-        xa = np.asarray(x)
-        ya = np.asarray(y)
-        za = np.asarray(z)
-        return (self._derY(xa.flatten(),ya.flatten(),za.flatten())).reshape(xa.shape)
+        (xa,ya,za), shape = _flatArgs(x,y,z)
+        return _shapeOutput(self._derY(xa,ya,za),shape,out)
         
-    def derivativeZ(self,x,y,z):
+    def derivativeZ(self,x,y,z,out=None):
         '''
         Evaluates the partial derivative of the interpolated function with respect
         to z (the third argument) at the given input.
@@ -307,6 +578,8 @@ class HARKinterpolator3D(HARKobject):
         z : np.array or float
             Real values to be evaluated in the interpolated function; must be
             the same size as x.
+        out : np.array or None
+            Optional array of the same shape as x to write the output into.
         
         Returns
         -------
@@ -314,10 +587,41 @@ class HARKinterpolator3D(HARKobject):
             The derivative with respect to z of the interpolated function evaluated
             at x,y,z: dfdz = f_z(x,y,z), with the same shape as x, y, and z.
         '''
-        xa = np.asarray(x)
-        ya = np.asarray(y)
-        za = np.asarray(z)
-        return (self._derZ(xa.flatten(),ya.flatten(),za.flatten())).reshape(xa.shape)
+        (xa,ya,za), shape = _flatArgs(x,y,z)
+        return _shapeOutput(self._derZ(xa,ya,za),shape,out)
+        
+    def eval_with_gradient(self,x,y,z):
+        '''
+        Evaluates the interpolated function and all of its partial derivatives
+        at the given input, in one pass where the subclass supports it.
+        
+        Parameters
+        ----------
+        x : np.array or float
+            Real values to be evaluated in the interpolated function.
+        y : np.array or float
+            Real values to be evaluated in the interpolated function; must be
+            the same size as x.
+        z : np.array or float
+            Real values to be evaluated in the interpolated function; must be
+            the same size as x.
+        
+        Returns
+        -------
+        f : np.array or float
+            The interpolated function evaluated at x,y,z, with the same shape as x.
+        dfdx : np.array or float
+            The derivative of the interpolated function with respect to x, with
+            the same shape as x.
+        dfdy : np.array or float
+            The derivative of the interpolated function with respect to y, with
+            the same shape as x.
+        dfdz : np.array or float
+            The derivative of the interpolated function with respect to z, with
+            the same shape as x.
+        '''
+        (xa,ya,za), shape = _flatArgs(x,y,z)
+        return tuple(result.reshape(shape) for result in self._evalAndGrad(xa,ya,za))
         
     def _evaluate(self,x,y,z):
         '''
@@ -343,6 +647,14 @@ class HARKinterpolator3D(HARKobject):
         '''
         raise NotImplementedError()
         
+    def _evalAndGrad(self,x,y,z):
+        '''
+        Returns the level and all partial derivatives of the interpolated function
+        at each value in x,y,z.  Subclasses that can find them in one pass override
+        this; by default, each is evaluated separately.
+        '''
+        return [self._evaluate(x,y,z),self._derX(x,y,z),self._derY(x,y,z),self._derZ(x,y,z)]
+        
         
 class HARKinterpolator4D(HARKobject):
     '''
@@ -350,7 +662,14 @@ class HARKinterpolator4D(HARKobject):
     '''
     distance_criteria = []
     
-    def __call__(self,w,x,y,z):
+    def distance(self,other):
+        '''
+        Calculates the distance between this interpolator and another object; see
+        interpolatorDistance.
+        '''
+        return interpolatorDistance(self,other)
+    
+    def __call__(self,w,x,y,z,out=None):
         '''
         Evaluates the interpolated function at the given input.
         
@@ -367,6 +686,8 @@ class HARKinterpolator4D(HARKobject):
         z : np.array or float
             Real values to be evaluated in the interpolated function; must be
             the same size as w.
+        out : np.array or None
+            Optional array of the same shape as w to write the output into.
         
         Returns
         -------
@@ -374,13 +695,10 @@ class HARKinterpolator4D(HARKobject):
             The interpolated function evaluated at w,x,y,z: fwxyz = f(w,x,y,z),
             with the same shape as w, x, y, and z.
         '''
-        wa = np.asarray(w)
-        xa = np.asarray(x)
-        ya = np.asarray(y)
-        za = np.asarray(z)
-        return (self._evaluate(wa.flatten(),xa.flatten(),ya.flatten(),za.flatten())).reshape(wa.shape)
+        (wa,xa,ya,za), shape = _flatArgs(w,x,y,z)
+        return _shapeOutput(self._evaluate(wa,xa,ya,za),shape,out)
 
-    def derivativeW(self,w,x,y,z):
+    def derivativeW(self,w,x,y,z,out=None):
         '''
         Evaluates the partial derivative with respect to w (the first argument)
         of the interpolated function at the given input.
@@ -398,6 +716,8 @@ class HARKinterpolator4D(HARKobject):
         z : np.array or float
             Real values to be evaluated in the interpolated function; must be
             the same size as w.
+        out : np.array or None
+            Optional array of the same shape as w to write the output into.
         
         Returns
         -------
@@ -405,13 +725,10 @@ class HARKinterpolator4D(HARKobject):
             The derivative with respect to w of the interpolated function eval-
             uated at w,x,y,z: dfdw = f_w(w,x,y,z), with the same shape as inputs.
         '''
-        wa = np.asarray(w)
-        xa = np.asarray(x)
-        ya = np.asarray(y)
-        za = np.asarray(z)
-        return (self._derW(wa.flatten(),xa.flatten(),ya.flatten(),za.flatten())).reshape(wa.shape)
+        (wa,xa,ya,za), shape = _flatArgs(w,x,y,z)
+        return _shapeOutput(self._derW(wa,xa,ya,za),shape,out)
 
-    def derivativeX(self,w,x,y,z):
+    def derivativeX(self,w,x,y,z,out=None):
         '''
         Evaluates the partial derivative with respect to x (the second argument)
         of the interpolated function at the given input.
@@ -429,6 +746,8 @@ class HARKinterpolator4D(HARKobject):
         z : np.array or float
             Real values to be evaluated in the interpolated function; must be
             the same size as w.
+        out : np.array or None
+            Optional array of the same shape as w to write the output into.
         
         Returns
         -------
@@ -436,13 +755,10 @@ class HARKinterpolator4D(HARKobject):
             The derivative with respect to x of the interpolated function eval-
             uated at w,x,y,z: dfdx = f_x(w,x,y,z), with the same shape as inputs.
         '''
-        wa = np.asarray(w)
-        xa = np.asarray(x)
-        ya = np.asarray(y)
-        za = np.asarray(z)
-        return (self._derX(wa.flatten(),xa.flatten(),ya.flatten(),za.flatten())).reshape(wa.shape)
+        (wa,xa,ya,za), shape = _flatArgs(w,x,y,z)
+        return _shapeOutput(self._derX(wa,xa,ya,za),shape,out)
         
-    def derivativeY(self,w,x,y,z):
+    def derivativeY(self,w,x,y,z,out=None):
         '''
         Evaluates the partial derivative with respect to y (the third argument)
         of the interpolated function at the given input.
@@ -460,6 +776,8 @@ class HARKinterpolator4D(HARKobject):
         z : np.array or float
             Real values to be evaluated in the interpolated function; must be
             the same size as w.
+        out : np.array or None
+            Optional array of the same shape as w to write the output into.
         
         Returns
         -------
@@ -467,13 +785,10 @@ class HARKinterpolator4D(HARKobject):
             The derivative with respect to y of the interpolated function eval-
             uated at w,x,y,z: dfdy = f_y(w,x,y,z), with the same shape as inputs.
         '''
-        wa = np.asarray(w)
-        xa = np.asarray(x)
-        ya = np.asarray(y)
-        za = np.asarray(z)
-        return (self._derY(wa.flatten(),xa.flatten(),ya.flatten(),za.flatten())).reshape(wa.shape)
+        (wa,xa,ya,za), shape = _flatArgs(w,x,y,z)
+        return _shapeOutput(self._derY(wa,xa,ya,za),shape,out)
 
-    def derivativeZ(self,w,x,y,z):
+    def derivativeZ(self,w,x,y,z,out=None):
         '''
         Evaluates the partial derivative with respect to z (the fourth argument)
         of the interpolated function at the given input.
@@ -491,6 +806,8 @@ class HARKinterpolator4D(HARKobject):
         z : np.array or float
             Real values to be evaluated in the interpolated function; must be
             the same size as w.
+        out : np.array or None
+            Optional array of the same shape as w to write the output into.
         
         Returns
         -------
@@ -498,11 +815,47 @@ class HARKinterpolator4D(HARKobject):
             The derivative with respect to z of the interpolated function eval-
             uated at w,x,y,z: dfdz = f_z(w,x,y,z), with the same shape as inputs.
         '''
-        wa = np.asarray(w)
-        xa = np.asarray(x)
-        ya = np.asarray(y)
-        za = np.asarray(z)
-        return (self._derZ(wa.flatten(),xa.flatten(),ya.flatten(),za.flatten())).reshape(wa.shape)
+        (wa,xa,ya,za), shape = _flatArgs(w,x,y,z)
+        return _shapeOutput(self._derZ(wa,xa,ya,za),shape,out)
+        
+    def eval_with_gradient(self,w,x,y,z):
+        '''
+        Evaluates the interpolated function and all of its partial derivatives
+        at the given input, in one pass where the subclass supports it.
+        
+        Parameters
+        ----------
+        w : np.array or float
+            Real values to be evaluated in the interpolated function.
+        x : np.array or float
+            Real values to be evaluated in the interpolated function; must be
+            the same size as w.
+        y : np.array or float
+            Real values to be evaluated in the interpolated function; must be
+            the same size as w.
+        z : np.array or float
+            Real values to be evaluated in the interpolated function; must be
+            the same size as w.
+        
+        Returns
+        -------
+        f : np.array or float
+            The interpolated function evaluated at w,x,y,z, with the same shape as w.
+        dfdw : np.array or float
+            The derivative of the interpolated function with respect to w, with
+            the same shape as w.
+        dfdx : np.array or float
+            The derivative of the interpolated function with respect to x, with
+            the same shape as w.
+        dfdy : np.array or float
+            The derivative of the interpolated function with respect to y, with
+            the same shape as w.
+        dfdz : np.array or float
+            The derivative of the interpolated function with respect to z, with
+            the same shape as w.
+        '''
+        (wa,xa,ya,za), shape = _flatArgs(w,x,y,z)
+        return tuple(result.reshape(shape) for result in self._evalAndGrad(wa,xa,ya,za))
         
     def _evaluate(self,w,x,y,z):
         '''
@@ -534,7 +887,42 @@ class HARKinterpolator4D(HARKobject):
         '''
         raise NotImplementedError()
         
+    def _evalAndGrad(self,w,x,y,z):
+        '''
+        Returns the level and all partial derivatives of the interpolated function
+        at each value in w,x,y,z.  Subclasses that can find them in one pass override
+        this; by default, each is evaluated separately.
+        '''
+        return [self._evaluate(w,x,y,z),self._derW(w,x,y,z),self._derX(w,x,y,z),self._derY(w,x,y,z),self._derZ(w,x,y,z)]
         
+        
+def evalWithGradient(function,*args):
+    '''
+    Evaluates a function of two to four variables and all of its partial derivatives
+    at the given input, using its eval_with_gradient method if it has one and its
+    separate evaluation methods otherwise.
+    
+    Parameters
+    ----------
+    function : HARKinterpolator2D, HARKinterpolator3D, HARKinterpolator4D, or similar
+        The function to be evaluated, with methods derivativeX, derivativeY (etc).
+    *args : np.array or float
+        Real values to be evaluated in the function, all of the same size.
+        
+    Returns
+    -------
+    output : tuple
+        The level of the function, followed by its partial derivatives with
+        respect to each argument in order.
+    '''
+    if hasattr(function,'eval_with_gradient'):
+        return function.eval_with_gradient(*args)
+    der_names = ['derivativeX','derivativeY','derivativeZ']
+    if len(args) == 4:
+        der_names = ['derivativeW'] + der_names
+    return tuple([function(*args)] + [getattr(function,name)(*args) for name in der_names[:len(args)]])
+    
+    
 class IdentityFunction(HARKobject):
     '''
     A fairly trivial interpolator that simply returns one of its arguments.  Useful for avoiding
@@ -695,6 +1083,192 @@ class ConstantFunction(HARKobject):
     derivativeXX= derivative
     
     
+def _isEvenlySpaced(t_list):
+    '''
+    Checks whether an increasing array is evenly spaced, with every point within
+    1% of a step of where it would be on an evenly spaced grid.
+    '''
+    if t_list.size < 3 or not np.all(np.isfinite(t_list)):
+        return False
+    steps = (t_list - t_list[0])/((t_list[-1] - t_list[0])/(t_list.size - 1))
+    return np.max(np.abs(steps - np.arange(t_list.size))) < 0.01
+
+
+class GridSearch(HARKobject):
+    '''
+    A replacement for np.searchsorted on a fixed grid from one of the families made
+    by HARKutilities (evenly spaced, exponentially spaced, or multi-exponentially
+    spaced as by makeGridExpMult).  On such a grid, the bracketing index of a query
+    point can be computed in closed form by inverting the transformation that makes
+    the grid evenly spaced, then corrected by one step to match np.searchsorted
+    exactly.  Instances are called like np.searchsorted, with the grid and the
+    query points, and can be given as a "search function" to the interpolators in
+    this module; on other grids (or where the transformation is more expensive than
+    a binary search) they just call np.searchsorted.
+    '''
+    distance_criteria = ['grid_type','timestonest']
+    
+    def __init__(self,x_list,grid_type='auto',timestonest=None):
+        '''
+        Make a new GridSearch for a grid.
+        
+        Parameters
+        ----------
+        x_list : np.array
+            The grid to be searched, sorted in increasing order.
+        grid_type : str
+            The family of the grid: 'uniform' (evenly spaced), 'log' (evenly spaced
+            in logs), 'exp_mult' (evenly spaced after applying log(x+1) timestonest
+            times), or 'auto' to detect which of these (if any) the grid is from.
+        timestonest : int or None
+            Number of times the transformation is nested for an 'exp_mult' grid.
+            When grid_type is 'auto', this is the greatest nesting to check for
+            (default 20, as in makeGridExpMult).
+            
+        Returns
+        -------
+        None
+        '''
+        self.x_list = np.asarray(x_list,dtype=float)
+        self.n = self.x_list.size
+        self.x_pad = np.concatenate(([-np.inf],self.x_list,[np.inf]))
+        if grid_type == 'auto':
+            grid_type, timestonest = self.detectGridType(self.x_list,timestonest)
+        elif grid_type == 'exp_mult' and timestonest is None:
+            timestonest = 20
+        if grid_type not in ['uniform','log','exp_mult']:
+            grid_type = None
+        self.grid_type = grid_type
+        self.timestonest = timestonest
+        if grid_type is not None:
+            with np.errstate(divide='ignore',invalid='ignore'):
+                t_list = self.transform(self.x_list)
+            if not _isEvenlySpaced(t_list): # The grid is not from the family it was said to be
+                self.grid_type = None
+        
+        # Only use the closed form if the grid is from a known family and the nested
+        # transformation (about as costly as three steps of bisection each) is cheap enough
+        self.closed_form = self.grid_type is not None and \
+            (self.grid_type != 'exp_mult' or 3*timestonest <= np.log2(self.n))
+        if self.closed_form:
+            self.bot = t_list[0]
+            self.step = (t_list[-1] - t_list[0])/(self.n - 1)
+            
+    @staticmethod
+    def detectGridType(x_list,max_nest=None):
+        '''
+        Detects whether a grid is evenly spaced, exponentially spaced, or multi-
+        exponentially spaced, up to small rounding errors.
+        
+        Parameters
+        ----------
+        x_list : np.array
+            The grid, sorted in increasing order.
+        max_nest : int or None
+            The greatest nesting of log(x+1) to check for (default 20).
+            
+        Returns
+        -------
+        grid_type : str or None
+            'uniform', 'log', or 'exp_mult'; None if the grid is from none of these.
+        timestonest : int or None
+            The nesting of an 'exp_mult' grid.
+        '''
+        if max_nest is None:
+            max_nest = 20
+        if _isEvenlySpaced(x_list):
+            return 'uniform', None
+        if x_list[0] > 0.0 and _isEvenlySpaced(np.log(x_list)):
+            return 'log', None
+        if x_list[0] > -1.0:
+            t_list = x_list
+            for j in range(max_nest):
+                t_list = np.log1p(t_list)
+                if _isEvenlySpaced(t_list):
+                    return 'exp_mult', j+1
+        return None, None
+        
+    def transform(self,x):
+        '''
+        Applies the transformation that makes this grid evenly spaced.
+        '''
+        if self.grid_type == 'log':
+            return np.log(x)
+        if self.grid_type == 'exp_mult':
+            for j in range(self.timestonest):
+                x = np.log1p(x)
+        return x
+        
+    def __call__(self,x_list,x):
+        '''
+        Finds the indices at which the query points would be inserted into the grid,
+        exactly as np.searchsorted(x_list,x).
+        
+        Parameters
+        ----------
+        x_list : np.array
+            The grid this GridSearch was made for.
+        x : np.array or float
+            Query points.
+            
+        Returns
+        -------
+        i : np.array or int
+            Number of gridpoints strictly less than each query point.
+        '''
+        if not self.closed_form or _isscalar(x):
+            return np.searchsorted(x_list,x)
+        with np.errstate(divide='ignore',invalid='ignore'):
+            pos = (self.transform(x) - self.bot)/self.step
+            pos[np.isnan(pos)] = -1.0 # below the domain of the transformation
+            i = np.floor(np.clip(pos,-1.0,self.n)).astype(int) + 1
+            i = np.minimum(i,self.n)
+            i -= x <= self.x_pad[i]
+            i += x > self.x_pad[i+1]
+        i = np.maximum(i,0)
+        i[np.isnan(x)] = self.n
+        return i
+
+
+# Query points that are sorted in rows shorter than this are located by a binary
+# search for each point anyway, as merging each short row separately costs more.
+merge_min_row = 2048
+
+def mergeSearch(x_list,x,row_size=None):
+    '''
+    Finds the index at which each value in x would be inserted into the sorted
+    array x_list, as np.searchsorted(x_list,x) does, when x is sorted in increasing
+    order within each consecutive row of row_size values (with any NaNs at the end
+    of their row).  Each row is merged with x_list: the position of each gridpoint
+    in the row is found instead, and the index for a query point is the number of
+    gridpoints that come before it.  On long rows this is several times faster
+    than a binary search for every query point.
+    
+    Parameters
+    ----------
+    x_list : np.array
+        A sorted 1D array.
+    x : np.array
+        Flat array of query points, sorted within each row.
+    row_size : int or None
+        Number of query points in each sorted row; None if all of x is sorted.
+        
+    Returns
+    -------
+    i : np.array
+        Number of gridpoints strictly less than each query point.
+    '''
+    if row_size is None:
+        row_size = x.size
+    row_size = max(row_size,1)
+    i = np.empty(x.size,dtype=int)
+    for start in xrange(0,x.size,row_size):
+        row = x[start:(start+row_size)]
+        counts = np.bincount(np.searchsorted(row,x_list,side='right'),minlength=row.size+1)
+        np.cumsum(counts[:-1],out=i[start:(start+row_size)])
+    return i
+
+
 class LinearInterp(HARKinterpolator1D):
     '''
     A "from scratch" 1D linear interpolation class.  Allows for linear or decay
@@ -702,7 +1276,8 @@ class LinearInterp(HARKinterpolator1D):
     '''
     distance_criteria = ['x_list','y_list']
     
-    def __init__(self,x_list,y_list,intercept_limit=None,slope_limit=None,lower_extrap=False):
+    def __init__(self,x_list,y_list,intercept_limit=None,slope_limit=None,lower_extrap=False,
+                 grid_type=None,timestonest=None):
         '''
         The interpolation constructor to make a new linear spline interpolation.
         
@@ -719,6 +1294,11 @@ class LinearInterp(HARKinterpolator1D):
         lower_extrap : boolean
             Indicator for whether lower extrapolation is allowed.  False means
             f(x) = NaN for x < min(x_list); True means linear extrapolation.
+        grid_type : str or None
+            The family of x_list, if known: 'uniform', 'log', 'exp_mult', or 'auto'
+            to detect it; see GridSearch.  If None, np.searchsorted is used.
+        timestonest : int or None
+            Nesting of a multi-exponentially spaced x_list; see GridSearch.
             
         Returns
         -------
@@ -732,6 +1312,8 @@ class LinearInterp(HARKinterpolator1D):
         self.y_list = np.array(y_list)
         self.lower_extrap = lower_extrap
         self.x_n = self.x_list.size
+        self.slope_list = (self.y_list[1:] - self.y_list[:-1])/(self.x_list[1:] - self.x_list[:-1])
+        self.searchFunc = GridSearch(self.x_list,grid_type,timestonest) if grid_type is not None else None
         
         # Make a decay extrapolation
         if intercept_limit is not None and slope_limit is not None:
@@ -746,9 +1328,52 @@ class LinearInterp(HARKinterpolator1D):
             self.decay_extrap    = True
         else:
             self.decay_extrap = False
+            
+    def distanceNodes(self):
+        '''
+        Returns the gridpoints of this interpolation, for interpolatorDistance.
+        '''
+        return (self.x_list,)
+        
+    def distanceValues(self):
+        '''
+        Returns the function values at the gridpoints, for interpolatorDistance.
+        '''
+        return self.y_list
+        
+    def distance(self,other):
+        '''
+        Calculates the distance between this interpolation and another object, as
+        in interpolatorDistance.  Two LinearInterps are compared directly at their
+        gridpoints with np.interp.
+        
+        Parameters
+        ----------
+        other : object
+            Another object to compare this instance to.
+            
+        Returns
+        -------
+        distance : float
+            The distance between this interpolation and the other object.
+        '''
+        if self.__class__ is not LinearInterp or other.__class__ is not LinearInterp:
+            return interpolatorDistance(self,other)
+        x_A, y_A, x_B, y_B = self.x_list, self.y_list, other.x_list, other.y_list
+        if x_A.shape == x_B.shape and np.array_equal(x_A,x_B):
+            return float(np.max(np.abs(y_A - y_B)))
+        bot = max(x_A[0],x_B[0])
+        top = min(x_A[-1],x_B[-1])
+        if bot > top:
+            return 1000.0
+        in_A = np.logical_and(x_A >= bot, x_A <= top)
+        in_B = np.logical_and(x_B >= bot, x_B <= top)
+        diff_A = np.abs(y_A[in_A] - np.interp(x_A[in_A],x_B,y_B))
+        diff_B = np.abs(np.interp(x_B[in_B],x_A,y_A) - y_B[in_B])
+        return float(np.max(np.concatenate((diff_A,diff_B))))
 
 
-    def _evalOrDer(self,x,_eval,_Der):
+    def _evalOrDer(self,x,_eval,_Der,row_size=None):
         '''
         Returns the level and/or first derivative of the function at each value in
         x.  Only called internally by HARKinterpolator1D.eval_and_der (etc).
@@ -761,21 +1386,38 @@ class LinearInterp(HARKinterpolator1D):
             Indicator for whether to evalute the level of the interpolated function.
         _Der : boolean
             Indicator for whether to evaluate the derivative of the interpolated function.
+        row_size : int or None
+            Length of the rows in which x is sorted, if it is; see mergeSearch.
             
         Returns
         -------
         A list including the level and/or derivative of the interpolated function where requested.
         '''
+        if _useJit() and not _isscalar(x):
+            y, dydx = _jitOutputs(x.size,[_eval,_Der])
+            if self.decay_extrap:
+                decay_params = np.array([self.intercept_limit,self.slope_limit,self.decay_extrap_A,self.decay_extrap_B],dtype=float)
+            else:
+                decay_params = np.empty(0)
+            linearInterpKernel(self.x_list,self.y_list,self.slope_list,bool(self.lower_extrap),decay_params,x,y,dydx,
+                               row_size is not None)
+            return [output for output, flag in [(y,_eval),(dydx,_Der)] if flag]
 
+        if row_size is not None and row_size >= merge_min_row:
+            i = np.minimum(np.maximum(mergeSearch(self.x_list,x,row_size),1),self.x_n-1)
+        elif self.searchFunc is None:
+            i = np.maximum(np.searchsorted(self.x_list[:-1],x),1)
+        else:
+            i = np.minimum(np.maximum(self.searchFunc(self.x_list,x),1),self.x_n-1)
+        i -= 1 # Index of the bottom gridpoint of each segment
+        slope = np.take(self.slope_list,i)
 
-
-        i      = np.maximum(np.searchsorted(self.x_list[:-1],x),1)
-        alpha  = (x-self.x_list[i-1])/(self.x_list[i]-self.x_list[i-1])
-
-        if _eval:
-                y = (1.-alpha)*self.y_list[i-1] + alpha*self.y_list[i]
+        if _eval: # Computed in place to avoid making temporary arrays
+                y = x - np.take(self.x_list,i)
+                y *= slope
+                y += np.take(self.y_list,i)
         if _Der:
-                dydx = (self.y_list[i] - self.y_list[i-1])/(self.x_list[i] - self.x_list[i-1])
+                dydx = slope
 
         if not self.lower_extrap:
             below_lower_bound = x < self.x_list[0]
@@ -807,30 +1449,567 @@ class LinearInterp(HARKinterpolator1D):
 
         return output
             
-    def _evaluate(self,x,return_indices = False):
+    def _evaluate(self,x,row_size=None):
         '''
         Returns the level of the interpolated function at each value in x.  Only
         called internally by HARKinterpolator1D.__call__ (etc).
         '''
-        return self._evalOrDer(x,True,False)[0]
+        return self._evalOrDer(x,True,False,row_size)[0]
         
-    def _der(self,x):
+    def _der(self,x,row_size=None):
+        '''
+        Returns the first derivative of the interpolated function at each value
+        in x. Only called internally by HARKinterpolator1D.derivative (etc).
+        '''
+        return self._evalOrDer(x,False,True,row_size)[0]
+
+    def _evalAndDer(self,x,row_size=None):
+        '''
+        Returns the level and first derivative of the function at each value in
+        x.  Only called internally by HARKinterpolator1D.eval_and_der (etc).
+        '''
+        y,dydx = self._evalOrDer(x,True,True,row_size)
+
+        return y,dydx
+
+
+class StackedGridSearch(HARKobject):
+    '''
+    Locates query points in the grids of a stack of interpolations, each query in
+    the grid of its own row of a padded array (as in LinearInterpStack), giving
+    the index of the upper gridpoint of its segment restricted to [1,x_n-1] in that
+    row, as the linear interpolators use.  The range of each grid is divided into
+    evenly spaced buckets, with a table of the first gridpoint above the bottom of
+    each bucket; a query point's bucket is found in closed form, and the index from
+    the table is corrected by stepping over any gridpoints in the same bucket.
+    NaN query points are given an arbitrary segment of their grid.
+    '''
+    distance_criteria = ['x_array','x_n']
+
+    def __init__(self,x_array,x_n,buckets_per_point=8):
+        '''
+        Make a new search for the grids in a padded array.
+
+        Parameters
+        ----------
+        x_array : np.array
+            Array of shape (N,n) with one increasing grid per row, padded by repeating
+            its top gridpoint.
+        x_n : np.array
+            Number of actual gridpoints in each row of x_array.
+        buckets_per_point : int
+            Number of buckets per gridpoint in the longest grid; more buckets means
+            fewer correction steps but a larger table.
+
+        Returns
+        -------
+        None
+        '''
+        self.x_array = x_array
+        self.x_n = x_n
+        N, n = x_array.shape
+        self.bucket_count = buckets_per_point*n
+        rows = np.arange(N)
+        self.x_bot = x_array[:,0]
+        self.scale = self.bucket_count/(x_array[rows,x_n-1] - self.x_bot)
+        self.table = np.empty((N,self.bucket_count),dtype=int)
+        for j in xrange(N):
+            bucket_bots = self.x_bot[j] + np.arange(self.bucket_count)/self.scale[j]
+            self.table[j,:] = np.searchsorted(x_array[j,:x_n[j]],bucket_bots)
+        self.table = np.minimum(np.maximum(self.table,1),x_n[:,np.newaxis]-1) + n*rows[:,np.newaxis]
+
+    def __call__(self,x,rows):
+        '''
+        Find the segment of its grid that contains each query point.
+
+        Parameters
+        ----------
+        x : np.array
+            Flat array of query points.
+        rows : np.array
+            Array of integers of the same size as x, naming the row for each point.
+
+        Returns
+        -------
+        i : np.array
+            Array of segment indices, of the same size as x.
+        '''
+        n = self.x_array.shape[1]
+        x_flat = self.x_array.ravel()
+        with np.errstate(invalid='ignore'):
+            u = (x - np.take(self.x_bot,rows))*np.take(self.scale,rows)
+            # Infinite queries go to the end buckets and NaN queries to the first
+            bucket = np.clip(np.nan_to_num(u),0.0,self.bucket_count-1).astype(int)
+        pos = np.take(self.table,bucket + rows*self.bucket_count) # Position in the flattened x_array
+
+        # Step up over gridpoints in the same bucket, then correct for rounding,
+        # moving only the points that need it; none needs more than n steps
+        row_top = rows*n + np.take(self.x_n,rows) - 1
+        these = np.flatnonzero(np.logical_and(x > np.take(x_flat,pos),pos < row_top))
+        steps = 0
+        while these.size > 0 and steps < n:
+            pos[these] += 1
+            these = these[np.logical_and(x[these] > x_flat[pos[these]],pos[these] < row_top[these])]
+            steps += 1
+        row_bot = rows*n + 1
+        these = np.flatnonzero(np.logical_and(x <= np.take(x_flat,pos-1),pos > row_bot))
+        steps = 0
+        while these.size > 0 and steps < n:
+            pos[these] -= 1
+            these = these[np.logical_and(x[these] <= x_flat[pos[these]-1],pos[these] > row_bot[these])]
+            steps += 1
+        return pos - rows*n
+
+
+class LinearInterpStack(HARKobject):
+    '''
+    A stack of 1D linear interpolations packed into padded 2D arrays so that
+    many functions can be evaluated in one vectorized pass.  Row j of the stack
+    behaves exactly like LinearInterp(x_lists[j],y_lists[j],intercept_limits[j],
+    slope_limits[j]), optionally bounded above by a two point linear "cap" as in
+    LowerEnvelope(LinearInterp(...),LinearInterp(cap_x[j],cap_y[j])).  Queries
+    are matched to rows by an integer array of row indices.
+    '''
+    distance_criteria = ['x_array','y_array','x_n']
+
+    def __init__(self,x_lists,y_lists,intercept_limits=None,slope_limits=None,
+                 lower_extrap=False,cap_x=None,cap_y=None):
+        '''
+        Make a new stack of linear interpolations.
+
+        Parameters
+        ----------
+        x_lists : [np.array] or np.array
+            List of (possibly ragged) x grids, one for each function in the stack;
+            a 2D array is interpreted as one grid per row.
+        y_lists : [np.array] or np.array
+            List of y values at the points in x_lists, with the same structure.
+        intercept_limits : np.array or None
+            Intercepts of limiting linear functions for decay extrapolation, one
+            per function; NaN (or None for all) means linear extrapolation.
+        slope_limits : np.array or None
+            Slopes of limiting linear functions for decay extrapolation.
+        lower_extrap : boolean
+            Indicator for whether lower extrapolation is allowed.  False means
+            f(x) = NaN for x < min(x_lists[j]); True means linear extrapolation.
+        cap_x : np.array or None
+            Array of shape (N,2) with the x gridpoints of a two point linear upper
+            bound for each function; rows of NaN indicate no bound.
+        cap_y : np.array or None
+            Array of shape (N,2) with y values for the upper bound.
+
+        Returns
+        -------
+        new instance of LinearInterpStack
+        '''
+        x_lists = [np.asarray(x_list,dtype=float) for x_list in x_lists]
+        y_lists = [np.asarray(y_list,dtype=float) for y_list in y_lists]
+        self.N = len(x_lists)
+        self.x_n = np.array([x_list.size for x_list in x_lists],dtype=int)
+        self.lower_extrap = lower_extrap
+
+        # Pack the grids into padded arrays, repeating the top gridpoint
+        n_max = np.max(self.x_n)
+        self.x_array = np.zeros((self.N,n_max))
+        self.y_array = np.zeros((self.N,n_max))
+        for j in xrange(self.N):
+            n = self.x_n[j]
+            self.x_array[j,:n] = x_lists[j]
+            self.x_array[j,n:] = x_lists[j][-1]
+            self.y_array[j,:n] = y_lists[j]
+            self.y_array[j,n:] = y_lists[j][-1]
+        rows = np.arange(self.N)
+        self.x_top = self.x_array[rows,self.x_n-1]
+        self.y_top = self.y_array[rows,self.x_n-1]
+        self.searchFunc = StackedGridSearch(self.x_array,self.x_n)
+
+        # Make the decay extrapolation, as in LinearInterp
+        if intercept_limits is None or slope_limits is None:
+            intercept_limits = np.zeros(self.N) + np.nan
+            slope_limits = np.zeros(self.N) + np.nan
+        self.intercept_limit = np.asarray(intercept_limits,dtype=float)*np.ones(self.N)
+        self.slope_limit     = np.asarray(slope_limits,dtype=float)*np.ones(self.N)
+        self.decay_extrap    = np.logical_not(np.logical_or(np.isnan(self.intercept_limit),
+                                                            np.isnan(self.slope_limit)))
+        x_below = self.x_array[rows,self.x_n-2]
+        y_below = self.y_array[rows,self.x_n-2]
+        with np.errstate(divide='ignore',invalid='ignore'):
+            slope_at_top = (self.y_top - y_below)/(self.x_top - x_below)
+            level_diff   = self.intercept_limit + self.slope_limit*self.x_top - self.y_top
+            slope_diff   = self.slope_limit - slope_at_top
+            self.decay_extrap_A = level_diff
+            self.decay_extrap_B = -slope_diff/level_diff
+
+        # Store the upper bounding functions, if any
+        if cap_x is None or cap_y is None:
+            cap_x = np.zeros((self.N,2)) + np.nan
+            cap_y = np.zeros((self.N,2)) + np.nan
+        self.cap_x = np.asarray(cap_x,dtype=float).reshape((self.N,2))
+        self.cap_y = np.asarray(cap_y,dtype=float).reshape((self.N,2))
+        self.capped = np.logical_not(np.isnan(self.cap_x[:,0]))
+
+    def findIndices(self,x,rows,block_size=None):
+        '''
+        Find the index of the upper gridpoint of the segment that contains each
+        query point, within the grid of its own row.  Gives the same result as
+        np.maximum(np.searchsorted(x_list[:-1],x),1) in LinearInterp.  When the
+        queries come in contiguous equal-size blocks for rows 0,...,N-1, each block
+        is searched directly; otherwise the StackedGridSearch of the stack is used.
+
+        Parameters
+        ----------
+        x : np.array
+            Flat array of query points.
+        rows : np.array
+            Array of integers of the same size as x, naming the row for each point.
+        block_size : int or None
+            Number of query points per row if x is arranged in row blocks.
+
+        Returns
+        -------
+        i : np.array
+            Array of segment indices, of the same size as x.
+        '''
+        if block_size is not None:
+            i = np.empty(x.size,dtype=int)
+            for j in xrange(self.N):
+                these = slice(j*block_size,(j+1)*block_size)
+                i[these] = np.searchsorted(self.x_array[j,:(self.x_n[j]-1)],x[these])
+            return np.maximum(i,1)
+
+        return self.searchFunc(x,rows)
+
+    def _evalOrDer(self,x,rows,_eval,_Der,block_size=None):
+        '''
+        Returns the level and/or first derivative of the stacked functions at
+        each value in x, using the row named in rows for each point.
+
+        Parameters
+        ----------
+        x : np.array
+            Flat array of query points.
+        rows : np.array
+            Array of integers of the same size as x, naming the row for each point.
+        _eval : boolean
+            Indicator for whether to evalute the level of the interpolated function.
+        _Der : boolean
+            Indicator for whether to evaluate the derivative of the interpolated function.
+        block_size : int or None
+            Number of query points per row if x is arranged in row blocks.
+
+        Returns
+        -------
+        A list including the level and/or derivative of the interpolated function where requested.
+        '''
+        i      = self.findIndices(x,rows,block_size)
+        pos    = rows*self.x_array.shape[1] + i
+        x_flat = self.x_array.ravel()
+        y_flat = self.y_array.ravel()
+        x_lo   = np.take(x_flat,pos-1)
+        x_hi   = np.take(x_flat,pos)
+        y_lo   = np.take(y_flat,pos-1)
+        y_hi   = np.take(y_flat,pos)
+        alpha  = (x-x_lo)/(x_hi-x_lo)
+
+        y = (1.-alpha)*y_lo + alpha*y_hi
+        if _Der:
+            dydx = (y_hi - y_lo)/(x_hi - x_lo)
+
+        if not self.lower_extrap:
+            below_lower_bound = x < np.take(self.x_array[:,0],rows)
+            y[below_lower_bound] = np.nan
+            if _Der:
+                dydx[below_lower_bound] = np.nan
+
+        if np.any(self.decay_extrap):
+            above_upper_bound = np.logical_and(np.take(self.decay_extrap,rows),x > np.take(self.x_top,rows))
+        else:
+            above_upper_bound = np.zeros(x.size,dtype=bool)
+        if np.any(above_upper_bound):
+            these  = rows[above_upper_bound]
+            x_temp = x[above_upper_bound] - self.x_top[these]
+            decay  = np.exp(-self.decay_extrap_B[these]*x_temp)
+            y[above_upper_bound] = self.intercept_limit[these] + \
+                                   self.slope_limit[these]*x[above_upper_bound] - \
+                                   self.decay_extrap_A[these]*decay
+            if _Der:
+                dydx[above_upper_bound] = self.slope_limit[these] + \
+                                          self.decay_extrap_B[these]*self.decay_extrap_A[these]*decay
+
+        # Apply the upper bound where it is tighter, as in LowerEnvelope
+        if np.any(self.capped):
+            capped    = self.capped[rows]
+            these     = rows[capped]
+            x_cap     = x[capped]
+            cap_x0    = self.cap_x[these,0]
+            cap_x1    = self.cap_x[these,1]
+            cap_alpha = (x_cap-cap_x0)/(cap_x1-cap_x0)
+            y_cap     = (1.-cap_alpha)*self.cap_y[these,0] + cap_alpha*self.cap_y[these,1]
+            if not self.lower_extrap:
+                y_cap[x_cap < cap_x0] = np.nan
+            y_unc = y[capped]
+            y[capped] = np.fmin(y_unc,y_cap)
+            if _Der:
+                use_cap = y_cap < np.where(np.isnan(y_unc),np.inf,y_unc)
+                dydx_cap = (self.cap_y[these,1] - self.cap_y[these,0])/(cap_x1 - cap_x0)
+                dydx_temp = dydx[capped]
+                dydx_temp[use_cap] = dydx_cap[use_cap]
+                dydx[capped] = dydx_temp
+
+        # NaN query points were put in an arbitrary segment by the grid search
+        if _Der:
+            dydx[np.isnan(x)] = np.nan
+
+        output = []
+        if _eval:
+            output += [y,]
+        if _Der:
+            output += [dydx,]
+        return output
+
+    def _prepareInputs(self,x,rows):
+        '''
+        Flattens the query points and row indices for the evaluation methods, as
+        in _flatArgs; row indices that are already an integer array of the same
+        shape as x are used as they are.  When rows is None, the leading axis of
+        x indexes the rows of the stack.
+        '''
+        (x_flat,), shape = _flatArgs(x)
+        if rows is None:
+            block_size = x_flat.size//self.N
+            rows = np.repeat(np.arange(self.N),block_size)
+        else:
+            block_size = None
+            rows = np.asarray(rows)
+            if rows.shape == shape and rows.dtype == int:
+                rows = rows.ravel()
+            else:
+                rows = (rows.astype(int)*np.ones(shape,dtype=int)).flatten()
+        return shape, x_flat, rows, block_size
+
+    def __call__(self,x,rows=None,out=None):
+        '''
+        Evaluates the stacked functions at the given inputs.
+
+        Parameters
+        ----------
+        x : np.array
+            Real values to be evaluated.
+        rows : np.array or None
+            Integers naming the function in the stack to use for each point in x,
+            broadcastable to the shape of x.  If None, the leading axis of x must
+            have length N and indexes the functions in the stack.
+        out : np.array or None
+            Optional array of the same shape as x to write the output into.
+
+        Returns
+        -------
+        y : np.array
+            The interpolated functions evaluated at x, with the same shape as x.
+        '''
+        shape, x_flat, rows_flat, block_size = self._prepareInputs(x,rows)
+        return _shapeOutput(self._evalOrDer(x_flat,rows_flat,True,False,block_size)[0],shape,out)
+
+    def derivative(self,x,rows=None,out=None):
+        '''
+        Evaluates the derivative of the stacked functions at the given inputs.
+        See __call__ for a description of the inputs.
+        '''
+        shape, x_flat, rows_flat, block_size = self._prepareInputs(x,rows)
+        return _shapeOutput(self._evalOrDer(x_flat,rows_flat,False,True,block_size)[0],shape,out)
+
+    def eval_with_derivative(self,x,rows=None,out=None):
+        '''
+        Evaluates the stacked functions and their derivatives at the given inputs.
+        See __call__ for a description of the inputs; out may be a pair of arrays
+        to write the level and derivative into.
+        '''
+        shape, x_flat, rows_flat, block_size = self._prepareInputs(x,rows)
+        y, dydx = self._evalOrDer(x_flat,rows_flat,True,True,block_size)
+        if out is None:
+            return y.reshape(shape), dydx.reshape(shape)
+        return _shapeOutput(y,shape,out[0]), _shapeOutput(dydx,shape,out[1])
+
+    def rowDistance(self,other):
+        '''
+        Calculates the distance between each function in this stack and the
+        corresponding function in another stack of the same size.  Gives the
+        same value as the distance method of the unstacked functions: the largest
+        absolute difference between the functions (and between their upper bounds)
+        at the gridpoints of either that lie in both of their domains.
+
+        Parameters
+        ----------
+        other : LinearInterpStack
+            Another stack of linear interpolations with the same number of rows.
+
+        Returns
+        -------
+        distance : np.array
+            Array of size N with the distance between each pair of functions.
         '''
-        Returns the first derivative of the interpolated function at each value
-        in x. Only called internally by HARKinterpolator1D.derivative (etc).
+        if self.x_array.shape == other.x_array.shape and np.array_equal(self.x_array,other.x_array):
+            distance = np.max(np.abs(self.y_array - other.y_array),axis=1)
+        else:
+            distance = stackedGridDistance(self.x_array,self.y_array,self.x_n,
+                                           other.x_array,other.y_array,other.x_n)
+        both_capped = np.logical_and(self.capped,other.capped)
+        if np.any(both_capped):
+            cap_n = 2*np.ones(self.N,dtype=int)[both_capped]
+            cap_distance = stackedGridDistance(self.cap_x[both_capped],self.cap_y[both_capped],cap_n,
+                                               other.cap_x[both_capped],other.cap_y[both_capped],cap_n)
+            distance[both_capped] = np.maximum(distance[both_capped],cap_distance)
+        distance[self.capped != other.capped] = 1000.0
+        return distance
+
+    def getRows(self,which):
         '''
-        return self._evalOrDer(x,False,True)[0]
+        Make a new stack that includes only some of the functions in this stack.
 
-    def _evalAndDer(self,x):
+        Parameters
+        ----------
+        which : np.array
+            Array of integers naming the functions to be kept, in order.
+
+        Returns
+        -------
+        new_stack : LinearInterpStack
+            A stack of the selected functions.
+        '''
+        which = np.asarray(which,dtype=int)
+        x_lists = [self.x_array[j,:self.x_n[j]] for j in which]
+        y_lists = [self.y_array[j,:self.x_n[j]] for j in which]
+        return LinearInterpStack(x_lists,y_lists,self.intercept_limit[which],self.slope_limit[which],
+                                 lower_extrap=self.lower_extrap,cap_x=self.cap_x[which,:],
+                                 cap_y=self.cap_y[which,:])
+
+    def unstack(self,j):
         '''
-        Returns the level and first derivative of the function at each value in
-        x.  Only called internally by HARKinterpolator1D.eval_and_der (etc).
+        Extract one function from the stack as an ordinary interpolation object:
+        a LinearInterp, or a LowerEnvelope of two LinearInterps if row j is capped.
+
+        Parameters
+        ----------
+        j : int
+            Index of the function to extract.
+
+        Returns
+        -------
+        func : LinearInterp or LowerEnvelope
+            The j-th function in the stack.
         '''
-        y,dydx = self._evalOrDer(x,True,True)
+        n = self.x_n[j]
+        if self.decay_extrap[j]:
+            func = LinearInterp(self.x_array[j,:n],self.y_array[j,:n],self.intercept_limit[j],
+                                self.slope_limit[j],lower_extrap=self.lower_extrap)
+        else:
+            func = LinearInterp(self.x_array[j,:n],self.y_array[j,:n],lower_extrap=self.lower_extrap)
+        if self.capped[j]:
+            func = LowerEnvelope(func,LinearInterp(self.cap_x[j,:],self.cap_y[j,:],
+                                                   lower_extrap=self.lower_extrap))
+        return func
 
-        return y,dydx
-        
 
+def makeLinearInterpStack(functions):
+    '''
+    Pack a list of linear interpolations into a LinearInterpStack.  Each element
+    must be a LinearInterp or a LowerEnvelope of a LinearInterp and a two point
+    LinearInterp without decay extrapolation (the constrained consumption function
+    made by the consumption-saving solvers).  All must share lower_extrap.
+
+    Parameters
+    ----------
+    functions : [LinearInterp or LowerEnvelope]
+        The functions to be stacked.
+
+    Returns
+    -------
+    stack : LinearInterpStack
+        The functions packed into a single stack.
+    '''
+    N = len(functions)
+    x_lists = []
+    y_lists = []
+    intercept_limits = np.zeros(N) + np.nan
+    slope_limits = np.zeros(N) + np.nan
+    cap_x = np.zeros((N,2)) + np.nan
+    cap_y = np.zeros((N,2)) + np.nan
+    lower_extrap = None
+    for j in xrange(N):
+        func = functions[j]
+        if isinstance(func,LowerEnvelope):
+            if func.funcCount != 2:
+                raise ValueError('Only lower envelopes of two functions can be stacked!')
+            func, cap = func.functions
+            if not isinstance(func,LinearInterp):
+                raise ValueError('Only LinearInterp functions can be stacked!')
+            if (not isinstance(cap,LinearInterp)) or cap.x_n != 2 or cap.decay_extrap \
+                or cap.lower_extrap != func.lower_extrap:
+                raise ValueError('The bounding function of a lower envelope must be a two point LinearInterp!')
+            cap_x[j,:] = cap.x_list
+            cap_y[j,:] = cap.y_list
+        if not isinstance(func,LinearInterp):
+            raise ValueError('Only LinearInterp functions can be stacked!')
+        if lower_extrap is None:
+            lower_extrap = func.lower_extrap
+        elif lower_extrap != func.lower_extrap:
+            raise ValueError('All stacked functions must have the same lower_extrap!')
+        x_lists.append(func.x_list)
+        y_lists.append(func.y_list)
+        if func.decay_extrap:
+            intercept_limits[j] = func.intercept_limit
+            slope_limits[j] = func.slope_limit
+    return LinearInterpStack(x_lists,y_lists,intercept_limits,slope_limits,
+                             lower_extrap=bool(lower_extrap),cap_x=cap_x,cap_y=cap_y)
+
+
+
+def stackedGridDistance(x_A,y_A,n_A,x_B,y_B,n_B):
+    '''
+    Calculates gridDistance between the piecewise linear functions in each row of
+    two pairs of padded arrays of gridpoints and values (as in LinearInterpStack),
+    for all rows at once.
+
+    Parameters
+    ----------
+    x_A : np.array
+        Array of shape (N,n) with the (padded) gridpoints of the first functions.
+    y_A : np.array
+        Array of shape (N,n) with the values of the first functions.
+    n_A : np.array
+        Number of actual gridpoints in each row of x_A.
+    x_B : np.array
+        Array of shape (N,m) with the (padded) gridpoints of the second functions.
+    y_B : np.array
+        Array of shape (N,m) with the values of the second functions.
+    n_B : np.array
+        Number of actual gridpoints in each row of x_B.
+
+    Returns
+    -------
+    distance : np.array
+        Array of size N with the distance between each pair of functions.
+    '''
+    rows = np.arange(x_A.shape[0])
+    bot = np.maximum(x_A[:,0],x_B[:,0])
+    top = np.minimum(x_A[rows,n_A-1],x_B[rows,n_B-1])
+
+    def evalRows(x_array,y_array,x_n,x):
+        i = np.sum(x_array[:,np.newaxis,:] < x[:,:,np.newaxis],axis=2)
+        i = np.minimum(np.maximum(i,1),(x_n-1)[:,np.newaxis])
+        x_lo = x_array[rows[:,np.newaxis],i-1]
+        x_hi = x_array[rows[:,np.newaxis],i]
+        alpha = (x-x_lo)/(x_hi-x_lo)
+        return (1.-alpha)*y_array[rows[:,np.newaxis],i-1] + alpha*y_array[rows[:,np.newaxis],i]
+
+    distance = np.zeros(x_A.shape[0])
+    for x_here, y_here, x_there, y_there, n_there in [(x_A,y_A,x_B,y_B,n_B),(x_B,y_B,x_A,y_A,n_A)]:
+        inside = np.logical_and(x_here >= bot[:,np.newaxis],x_here <= top[:,np.newaxis])
+        with np.errstate(invalid='ignore'):
+            diff = np.abs(y_here - evalRows(x_there,y_there,n_there,x_here))
+        distance = np.maximum(distance,np.max(np.where(inside,diff,0.0),axis=1))
+    distance[bot > top] = 1000.0
+    return distance
 
 
 class CubicInterp(HARKinterpolator1D):
@@ -842,7 +2021,8 @@ class CubicInterp(HARKinterpolator1D):
     '''
     distance_criteria = ['x_list','y_list','dydx_list']
     
-    def __init__(self,x_list,y_list,dydx_list,intercept_limit=None,slope_limit=None,lower_extrap=False):
+    def __init__(self,x_list,y_list,dydx_list,intercept_limit=None,slope_limit=None,lower_extrap=False,
+                 grid_type=None,timestonest=None):
         '''
         The interpolation constructor to make a new cubic spline interpolation.
         
@@ -861,6 +2041,11 @@ class CubicInterp(HARKinterpolator1D):
         lower_extrap : boolean
             Indicator for whether lower extrapolation is allowed.  False means
             f(x) = NaN for x < min(x_list); True means linear extrapolation.
+        grid_type : str or None
+            The family of x_list, if known: 'uniform', 'log', 'exp_mult', or 'auto'
+            to detect it; see GridSearch.  If None, np.searchsorted is used.
+        timestonest : int or None
+            Nesting of a multi-exponentially spaced x_list; see GridSearch.
             
         Returns
         -------
@@ -873,159 +2058,214 @@ class CubicInterp(HARKinterpolator1D):
         self.y_list = np.asarray(y_list)
         self.dydx_list = np.asarray(dydx_list)
         self.n = len(x_list)
+        self.searchFunc = GridSearch(self.x_list,grid_type,timestonest) if grid_type is not None else np.searchsorted
+        self.coeffs = np.empty((self.n+1,4))
         
         # Define lower extrapolation as linear function (or just NaN)
         if lower_extrap:
-            self.coeffs = [[y_list[0],dydx_list[0],0,0]]
+            self.coeffs[0,:] = [self.y_list[0],self.dydx_list[0],0,0]
         else:
-            self.coeffs = [[np.nan,np.nan,np.nan,np.nan]]
+            self.coeffs[0,:] = np.nan
 
         # Calculate interpolation coefficients on segments mapped to [0,1]
-        for i in xrange(self.n-1):
-           x0 = x_list[i]
-           y0 = y_list[i]
-           x1 = x_list[i+1]
-           y1 = y_list[i+1]
-           Span = x1 - x0
-           dydx0 = dydx_list[i]*Span
-           dydx1 = dydx_list[i+1]*Span
-           
-           temp = [y0, dydx0, 3*(y1 - y0) - 2*dydx0 - dydx1, 2*(y0 - y1) + dydx0 + dydx1];
-           self.coeffs.append(temp)
+        y0 = self.y_list[:-1]
+        y1 = self.y_list[1:]
+        Span = self.x_list[1:] - self.x_list[:-1]
+        dydx0 = self.dydx_list[:-1]*Span
+        dydx1 = self.dydx_list[1:]*Span
+        self.coeffs[1:self.n,0] = y0
+        self.coeffs[1:self.n,1] = dydx0
+        self.coeffs[1:self.n,2] = 3*(y1 - y0) - 2*dydx0 - dydx1
+        self.coeffs[1:self.n,3] = 2*(y0 - y1) + dydx0 + dydx1
 
         # Calculate extrapolation coefficients as a decay toward limiting function y = mx+b
+        x1 = self.x_list[-1]
+        y1 = self.y_list[-1]
         if slope_limit is None and intercept_limit is None:
-            slope_limit = dydx_list[-1]
-            intercept_limit = y_list[-1] - slope_limit*x_list[-1]
+            slope_limit = self.dydx_list[-1]
+            intercept_limit = y1 - slope_limit*x1
         gap = slope_limit*x1 + intercept_limit - y1
-        slope = slope_limit - dydx_list[self.n-1]
+        slope = slope_limit - self.dydx_list[-1]
         if (gap != 0) and (slope <= 0):
-            temp = [intercept_limit, slope_limit, gap, slope/gap]
+            self.coeffs[self.n,:] = [intercept_limit, slope_limit, gap, slope/gap]
         elif slope > 0:
-            temp = [intercept_limit, slope_limit, 0, 0] # fixing a problem when slope is positive
+            self.coeffs[self.n,:] = [intercept_limit, slope_limit, 0, 0] # fixing a problem when slope is positive
         else:
-            temp = [intercept_limit, slope_limit, gap, 0]
-        self.coeffs.append(temp)
-        self.coeffs = np.array(self.coeffs)
+            self.coeffs[self.n,:] = [intercept_limit, slope_limit, gap, 0]
+        
+    def distanceNodes(self):
+        '''
+        Returns the gridpoints of this interpolation and the midpoints between them,
+        for interpolatorDistance.
+        '''
+        midpoints = 0.5*(self.x_list[1:] + self.x_list[:-1])
+        return (np.sort(np.concatenate((self.x_list,midpoints))),)
 
-    def _evaluate(self,x):
+    def _evalOrDer(self,x,_eval,_Der,row_size=None):
         '''
-        Returns the level of the interpolated function at each value in x.  Only
-        called internally by HARKinterpolator1D.__call__ (etc).
+        Returns the level and/or first derivative of the function at each value in
+        x, from a single search for the segments that contain them.  Only called
+        internally by HARKinterpolator1D.eval_and_der (etc).
+
+        Parameters
+        ----------
+        x : scalar or np.array
+            Set of points where we want to evaluate the interpolated function and/or its derivative.
+        _eval : boolean
+            Indicator for whether to evalute the level of the interpolated function.
+        _Der : boolean
+            Indicator for whether to evaluate the derivative of the interpolated function.
+        row_size : int or None
+            Length of the rows in which x is sorted, if it is; see mergeSearch.
+            
+        Returns
+        -------
+        A list including the level and/or derivative of the interpolated function where requested.
         '''
         if _isscalar(x):
-            pos = np.searchsorted(self.x_list,x)
-            if pos == 0:
-                y = self.coeffs[0,0] + self.coeffs[0,1]*(x - self.x_list[0])
-            elif (pos < self.n):
-                alpha = (x - self.x_list[pos-1])/(self.x_list[pos] - self.x_list[pos-1])
-                y = self.coeffs[pos,0] + alpha*(self.coeffs[pos,1] + alpha*(self.coeffs[pos,2] + alpha*self.coeffs[pos,3]))
-            else:
-                alpha = x - self.x_list[self.n-1]
-                y = self.coeffs[pos,0] + x*self.coeffs[pos,1] - self.coeffs[pos,2]*np.exp(alpha*self.coeffs[pos,3])
+            return [output[0] for output in self._evalOrDer(np.array([x]),_eval,_Der)]
+        if _useJit():
+            y, dydx = _jitOutputs(x.size,[_eval,_Der])
+            cubicInterpKernel(self.x_list,self.coeffs,x,y,dydx,row_size is not None)
+            return [output for output, flag in [(y,_eval),(dydx,_Der)] if flag]
+        
+        # Evaluate the cubic on the nearest segment at every point
+        if row_size is not None and row_size >= merge_min_row:
+            pos = mergeSearch(self.x_list,x,row_size)
         else:
-            m = len(x)
-            pos = np.searchsorted(self.x_list,x)
-            y = np.zeros(m)
-            if y.size > 0:
-                out_bot   = pos == 0
-                out_top   = pos == self.n
-                in_bnds   = np.logical_not(np.logical_or(out_bot, out_top))
-                
-                # Do the "in bounds" evaluation points
-                i = pos[in_bnds]
-                coeffs_in = self.coeffs[i,:]
-                alpha = (x[in_bnds] - self.x_list[i-1])/(self.x_list[i] - self.x_list[i-1])
-                y[in_bnds] = coeffs_in[:,0] + alpha*(coeffs_in[:,1] + alpha*(coeffs_in[:,2] + alpha*coeffs_in[:,3]))
-                
-                # Do the "out of bounds" evaluation points
+            pos = self.searchFunc(self.x_list,x)
+        i = np.minimum(np.maximum(pos,1),self.n-1)
+        x_bot = np.take(self.x_list,i-1)
+        Span = np.take(self.x_list,i) - x_bot
+        coeffs_in = np.take(self.coeffs,i,axis=0)
+        alpha = (x - x_bot)/Span
+        if _eval:
+            y = coeffs_in[:,0] + alpha*(coeffs_in[:,1] + alpha*(coeffs_in[:,2] + alpha*coeffs_in[:,3]))
+        if _Der:
+            dydx = (coeffs_in[:,1] + alpha*(2*coeffs_in[:,2] + alpha*3*coeffs_in[:,3]))/Span
+            
+        # Replace the points that are out of bounds with the extrapolating functions
+        out_bot = pos == 0
+        if np.any(out_bot):
+            if _eval:
                 y[out_bot] = self.coeffs[0,0] + self.coeffs[0,1]*(x[out_bot] - self.x_list[0])
-                alpha = x[out_top] - self.x_list[self.n-1]
-                y[out_top] = self.coeffs[self.n,0] + x[out_top]*self.coeffs[self.n,1] - self.coeffs[self.n,2]*np.exp(alpha*self.coeffs[self.n,3])                      
-        return y
+            if _Der:
+                dydx[out_bot] = self.coeffs[0,1]
+        out_top = pos == self.n
+        if np.any(out_top):
+            x_top = x[out_top]
+            decay = np.exp((x_top - self.x_list[self.n-1])*self.coeffs[self.n,3])
+            if _eval:
+                y[out_top] = self.coeffs[self.n,0] + x_top*self.coeffs[self.n,1] - self.coeffs[self.n,2]*decay
+            if _Der:
+                dydx[out_top] = self.coeffs[self.n,1] - self.coeffs[self.n,2]*self.coeffs[self.n,3]*decay
 
-    def _der(self,x):
+        output = []
+        if _eval:
+            output += [y,]
+        if _Der:
+            output += [dydx,]
+        return output
+
+    def _evaluate(self,x,row_size=None):
+        '''
+        Returns the level of the interpolated function at each value in x.  Only
+        called internally by HARKinterpolator1D.__call__ (etc).
+        '''
+        return self._evalOrDer(x,True,False,row_size)[0]
+
+    def _der(self,x,row_size=None):
         '''
         Returns the first derivative of the interpolated function at each value
         in x. Only called internally by HARKinterpolator1D.derivative (etc).
         '''
-        if _isscalar(x):
-            pos = np.searchsorted(self.x_list,x)
-            if pos == 0:
-                dydx = self.coeffs[0,1]
-            elif (pos < self.n):
-                alpha = (x - self.x_list[pos-1])/(self.x_list[pos] - self.x_list[pos-1])
-                dydx = (self.coeffs[pos,1] + alpha*(2*self.coeffs[pos,2] + alpha*3*self.coeffs[pos,3]))/(self.x_list[pos] - self.x_list[pos-1])
-            else:
-                alpha = x - self.x_list[self.n-1]
-                dydx = self.coeffs[pos,1] - self.coeffs[pos,2]*self.coeffs[pos,3]*np.exp(alpha*self.coeffs[pos,3])
-        else:
-            m = len(x)
-            pos = np.searchsorted(self.x_list,x)
-            dydx = np.zeros(m)
-            if dydx.size > 0:
-                out_bot   = pos == 0
-                out_top   = pos == self.n
-                in_bnds   = np.logical_not(np.logical_or(out_bot, out_top))
-                
-                # Do the "in bounds" evaluation points
-                i = pos[in_bnds]
-                coeffs_in = self.coeffs[i,:]
-                alpha = (x[in_bnds] - self.x_list[i-1])/(self.x_list[i] - self.x_list[i-1])
-                dydx[in_bnds] = (coeffs_in[:,1] + alpha*(2*coeffs_in[:,2] + alpha*3*coeffs_in[:,3]))/(self.x_list[i] - self.x_list[i-1])
-                
-                # Do the "out of bounds" evaluation points
-                dydx[out_bot] = self.coeffs[0,1]
-                alpha = x[out_top] - self.x_list[self.n-1]
-                dydx[out_top] = self.coeffs[self.n,1] - self.coeffs[self.n,2]*self.coeffs[self.n,3]*np.exp(alpha*self.coeffs[self.n,3])
-        return dydx
-
+        return self._evalOrDer(x,False,True,row_size)[0]
 
-    def _evalAndDer(self,x):
+    def _evalAndDer(self,x,row_size=None):
         '''
         Returns the level and first derivative of the function at each value in
         x.  Only called internally by HARKinterpolator1D.eval_and_der (etc).
         '''
-        if _isscalar(x):
-            pos = np.searchsorted(self.x_list,x)
-            if pos == 0:
-                y = self.coeffs[0,0] + self.coeffs[0,1]*(x - self.x_list[0])
-                dydx = self.coeffs[0,1]
-            elif (pos < self.n):
-                alpha = (x - self.x_list[pos-1])/(self.x_list[pos] - self.x_list[pos-1])
-                y = self.coeffs[pos,0] + alpha*(self.coeffs[pos,1] + alpha*(self.coeffs[pos,2] + alpha*self.coeffs[pos,3]))
-                dydx = (self.coeffs[pos,1] + alpha*(2*self.coeffs[pos,2] + alpha*3*self.coeffs[pos,3]))/(self.x_list[pos] - self.x_list[pos-1])
-            else:
-                alpha = x - self.x_list[self.n-1]
-                y = self.coeffs[pos,0] + x*self.coeffs[pos,1] - self.coeffs[pos,2]*np.exp(alpha*self.coeffs[pos,3])
-                dydx = self.coeffs[pos,1] - self.coeffs[pos,2]*self.coeffs[pos,3]*np.exp(alpha*self.coeffs[pos,3])
-        else:
-            m = len(x)
-            pos = np.searchsorted(self.x_list,x)
-            y = np.zeros(m)
-            dydx = np.zeros(m)
-            if y.size > 0:
-                out_bot   = pos == 0
-                out_top   = pos == self.n
-                in_bnds   = np.logical_not(np.logical_or(out_bot, out_top))
-                
-                # Do the "in bounds" evaluation points
-                i = pos[in_bnds]
-                coeffs_in = self.coeffs[i,:]
-                alpha = (x[in_bnds] - self.x_list[i-1])/(self.x_list[i] - self.x_list[i-1])
-                y[in_bnds] = coeffs_in[:,0] + alpha*(coeffs_in[:,1] + alpha*(coeffs_in[:,2] + alpha*coeffs_in[:,3]))
-                dydx[in_bnds] = (coeffs_in[:,1] + alpha*(2*coeffs_in[:,2] + alpha*3*coeffs_in[:,3]))/(self.x_list[i] - self.x_list[i-1])
-                
-                # Do the "out of bounds" evaluation points
-                y[out_bot] = self.coeffs[0,0] + self.coeffs[0,1]*(x[out_bot] - self.x_list[0])
-                dydx[out_bot] = self.coeffs[0,1]
-                alpha = x[out_top] - self.x_list[self.n-1]
-                y[out_top] = self.coeffs[self.n,0] + x[out_top]*self.coeffs[self.n,1] - self.coeffs[self.n,2]*np.exp(alpha*self.coeffs[self.n,3])
-                dydx[out_top] = self.coeffs[self.n,1] - self.coeffs[self.n,2]*self.coeffs[self.n,3]*np.exp(alpha*self.coeffs[self.n,3])
-        return y, dydx
+        y,dydx = self._evalOrDer(x,True,True,row_size)
+        return y,dydx
 
         
         
+def _combineCorners(f,weights,spans,derivs=[]):
+    '''
+    Combines values at the corners of the cells of a tensor grid into the level
+    and partial derivatives of a multilinear interpolation, one grid dimension at
+    a time (starting from the last).
+    
+    Parameters
+    ----------
+    f : np.array
+        Array of shape (2,)*d + (m,) with the level at each corner of the cell of
+        each of m query points.
+    weights : [np.array]
+        For each of the d grid dimensions, the relative position of each query
+        point in its cell.
+    spans : [np.array]
+        For each of the d grid dimensions, the width of each query point's cell.
+    derivs : [np.array]
+        Arrays shaped like f with partial derivatives at each corner (with respect
+        to variables that are not gridded), which are interpolated like the level.
+        
+    Returns
+    -------
+    output : [np.array]
+        The level, then the interpolated derivs, then the partial derivatives with
+        respect to each grid dimension in order.
+    '''
+    arrays = [f] + list(derivs)
+    count = len(arrays)
+    for k in xrange(len(weights)-1,-1,-1):
+        grad = (arrays[0][...,1,:] - arrays[0][...,0,:])/spans[k]
+        arrays = [(1.-weights[k])*a[...,0,:] + weights[k]*a[...,1,:] for a in arrays]
+        arrays.insert(count,grad)
+    return arrays
+
+
+def _multilinearEvalAndGrad(f_values,grids,search_funcs,points):
+    '''
+    Returns the level and all partial derivatives of a multilinear interpolation
+    on a tensor grid, finding the cell of each query point only once and gathering
+    the function values at its corners in a single pass.
+    
+    Parameters
+    ----------
+    f_values : np.array
+        The function values on the tensor grid, with one axis per grid.
+    grids : [np.array]
+        The gridpoints in each dimension.
+    search_funcs : [function]
+        The function that locates query points in each grid, as in np.searchsorted.
+    points : [np.array]
+        Query points for each dimension, all of the same size.
+        
+    Returns
+    -------
+    output : [np.array]
+        The level, then the partial derivative with respect to each dimension.
+    '''
+    d = len(grids)
+    spans = []
+    weights = []
+    base = 0
+    stride = 1
+    offsets = np.zeros((2,)*d + (1,),dtype=int)
+    for k in xrange(d-1,-1,-1):
+        grid = grids[k]
+        i = np.minimum(np.maximum(search_funcs[k](grid,points[k]),1),grid.size-1)
+        lo = grid[i-1]
+        spans.insert(0,grid[i] - lo)
+        weights.insert(0,(points[k] - lo)/spans[0])
+        base = base + (i-1)*stride
+        offsets = offsets + stride*np.arange(2).reshape((1,)*k + (2,) + (1,)*(d-k))
+        stride *= f_values.shape[k]
+    return _combineCorners(np.take(f_values,base + offsets),weights,spans)
+
+
 class BilinearInterp(HARKinterpolator2D):
     '''
     Bilinear full (or tensor) grid interpolation of a function f(x,y).
@@ -1067,11 +2307,44 @@ class BilinearInterp(HARKinterpolator2D):
         self.xSearchFunc = xSearchFunc
         self.ySearchFunc = ySearchFunc
         
+    def distanceNodes(self):
+        '''
+        Returns the gridpoints of this interpolation, for interpolatorDistance.
+        '''
+        return (self.x_list,self.y_list)
+        
+    def distanceValues(self):
+        '''
+        Returns the function values at the gridpoints, for interpolatorDistance.
+        '''
+        return self.f_values
+        
+    def _canUseJit(self,x):
+        '''
+        Checks whether this interpolation should be evaluated at x by the compiled
+        kernel in HARKjit, which searches the grids like np.searchsorted.
+        '''
+        searches_sorted = [search is np.searchsorted or isinstance(search,GridSearch)
+                           for search in (self.xSearchFunc,self.ySearchFunc)]
+        return all(searches_sorted) and not _isscalar(x) and _useJit()
+        
+    def _evalOrDerJit(self,x,y,_eval,_derX,_derY):
+        '''
+        Returns the level and/or partial derivatives of the interpolated function
+        at each value in x,y, as computed by the compiled kernel in HARKjit.
+        '''
+        flags = [_eval,_derX,_derY]
+        outputs = _jitOutputs(x.size,flags)
+        bilinearInterpKernel(self.f_values,self.x_list,self.y_list,x,y,*outputs)
+        return [output for output, flag in zip(outputs,flags) if flag]
+        
     def _evaluate(self,x,y):
         '''
         Returns the level of the interpolated function at each value in x,y.
         Only called internally by HARKinterpolator2D.__call__ (etc).
         '''
+        if self._canUseJit(x):
+            return self._evalOrDerJit(x,y,True,False,False)[0]
         if _isscalar(x):
             x_pos = max(min(self.xSearchFunc(self.x_list,x),self.x_n-1),1)
             y_pos = max(min(self.ySearchFunc(self.y_list,y),self.y_n-1),1)
@@ -1096,6 +2369,8 @@ class BilinearInterp(HARKinterpolator2D):
         Returns the derivative with respect to x of the interpolated function
         at each value in x,y. Only called internally by HARKinterpolator2D.derivativeX.
         '''
+        if self._canUseJit(x):
+            return self._evalOrDerJit(x,y,False,True,False)[0]
         if _isscalar(x):
             x_pos = max(min(self.xSearchFunc(self.x_list,x),self.x_n-1),1)
             y_pos = max(min(self.ySearchFunc(self.y_list,y),self.y_n-1),1)
@@ -1119,6 +2394,8 @@ class BilinearInterp(HARKinterpolator2D):
         Returns the derivative with respect to y of the interpolated function
         at each value in x,y. Only called internally by HARKinterpolator2D.derivativeY.
         '''
+        if self._canUseJit(x):
+            return self._evalOrDerJit(x,y,False,False,True)[0]
         if _isscalar(x):
             x_pos = max(min(self.xSearchFunc(self.x_list,x),self.x_n-1),1)
             y_pos = max(min(self.ySearchFunc(self.y_list,y),self.y_n-1),1)
@@ -1133,9 +2410,147 @@ class BilinearInterp(HARKinterpolator2D):
         dfdy = (
               ((1-alpha)*self.f_values[x_pos-1,y_pos]
             +  alpha*self.f_values[x_pos,y_pos]) -
-              ((1-alpha)*self.f_values[x_pos-1,y_pos]
-            +  alpha*self.f_values[x_pos-1,y_pos-1]))/(self.y_list[y_pos] - self.y_list[y_pos-1])
+              ((1-alpha)*self.f_values[x_pos-1,y_pos-1]
+            +  alpha*self.f_values[x_pos,y_pos-1]))/(self.y_list[y_pos] - self.y_list[y_pos-1])
         return dfdy
+        
+    def _evalAndGrad(self,x,y):
+        '''
+        Returns the level and both partial derivatives of the interpolated function
+        at each value in x,y, locating each point in the grid only once.  Only
+        called internally by HARKinterpolator2D.eval_with_gradient.
+        '''
+        if self._canUseJit(x):
+            outputs = _jitOutputs(x.size,[True,True,True])
+            bilinearEvalAndGradKernel(self.f_values,self.x_list,self.y_list,x,y,*outputs)
+            return outputs
+        return _multilinearEvalAndGrad(self.f_values,[self.x_list,self.y_list],
+                                       [self.xSearchFunc,self.ySearchFunc],[x,y])
+
+
+class BilinearInterpStack(HARKobject):
+    '''
+    A stack of bilinear interpolations packed into padded arrays so that many
+    functions can be evaluated in one vectorized pass.  Function j of the stack
+    behaves exactly like BilinearInterp(f_values[j],x_lists[j],y_lists[j]).
+    Queries are matched to functions by an integer array of row indices.
+    '''
+    distance_criteria = ['x_array','y_array','f_array']
+
+    def __init__(self,f_values,x_lists,y_lists):
+        '''
+        Make a new stack of bilinear interpolations.
+
+        Parameters
+        ----------
+        f_values : [np.array]
+            List of arrays of function values, one for each function in the stack;
+            f_values[j] has shape (x_lists[j].size,y_lists[j].size).
+        x_lists : [np.array]
+            List of (possibly ragged) x grids, one for each function in the stack.
+        y_lists : [np.array]
+            List of (possibly ragged) y grids, one for each function in the stack.
+
+        Returns
+        -------
+        new instance of BilinearInterpStack
+        '''
+        self.N = len(f_values)
+        self.x_n = np.array([np.size(x_list) for x_list in x_lists],dtype=int)
+        self.y_n = np.array([np.size(y_list) for y_list in y_lists],dtype=int)
+
+        # Pack the grids into padded arrays, repeating the top gridpoint
+        self.x_array = np.zeros((self.N,np.max(self.x_n)))
+        self.y_array = np.zeros((self.N,np.max(self.y_n)))
+        self.f_array = np.zeros((self.N,np.max(self.x_n),np.max(self.y_n)))
+        for j in xrange(self.N):
+            self.x_array[j,:self.x_n[j]] = x_lists[j]
+            self.x_array[j,self.x_n[j]:] = x_lists[j][-1]
+            self.y_array[j,:self.y_n[j]] = y_lists[j]
+            self.y_array[j,self.y_n[j]:] = y_lists[j][-1]
+            self.f_array[j,:self.x_n[j],:self.y_n[j]] = f_values[j]
+        self.xSearchFunc = StackedGridSearch(self.x_array,self.x_n)
+        self.ySearchFunc = StackedGridSearch(self.y_array,self.y_n)
+
+    def _evalOrDer(self,x,y,rows,_eval,_derX,_derY):
+        '''
+        Returns the level and/or first derivatives of the stacked functions at
+        each value in x,y, using the function named in rows for each point.
+
+        Parameters
+        ----------
+        x : np.array
+            Flat array of first coordinates of the query points.
+        y : np.array
+            Flat array of second coordinates of the query points.
+        rows : np.array
+            Array of integers of the same size as x, naming the function for each point.
+        _eval : boolean
+            Indicator for whether to evalute the level of the interpolated function.
+        _derX : boolean
+            Indicator for whether to evaluate the derivative with respect to x.
+        _derY : boolean
+            Indicator for whether to evaluate the derivative with respect to y.
+
+        Returns
+        -------
+        A list including the level and/or derivatives of the interpolated function where requested.
+        '''
+        x_pos  = self.xSearchFunc(x,rows)
+        y_pos  = self.ySearchFunc(y,rows)
+        x_flat = self.x_array.ravel()
+        y_flat = self.y_array.ravel()
+        f_flat = self.f_array.ravel()
+        x_base = rows*self.x_array.shape[1] + x_pos
+        y_base = rows*self.y_array.shape[1] + y_pos
+        x_lo   = x_flat[x_base-1]
+        x_hi   = x_flat[x_base]
+        y_lo   = y_flat[y_base-1]
+        y_hi   = y_flat[y_base]
+        f_base = (rows*self.f_array.shape[1] + x_pos)*self.f_array.shape[2] + y_pos
+        f_11   = f_flat[f_base]
+        f_10   = f_flat[f_base-1]
+        f_01   = f_flat[f_base-self.f_array.shape[2]]
+        f_00   = f_flat[f_base-self.f_array.shape[2]-1]
+        alpha  = (x - x_lo)/(x_hi - x_lo)
+        beta   = (y - y_lo)/(y_hi - y_lo)
+
+        output = []
+        if _eval:
+            output += [(1-alpha)*(1-beta)*f_00 + (1-alpha)*beta*f_01 + alpha*(1-beta)*f_10 + alpha*beta*f_11,]
+        if _derX:
+            output += [((1-beta)*f_10 + beta*f_11 - ((1-beta)*f_00 + beta*f_01))/(x_hi - x_lo),]
+        if _derY:
+            output += [((1-alpha)*f_01 + alpha*f_11 - ((1-alpha)*f_00 + alpha*f_10))/(y_hi - y_lo),]
+
+        # NaN query points were put in an arbitrary sector by the grid searches
+        missing = np.logical_or(np.isnan(x),np.isnan(y))
+        if np.any(missing):
+            for f in output:
+                f[missing] = np.nan
+        return output
+
+
+def makeBilinearInterpStack(functions):
+    '''
+    Pack a list of BilinearInterp functions into a BilinearInterpStack.
+
+    Parameters
+    ----------
+    functions : [BilinearInterp]
+        The functions to be stacked.
+
+    Returns
+    -------
+    stack : BilinearInterpStack
+        The functions packed into a single stack.
+    '''
+    for func in functions:
+        if not isinstance(func,BilinearInterp):
+            raise ValueError('Only BilinearInterp functions can be stacked!')
+    return BilinearInterpStack([func.f_values for func in functions],
+                               [func.x_list for func in functions],
+                               [func.y_list for func in functions])
 
 
 class TrilinearInterp(HARKinterpolator3D):
@@ -1190,6 +2605,18 @@ class TrilinearInterp(HARKinterpolator3D):
         self.ySearchFunc = ySearchFunc
         self.zSearchFunc = zSearchFunc
         
+    def distanceNodes(self):
+        '''
+        Returns the gridpoints of this interpolation, for interpolatorDistance.
+        '''
+        return (self.x_list,self.y_list,self.z_list)
+        
+    def distanceValues(self):
+        '''
+        Returns the function values at the gridpoints, for interpolatorDistance.
+        '''
+        return self.f_values
+        
     def _evaluate(self,x,y,z):
         '''
         Returns the level of the interpolated function at each value in x,y,z.
@@ -1319,6 +2746,15 @@ class TrilinearInterp(HARKinterpolator3D):
            +  alpha*beta*self.f_values[x_pos,y_pos,z_pos-1]))/(self.z_list[z_pos] - self.z_list[z_pos-1])
         return dfdz
         
+    def _evalAndGrad(self,x,y,z):
+        '''
+        Returns the level and all three partial derivatives of the interpolated
+        function at each value in x,y,z, locating each point in the grid only once.
+        Only called internally by HARKinterpolator3D.eval_with_gradient.
+        '''
+        return _multilinearEvalAndGrad(self.f_values,[self.x_list,self.y_list,self.z_list],
+                                       [self.xSearchFunc,self.ySearchFunc,self.zSearchFunc],[x,y,z])
+
 
 class QuadlinearInterp(HARKinterpolator4D):
     '''
@@ -1382,6 +2818,18 @@ class QuadlinearInterp(HARKinterpolator4D):
         self.ySearchFunc = ySearchFunc
         self.zSearchFunc = zSearchFunc
         
+    def distanceNodes(self):
+        '''
+        Returns the gridpoints of this interpolation, for interpolatorDistance.
+        '''
+        return (self.w_list,self.x_list,self.y_list,self.z_list)
+        
+    def distanceValues(self):
+        '''
+        Returns the function values at the gridpoints, for interpolatorDistance.
+        '''
+        return self.f_values
+        
     def _evaluate(self,w,x,y,z):
         '''
         Returns the level of the interpolated function at each value in x,y,z.
@@ -1632,16 +3080,149 @@ class QuadlinearInterp(HARKinterpolator4D):
               )/(self.z_list[l] - self.z_list[l-1])
         return dfdz
         
+    def _evalAndGrad(self,w,x,y,z):
+        '''
+        Returns the level and all four partial derivatives of the interpolated
+        function at each value in w,x,y,z, locating each point in the grid only
+        once.  Only called internally by HARKinterpolator4D.eval_with_gradient.
+        '''
+        return _multilinearEvalAndGrad(self.f_values,[self.w_list,self.x_list,self.y_list,self.z_list],
+                                       [self.wSearchFunc,self.xSearchFunc,self.ySearchFunc,self.zSearchFunc],[w,x,y,z])
+
+
+def _linearLevels(function,x):
+    '''
+    Returns the level of a LinearInterp at each value in x, none of which are below
+    its bottom gridpoint, extending its last segment above its top gridpoint.  Used
+    by resolveEnvelope in place of the general evaluation method.
+    '''
+    y = np.interp(x,function.x_list,function.y_list)
+    above = x > function.x_list[-1]
+    y[above] = function.y_list[-1] + function.slope_list[-1]*(x[above] - function.x_list[-1])
+    return y
+
+
+def resolveEnvelope(functions,lower=True):
+    '''
+    Makes a single LinearInterp that equals the lower (or upper) envelope of a set
+    of LinearInterps wherever all of them are defined: at and above the greatest
+    of their bottom gridpoints.  The envelope of piecewise linear functions is
+    piecewise linear, with kinks at the gridpoints of the functions and where two
+    of them cross, so it is represented exactly by interpolating the envelope over
+    all of these points.  At most one of the functions may have decay extrapolation,
+    and then only if its top gridpoint is the highest and the other functions can
+    be shown to stay above it (below it for an upper envelope) beyond that point.
+    
+    Parameters
+    ----------
+    functions : [LinearInterp]
+        The functions whose envelope is to be found.
+    lower : boolean
+        Indicator for whether to find the lower envelope (True) or upper (False).
+        
+    Returns
+    -------
+    envelope : LinearInterp or None
+        The envelope of the functions, with linear extrapolation below its bottom
+        gridpoint; None if the functions do not meet the conditions above.
+    '''
+    for function in functions:
+        if function.__class__ is not LinearInterp:
+            return None
+    sign = 1.0 if lower else -1.0
+    decaying = [function for function in functions if function.decay_extrap]
+    if len(decaying) > 1:
+        return None
+    bot = max([function.x_list[0] for function in functions])
+    top = max([function.x_list[-1] for function in functions])
+    knots = np.unique(np.concatenate([function.x_list for function in functions]))
+    knots = knots[knots >= bot]
+    
+    if len(decaying) == 1:
+        # The decaying function must be the envelope above its top gridpoint: the
+        # others are linear there, and must start and stay on the right side of it
+        decay_func = decaying[0]
+        if decay_func.x_list[-1] < top:
+            return None
+        decay_top = sign*decay_func.y_list[-1]
+        decay_slopes = sign*np.array([decay_func.slope_limit,
+                                      decay_func.slope_limit + decay_func.decay_extrap_B*decay_func.decay_extrap_A])
+        for function in functions:
+            if function is not decay_func:
+                if sign*_linearLevels(function,np.array([top]))[0] < decay_top or sign*function.slope_list[-1] < np.max(decay_slopes):
+                    return None
+    else:
+        # Above the top gridpoint all of the functions are linear; add their crossing
+        # points there, and a final point on the line that is the envelope beyond them
+        tops = sign*np.array([_linearLevels(function,np.array([top]))[0] for function in functions])
+        slopes = np.array([sign*function.slope_list[-1] for function in functions])
+        last = top
+        for j in xrange(len(functions)):
+            for k in xrange(j):
+                if slopes[j] != slopes[k]:
+                    cross = top + (tops[k] - tops[j])/(slopes[j] - slopes[k])
+                    if cross > top:
+                        knots = np.append(knots,cross)
+                        last = max(last,cross)
+        knots = np.append(knots,last + 1.0)
+        knots = np.unique(knots)
+    if knots.size < 2:
+        return None
+    
+    # Add the points where each pair of functions cross between gridpoints
+    values = sign*np.array([_linearLevels(function,knots) for function in functions])
+    crossings = [knots]
+    gaps = knots[1:] - knots[:-1]
+    for j in xrange(len(functions)):
+        for k in xrange(j):
+            diff = values[j] - values[k]
+            these = diff[:-1]*diff[1:] < 0.0
+            share = diff[:-1][these]/(diff[:-1][these] - diff[1:][these])
+            inside = np.logical_and(share > 1e-10, share < 1.0 - 1e-10) # Skip crossings at gridpoints
+            crossings.append(knots[:-1][these][inside] + share[inside]*gaps[these][inside])
+    knots = np.unique(np.concatenate(crossings))
+    envelope_values = sign*np.min([sign*_linearLevels(function,knots) for function in functions],axis=0)
+    
+    if len(decaying) == 1:
+        envelope = LinearInterp(knots,envelope_values,decay_func.intercept_limit,decay_func.slope_limit,lower_extrap=True)
+        envelope.decay_extrap_A = decay_func.decay_extrap_A # The decay is measured from the
+        envelope.decay_extrap_B = decay_func.decay_extrap_B # last segment of decay_func
+    else:
+        envelope = LinearInterp(knots,envelope_values,lower_extrap=True)
+    return envelope
+
+
+def _envelopeKeywords(envelope,functions,kwds,lower):
+    '''
+    Sets the functions of a LowerEnvelope or UpperEnvelope from its constructor's
+    arguments, and resolves it now if the keyword resolve is True.  Any other
+    keyword is an error.
+    '''
+    for key in kwds:
+        if key != 'resolve':
+            raise TypeError(envelope.__class__.__name__ + ' got an unexpected keyword argument ' + repr(key))
+    envelope.functions = []
+    for function in functions:
+        envelope.functions.append(function)
+    envelope.funcCount = len(envelope.functions)
+    if kwds.get('resolve',False):
+        envelope.resolved = resolveEnvelope(envelope.functions,lower)
+    else:
+        envelope.resolved = None
+
 
 class LowerEnvelope(HARKinterpolator1D):
     '''
     The lower envelope of a finite set of 1D functions, each of which can be of
     any class that has the methods __call__, derivative, and eval_with_derivative.
-    Generally: it combines HARKinterpolator1Ds. 
+    Generally: it combines HARKinterpolator1Ds.  When the functions are all
+    LinearInterps, the envelope can be resolved into a single LinearInterp when it
+    is made (see resolveEnvelope), which is then used wherever all of them are
+    defined.
     '''
     distance_criteria = ['functions']
 
-    def __init__(self,*functions):
+    def __init__(self,*functions,**kwds):
         '''
         Constructor to make a new lower envelope iterpolation.
         
@@ -1649,44 +3230,69 @@ class LowerEnvelope(HARKinterpolator1D):
         ----------
         *functions : function
             Any number of real functions; often instances of HARKinterpolator1D
+        resolve : boolean
+            Optional keyword for whether to resolve an envelope of LinearInterps into
+            a single LinearInterp now (default False); see resolveEnvelope.
             
         Returns
         -------
         new instance of LowerEnvelope
         '''
-        self.functions = []
-        for function in functions:
-            self.functions.append(function)
-        self.funcCount = len(self.functions)
+        _envelopeKeywords(self,functions,kwds,True)
 
-    def _evaluate(self,x):
+    def _evaluate(self,x,row_size=None):
         '''
         Returns the level of the function at each value in x as the minimum among
         all of the functions.  Only called internally by HARKinterpolator1D.__call__.
         '''
         if _isscalar(x):
             y = np.nanmin([f(x) for f in self.functions])
+        elif self.resolved is not None:
+            y = self.resolved._evaluate(x,row_size)
+            below = x < self.resolved.x_list[0]
+            if np.any(below):
+                y[below] = self._evaluateAll(x[below])
         else:
-            m = len(x)
-            fx = np.zeros((m,self.funcCount))
-            for j in range(self.funcCount):
-                fx[:,j] = self.functions[j](x)
-            y = np.nanmin(fx,axis=1)       
+            y = self._evaluateAll(x)
         return y
+        
+    def _evaluateAll(self,x):
+        '''
+        Returns the minimum among all of the functions at each value in x, by
+        evaluating every function.
+        '''
+        m = len(x)
+        fx = np.zeros((m,self.funcCount))
+        for j in range(self.funcCount):
+            fx[:,j] = self.functions[j](x)
+        return np.nanmin(fx,axis=1)
 
-    def _der(self,x):
+    def _der(self,x,row_size=None):
         '''
         Returns the first derivative of the function at each value in x.  Only
         called internally by HARKinterpolator1D.derivative.
         '''
-        y,dydx = self.eval_with_derivative(x)
+        y,dydx = self._evalAndDer(x,row_size)
         return dydx  # Sadly, this is the fastest / most convenient way...
 
-    def _evalAndDer(self,x):
+    def _evalAndDer(self,x,row_size=None):
         '''
         Returns the level and first derivative of the function at each value in
         x.  Only called internally by HARKinterpolator1D.eval_and_der.
         '''
+        if self.resolved is not None:
+            y,dydx = self.resolved._evalAndDer(x,row_size)
+            below = x < self.resolved.x_list[0]
+            if np.any(below):
+                y[below],dydx[below] = self._evalAndDerAll(x[below])
+            return y,dydx
+        return self._evalAndDerAll(x)
+        
+    def _evalAndDerAll(self,x):
+        '''
+        Returns the level and first derivative of the function at each value in
+        x, by evaluating every function.
+        '''
         m = len(x)
         fx = np.zeros((m,self.funcCount))
         for j in range(self.funcCount):
@@ -1705,11 +3311,12 @@ class UpperEnvelope(HARKinterpolator1D):
     '''
     The upper envelope of a finite set of 1D functions, each of which can be of
     any class that has the methods __call__, derivative, and eval_with_derivative.
-    Generally: it combines HARKinterpolator1Ds. 
+    Generally: it combines HARKinterpolator1Ds.  As in LowerEnvelope, an envelope
+    of LinearInterps can be resolved into a single LinearInterp.
     '''
     distance_criteria = ['functions']
 
-    def __init__(self,*functions):
+    def __init__(self,*functions,**kwds):
         '''
         Constructor to make a new upper envelope iterpolation.
         
@@ -1717,44 +3324,69 @@ class UpperEnvelope(HARKinterpolator1D):
         ----------
         *functions : function
             Any number of real functions; often instances of HARKinterpolator1D
+        resolve : boolean
+            Optional keyword for whether to resolve an envelope of LinearInterps into
+            a single LinearInterp now (default False); see resolveEnvelope.
             
         Returns
         -------
         new instance of UpperEnvelope
         '''
-        self.functions = []
-        for function in functions:
-            self.functions.append(function)
-        self.funcCount = len(self.functions)
+        _envelopeKeywords(self,functions,kwds,False)
 
-    def _evaluate(self,x):
+    def _evaluate(self,x,row_size=None):
         '''
         Returns the level of the function at each value in x as the maximum among
         all of the functions.  Only called internally by HARKinterpolator1D.__call__.
         '''
         if _isscalar(x):
             y = np.nanmax([f(x) for f in self.functions])
+        elif self.resolved is not None:
+            y = self.resolved._evaluate(x,row_size)
+            below = x < self.resolved.x_list[0]
+            if np.any(below):
+                y[below] = self._evaluateAll(x[below])
         else:
-            m = len(x)
-            fx = np.zeros((m,self.funcCount))
-            for j in range(self.funcCount):
-                fx[:,j] = self.functions[j](x)
-            y = np.nanmax(fx,axis=1)       
+            y = self._evaluateAll(x)
         return y
+        
+    def _evaluateAll(self,x):
+        '''
+        Returns the maximum among all of the functions at each value in x, by
+        evaluating every function.
+        '''
+        m = len(x)
+        fx = np.zeros((m,self.funcCount))
+        for j in range(self.funcCount):
+            fx[:,j] = self.functions[j](x)
+        return np.nanmax(fx,axis=1)
 
-    def _der(self,x):
+    def _der(self,x,row_size=None):
         '''
         Returns the first derivative of the function at each value in x.  Only
         called internally by HARKinterpolator1D.derivative.
         '''
-        y,dydx = self.eval_with_derivative(x)
+        y,dydx = self._evalAndDer(x,row_size)
         return dydx  # Sadly, this is the fastest / most convenient way...
 
-    def _evalAndDer(self,x):
+    def _evalAndDer(self,x,row_size=None):
         '''
         Returns the level and first derivative of the function at each value in
         x.  Only called internally by HARKinterpolator1D.eval_and_der.
         '''
+        if self.resolved is not None:
+            y,dydx = self.resolved._evalAndDer(x,row_size)
+            below = x < self.resolved.x_list[0]
+            if np.any(below):
+                y[below],dydx[below] = self._evalAndDerAll(x[below])
+            return y,dydx
+        return self._evalAndDerAll(x)
+        
+    def _evalAndDerAll(self,x):
+        '''
+        Returns the level and first derivative of the function at each value in
+        x, by evaluating every function.
+        '''
         m = len(x)
         fx = np.zeros((m,self.funcCount))
         for j in range(self.funcCount):
@@ -1767,8 +3399,88 @@ class UpperEnvelope(HARKinterpolator1D):
             c = i == j
             dydx[c] = self.functions[j].derivative(x[c])
         return y,dydx
-        
-        
+
+
+def flatForm(function):
+    '''
+    Returns the interpolator that evaluates a 1D function at arrays of points with
+    the fewest layers of Python in between.  For a LowerEnvelope or UpperEnvelope
+    that was resolved when it was made, this is its resolved form, which only
+    applies at and above its bottom gridpoint.  For any other interpolator it is
+    the function itself.
+
+    Parameters
+    ----------
+    function : function
+        A real function of one variable.
+
+    Returns
+    -------
+    flat : HARKinterpolator1D or None
+        An interpolator equal to function at and above bot, whose _evaluate and
+        _evalAndDer methods can be called directly; None if function is not an
+        interpolator.
+    bot : float or None
+        The point below which function itself must be evaluated instead of flat.
+    '''
+    if isinstance(function,(LowerEnvelope,UpperEnvelope)) and function.resolved is not None:
+        return function.resolved, function.resolved.x_list[0]
+    if isinstance(function,HARKinterpolator1D):
+        return function, -np.inf
+    return None, None
+
+
+def evalFlat(function,x,derivative=False,sorted_x=False):
+    '''
+    Evaluates a 1D function (and optionally its derivative) at an array of points
+    through its flatForm: one call to the interpolator that makes it up, on the
+    points as a flat view, rather than a call through each layer of the function.
+    This is meant for functions that are composed with something else and then
+    evaluated many times, like the consumption function inside a marginal value
+    function.  The results are new arrays, which the caller may modify in place.
+
+    Parameters
+    ----------
+    function : function
+        A real function of one variable.
+    x : np.array or float
+        Real values at which to evaluate the function.
+    derivative : boolean
+        Indicator for whether to return the derivative along with the level.
+    sorted_x : boolean
+        Optional indicator that x is sorted in increasing order along its last
+        axis; see HARKinterpolator1D.__call__.
+
+    Returns
+    -------
+    y : np.array or float
+        The function evaluated at x, with the same shape as x.
+    dydx : np.array or float
+        The function's first derivative evaluated at x, with the same shape as x;
+        only returned if derivative is True.
+    '''
+    flat, bot = flatForm(function)
+    if flat is None or _isscalar(x):
+        return function.eval_with_derivative(x) if derivative else function(x)
+    x = np.asarray(x)
+    shape = x.shape
+    x = x.ravel() # The evaluation methods never write into their inputs
+    if derivative:
+        y, dydx = flat._evalAndDer(x,**_sortedKwds(shape,sorted_x))
+    else:
+        y = flat._evaluate(x,**_sortedKwds(shape,sorted_x))
+    if bot > -np.inf:
+        below = x < bot
+        if np.any(below):
+            if derivative:
+                y[below], dydx[below] = function.eval_with_derivative(x[below])
+            else:
+                y[below] = function(x[below])
+    if derivative:
+        return y.reshape(shape), dydx.reshape(shape)
+    return y.reshape(shape)
+
+
 class LowerEnvelope2D(HARKinterpolator2D):
     '''
     The lower envelope of a finite set of 2D functions, each of which can be of
@@ -1839,13 +3551,32 @@ class LowerEnvelope2D(HARKinterpolator2D):
             temp[:,j] = self.functions[j](x,y)
         temp[np.isnan(temp)] = np.inf
         i = np.argmin(temp,axis=1)
-        y = temp[np.arange(m),i]
         dfdy = np.zeros_like(x)
         for j in range(self.funcCount):
             c = i == j
             dfdy[c] = self.functions[j].derivativeY(x[c],y[c])
         return dfdy
         
+    def _evalAndGrad(self,x,y):
+        '''
+        Returns the level and both partial derivatives of the function at each
+        value in (x,y), finding the minimizing function at each point only once.
+        Only called internally by HARKinterpolator2D.eval_with_gradient.
+        '''
+        m = len(x)
+        temp = np.zeros((m,self.funcCount))
+        for j in range(self.funcCount):
+            temp[:,j] = self.functions[j](x,y)
+        f = np.nanmin(temp,axis=1)
+        temp[np.isnan(temp)] = np.inf
+        i = np.argmin(temp,axis=1)
+        dfdx = np.zeros_like(x)
+        dfdy = np.zeros_like(x)
+        for j in range(self.funcCount):
+            c = i == j
+            dfdx[c], dfdy[c] = evalWithGradient(self.functions[j],x[c],y[c])[1:]
+        return [f,dfdx,dfdy]
+        
     
 class LowerEnvelope3D(HARKinterpolator3D):
     '''
@@ -1917,7 +3648,6 @@ class LowerEnvelope3D(HARKinterpolator3D):
             temp[:,j] = self.functions[j](x,y,z)
         temp[np.isnan(temp)] = np.inf
         i = np.argmin(temp,axis=1)
-        y = temp[np.arange(m),i]
         dfdy = np.zeros_like(x)
         for j in range(self.funcCount):
             c = i == j
@@ -1935,13 +3665,33 @@ class LowerEnvelope3D(HARKinterpolator3D):
             temp[:,j] = self.functions[j](x,y,z)
         temp[np.isnan(temp)] = np.inf
         i = np.argmin(temp,axis=1)
-        y = temp[np.arange(m),i]
         dfdz = np.zeros_like(x)
         for j in range(self.funcCount):
             c = i == j
             dfdz[c] = self.functions[j].derivativeZ(x[c],y[c],z[c])
         return dfdz
         
+    def _evalAndGrad(self,x,y,z):
+        '''
+        Returns the level and all three partial derivatives of the function at
+        each value in (x,y,z), finding the minimizing function at each point only
+        once.  Only called internally by HARKinterpolator3D.eval_with_gradient.
+        '''
+        m = len(x)
+        temp = np.zeros((m,self.funcCount))
+        for j in range(self.funcCount):
+            temp[:,j] = self.functions[j](x,y,z)
+        f = np.nanmin(temp,axis=1)
+        temp[np.isnan(temp)] = np.inf
+        i = np.argmin(temp,axis=1)
+        dfdx = np.zeros_like(x)
+        dfdy = np.zeros_like(x)
+        dfdz = np.zeros_like(x)
+        for j in range(self.funcCount):
+            c = i == j
+            dfdx[c], dfdy[c], dfdz[c] = evalWithGradient(self.functions[j],x[c],y[c],z[c])[1:]
+        return [f,dfdx,dfdy,dfdz]
+        
         
 class VariableLowerBoundFunc2D(HARKobject):
     '''
@@ -2035,6 +3785,31 @@ class VariableLowerBoundFunc2D(HARKobject):
         dfdy_out = self.func.derivativeY(x-xShift,y) - xShiftDer*self.func.derivativeX(x-xShift,y)
         return dfdy_out
         
+    def eval_with_gradient(self,x,y):
+        '''
+        Evaluate the function and both of its first derivatives at given state
+        space points, evaluating the lower bound and shifted function only once.
+        
+        Parameters
+        ----------
+        x : np.array
+             First input values.
+        y : np.array
+             Second input values; should be of same shape as x.
+             
+        Returns
+        -------
+        f_out : np.array
+            Function evaluated at (x,y), of same shape as inputs.
+        dfdx_out : np.array
+            First derivative of function with respect to the first input.
+        dfdy_out : np.array
+            First derivative of function with respect to the second input.
+        '''
+        xShift,xShiftDer = self.lowerBound.eval_with_derivative(y)
+        f_out, dfdx_out, dfdy_out = evalWithGradient(self.func,x-xShift,y)
+        return f_out, dfdx_out, dfdy_out - xShiftDer*dfdx_out
+        
         
 class VariableLowerBoundFunc3D(HARKobject):
     '''
@@ -2158,11 +3933,256 @@ class VariableLowerBoundFunc3D(HARKobject):
         xShift = self.lowerBound(y)
         dfdz_out = self.func.derivativeZ(x-xShift,y,z)
         return dfdz_out
+        
+    def eval_with_gradient(self,x,y,z):
+        '''
+        Evaluate the function and all three of its first derivatives at given
+        state space points, evaluating the lower bound and shifted function only
+        once.
+        
+        Parameters
+        ----------
+        x : np.array
+             First input values.
+        y : np.array
+             Second input values; should be of same shape as x.
+        z : np.array
+             Third input values; should be of same shape as x.
+             
+        Returns
+        -------
+        f_out : np.array
+            Function evaluated at (x,y,z), of same shape as inputs.
+        dfdx_out : np.array
+            First derivative of function with respect to the first input.
+        dfdy_out : np.array
+            First derivative of function with respect to the second input.
+        dfdz_out : np.array
+            First derivative of function with respect to the third input.
+        '''
+        xShift,xShiftDer = self.lowerBound.eval_with_derivative(y)
+        f_out, dfdx_out, dfdy_out, dfdz_out = evalWithGradient(self.func,x-xShift,y,z)
+        return f_out, dfdx_out, dfdy_out - xShiftDer*dfdx_out, dfdz_out
+
+
+# The functions at the corners of the cells of an "InterpOnInterp" class are
+# evaluated one cell at a time, rather than in one pass through their stack, when
+# the query points occupy few enough cells that there are at least this many of
+# them per occupied cell on average; each of the unpacked functions evaluates its
+# points faster than the gather through a stack can.
+cell_loop_min_points = 2048
+
+
+def _locateOnGrids(grids,points):
+    '''
+    Finds the cell of a tensor grid that contains each query point, as the
+    "InterpOnInterp" classes use: for each grid, the index of the upper gridpoint
+    of the point's segment (restricted to [1,size-1]), the width of that segment,
+    and the relative position of the point within it; and the flat index of the
+    cell.
+
+    Parameters
+    ----------
+    grids : [np.array]
+        The grids over which functions are interpolated.
+    points : [np.array]
+        Query points for the grid variables, one array per grid.
+
+    Returns
+    -------
+    pos : [np.array]
+        Index of the upper gridpoint of each query point's segment in each grid.
+    span : [np.array]
+        Width of each query point's segment in each grid.
+    weight : [np.array]
+        Relative position of each query point in its segment in each grid.
+    cells : np.array
+        Index of each query point's cell among the cells of the tensor grid, in
+        C order.
+    '''
+    pos = []
+    span = []
+    weight = []
+    for grid, point in zip(grids,points):
+        i = np.clip(np.searchsorted(grid,point),1,grid.size-1)
+        lo = grid[i-1]
+        pos.append(i)
+        span.append(grid[i] - lo)
+        weight.append((point - lo)/span[-1])
+    if len(grids) == 1:
+        cells = pos[0] - 1
+    else:
+        cells = np.ravel_multi_index([i-1 for i in pos],[grid.size-1 for grid in grids])
+    return pos, span, weight, cells
+
+
+def _combineRequested(f,weight,span,which,arg_count):
+    '''
+    Combines the level or a derivative at the corners of each query point's cell
+    into the requested level or partial derivative of a multilinear interpolation
+    among functions, one grid dimension at a time, for _interpOnStack and
+    _interpOnCells.  The argument which is as in _interpOnStack.
+    '''
+    for k in xrange(len(weight)):
+        if which == arg_count + 1 + k:
+            f = (f[1] - f[0])/span[k]
+        else:
+            f = (1-weight[k])*f[0] + weight[k]*f[1]
+    return f
+
+
+def _interpOnStack(stack,children,args,grids,points,which=None):
+    '''
+    Multilinear interpolation among the functions in a LinearInterpStack or
+    BilinearInterpStack that are laid out on a tensor grid, for the "InterpOnInterp"
+    classes.  The function in row sum_k i_k*prod(grids[k+1:] sizes) of the stack
+    represents f(args,grids[0][i_0],grids[1][i_1],...).  The functions at all
+    corners of each query point's cell are evaluated in one vectorized pass, unless
+    the points are concentrated in few cells (see cell_loop_min_points), in which
+    case the unpacked functions are evaluated one cell at a time by _interpOnCells.
+    Query points with a NaN coordinate give NaN in every output, on either path.
+
+    Parameters
+    ----------
+    stack : LinearInterpStack or BilinearInterpStack
+        The packed functions of the first one or two arguments.
+    children : nested lists of functions
+        The same functions, unpacked, as in _interpOnCells.
+    args : [np.array]
+        Query points for the arguments of the stacked functions.
+    grids : [np.array]
+        The grids over which the stacked functions are interpolated.
+    points : [np.array]
+        Query points for the grid variables, one array per grid.
+    which : int or None
+        Zero for the level of the function; otherwise, one plus the position of
+        the variable (in args then points) for which the derivative is wanted.
+        If None, the level and all partial derivatives are returned.
+
+    Returns
+    -------
+    f : np.array or [np.array]
+        The requested level or derivative at each query point; or, if which is
+        None, the level and the partial derivatives with respect to each variable
+        in args and then in points.
+    '''
+    located = _locateOnGrids(grids,points)
+    pos, span, weight, cells = located
+    d = len(grids)
+    m = args[0].size
+    if m >= cell_loop_min_points*np.count_nonzero(np.bincount(cells)):
+        output = _interpOnCells(children,args,grids,points,which,located)
+    else:
+        # Evaluate the stacked functions at every corner of the cells at once
+        strides = np.cumprod([1] + [grid.size for grid in grids[:0:-1]])[::-1]
+        rows = np.concatenate([sum((pos[k] - 1 + corner[k])*strides[k] for k in xrange(d))
+                               for corner in itertools.product([0,1],repeat=d)])
+        arg_count = len(args)
+        if which is None:
+            flags = (arg_count+1)*[True]
+        elif which <= arg_count:
+            flags = [which == j for j in xrange(arg_count+1)]
+        else:
+            flags = [True] + arg_count*[False]
+        corner_args = [np.tile(arg,2**d) for arg in args]
+        corners = [f.reshape((2,)*d + (m,)) for f in stack._evalOrDer(*(corner_args + [rows] + flags))]
+        if which is None:
+            output = _combineCorners(corners[0],weight,span,corners[1:])
+        else:
+            output = _combineRequested(corners[0],weight,span,which,arg_count)
+
+    # Query points with a NaN coordinate are in no cell
+    missing = np.zeros(m,dtype=bool)
+    for point in args + points:
+        missing |= np.isnan(point)
+    if np.any(missing):
+        for f in (output if which is None else [output]):
+            f[missing] = np.nan
+    return output
+
+
+def _interpOnCells(children,args,grids,points,which=None,located=None):
+    '''
+    Multilinear interpolation among functions laid out on a tensor grid, for the
+    "InterpOnInterp" classes whose functions can't be packed into a stack, and
+    for _interpOnStack when the query points occupy few cells.  Query points are
+    grouped by their cell of the grid, and the functions at the corners of each
+    cell are evaluated on its points.
+
+    Parameters
+    ----------
+    children : nested lists of functions
+        children[i_0][i_1]... represents f(args,grids[0][i_0],grids[1][i_1],...);
+        these are 1D interpolators if there is one arg, or 2D interpolators if
+        there are two.
+    args : [np.array]
+        Query points for the arguments of the children.
+    grids : [np.array]
+        The grids over which the children are interpolated.
+    points : [np.array]
+        Query points for the grid variables, one array per grid.
+    which : int or None
+        As in _interpOnStack.
+    located : tuple or None
+        The output of _locateOnGrids(grids,points), if it has already been found.
+
+    Returns
+    -------
+    f : np.array or [np.array]
+        As in _interpOnStack.
+    '''
+    if located is None:
+        located = _locateOnGrids(grids,points)
+    pos, span, weight, cells = located
+    d = len(grids)
+    arg_count = len(args)
+    cell_counts = [grid.size-1 for grid in grids]
+
+    if which is None:
+        output = [np.zeros(args[0].size) + np.nan for j in xrange(1+arg_count+d)]
+    else:
+        output = np.zeros(args[0].size) + np.nan
+    for cell in np.flatnonzero(np.bincount(cells)):
+        c = cells == cell
+        index = np.unravel_index(cell,cell_counts)
+        args_c = [arg[c] for arg in args]
+        corner_values = []
+        for corner in itertools.product([0,1],repeat=d):
+            child = children
+            for k in xrange(d):
+                child = child[index[k]+corner[k]]
+            if which is None:
+                if arg_count == 1:
+                    corner_values.append(child.eval_with_derivative(args_c[0]))
+                else:
+                    corner_values.append(evalWithGradient(child,*args_c))
+            elif which == 0 or which > arg_count:
+                corner_values.append(child(*args_c))
+            elif arg_count == 1:
+                corner_values.append(child.derivative(args_c[0]))
+            else:
+                corner_values.append([child.derivativeX,child.derivativeY][which-1](*args_c))
+        weight_c = [w[c] for w in weight]
+        if which is None or which > arg_count:
+            span_c = [s[c] for s in span]
+        else:
+            span_c = None # Only needed for derivatives with respect to the grids
+        if which is None:
+            corners = [np.array([values[j] for values in corner_values]).reshape((2,)*d + (-1,)) for j in xrange(1+arg_count)]
+            results = _combineCorners(corners[0],weight_c,span_c,corners[1:])
+            for j in xrange(len(output)):
+                output[j][c] = results[j]
+        else:
+            corners = np.array(corner_values).reshape((2,)*d + (-1,))
+            output[c] = _combineRequested(corners,weight_c,span_c,which,arg_count)
+    return output
 
 
 class LinearInterpOnInterp1D(HARKinterpolator2D):
     '''
     A 2D interpolator that linearly interpolates among a list of 1D interpolators.
+    When the 1D interpolators can all be packed into a LinearInterpStack, arrays of
+    points are evaluated in one vectorized pass through the stack.
     '''
     distance_criteria = ['xInterpolators','y_list']
     def __init__(self,xInterpolators,y_values):
@@ -2186,12 +4206,18 @@ class LinearInterpOnInterp1D(HARKinterpolator2D):
         self.xInterpolators = xInterpolators
         self.y_list = y_values
         self.y_n = y_values.size
+        try:
+            self.xStack = makeLinearInterpStack(xInterpolators)
+        except ValueError:
+            self.xStack = None
         
     def _evaluate(self,x,y):
         '''
         Returns the level of the interpolated function at each value in x,y.
         Only called internally by HARKinterpolator2D.__call__ (etc).
         '''
+        if self.xStack is not None and not _isscalar(x):
+            return _interpOnStack(self.xStack,self.xInterpolators,[x],[self.y_list],[y],0)
         if _isscalar(x):
             y_pos = max(min(np.searchsorted(self.y_list,y),self.y_n-1),1)
             alpha = (y - self.y_list[y_pos-1])/(self.y_list[y_pos] - self.y_list[y_pos-1])
@@ -2215,6 +4241,8 @@ class LinearInterpOnInterp1D(HARKinterpolator2D):
         Returns the derivative with respect to x of the interpolated function
         at each value in x,y. Only called internally by HARKinterpolator2D.derivativeX.
         '''
+        if self.xStack is not None and not _isscalar(x):
+            return _interpOnStack(self.xStack,self.xInterpolators,[x],[self.y_list],[y],1)
         if _isscalar(x):
             y_pos = max(min(np.searchsorted(self.y_list,y),self.y_n-1),1)
             alpha = (y - self.y_list[y_pos-1])/(self.y_list[y_pos] - self.y_list[y_pos-1])
@@ -2238,6 +4266,8 @@ class LinearInterpOnInterp1D(HARKinterpolator2D):
         Returns the derivative with respect to y of the interpolated function
         at each value in x,y. Only called internally by HARKinterpolator2D.derivativeY.
         '''
+        if self.xStack is not None and not _isscalar(x):
+            return _interpOnStack(self.xStack,self.xInterpolators,[x],[self.y_list],[y],2)
         if _isscalar(x):
             y_pos = max(min(np.searchsorted(self.y_list,y),self.y_n-1),1)
             dfdy = (self.xInterpolators[y_pos](x) - self.xInterpolators[y_pos-1](x))/(self.y_list[y_pos] - self.y_list[y_pos-1])
@@ -2253,6 +4283,16 @@ class LinearInterpOnInterp1D(HARKinterpolator2D):
                     if np.any(c):
                         dfdy[c] = (self.xInterpolators[i](x[c]) - self.xInterpolators[i-1](x[c]))/(self.y_list[i] - self.y_list[i-1])
         return dfdy
+        
+    def _evalAndGrad(self,x,y):
+        '''
+        Returns the level and both partial derivatives of the interpolated function
+        at each value in x,y, evaluating the 1D interpolators at each point only once.
+        Only called internally by HARKinterpolator2D.eval_with_gradient.
+        '''
+        if self.xStack is not None:
+            return _interpOnStack(self.xStack,self.xInterpolators,[x],[self.y_list],[y])
+        return _interpOnCells(self.xInterpolators,[x],[self.y_list],[y])
 
 
 class BilinearInterpOnInterp1D(HARKinterpolator3D):
@@ -2287,12 +4327,18 @@ class BilinearInterpOnInterp1D(HARKinterpolator3D):
         self.y_n = y_values.size
         self.z_list = z_values
         self.z_n = z_values.size
+        try:
+            self.xStack = makeLinearInterpStack([func for funcs in xInterpolators for func in funcs])
+        except ValueError:
+            self.xStack = None
         
     def _evaluate(self,x,y,z):
         '''
         Returns the level of the interpolated function at each value in x,y,z.
         Only called internally by HARKinterpolator3D.__call__ (etc).
         '''
+        if self.xStack is not None and not _isscalar(x):
+            return _interpOnStack(self.xStack,self.xInterpolators,[x],[self.y_list,self.z_list],[y,z],0)
         if _isscalar(x):
             y_pos = max(min(np.searchsorted(self.y_list,y),self.y_n-1),1)
             z_pos = max(min(np.searchsorted(self.z_list,z),self.z_n-1),1)
@@ -2329,6 +4375,8 @@ class BilinearInterpOnInterp1D(HARKinterpolator3D):
         Returns the derivative with respect to x of the interpolated function
         at each value in x,y,z. Only called internally by HARKinterpolator3D.derivativeX.
         '''
+        if self.xStack is not None and not _isscalar(x):
+            return _interpOnStack(self.xStack,self.xInterpolators,[x],[self.y_list,self.z_list],[y,z],1)
         if _isscalar(x):
             y_pos = max(min(np.searchsorted(self.y_list,y),self.y_n-1),1)
             z_pos = max(min(np.searchsorted(self.z_list,z),self.z_n-1),1)
@@ -2365,6 +4413,8 @@ class BilinearInterpOnInterp1D(HARKinterpolator3D):
         Returns the derivative with respect to y of the interpolated function
         at each value in x,y,z. Only called internally by HARKinterpolator3D.derivativeY.
         '''
+        if self.xStack is not None and not _isscalar(x):
+            return _interpOnStack(self.xStack,self.xInterpolators,[x],[self.y_list,self.z_list],[y,z],2)
         if _isscalar(x):
             y_pos = max(min(np.searchsorted(self.y_list,y),self.y_n-1),1)
             z_pos = max(min(np.searchsorted(self.z_list,z),self.z_n-1),1)
@@ -2394,6 +4444,8 @@ class BilinearInterpOnInterp1D(HARKinterpolator3D):
         Returns the derivative with respect to z of the interpolated function
         at each value in x,y,z. Only called internally by HARKinterpolator3D.derivativeZ.
         '''
+        if self.xStack is not None and not _isscalar(x):
+            return _interpOnStack(self.xStack,self.xInterpolators,[x],[self.y_list,self.z_list],[y,z],3)
         if _isscalar(x):
             y_pos = max(min(np.searchsorted(self.y_list,y),self.y_n-1),1)
             z_pos = max(min(np.searchsorted(self.z_list,z),self.z_n-1),1)
@@ -2417,6 +4469,16 @@ class BilinearInterpOnInterp1D(HARKinterpolator3D):
                         dfdz[c] = (((1-alpha)*self.xInterpolators[i-1][j](x[c]) + alpha*self.xInterpolators[i][j](x[c]))
                                 -  ((1-alpha)*self.xInterpolators[i-1][j-1](x[c]) + alpha*self.xInterpolators[i][j-1](x[c])))/(self.z_list[j] - self.z_list[j-1])
         return dfdz
+        
+    def _evalAndGrad(self,x,y,z):
+        '''
+        Returns the level and all three partial derivatives of the interpolated function
+        at each value in x,y,z, evaluating the 1D interpolators at each point only once.
+        Only called internally by HARKinterpolator3D.eval_with_gradient.
+        '''
+        if self.xStack is not None:
+            return _interpOnStack(self.xStack,self.xInterpolators,[x],[self.y_list,self.z_list],[y,z])
+        return _interpOnCells(self.xInterpolators,[x],[self.y_list,self.z_list],[y,z])
 
              
 
@@ -2455,12 +4517,18 @@ class TrilinearInterpOnInterp1D(HARKinterpolator4D):
         self.y_n = y_values.size
         self.z_list = z_values
         self.z_n = z_values.size
+        try:
+            self.wStack = makeLinearInterpStack([func for funcs_x in wInterpolators for funcs in funcs_x for func in funcs])
+        except ValueError:
+            self.wStack = None
 
     def _evaluate(self,w,x,y,z):
         '''
         Returns the level of the interpolated function at each value in w,x,y,z.
         Only called internally by HARKinterpolator4D.__call__ (etc).
         '''
+        if self.wStack is not None and not _isscalar(w):
+            return _interpOnStack(self.wStack,self.wInterpolators,[w],[self.x_list,self.y_list,self.z_list],[x,y,z],0)
         if _isscalar(w):
             x_pos = max(min(np.searchsorted(self.x_list,x),self.x_n-1),1)
             y_pos = max(min(np.searchsorted(self.y_list,y),self.y_n-1),1)
@@ -2481,6 +4549,7 @@ class TrilinearInterpOnInterp1D(HARKinterpolator4D):
             m = len(x)
             x_pos = np.searchsorted(self.x_list,x)
             x_pos[x_pos > self.x_n-1] = self.x_n-1
+            x_pos[x_pos < 1] = 1
             y_pos = np.searchsorted(self.y_list,y)
             y_pos[y_pos > self.y_n-1] = self.y_n-1
             y_pos[y_pos < 1] = 1
@@ -2512,6 +4581,8 @@ class TrilinearInterpOnInterp1D(HARKinterpolator4D):
         Returns the derivative with respect to w of the interpolated function
         at each value in w,x,y,z. Only called internally by HARKinterpolator4D.derivativeW.
         '''
+        if self.wStack is not None and not _isscalar(w):
+            return _interpOnStack(self.wStack,self.wInterpolators,[w],[self.x_list,self.y_list,self.z_list],[x,y,z],1)
         if _isscalar(w):
             x_pos = max(min(np.searchsorted(self.x_list,x),self.x_n-1),1)
             y_pos = max(min(np.searchsorted(self.y_list,y),self.y_n-1),1)
@@ -2532,6 +4603,7 @@ class TrilinearInterpOnInterp1D(HARKinterpolator4D):
             m = len(x)
             x_pos = np.searchsorted(self.x_list,x)
             x_pos[x_pos > self.x_n-1] = self.x_n-1
+            x_pos[x_pos < 1] = 1
             y_pos = np.searchsorted(self.y_list,y)
             y_pos[y_pos > self.y_n-1] = self.y_n-1
             y_pos[y_pos < 1] = 1
@@ -2563,6 +4635,8 @@ class TrilinearInterpOnInterp1D(HARKinterpolator4D):
         Returns the derivative with respect to x of the interpolated function
         at each value in w,x,y,z. Only called internally by HARKinterpolator4D.derivativeX.
         '''
+        if self.wStack is not None and not _isscalar(w):
+            return _interpOnStack(self.wStack,self.wInterpolators,[w],[self.x_list,self.y_list,self.z_list],[x,y,z],2)
         if _isscalar(w):
             x_pos = max(min(np.searchsorted(self.x_list,x),self.x_n-1),1)
             y_pos = max(min(np.searchsorted(self.y_list,y),self.y_n-1),1)
@@ -2582,6 +4656,7 @@ class TrilinearInterpOnInterp1D(HARKinterpolator4D):
             m = len(x)
             x_pos = np.searchsorted(self.x_list,x)
             x_pos[x_pos > self.x_n-1] = self.x_n-1
+            x_pos[x_pos < 1] = 1
             y_pos = np.searchsorted(self.y_list,y)
             y_pos[y_pos > self.y_n-1] = self.y_n-1
             y_pos[y_pos < 1] = 1
@@ -2612,6 +4687,8 @@ class TrilinearInterpOnInterp1D(HARKinterpolator4D):
         Returns the derivative with respect to y of the interpolated function
         at each value in w,x,y,z. Only called internally by HARKinterpolator4D.derivativeY.
         '''
+        if self.wStack is not None and not _isscalar(w):
+            return _interpOnStack(self.wStack,self.wInterpolators,[w],[self.x_list,self.y_list,self.z_list],[x,y,z],3)
         if _isscalar(w):
             x_pos = max(min(np.searchsorted(self.x_list,x),self.x_n-1),1)
             y_pos = max(min(np.searchsorted(self.y_list,y),self.y_n-1),1)
@@ -2631,6 +4708,7 @@ class TrilinearInterpOnInterp1D(HARKinterpolator4D):
             m = len(x)
             x_pos = np.searchsorted(self.x_list,x)
             x_pos[x_pos > self.x_n-1] = self.x_n-1
+            x_pos[x_pos < 1] = 1
             y_pos = np.searchsorted(self.y_list,y)
             y_pos[y_pos > self.y_n-1] = self.y_n-1
             y_pos[y_pos < 1] = 1
@@ -2661,6 +4739,8 @@ class TrilinearInterpOnInterp1D(HARKinterpolator4D):
         Returns the derivative with respect to z of the interpolated function
         at each value in w,x,y,z. Only called internally by HARKinterpolator4D.derivativeZ.
         '''
+        if self.wStack is not None and not _isscalar(w):
+            return _interpOnStack(self.wStack,self.wInterpolators,[w],[self.x_list,self.y_list,self.z_list],[x,y,z],4)
         if _isscalar(w):
             x_pos = max(min(np.searchsorted(self.x_list,x),self.x_n-1),1)
             y_pos = max(min(np.searchsorted(self.y_list,y),self.y_n-1),1)
@@ -2680,6 +4760,7 @@ class TrilinearInterpOnInterp1D(HARKinterpolator4D):
             m = len(x)
             x_pos = np.searchsorted(self.x_list,x)
             x_pos[x_pos > self.x_n-1] = self.x_n-1
+            x_pos[x_pos < 1] = 1
             y_pos = np.searchsorted(self.y_list,y)
             y_pos[y_pos > self.y_n-1] = self.y_n-1
             y_pos[y_pos < 1] = 1
@@ -2705,6 +4786,16 @@ class TrilinearInterpOnInterp1D(HARKinterpolator4D):
                                  + alpha*beta*self.wInterpolators[i][j][k-1](w[c])))/(self.z_list[k] - self.z_list[k-1])
         return dfdz
         
+    def _evalAndGrad(self,w,x,y,z):
+        '''
+        Returns the level and all four partial derivatives of the interpolated function
+        at each value in w,x,y,z, evaluating the 1D interpolators at each point only once.
+        Only called internally by HARKinterpolator4D.eval_with_gradient.
+        '''
+        if self.wStack is not None:
+            return _interpOnStack(self.wStack,self.wInterpolators,[w],[self.x_list,self.y_list,self.z_list],[x,y,z])
+        return _interpOnCells(self.wInterpolators,[w],[self.x_list,self.y_list,self.z_list],[x,y,z])
+        
        
 class LinearInterpOnInterp2D(HARKinterpolator3D):
     '''
@@ -2737,12 +4828,18 @@ class LinearInterpOnInterp2D(HARKinterpolator3D):
         self.xyInterpolators = xyInterpolators
         self.z_list = z_values
         self.z_n = z_values.size
+        try:
+            self.xyStack = makeBilinearInterpStack(xyInterpolators)
+        except ValueError:
+            self.xyStack = None
         
     def _evaluate(self,x,y,z):
         '''
         Returns the level of the interpolated function at each value in x,y,z.
         Only called internally by HARKinterpolator3D.__call__ (etc).
         '''
+        if self.xyStack is not None and not _isscalar(x):
+            return _interpOnStack(self.xyStack,self.xyInterpolators,[x,y],[self.z_list],[z],0)
         if _isscalar(x):
             z_pos = max(min(np.searchsorted(self.z_list,z),self.z_n-1),1)
             alpha = (z - self.z_list[z_pos-1])/(self.z_list[z_pos] - self.z_list[z_pos-1])
@@ -2766,6 +4863,8 @@ class LinearInterpOnInterp2D(HARKinterpolator3D):
         Returns the derivative with respect to x of the interpolated function
         at each value in x,y,z. Only called internally by HARKinterpolator3D.derivativeX.
         '''
+        if self.xyStack is not None and not _isscalar(x):
+            return _interpOnStack(self.xyStack,self.xyInterpolators,[x,y],[self.z_list],[z],1)
         if _isscalar(x):
             z_pos = max(min(np.searchsorted(self.z_list,z),self.z_n-1),1)
             alpha = (z - self.z_list[z_pos-1])/(self.z_list[z_pos] - self.z_list[z_pos-1])
@@ -2789,6 +4888,8 @@ class LinearInterpOnInterp2D(HARKinterpolator3D):
         Returns the derivative with respect to y of the interpolated function
         at each value in x,y,z. Only called internally by HARKinterpolator3D.derivativeY.
         '''
+        if self.xyStack is not None and not _isscalar(x):
+            return _interpOnStack(self.xyStack,self.xyInterpolators,[x,y],[self.z_list],[z],2)
         if _isscalar(x):
             z_pos = max(min(np.searchsorted(self.z_list,z),self.z_n-1),1)
             alpha = (z - self.z_list[z_pos-1])/(self.z_list[z_pos] - self.z_list[z_pos-1])
@@ -2812,9 +4913,11 @@ class LinearInterpOnInterp2D(HARKinterpolator3D):
         Returns the derivative with respect to z of the interpolated function
         at each value in x,y,z. Only called internally by HARKinterpolator3D.derivativeZ.
         '''
+        if self.xyStack is not None and not _isscalar(x):
+            return _interpOnStack(self.xyStack,self.xyInterpolators,[x,y],[self.z_list],[z],3)
         if _isscalar(x):
             z_pos = max(min(np.searchsorted(self.z_list,z),self.z_n-1),1)
-            dfdz = (self.xyInterpolators[z_pos].derivativeX(x,y) - self.xyInterpolators[z_pos-1].derivativeX(x,y))/(self.z_list[z_pos] - self.z_list[z_pos-1])
+            dfdz = (self.xyInterpolators[z_pos](x,y) - self.xyInterpolators[z_pos-1](x,y))/(self.z_list[z_pos] - self.z_list[z_pos-1])
         else:
             m = len(x)
             z_pos = np.searchsorted(self.z_list,z)
@@ -2827,6 +4930,16 @@ class LinearInterpOnInterp2D(HARKinterpolator3D):
                     if np.any(c):
                         dfdz[c] = (self.xyInterpolators[i](x[c],y[c]) - self.xyInterpolators[i-1](x[c],y[c]))/(self.z_list[i] - self.z_list[i-1])
         return dfdz
+        
+    def _evalAndGrad(self,x,y,z):
+        '''
+        Returns the level and all three partial derivatives of the interpolated function
+        at each value in x,y,z, evaluating the 2D interpolators at each point only once.
+        Only called internally by HARKinterpolator3D.eval_with_gradient.
+        '''
+        if self.xyStack is not None:
+            return _interpOnStack(self.xyStack,self.xyInterpolators,[x,y],[self.z_list],[z])
+        return _interpOnCells(self.xyInterpolators,[x,y],[self.z_list],[z])
 
 class BilinearInterpOnInterp2D(HARKinterpolator4D):
     '''
@@ -2864,12 +4977,18 @@ class BilinearInterpOnInterp2D(HARKinterpolator4D):
         self.y_n = y_values.size
         self.z_list = z_values
         self.z_n = z_values.size
+        try:
+            self.wxStack = makeBilinearInterpStack([func for funcs in wxInterpolators for func in funcs])
+        except ValueError:
+            self.wxStack = None
         
     def _evaluate(self,w,x,y,z):
         '''
         Returns the level of the interpolated function at each value in x,y,z.
         Only called internally by HARKinterpolator4D.__call__ (etc).
         '''
+        if self.wxStack is not None and not _isscalar(x):
+            return _interpOnStack(self.wxStack,self.wxInterpolators,[w,x],[self.y_list,self.z_list],[y,z],0)
         if _isscalar(x):
             y_pos = max(min(np.searchsorted(self.y_list,y),self.y_n-1),1)
             z_pos = max(min(np.searchsorted(self.z_list,z),self.z_n-1),1)
@@ -2906,6 +5025,8 @@ class BilinearInterpOnInterp2D(HARKinterpolator4D):
         Returns the derivative with respect to w of the interpolated function
         at each value in w,x,y,z. Only called internally by HARKinterpolator4D.derivativeW.
         '''
+        if self.wxStack is not None and not _isscalar(x):
+            return _interpOnStack(self.wxStack,self.wxInterpolators,[w,x],[self.y_list,self.z_list],[y,z],1)
         # This may look strange, as we call the derivativeX() method to get the
         # derivative with respect to w, but that's just a quirk of 4D interpolations
         # beginning with w rather than x.  The derivative wrt the first dimension
@@ -2946,6 +5067,8 @@ class BilinearInterpOnInterp2D(HARKinterpolator4D):
         Returns the derivative with respect to x of the interpolated function
         at each value in w,x,y,z. Only called internally by HARKinterpolator4D.derivativeX.
         '''
+        if self.wxStack is not None and not _isscalar(x):
+            return _interpOnStack(self.wxStack,self.wxInterpolators,[w,x],[self.y_list,self.z_list],[y,z],2)
         # This may look strange, as we call the derivativeY() method to get the
         # derivative with respect to x, but that's just a quirk of 4D interpolations
         # beginning with w rather than x.  The derivative wrt the second dimension
@@ -2986,6 +5109,8 @@ class BilinearInterpOnInterp2D(HARKinterpolator4D):
         Returns the derivative with respect to y of the interpolated function
         at each value in w,x,y,z. Only called internally by HARKinterpolator4D.derivativeY.
         '''
+        if self.wxStack is not None and not _isscalar(x):
+            return _interpOnStack(self.wxStack,self.wxInterpolators,[w,x],[self.y_list,self.z_list],[y,z],3)
         if _isscalar(x):
             y_pos = max(min(np.searchsorted(self.y_list,y),self.y_n-1),1)
             z_pos = max(min(np.searchsorted(self.z_list,z),self.z_n-1),1)
@@ -3015,6 +5140,8 @@ class BilinearInterpOnInterp2D(HARKinterpolator4D):
         Returns the derivative with respect to z of the interpolated function
         at each value in w,x,y,z. Only called internally by HARKinterpolator4D.derivativeZ.
         '''
+        if self.wxStack is not None and not _isscalar(x):
+            return _interpOnStack(self.wxStack,self.wxInterpolators,[w,x],[self.y_list,self.z_list],[y,z],4)
         if _isscalar(x):
             y_pos = max(min(np.searchsorted(self.y_list,y),self.y_n-1),1)
             z_pos = max(min(np.searchsorted(self.z_list,z),self.z_n-1),1)
@@ -3039,16 +5166,29 @@ class BilinearInterpOnInterp2D(HARKinterpolator4D):
                                 -  ((1-alpha)*self.wxInterpolators[i-1][j-1](w[c],x[c]) + alpha*self.wxInterpolators[i][j-1](w[c],x[c])))/(self.z_list[j] - self.z_list[j-1])
         return dfdz
         
+    def _evalAndGrad(self,w,x,y,z):
+        '''
+        Returns the level and all four partial derivatives of the interpolated function
+        at each value in w,x,y,z, evaluating the 2D interpolators at each point only once.
+        Only called internally by HARKinterpolator4D.eval_with_gradient.
+        '''
+        if self.wxStack is not None:
+            return _interpOnStack(self.wxStack,self.wxInterpolators,[w,x],[self.y_list,self.z_list],[y,z])
+        return _interpOnCells(self.wxInterpolators,[w,x],[self.y_list,self.z_list],[y,z])
+        
         
 class Curvilinear2DInterp(HARKinterpolator2D):
     '''
     A 2D interpolation method for curvilinear or "warped grid" interpolation, as
     in White (2015).  Used for models with two endogenous states that are solved
-    with the endogenous grid method.
+    with the endogenous grid method.  The sector containing each query point is
+    found by walking from sector to sector, starting from a sector found for its
+    cell of a uniform "bucket" grid laid over the domain when the interpolation
+    is made.
     '''
     distance_criteria = ['f_values','x_values','y_values']
     
-    def __init__(self,f_values,x_values,y_values):
+    def __init__(self,f_values,x_values,y_values,bucket_count=None):
         '''
         Constructor for 2D curvilinear interpolation for a function f(x,y)
         
@@ -3061,6 +5201,10 @@ class Curvilinear2DInterp(HARKinterpolator2D):
             A 2D array of x values of the same size as f_values.
         y_values: numpy.array
             A 2D array of y values of the same size as f_values.
+        bucket_count: int or None
+            Number of buckets along each axis of the grid used to start the search
+            for each point's sector; defaults to twice the larger dimension of
+            f_values.  Zero means every search starts at the center of the grid.
             
         Returns
         -------
@@ -3072,7 +5216,55 @@ class Curvilinear2DInterp(HARKinterpolator2D):
         my_shape = f_values.shape
         self.x_n = my_shape[0]
         self.y_n = my_shape[1]
+        self.updateGeometry()
         self.updatePolarity()
+        self.updateSectorIndex(bucket_count)
+        
+    def updateGeometry(self):
+        '''
+        Stores the vertices, bounding boxes, and edges of every sector, along with
+        the coefficients of the transformation to relative coordinates in that
+        sector, in arrays indexed by x_pos*(y_n-1) + y_pos.  These are used by
+        findSector and findCoords.  Needs to be called in __init__.
+        
+        Parameters
+        ----------
+        none
+            
+        Returns
+        -------
+        none
+        '''
+        corner = lambda values,i,j : values[i:(self.x_n-1+i),j:(self.y_n-1+j)].flatten()
+        xA, xB, xC, xD = [corner(self.x_values,i,j) for i, j in [(0,0),(1,0),(0,1),(1,1)]]
+        yA, yB, yC, yD = [corner(self.y_values,i,j) for i, j in [(0,0),(1,0),(0,1),(1,1)]]
+        self.sector_x = np.array([xA,xB,xC,xD])
+        self.sector_y = np.array([yA,yB,yC,yD])
+        
+        # Bounding box limits and boundaries of each sector, in the order: bottom,
+        # right, top, left.  A point is outside a boundary from (x_1,y_1) to
+        # (x_2,y_2), which are *COUNTER CLOCKWISE* around the sector, when
+        # (y_2-y_1)*x - (x_2-x_1)*y > x_1*y_2 - y_1*x_2.
+        self.sector_bounds = np.array([np.minimum(yA,yB),np.maximum(xB,xD),np.maximum(yC,yD),np.minimum(xA,xC)])
+        edges = [(xA,yA,xB,yB),(xB,yB,xD,yD),(xD,yD,xC,yC),(xC,yC,xA,yA)]
+        self.edge_y_coeff = np.array([y_2 - y_1 for x_1, y_1, x_2, y_2 in edges])
+        self.edge_x_coeff = np.array([x_2 - x_1 for x_1, y_1, x_2, y_2 in edges])
+        self.edge_const = np.array([x_1*y_2 - y_1*x_2 for x_1, y_1, x_2, y_2 in edges])
+        
+        # Coefficients of the system of equations for relative coordinates, and of
+        # the alternate method for sectors that are "too regular"
+        with np.errstate(divide='ignore',invalid='ignore'):
+            b = (xB-xA)
+            c = (xC-xA)
+            d = (xA-xB-xC+xD)
+            f = (yB-yA)
+            g = (yC-yA)
+            h = (yA-yB-yC+yD)
+            denom = (d*g-h*c)
+            mu = (h*b-d*f)/denom
+            self.regular = np.isclose(f/b,(yD-yC)/(xD-xC)) # iso-beta lines have equal slope
+            kappa = f/b
+            self.coord_coeffs = np.array([xA,b,c,d,yA,h,denom,mu,kappa,yA - kappa*xA,yC - kappa*xC])
         
     def updatePolarity(self):
         '''
@@ -3109,6 +5301,116 @@ class Curvilinear2DInterp(HARKinterpolator2D):
         # sector must use the "minus" solution instead
         self.polarity = np.reshape(polarity,(self.x_n-1,self.y_n-1))
         
+    def updateSectorIndex(self,bucket_count=None):
+        '''
+        Makes the index of starting sectors for findSector: the bounding box of the
+        gridpoints is divided into bucket_count by bucket_count evenly spaced buckets,
+        and the sector of the center of each bucket is found by walking from the
+        center of the grid.  Needs to be called in __init__.
+        
+        Parameters
+        ----------
+        bucket_count : int or None
+            Number of buckets along each axis; defaults to twice the larger dimension
+            of the grid.  Zero means no index is made.
+            
+        Returns
+        -------
+        none
+        '''
+        if bucket_count is None:
+            bucket_count = 2*max(self.x_n,self.y_n)
+        self.bucket_count = bucket_count
+        self.sector_index = None
+        if bucket_count == 0:
+            return
+        self.x_bot = np.min(self.x_values)
+        self.y_bot = np.min(self.y_values)
+        self.x_scale = bucket_count/(np.max(self.x_values) - self.x_bot)
+        self.y_scale = bucket_count/(np.max(self.y_values) - self.y_bot)
+        bucket_mids = (np.arange(bucket_count) + 0.5)
+        x_mid, y_mid = np.meshgrid(self.x_bot + bucket_mids/self.x_scale,self.y_bot + bucket_mids/self.y_scale,indexing='ij')
+        x_pos, y_pos = self.findSector(x_mid.flatten(),y_mid.flatten())
+        self.sector_index = x_pos*(self.y_n-1) + y_pos
+        
+    def checkSector(self,x,y,sector):
+        '''
+        Checks whether each (x,y) point is inside its sector, giving the direction
+        to move for each boundary of the sector that it is outside of.  When the
+        point is outside the bounding box of the sector, only the bounding box is
+        checked.  Only called as a subroutine of findSector().
+        
+        Parameters
+        ----------
+        x : np.array
+            Values whose sector should be checked.
+        y : np.array
+            Values whose sector should be checked.  Should be same size as x.
+        sector : np.array
+            Sector numbers x_pos*(y_n-1) + y_pos of each point, of the same size.
+            
+        Returns
+        -------
+        moves : np.array
+            Array of shape (4,x.size) with 1 where the point is outside the bottom,
+            right, top, or left boundary of its sector, respectively, and 0 otherwise.
+        '''
+        bounds = self.sector_bounds[:,sector]
+        moves = np.array([y < bounds[0], x > bounds[1], y > bounds[2], x < bounds[3]],dtype=int)
+        c = np.logical_not(np.any(moves,axis=0))
+        if np.any(c):
+            edge_sectors = sector[c]
+            moves[:,c] = (self.edge_y_coeff[:,edge_sectors]*x[c] - self.edge_x_coeff[:,edge_sectors]*y[c]
+                          > self.edge_const[:,edge_sectors]) + 0
+        return moves
+        
+    def walkSectors(self,x,y,x_pos,y_pos):
+        '''
+        Walks from sector to sector, starting from the sectors given, until each
+        (x,y) point is inside its sector or against the edge of the grid.  Only
+        called as a subroutine of findSector().
+        
+        Parameters
+        ----------
+        x : np.array
+            Values whose sector should be found.
+        y : np.array
+            Values whose sector should be found.  Should be same size as x.
+        x_pos : np.array
+            Starting sector x-coordinates for each point, updated in place.
+        y_pos : np.array
+            Starting sector y-coordinates for each point, updated in place.
+            
+        Returns
+        -------
+        outside : np.array
+            Boolean array indicating points that are still outside their sectors,
+            because they are outside the grid or the walk did not settle.
+        '''
+        if _useJit():
+            outside = np.empty(x.size,dtype=bool)
+            walkSectorsKernel(x,y,x_pos,y_pos,self.sector_bounds,self.edge_y_coeff,self.edge_x_coeff,
+                              self.edge_const,self.x_n,self.y_n,outside)
+            return outside
+        these = np.arange(x.size)
+        outside = np.zeros(x.size,dtype=bool)
+        max_loops = self.x_n + self.y_n
+        loops = 0
+        while these.size > 0 and loops < max_loops:
+            moves = self.checkSector(x[these],y[these],x_pos[these]*(self.y_n-1) + y_pos[these])
+            x_pos_next = np.minimum(np.maximum(x_pos[these] - moves[3] + moves[1],0),self.x_n-2)
+            y_pos_next = np.minimum(np.maximum(y_pos[these] - moves[0] + moves[2],0),self.y_n-2)
+            
+            # Points whose sectors have not changed are done
+            no_move = np.logical_and(x_pos[these] == x_pos_next, y_pos[these] == y_pos_next)
+            outside[these[no_move]] = np.any(moves[:,no_move],axis=0)
+            x_pos[these] = x_pos_next
+            y_pos[these] = y_pos_next
+            these = these[np.logical_not(no_move)]
+            loops += 1
+        outside[these] = True
+        return outside
+        
     def findSector(self,x,y):
         '''
         Finds the quadrilateral "sector" for each (x,y) point in the input.
@@ -3128,69 +5430,34 @@ class Curvilinear2DInterp(HARKinterpolator2D):
         y_pos : np.array
             Sector y-coordinates for each point of the input, of the same size.
         '''
-        # Initialize the sector guess
         m = x.size
-        x_pos_guess = (np.ones(m)*self.x_n/2).astype(int)
-        y_pos_guess = (np.ones(m)*self.y_n/2).astype(int)
-        
-        # Define a function that checks whether a set of points violates a linear
-        # boundary defined by (x_bound_1,y_bound_1) and (x_bound_2,y_bound_2),
-        # where the latter is *COUNTER CLOCKWISE* from the former.  Returns
-        # 1 if the point is outside the boundary and 0 otherwise.
-        violationCheck = lambda x_check,y_check,x_bound_1,y_bound_1,x_bound_2,y_bound_2 : (
-            (y_bound_2 - y_bound_1)*x_check - (x_bound_2 - x_bound_1)*y_check > x_bound_1*y_bound_2 - y_bound_1*x_bound_2 ) + 0
-        
-        # Identify the correct sector for each point to be evaluated
-        these = np.ones(m,dtype=bool)
-        max_loops = self.x_n + self.y_n
-        loops = 0
-        while np.any(these) and loops < max_loops:
-            # Get coordinates for the four vertices: (xA,yA),...,(xD,yD)
-            x_temp = x[these]
-            y_temp = y[these]
-            xA = self.x_values[x_pos_guess[these],y_pos_guess[these]]
-            xB = self.x_values[x_pos_guess[these]+1,y_pos_guess[these]]
-            xC = self.x_values[x_pos_guess[these],y_pos_guess[these]+1]
-            xD = self.x_values[x_pos_guess[these]+1,y_pos_guess[these]+1]
-            yA = self.y_values[x_pos_guess[these],y_pos_guess[these]]
-            yB = self.y_values[x_pos_guess[these]+1,y_pos_guess[these]]
-            yC = self.y_values[x_pos_guess[these],y_pos_guess[these]+1]
-            yD = self.y_values[x_pos_guess[these]+1,y_pos_guess[these]+1]
-            
-            # Check the "bounding box" for the sector: is this guess plausible?
-            move_down = (y_temp < np.minimum(yA,yB)) + 0
-            move_right = (x_temp > np.maximum(xB,xD)) + 0
-            move_up = (y_temp > np.maximum(yC,yD)) + 0
-            move_left = (x_temp < np.minimum(xA,xC)) + 0
-            
-            # Check which boundaries are violated (and thus where to look next)
-            c = (move_down + move_right + move_up + move_left) == 0
-            move_down[c] = violationCheck(x_temp[c],y_temp[c],xA[c],yA[c],xB[c],yB[c])
-            move_right[c] = violationCheck(x_temp[c],y_temp[c],xB[c],yB[c],xD[c],yD[c])
-            move_up[c] = violationCheck(x_temp[c],y_temp[c],xD[c],yD[c],xC[c],yC[c])
-            move_left[c] = violationCheck(x_temp[c],y_temp[c],xC[c],yC[c],xA[c],yA[c])
-            
-            # Update the sector guess based on the violations
-            x_pos_next = x_pos_guess[these] - move_left + move_right
-            x_pos_next[x_pos_next < 0] = 0
-            x_pos_next[x_pos_next > (self.x_n-2)] = self.x_n-2
-            y_pos_next = y_pos_guess[these] - move_down + move_up
-            y_pos_next[y_pos_next < 0] = 0
-            y_pos_next[y_pos_next > (self.y_n-2)] = self.y_n-2
-            
-            # Check which sectors have not changed, and mark them as complete
-            no_move = np.array(np.logical_and(x_pos_guess[these] == x_pos_next, y_pos_guess[these] == y_pos_next))
-            x_pos_guess[these] = x_pos_next
-            y_pos_guess[these] = y_pos_next
-            temp = these.nonzero()
-            these[temp[0][no_move]] = False
-            
-            # Move to the next iteration of the search
-            loops += 1
-            
-        # Return the output
-        x_pos = x_pos_guess
-        y_pos = y_pos_guess
+        x_center = min(self.x_n//2,self.x_n-2)
+        y_center = min(self.y_n//2,self.y_n-2)
+        if self.sector_index is None:
+            x_pos = np.zeros(m,dtype=int) + x_center
+            y_pos = np.zeros(m,dtype=int) + y_center
+            self.walkSectors(x,y,x_pos,y_pos)
+            return x_pos, y_pos
+        
+        # Start from the sector of each point's bucket
+        with np.errstate(invalid='ignore'):
+            x_bucket = np.clip(np.nan_to_num((x - self.x_bot)*self.x_scale),0,self.bucket_count-1).astype(int)
+            y_bucket = np.clip(np.nan_to_num((y - self.y_bot)*self.y_scale),0,self.bucket_count-1).astype(int)
+        sector = self.sector_index[x_bucket*self.bucket_count + y_bucket]
+        x_pos = sector//(self.y_n-1)
+        y_pos = sector - x_pos*(self.y_n-1)
+        outside = self.walkSectors(x,y,x_pos,y_pos)
+        
+        # Points outside the grid are placed in the sector where the walk from the
+        # center of the grid stops, so that extrapolation does not depend on the index
+        if np.any(outside):
+            x_temp = x[outside]
+            y_temp = y[outside]
+            x_pos_temp = np.zeros(x_temp.size,dtype=int) + x_center
+            y_pos_temp = np.zeros(x_temp.size,dtype=int) + y_center
+            self.walkSectors(x_temp,y_temp,x_pos_temp,y_pos_temp)
+            x_pos[outside] = x_pos_temp
+            y_pos[outside] = y_pos_temp
         return x_pos, y_pos
         
     def findCoords(self,x,y,x_pos,y_pos):
@@ -3218,25 +5485,9 @@ class Curvilinear2DInterp(HARKinterpolator2D):
             Relative "vertical" position of the input in their respective sectors.
         '''
         # Calculate relative coordinates in the sector for each point
-        xA = self.x_values[x_pos,y_pos]
-        xB = self.x_values[x_pos+1,y_pos]
-        xC = self.x_values[x_pos,y_pos+1]
-        xD = self.x_values[x_pos+1,y_pos+1]
-        yA = self.y_values[x_pos,y_pos]
-        yB = self.y_values[x_pos+1,y_pos]
-        yC = self.y_values[x_pos,y_pos+1]
-        yD = self.y_values[x_pos+1,y_pos+1]
+        sector = x_pos*(self.y_n-1) + y_pos
+        a, b, c, d, e, h, denom, mu = self.coord_coeffs[:8,sector]
         polarity = 2.0*self.polarity[x_pos,y_pos] - 1.0
-        a = xA
-        b = (xB-xA)
-        c = (xC-xA)
-        d = (xA-xB-xC+xD)
-        e = yA
-        f = (yB-yA)
-        g = (yC-yA)
-        h = (yA-yB-yC+yD)
-        denom = (d*g-h*c)
-        mu = (h*b-d*f)/denom
         tau = (h*(a-x) - d*(e-y))/denom
         zeta = a - x + c*tau
         eta = b + c*mu + d*tau
@@ -3247,20 +5498,17 @@ class Curvilinear2DInterp(HARKinterpolator2D):
         # Alternate method if there are sectors that are "too regular"
         z = np.logical_or(np.isnan(alpha),np.isnan(beta))   # These points weren't able to identify coordinates
         if np.any(z): 
-            these = np.isclose(f/b,(yD-yC)/(xD-xC)) # iso-beta lines have equal slope
+            these = self.regular[sector]
             if np.any(these):
-                kappa     = f[these]/b[these]
-                int_bot   = yA[these] - kappa*xA[these]
-                int_top   = yC[these] - kappa*xC[these]
+                kappa, int_bot, int_top = self.coord_coeffs[8:,sector[these]]
+                xA, xB, xC, xD = self.sector_x[:,sector[these]]
                 int_these = y[these] - kappa*x[these]
                 beta_temp = (int_these-int_bot)/(int_top-int_bot)
-                x_left    = beta_temp*xC[these] + (1.0-beta_temp)*xA[these]
-                x_right   = beta_temp*xD[these] + (1.0-beta_temp)*xB[these]
+                x_left    = beta_temp*xC + (1.0-beta_temp)*xA
+                x_right   = beta_temp*xD + (1.0-beta_temp)*xB
                 alpha_temp= (x[these]-x_left)/(x_right-x_left)
                 beta[these]  = beta_temp
                 alpha[these] = alpha_temp
-                
-            #print(np.sum(np.isclose(g/c,(yD-yB)/(xD-xB))))
         
         return alpha, beta
         
@@ -3366,6 +5614,44 @@ class Curvilinear2DInterp(HARKinterpolator2D):
         dfdy = y_alpha*dfda + y_beta*dfdb
         return dfdy
         
+    def _evalAndGrad(self,x,y):
+        '''
+        Returns the level and both partial derivatives of the interpolated function
+        at each value in x,y, finding the sector of each point only once.  Only
+        called internally by HARKinterpolator2D.eval_with_gradient.
+        '''
+        x_pos, y_pos = self.findSector(x,y)
+        alpha, beta = self.findCoords(x,y,x_pos,y_pos)
+        
+        # Get four corners data for each point
+        xA = self.x_values[x_pos,y_pos]
+        xB = self.x_values[x_pos+1,y_pos]
+        xC = self.x_values[x_pos,y_pos+1]
+        xD = self.x_values[x_pos+1,y_pos+1]
+        yA = self.y_values[x_pos,y_pos]
+        yB = self.y_values[x_pos+1,y_pos]
+        yC = self.y_values[x_pos,y_pos+1]
+        yD = self.y_values[x_pos+1,y_pos+1]
+        fA = self.f_values[x_pos,y_pos]
+        fB = self.f_values[x_pos+1,y_pos]
+        fC = self.f_values[x_pos,y_pos+1]
+        fD = self.f_values[x_pos+1,y_pos+1]
+        
+        # Calculate the level and the derivatives of f w.r.t. alpha and beta
+        f = (1-alpha)*(1-beta)*fA + (1-alpha)*beta*fC + alpha*(1-beta)*fB + alpha*beta*fD
+        dfda = (1-beta)*(fB-fA) + beta*(fD-fC)
+        dfdb = (1-alpha)*(fC-fA) + alpha*(fD-fB)
+        
+        # Invert the alpha,beta --> x,y delta translation matrix to get the gradient
+        alpha_x = (1-beta)*(xB-xA) + beta*(xD-xC)
+        alpha_y = (1-beta)*(yB-yA) + beta*(yD-yC)
+        beta_x  = (1-alpha)*(xC-xA) + alpha*(xD-xB)
+        beta_y  = (1-alpha)*(yC-yA) + alpha*(yD-yB)
+        det = alpha_x*beta_y - beta_x*alpha_y
+        dfdx = (beta_y*dfda - alpha_y*dfdb)/det
+        dfdy = (alpha_x*dfdb - beta_x*dfda)/det
+        return [f,dfdx,dfdy]
+        
         
 if __name__ == '__main__':       
     print("Sorry, HARKinterpolation doesn't actually do much on its own.")
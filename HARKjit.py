@@ -0,0 +1,328 @@
+'''
+Compiled versions of the evaluation kernels in HARKinterpolation, each written as
+a single loop over the query points instead of a sequence of array operations with
+their temporary arrays and masks.  They are compiled with Numba if it is installed
+(it can be installed by typing "conda install numba" at a command prompt); which
+kernels HARKinterpolation uses is set by its interp_backend attribute.  Each kernel
+follows the corresponding NumPy code in HARKinterpolation step for step, so that
+both give the same results.
+'''
+import numpy as np
+
+try:
+    from numba import njit
+    numba_available = True
+except ImportError:
+    # We want to be able to import this module even if numba is not installed; the
+    # kernels are then plain Python functions, which HARKinterpolation never uses.
+    numba_available = False
+    def njit(*args,**kwds):
+        return lambda function : function
+
+
+@njit(cache=True)
+def searchSorted(x_list,x):
+    '''
+    Finds the index at which x would be inserted into the sorted array x_list,
+    as np.searchsorted(x_list,x) does (with NaN sorted above everything).
+
+    Parameters
+    ----------
+    x_list : np.array
+        A sorted 1D array.
+    x : float
+        The value to be located.
+
+    Returns
+    -------
+    pos : int
+        The number of elements of x_list that are less than x.
+    '''
+    if np.isnan(x):
+        return x_list.size
+    lo = 0
+    hi = x_list.size
+    while lo < hi:
+        mid = (lo + hi)//2
+        if x_list[mid] < x:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+@njit(cache=True)
+def walkSorted(x_list,x,pos):
+    '''
+    Finds the index at which x would be inserted into the sorted array x_list by
+    walking up from pos, the index for a query point that is no greater than x.
+    For a sorted sequence of query points this merges them with x_list.
+
+    Parameters
+    ----------
+    x_list : np.array
+        A sorted 1D array.
+    x : float
+        The value to be located.
+    pos : int
+        The number of elements of x_list that are less than the previous query.
+
+    Returns
+    -------
+    pos : int
+        The number of elements of x_list that are less than x.
+    '''
+    while pos < x_list.size and x_list[pos] < x:
+        pos += 1
+    return pos
+
+
+@njit(cache=True)
+def linearInterpKernel(x_list,y_list,slope_list,lower_extrap,decay_params,x,y,dydx,sorted_x=False):
+    '''
+    Evaluates a LinearInterp and/or its derivative at each value in x, as in
+    LinearInterp._evalOrDer.
+
+    Parameters
+    ----------
+    x_list, y_list, slope_list : np.array
+        The gridpoints, levels, and segment slopes of the interpolation.
+    lower_extrap : boolean
+        Indicator for whether lower extrapolation is allowed.
+    decay_params : np.array
+        The intercept and slope of the limiting linear function and the
+        decay_extrap_A and decay_extrap_B of the interpolation, or an empty
+        array if it has no decay extrapolation.
+    x : np.array
+        Query points.
+    y : np.array
+        Array of the same size as x to write the level into, or an empty array
+        if the level is not wanted.
+    dydx : np.array
+        Array of the same size as x to write the derivative into, or an empty
+        array if the derivative is not wanted.
+    sorted_x : boolean
+        Indicator that x is sorted in runs, so that each point is located by
+        walking up from the previous one while it is no smaller than it.
+
+    Returns
+    -------
+    none
+    '''
+    n = x_list.size
+    x_bot = x_list[0]
+    x_top = x_list[n-1]
+    do_level = y.size > 0
+    do_der = dydx.size > 0
+    decay_extrap = decay_params.size > 0
+    pos = 0
+    for k in range(x.size):
+        x_k = x[k]
+        if sorted_x and k > 0 and x_k >= x[k-1]:
+            pos = walkSorted(x_list,x_k,pos)
+        else:
+            pos = searchSorted(x_list,x_k)
+        i = min(max(pos,1),n-1) - 1
+        slope = slope_list[i]
+        level = (x_k - x_list[i])*slope + y_list[i]
+        der = slope
+        if x_k < x_bot and not lower_extrap:
+            level = np.nan
+            der = np.nan
+        elif decay_extrap and x_k > x_top:
+            decay = np.exp(-decay_params[3]*(x_k - x_top))
+            level = decay_params[0] + decay_params[1]*x_k - decay_params[2]*decay
+            der = decay_params[1] + decay_params[3]*decay_params[2]*decay
+        if do_level:
+            y[k] = level
+        if do_der:
+            dydx[k] = der
+
+
+@njit(cache=True)
+def cubicInterpKernel(x_list,coeffs,x,y,dydx,sorted_x=False):
+    '''
+    Evaluates a CubicInterp and/or its derivative at each value in x, as in
+    CubicInterp._evalOrDer.
+
+    Parameters
+    ----------
+    x_list : np.array
+        The gridpoints of the interpolation.
+    coeffs : np.array
+        The coefficients of the interpolation, of shape (x_list.size+1,4).
+    x : np.array
+        Query points.
+    y : np.array
+        Array of the same size as x to write the level into, or an empty array
+        if the level is not wanted.
+    dydx : np.array
+        Array of the same size as x to write the derivative into, or an empty
+        array if the derivative is not wanted.
+    sorted_x : boolean
+        Indicator that x is sorted in runs, as in linearInterpKernel.
+
+    Returns
+    -------
+    none
+    '''
+    n = x_list.size
+    do_level = y.size > 0
+    do_der = dydx.size > 0
+    pos = 0
+    for k in range(x.size):
+        x_k = x[k]
+        if sorted_x and k > 0 and x_k >= x[k-1]:
+            pos = walkSorted(x_list,x_k,pos)
+        else:
+            pos = searchSorted(x_list,x_k)
+        if pos == 0:
+            level = coeffs[0,0] + coeffs[0,1]*(x_k - x_list[0])
+            der = coeffs[0,1]
+        elif pos == n:
+            decay = np.exp((x_k - x_list[n-1])*coeffs[n,3])
+            level = coeffs[n,0] + x_k*coeffs[n,1] - coeffs[n,2]*decay
+            der = coeffs[n,1] - coeffs[n,2]*coeffs[n,3]*decay
+        else:
+            x_lo = x_list[pos-1]
+            span = x_list[pos] - x_lo
+            alpha = (x_k - x_lo)/span
+            level = coeffs[pos,0] + alpha*(coeffs[pos,1] + alpha*(coeffs[pos,2] + alpha*coeffs[pos,3]))
+            der = (coeffs[pos,1] + alpha*(2*coeffs[pos,2] + alpha*3*coeffs[pos,3]))/span
+        if do_level:
+            y[k] = level
+        if do_der:
+            dydx[k] = der
+
+
+@njit(cache=True)
+def bilinearInterpKernel(f_values,x_list,y_list,x,y,f,dfdx,dfdy):
+    '''
+    Evaluates a BilinearInterp and/or its partial derivatives at each value in
+    x,y, as in BilinearInterp._evaluate, _derX, and _derY.
+
+    Parameters
+    ----------
+    f_values, x_list, y_list : np.array
+        The function values and gridpoints of the interpolation.
+    x, y : np.array
+        Query points, of the same size.
+    f, dfdx, dfdy : np.array
+        Arrays of the same size as x to write the level and the derivatives with
+        respect to x and y into, or empty arrays for those that are not wanted.
+
+    Returns
+    -------
+    none
+    '''
+    x_n = x_list.size
+    y_n = y_list.size
+    do_level = f.size > 0
+    do_derX = dfdx.size > 0
+    do_derY = dfdy.size > 0
+    for k in range(x.size):
+        i = min(max(searchSorted(x_list,x[k]),1),x_n-1)
+        j = min(max(searchSorted(y_list,y[k]),1),y_n-1)
+        alpha = (x[k] - x_list[i-1])/(x_list[i] - x_list[i-1])
+        beta = (y[k] - y_list[j-1])/(y_list[j] - y_list[j-1])
+        if do_level:
+            f[k] = ((1-alpha)*(1-beta)*f_values[i-1,j-1] + (1-alpha)*beta*f_values[i-1,j]
+                    + alpha*(1-beta)*f_values[i,j-1] + alpha*beta*f_values[i,j])
+        if do_derX:
+            dfdx[k] = (((1-beta)*f_values[i,j-1] + beta*f_values[i,j]) -
+                       ((1-beta)*f_values[i-1,j-1] + beta*f_values[i-1,j]))/(x_list[i] - x_list[i-1])
+        if do_derY:
+            dfdy[k] = (((1-alpha)*f_values[i-1,j] + alpha*f_values[i,j]) -
+                       ((1-alpha)*f_values[i-1,j-1] + alpha*f_values[i,j-1]))/(y_list[j] - y_list[j-1])
+
+
+@njit(cache=True)
+def bilinearEvalAndGradKernel(f_values,x_list,y_list,x,y,f,dfdx,dfdy):
+    '''
+    Evaluates a BilinearInterp and both of its partial derivatives at each value
+    in x,y, as in BilinearInterp._evalAndGrad (that is, _multilinearEvalAndGrad):
+    the values at the corners of each cell are combined along y, then along x.
+
+    Parameters
+    ----------
+    f_values, x_list, y_list : np.array
+        The function values and gridpoints of the interpolation.
+    x, y : np.array
+        Query points, of the same size.
+    f, dfdx, dfdy : np.array
+        Arrays of the same size as x to write the level and the derivatives with
+        respect to x and y into.
+
+    Returns
+    -------
+    none
+    '''
+    x_n = x_list.size
+    y_n = y_list.size
+    for k in range(x.size):
+        i = min(max(searchSorted(x_list,x[k]),1),x_n-1)
+        j = min(max(searchSorted(y_list,y[k]),1),y_n-1)
+        x_span = x_list[i] - x_list[i-1]
+        y_span = y_list[j] - y_list[j-1]
+        alpha = (x[k] - x_list[i-1])/x_span
+        beta = (y[k] - y_list[j-1])/y_span
+        dfdy_lo = (f_values[i-1,j] - f_values[i-1,j-1])/y_span
+        dfdy_hi = (f_values[i,j] - f_values[i,j-1])/y_span
+        f_lo = (1.-beta)*f_values[i-1,j-1] + beta*f_values[i-1,j]
+        f_hi = (1.-beta)*f_values[i,j-1] + beta*f_values[i,j]
+        dfdx[k] = (f_hi - f_lo)/x_span
+        f[k] = (1.-alpha)*f_lo + alpha*f_hi
+        dfdy[k] = (1.-alpha)*dfdy_lo + alpha*dfdy_hi
+
+
+@njit(cache=True)
+def walkSectorsKernel(x,y,x_pos,y_pos,sector_bounds,edge_y_coeff,edge_x_coeff,edge_const,x_n,y_n,outside):
+    '''
+    Walks each (x,y) point from sector to sector of a Curvilinear2DInterp until it
+    is inside its sector or against the edge of the grid, as in walkSectors.
+
+    Parameters
+    ----------
+    x, y : np.array
+        Values whose sector should be found, of the same size.
+    x_pos, y_pos : np.array
+        Starting sector coordinates for each point, updated in place.
+    sector_bounds, edge_y_coeff, edge_x_coeff, edge_const : np.array
+        The bounding boxes and edges of the sectors of the interpolation.
+    x_n, y_n : int
+        The dimensions of the grid of the interpolation.
+    outside : np.array
+        Boolean array of the same size as x, filled with True for the points that
+        are still outside their sectors at the end of the walk.
+
+    Returns
+    -------
+    none
+    '''
+    max_loops = x_n + y_n
+    for k in range(x.size):
+        x_k = x[k]
+        y_k = y[k]
+        i = x_pos[k]
+        j = y_pos[k]
+        outside[k] = True
+        for loop in range(max_loops):
+            s = i*(y_n-1) + j
+            down  = 1 if y_k < sector_bounds[0,s] else 0
+            right = 1 if x_k > sector_bounds[1,s] else 0
+            up    = 1 if y_k > sector_bounds[2,s] else 0
+            left  = 1 if x_k < sector_bounds[3,s] else 0
+            if down + right + up + left == 0:
+                down  = 1 if edge_y_coeff[0,s]*x_k - edge_x_coeff[0,s]*y_k > edge_const[0,s] else 0
+                right = 1 if edge_y_coeff[1,s]*x_k - edge_x_coeff[1,s]*y_k > edge_const[1,s] else 0
+                up    = 1 if edge_y_coeff[2,s]*x_k - edge_x_coeff[2,s]*y_k > edge_const[2,s] else 0
+                left  = 1 if edge_y_coeff[3,s]*x_k - edge_x_coeff[3,s]*y_k > edge_const[3,s] else 0
+            i_next = min(max(i - left + right,0),x_n-2)
+            j_next = min(max(j - down + up,0),y_n-2)
+            if i_next == i and j_next == j:
+                outside[k] = down + right + up + left > 0
+                break
+            i = i_next
+            j = j_next
+        x_pos[k] = i
+        y_pos[k] = j
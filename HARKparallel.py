@@ -4,6 +4,8 @@ and joblib.  Packages can be installed by typing "conda install dill" (etc) at
 a command prompt.
 '''
 import multiprocessing
+import weakref
+import cPickle
 import numpy as np
 from time import clock
 import csv
@@ -27,6 +29,12 @@ except:
     delayed  = raiseImportError('joblib')
     pickle   = raiseImportError('dill')
 
+try:
+    # AgentPool can use dill on its own, but does not need it
+    import dill as pool_pickle
+except:
+    pool_pickle = None
+
 
 def multiThreadCommandsFake(agent_list,command_list):
     '''
@@ -104,6 +112,487 @@ def runCommands(agent,command_list):
     return agent
     
     
+#=============================================================
+# ========  A persistent pool of resident AgentTypes  ========
+#=============================================================
+
+class AgentPool(object):
+    '''
+    A persistent pool of worker processes that keep copies of AgentTypes resident
+    between calls, for solving the same agent types over and over (as in each loop
+    of Market.solve).  The first time an AgentType is solved by the pool, a copy of
+    it is sent to one of the workers; afterwards only its "parameter deltas" are
+    sent (attributes used in solving it that have been reassigned since the last
+    call, such as a new AFunc distributed by Market.updateDynamics), and only the
+    list of one period solutions (with the type's solution_cache, if it has one)
+    is sent back.  Attributes are compared by identity
+    (and by value for arrays and lists of names), so parameters changed by mutating
+    other objects in place are not detected; call forget() on the type after doing so.
+    Types that cannot be pickled are solved in this process instead.
+    '''
+    solve_vars = ['solution_terminal','cycles','tolerance','pseudo_terminal','time_flow',
+                  'solveOnePeriod','time_inv','time_vary','accelerate','accelerate_memory','solution_cache']
+    
+    def __init__(self,num_workers=None):
+        '''
+        Make a new AgentPool and start its worker processes.
+        
+        Parameters
+        ----------
+        num_workers : int or None
+            Number of worker processes; defaults to the number of CPU cores.
+            
+        Returns
+        -------
+        None
+        '''
+        if num_workers is None:
+            num_workers = multiprocessing.cpu_count()
+        self.workers = []
+        self.conns = []
+        for i in range(num_workers):
+            conn, worker_conn = multiprocessing.Pipe()
+            worker = multiprocessing.Process(target=agentPoolWorker,args=(worker_conn,))
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+            self.conns.append(conn)
+        self.records = {}     # Keyed by id(agent); see register()
+        self.next_worker = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        
+    def send(self,i,message):
+        '''
+        Pickles a message and sends it to worker i, counting the bytes sent.
+        '''
+        data = dumpsForPool(message)
+        self.bytes_sent += len(data)
+        self.conns[i].send_bytes(data)
+        
+    def receive(self,i,raise_error=True):
+        '''
+        Receives and unpickles a message from worker i, counting the bytes received.
+        An exception sent back by the worker is raised, unless raise_error is False.
+        '''
+        data = self.conns[i].recv_bytes()
+        self.bytes_received += len(data)
+        reply = loadsForPool(data)
+        if raise_error and isinstance(reply,Exception):
+            raise reply
+        return reply
+        
+    def snapshot(self,agent):
+        '''
+        Makes a dictionary of the attributes of agent that are used in solving it,
+        holding references to their current values (and copies of arrays and lists).
+        '''
+        names = self.solve_vars + [name for name in agent.time_inv + agent.time_vary if name != 'solution']
+        snap = {}
+        for name in names:
+            if hasattr(agent,name) and name not in snap:
+                value = getattr(agent,name)
+                if isinstance(value,np.ndarray):
+                    snap[name] = (value,value.copy())
+                elif isinstance(value,list):
+                    snap[name] = (value,list(value))
+                else:
+                    snap[name] = (value,None)
+        return snap
+        
+    def findDeltas(self,agent,record):
+        '''
+        Returns a dictionary of the attributes of agent used in solving it that
+        have changed since they were last sent to its worker, and updates the record.
+        '''
+        snap = self.snapshot(agent)
+        deltas = {}
+        for name, (value, copied) in snap.items():
+            if name not in record['snapshot']:
+                deltas[name] = value
+                continue
+            old_value, old_copied = record['snapshot'][name]
+            if value is not old_value:
+                deltas[name] = value
+            elif isinstance(value,np.ndarray):
+                if value.shape != old_copied.shape or not np.array_equal(value,old_copied):
+                    deltas[name] = value
+            elif isinstance(value,list):
+                if len(value) != len(old_copied) or any(a is not b for a, b in zip(value,old_copied)):
+                    deltas[name] = value
+        record['snapshot'] = snap
+        return deltas
+        
+    def register(self,agent):
+        '''
+        Sends a copy of agent to the next worker, making it resident there.  Returns
+        False if the agent cannot be pickled.
+        '''
+        try:
+            data = dumpsForPool(('register',id(agent),agent))
+        except Exception:
+            return False
+        i = self.next_worker
+        self.next_worker = (self.next_worker + 1) % len(self.workers)
+        self.bytes_sent += len(data)
+        self.conns[i].send_bytes(data)
+        self.receive(i)
+        self.records[id(agent)] = {'ref' : weakref.ref(agent), 'worker' : i, 'snapshot' : self.snapshot(agent)}
+        return True
+        
+    def forget(self,agent):
+        '''
+        Removes the resident copy of agent from its worker, so that the whole type
+        is sent again the next time it is solved.
+        
+        Parameters
+        ----------
+        agent : AgentType
+            The agent type to forget.
+            
+        Returns
+        -------
+        None
+        '''
+        record = self.records.pop(id(agent),None)
+        if record is not None:
+            self.send(record['worker'],('forget',id(agent),None))
+            self.receive(record['worker'])
+        
+    def solveAgents(self,agent_list,verbose=False):
+        '''
+        Solves each AgentType in agent_list in the worker processes, storing each
+        type's solution in its solution attribute (then running its postSolve
+        method) just as AgentType.solve would.  The types in agent_list are updated
+        in place rather than replaced.
+        
+        Parameters
+        ----------
+        agent_list : [AgentType]
+            The agent types to solve.
+        verbose : boolean
+            If True, solution progress is printed to screen (by the workers).
+            
+        Returns
+        -------
+        None
+        '''
+        # Make sure each type is resident in a worker and send any parameter deltas
+        jobs = [[] for i in range(len(self.workers))]
+        local_agents = []
+        for agent in agent_list:
+            record = self.records.get(id(agent))
+            if record is not None and record['ref']() is not agent: # Stale id of a dead type
+                self.forget(agent)
+                record = None
+            if record is None:
+                if not self.register(agent):
+                    local_agents.append(agent)
+                    continue
+                record = self.records[id(agent)]
+            else:
+                deltas = self.findDeltas(agent,record)
+                if len(deltas) > 0:
+                    self.send(record['worker'],('update',id(agent),deltas))
+                    self.receive(record['worker'])
+            jobs[record['worker']].append(agent)
+            
+        # Have each worker solve its resident types, solving any others here meanwhile.
+        # Every worker's reply is read before any error is raised, so that no stale
+        # replies are left in the pipes for the next call to read.
+        busy = [i for i in range(len(self.workers)) if len(jobs[i]) > 0]
+        for i in busy:
+            self.send(i,('solve',[id(agent) for agent in jobs[i]],verbose))
+        replies = []
+        try:
+            for agent in local_agents:
+                agent.solve(verbose)
+        finally:
+            for i in busy:
+                replies.append(self.receive(i,raise_error=False))
+        for reply in replies:
+            if isinstance(reply,Exception):
+                raise reply
+        for i, solutions in zip(busy,replies):
+            for agent, (solution, cache) in zip(jobs[i],solutions):
+                if cache is not None: # The resident copy's cache now matches this one
+                    agent.solution_cache = cache
+                    self.records[id(agent)]['snapshot']['solution_cache'] = (cache,None)
+                agent.solution = solution
+                agent.addToTimeVary('solution')
+                agent.postSolve()
+                    
+    def close(self):
+        '''
+        Stops the worker processes of this pool.
+        
+        Parameters
+        ----------
+        None
+        
+        Returns
+        -------
+        None
+        '''
+        for i in range(len(self.workers)):
+            try:
+                self.send(i,('stop',None,None))
+            except Exception:
+                pass
+        for worker in self.workers:
+            worker.join(1.0)
+        self.workers = []
+        self.conns = []
+        self.records = {}
+        
+        
+def dumpsForPool(obj):
+    '''
+    Pickles an object for sending to or from an AgentPool worker, using dill if
+    it is available and the standard pickler otherwise.
+    '''
+    if pool_pickle is None:
+        return cPickle.dumps(obj,2)
+    return pool_pickle.dumps(obj,2)
+    
+def loadsForPool(data):
+    '''
+    Unpickles an object sent to or from an AgentPool worker.
+    '''
+    if pool_pickle is None:
+        return cPickle.loads(data)
+    return pool_pickle.loads(data)
+        
+def agentPoolWorker(conn):
+    '''
+    The main loop of an AgentPool worker process, which keeps a dictionary of
+    resident AgentTypes and responds to messages from the pool until told to stop.
+    Should basically never be called directly.
+    
+    Parameters
+    ----------
+    conn : multiprocessing.Connection
+        The worker's end of a pipe to the pool.
+        
+    Returns
+    -------
+    None
+    '''
+    from HARKcore import solveAgent
+    agents = {}
+    while True:
+        command, key, payload = loadsForPool(conn.recv_bytes())
+        if command == 'stop':
+            break
+        try:
+            if command == 'register':
+                agents[key] = payload
+                reply = None
+            elif command == 'update':
+                for name, value in payload.items():
+                    setattr(agents[key],name,value)
+                reply = None
+            elif command == 'forget':
+                agents.pop(key,None)
+                reply = None
+            elif command == 'solve':
+                reply = []
+                for this_key in key:
+                    agent = agents[this_key]
+                    time_flow = agent.time_flow
+                    try:
+                        agent.preSolve()
+                        solution = solveAgent(agent,payload)
+                    except Exception:
+                        # Leave the resident copy as it was, with time flowing the same way
+                        if time_flow:
+                            agent.timeFwd()
+                        else:
+                            agent.timeRev()
+                        raise
+                    if agent.time_flow:
+                        solution.reverse()
+                    agent.solution = solution
+                    reply.append((solution,getattr(agent,'solution_cache',None)))
+        except Exception as error:
+            reply = error
+        conn.send_bytes(dumpsForPool(reply))
+        
+        
+#=============================================================
+# ====  Cultivating a Market's agents in parallel processes ====
+#=============================================================
+
+class ParallelCultivator(object):
+    '''
+    Runs the sow-->cultivate-->reap part of Market.makeHistory with the market's
+    AgentTypes spread across worker processes, which advance their types one period
+    at a time in lockstep with the market.  Each type's variables in reap_vars live
+    in shared memory blocks that the workers write after each period's marketAction
+    and that reap hands to the millRule as arrays without copying, unless the market
+    tracks them.  The workers overwrite these arrays each period, so an untracked
+    reaped array is only valid until the next period.  Everything else
+    about each type stays private to its worker until finish() copies the types'
+    final states back.  Workers are forked with the agents already in memory, so
+    this requires a platform where multiprocessing forks (not Windows).
+    '''
+    def __init__(self,market,num_workers=None):
+        '''
+        Make a new ParallelCultivator for a market whose agents have just been reset,
+        allocating the shared memory blocks and starting the workers.
+        
+        Parameters
+        ----------
+        market : Market
+            The market whose agents will be cultivated.
+        num_workers : int or None
+            Number of worker processes; defaults to the smaller of the number of
+            AgentTypes and the number of CPU cores.
+            
+        Returns
+        -------
+        None
+        '''
+        self.market = market
+        agents = market.agents
+        if num_workers is None:
+            num_workers = multiprocessing.cpu_count()
+        num_workers = max(min(num_workers,len(agents)),1)
+        
+        # Allocate a shared block for each reaped variable of each type, starting
+        # from the values the type has now
+        self.blocks = []
+        self.shared = []
+        for agent in agents:
+            blocks = {}
+            views = {}
+            for name in market.reap_vars:
+                value = np.asarray(getattr(agent,name))
+                blocks[name] = multiprocessing.RawArray('b',max(value.nbytes,1))
+                views[name] = np.frombuffer(blocks[name],dtype=np.uint8)[:value.nbytes].view(value.dtype).reshape(value.shape)
+                views[name][...] = value
+            self.blocks.append(blocks)
+            self.shared.append(views)
+            
+        # Start the workers, dealing out the types in turn
+        self.assignments = [range(j,len(agents),num_workers) for j in range(num_workers)]
+        self.workers = []
+        self.conns = []
+        for indices in self.assignments:
+            conn, worker_conn = multiprocessing.Pipe()
+            worker = multiprocessing.Process(target=cultivatorWorker,args=(worker_conn,[agents[j] for j in indices],
+                                             market.reap_vars,[self.shared[j] for j in indices]))
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+            self.conns.append(conn)
+            
+    def sow(self):
+        '''
+        Collects this period's values of the market's sow_vars, to be distributed
+        to the agents by cultivate.
+        '''
+        self.seeds = {name : getattr(self.market,name) for name in self.market.sow_vars}
+        
+    def cultivate(self):
+        '''
+        Has every worker distribute the sown values to its types and run their
+        marketAction methods, waiting until all workers have finished the period.
+        '''
+        for conn in self.conns:
+            conn.send(('step',self.seeds))
+        for conn in self.conns:
+            reply = conn.recv()
+            if isinstance(reply,Exception):
+                raise reply
+            
+    def reap(self):
+        '''
+        Stores lists of each type's shared arrays in the market's reap_vars.  The
+        arrays of variables in the market's track_vars are copied, so that store()
+        keeps each period's values rather than arrays the workers will overwrite.
+        '''
+        for name in self.market.reap_vars:
+            if name in self.market.track_vars:
+                setattr(self.market,name,[np.copy(views[name]) for views in self.shared])
+            else:
+                setattr(self.market,name,[views[name] for views in self.shared])
+            
+    def finish(self):
+        '''
+        Stops the workers, copying the final state of each type back into the
+        market's agents.
+        '''
+        agents = self.market.agents
+        for conn in self.conns:
+            conn.send(('finish',None))
+        for conn, indices in zip(self.conns,self.assignments):
+            states = loadsForPool(conn.recv_bytes())
+            if isinstance(states,Exception):
+                raise states
+            for j, state in zip(indices,states):
+                agents[j].__dict__.update(state)
+        for worker in self.workers:
+            worker.join()
+            
+    def abort(self):
+        '''
+        Stops the workers without copying anything back.
+        '''
+        for worker in self.workers:
+            if worker.is_alive():
+                worker.terminate()
+                
+                
+def cultivatorWorker(conn,agents,reap_vars,shared):
+    '''
+    The main loop of a ParallelCultivator worker process, which advances its agents
+    one period at a time when told to.  Should basically never be called directly.
+    
+    Parameters
+    ----------
+    conn : multiprocessing.Connection
+        The worker's end of a pipe to the cultivator.
+    agents : [AgentType]
+        The agent types this worker is responsible for.
+    reap_vars : [string]
+        Names of the variables to write to shared memory after each period.
+    shared : [dict]
+        For each agent type, a dictionary of arrays in shared memory, by variable name.
+        
+    Returns
+    -------
+    None
+    '''
+    while True:
+        command, seeds = conn.recv()
+        if command == 'step':
+            try:
+                for agent, views in zip(agents,shared):
+                    for name, value in seeds.items():
+                        setattr(agent,name,value)
+                    agent.marketAction()
+                    for name in reap_vars:
+                        value = np.asarray(getattr(agent,name))
+                        if value.shape != views[name].shape:
+                            raise ValueError('The shape of ' + name + ' changed during the history!')
+                        views[name][...] = value
+                reply = None
+            except Exception as error:
+                reply = error
+            conn.send(reply)
+        elif command == 'finish':
+            try:
+                for agent in agents: # Write out rows buffered in held HistoryStores
+                    if getattr(agent,'history',None) is not None:
+                        agent.history.flush()
+                data = dumpsForPool([agent.__dict__ for agent in agents])
+            except Exception as error:
+                data = dumpsForPool(error)
+            conn.send_bytes(data)
+            break
+    
+    
 #=============================================================
 # ========  Define a parallel Nelder-Mead algorithm ==========
 #=============================================================
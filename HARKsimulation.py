@@ -292,7 +292,136 @@ def drawDiscrete(N,P=[1.0],X=[0.0],exact_match=False,seed=0):
         indices = cum_dist.searchsorted(base_draws)
         draws = np.asarray(X)[indices]
     return draws
-    
+
+def drawUniformByIndex(indices, seed=0):
+    '''
+    Generates "counter based" uniform draws on [0,1): each draw is a deterministic
+    function of the seed and its own index only (a SplitMix64 hash of the pair),
+    so the draw for a given index does not depend on how many other draws are
+    made or in what order.  Useful for giving each simulated agent its own stream.
+
+    Parameters
+    ----------
+    indices : np.array
+        Array of non-negative integers (such as agent indices) identifying draws.
+    seed : int
+        Seed for the draws; different seeds give unrelated sets of draws.
+
+    Returns
+    -------
+    draws : np.array
+        Array of uniform draws with the same shape as indices.
+    '''
+    with np.errstate(over='ignore'):
+        z = np.asarray(indices).astype(np.uint64) + np.uint64(seed)*np.uint64(0x9E3779B97F4A7C15)
+        z = z + np.uint64(0x9E3779B97F4A7C15)
+        z = (z ^ (z >> np.uint64(30)))*np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27)))*np.uint64(0x94D049BB133111EB)
+        z = z ^ (z >> np.uint64(31))
+    draws = (z >> np.uint64(11)).astype(float)*(2.0**-53)
+    return draws
+
+def makeAliasTable(P):
+    '''
+    Makes a Walker/Vose alias table for drawing from a discrete distribution with
+    probabilities P in constant time per draw.
+
+    Parameters
+    ----------
+    P : np.array
+        A list of probabilities of outcomes.
+
+    Returns
+    -------
+    AliasPrb : np.array
+        Probability of keeping each column's own outcome.
+    AliasIdx : np.array
+        Index of the outcome used otherwise ("alias") in each column.
+    '''
+    P = np.asarray(P,dtype=float)
+    K = P.size
+    scaled = P*K/np.sum(P)
+    AliasPrb = np.ones(K)
+    AliasIdx = np.arange(K)
+    small = [k for k in range(K) if scaled[k] < 1.0]
+    large = [k for k in range(K) if scaled[k] >= 1.0]
+    while len(small) > 0 and len(large) > 0:
+        s = small.pop()
+        l = large.pop()
+        AliasPrb[s] = scaled[s]
+        AliasIdx[s] = l
+        scaled[l] = (scaled[l] + scaled[s]) - 1.0
+        if scaled[l] < 1.0:
+            small.append(l)
+        else:
+            large.append(l)
+    return AliasPrb, AliasIdx
+
+def makeAliasTableStack(P_list):
+    '''
+    Makes alias tables for several discrete distributions (possibly with different
+    numbers of outcomes), packed into padded 2D arrays with one row per distri-
+    bution, for use by drawDiscreteStacked.  Distributions that share the same
+    probability array (as periods with the same shocks do) are tabulated once.
+
+    Parameters
+    ----------
+    P_list : [np.array]
+        List of arrays of outcome probabilities.
+
+    Returns
+    -------
+    AliasPrb : np.array
+        2D array of probabilities of keeping each column's own outcome.
+    AliasIdx : np.array
+        2D array of alias outcome indices.
+    Counts : np.array
+        Number of outcomes in each distribution.
+    '''
+    Counts = np.array([np.asarray(P).size for P in P_list],dtype=int)
+    AliasPrb = np.ones((len(P_list),np.max(Counts)))
+    AliasIdx = np.zeros((len(P_list),np.max(Counts)),dtype=int)
+    first_row = {} # Row of the first distribution with each probability array
+    for j in range(len(P_list)):
+        i = first_row.setdefault(id(P_list[j]),j)
+        if i < j:
+            AliasPrb[j,:], AliasIdx[j,:] = AliasPrb[i,:], AliasIdx[i,:]
+        else:
+            AliasPrb[j,:Counts[j]], AliasIdx[j,:Counts[j]] = makeAliasTable(P_list[j])
+    return AliasPrb, AliasIdx, Counts
+
+def drawDiscreteStacked(rows,AliasPrb,AliasIdx,Counts,base_draws):
+    '''
+    Draws event indices for many agents at once, each from its own discrete
+    distribution among those in a stack of alias tables (see makeAliasTableStack).
+    Each draw uses a single uniform draw: its integer part (after scaling by the
+    number of outcomes) picks a column and its fractional part decides between
+    the column's own outcome and its alias.
+
+    Parameters
+    ----------
+    rows : np.array
+        Array of integers naming the distribution (row of the stack) for each draw.
+    AliasPrb : np.array
+        2D array of probabilities of keeping each column's own outcome.
+    AliasIdx : np.array
+        2D array of alias outcome indices.
+    Counts : np.array
+        Number of outcomes in each distribution.
+    base_draws : np.array
+        Uniform draws on [0,1), one per element of rows.
+
+    Returns
+    -------
+    events : np.array
+        Array of event indices, of the same size as rows.
+    '''
+    scaled = base_draws*Counts[rows]
+    cols = np.minimum(np.floor(scaled).astype(int),Counts[rows]-1)
+    keep = (scaled - cols) < AliasPrb[rows,cols]
+    events = np.where(keep,cols,AliasIdx[rows,cols])
+    return events
+
     
 if __name__ == '__main__':       
     print("Sorry, HARKsimulation doesn't actually do anything on its own.")
@@ -6,11 +6,18 @@ derivatives), manipulation of discrete distributions, and basic plotting tools.
 
 from __future__ import division     # Import Python 3.x division function
 import functools
+import hashlib
+import numbers
+import os
+import pickle
+import sys
 import re                           # Regular expression, for string cleaning
+from collections import namedtuple
 import warnings
 import numpy as np                  # Python's numeric library, abbreviated "np"
 import pylab as plt                 # Python's plotting library
 import scipy.stats as stats         # Python's statistics library
+import scipy.sparse as sparse       # Python's sparse matrix library
 from scipy.interpolate import interp1d
 from scipy.special import erf, erfc
 from scipy.stats import norm
@@ -27,23 +34,176 @@ def _warning(message,category = UserWarning,filename = '',lineno = -1):
     print(message)
 warnings.showwarning = _warning
 
-def memoize(obj):
-   '''
-   A decorator to (potentially) make functions more efficient.
-   
-   With this decorator, functions will "remember" if they have been evaluated with given inputs 
-   before.  If they have, they will "remember" the outputs that have already been calculated 
-   for those inputs, rather than calculating them again.
-   '''
-   cache = obj._cache = {}
+CacheInfo = namedtuple('CacheInfo',['hits','misses','disk_hits','size','bytes','maxsize','maxbytes'])
 
-   @functools.wraps(obj)
-   def memoizer(*args, **kwargs):
-       key = str(args) + str(kwargs)
-       if key not in cache:
-           cache[key] = obj(*args, **kwargs)
-       return cache[key]
-   return memoizer
+def memoize(obj=None, maxsize=128, maxbytes=None, cache_dir=None, key=None):
+    '''
+    A decorator to (potentially) make functions more efficient.
+    
+    With this decorator, functions will "remember" if they have been evaluated with given inputs 
+    before.  If they have, they will "remember" the outputs that have already been calculated 
+    for those inputs, rather than calculating them again.  It can be used either as @memoize
+    or with options as @memoize(maxsize=...).
+    
+    Inputs are compared by value: arrays by their shape, dtype, and a digest of their
+    contents, and lists, tuples, and dictionaries by their elements.  Calls with inputs
+    that can't be compared this way are evaluated without the cache.  The least recently
+    used outputs are dropped when there are more than maxsize of them or their arrays
+    take more than maxbytes.  Lists in the outputs are copied on each call, so callers
+    can modify them (as timeRev does), but arrays are shared and must not be modified
+    in place.  The decorated function has a cache_info() method that reports its hits
+    and misses, and a cache_clear() method.
+    
+    Parameters
+    ----------
+    obj : function
+        The function to be decorated.
+    maxsize : int or None
+        Largest number of outputs to keep; None for no limit.
+    maxbytes : int or None
+        Largest total size of the arrays in the outputs to keep; None for no limit.
+    cache_dir : str or None
+        If not None, a directory in which outputs are also saved with pickle, to be
+        loaded by later sessions.  Only calls whose inputs are numbers, strings,
+        arrays, and containers of these are saved.
+    key : function or None
+        If not None, a function of the inputs that returns what they should be
+        compared by, such as the relevant attributes of an input object.
+        
+    Returns
+    -------
+    memoizer : function
+        The decorated function.
+    '''
+    if obj is None:
+        return lambda function : memoize(function,maxsize,maxbytes,cache_dir,key)
+    cache = obj._cache = {}
+    sizes = {}
+    last_used = {} # The number of calls made as of the last use of each output
+    stats = {'hits' : 0, 'misses' : 0, 'disk_hits' : 0, 'bytes' : 0, 'calls' : 0}
+
+    @functools.wraps(obj)
+    def memoizer(*args, **kwargs):
+        try:
+            if key is not None:
+                cache_key = makeCacheKey(key(*args, **kwargs))
+            else:
+                cache_key = tuple([makeCacheKey(x) for x in args])
+                if kwargs:
+                    cache_key += makeCacheKey(kwargs)
+        except TypeError: # Some input can't be compared by value
+            stats['misses'] += 1
+            return obj(*args, **kwargs)
+        stats['calls'] += 1
+        if cache_key in cache:
+            stats['hits'] += 1
+            last_used[cache_key] = stats['calls']
+            return _copyContainers(cache[cache_key])
+        else:
+            if cache_dir is not None and _isPortableKey(cache_key):
+                file_name = os.path.join(cache_dir,obj.__name__ + '_' + hashlib.sha1(repr(cache_key).encode()).hexdigest() + '.pkl')
+                if os.path.exists(file_name):
+                    with open(file_name,'rb') as f:
+                        result = pickle.load(f)
+                    stats['disk_hits'] += 1
+                else:
+                    result = obj(*args, **kwargs)
+                    stats['misses'] += 1
+                    if not os.path.isdir(cache_dir):
+                        os.makedirs(cache_dir)
+                    temp_name = file_name + '.' + str(os.getpid())
+                    with open(temp_name,'wb') as f:
+                        pickle.dump(result,f,pickle.HIGHEST_PROTOCOL)
+                    os.rename(temp_name,file_name)
+            else:
+                result = obj(*args, **kwargs)
+                stats['misses'] += 1
+            cache[cache_key] = result
+            last_used[cache_key] = stats['calls']
+            sizes[cache_key] = _cacheBytes(result)
+            stats['bytes'] += sizes[cache_key]
+            while (maxsize is not None and len(cache) > maxsize) or \
+                  (maxbytes is not None and stats['bytes'] > maxbytes and len(cache) > 1):
+                old_key = min(last_used,key=last_used.get) # Drop the least recently used output
+                del cache[old_key]
+                del last_used[old_key]
+                stats['bytes'] -= sizes.pop(old_key)
+            return _copyContainers(result)
+
+    def cache_info():
+        return CacheInfo(stats['hits'],stats['misses'],stats['disk_hits'],len(cache),stats['bytes'],maxsize,maxbytes)
+
+    def cache_clear():
+        cache.clear()
+        sizes.clear()
+        last_used.clear()
+        stats.update(hits=0,misses=0,disk_hits=0,bytes=0,calls=0)
+
+    memoizer.cache_info = cache_info
+    memoizer.cache_clear = cache_clear
+    return memoizer
+
+_plain_types = (type(None),bool,int,float,complex,str,type(u''),type(2**64))
+
+def makeCacheKey(x):
+    '''
+    Makes a hashable key that identifies the value of x, for memoize.  Arrays are
+    identified by their shape, dtype, and a digest of their contents (so that large
+    arrays with equal summaries are not confused), and lists, tuples, and dictionaries
+    by their elements.  Other inputs are used as they are.
+    
+    Parameters
+    ----------
+    x : anything
+        The value to be identified.
+        
+    Returns
+    -------
+    cache_key : hashable
+        A key for x; equal values have equal keys.
+    '''
+    if type(x) in _plain_types:
+        return x
+    if isinstance(x,np.ndarray):
+        if x.dtype.hasobject:
+            raise TypeError('Arrays of objects cannot be compared by value.')
+        digest = hashlib.sha1(np.ascontiguousarray(x).ravel().view(np.uint8)).hexdigest()
+        return ('ndarray',x.shape,x.dtype.str,digest)
+    if isinstance(x,(list,tuple)):
+        return (type(x).__name__,) + tuple([makeCacheKey(y) for y in x])
+    if isinstance(x,dict):
+        return ('dict',) + tuple(sorted([(k,makeCacheKey(v)) for k, v in x.items()]))
+    hash(x) # Raises TypeError if x is unhashable
+    return x
+
+def _isPortableKey(cache_key):
+    '''
+    Checks whether a key from makeCacheKey identifies its value across sessions,
+    because it is made only of numbers, strings, and None.
+    '''
+    if isinstance(cache_key,tuple):
+        return all(_isPortableKey(x) for x in cache_key)
+    return cache_key is None or isinstance(cache_key,(numbers.Number,str,type(u''),np.generic))
+
+def _cacheBytes(result):
+    '''
+    Counts the bytes in the arrays of an output held by memoize.
+    '''
+    if isinstance(result,np.ndarray):
+        return result.nbytes
+    if isinstance(result,(list,tuple)):
+        return sum(_cacheBytes(x) for x in result)
+    return sys.getsizeof(result)
+
+def _copyContainers(result):
+    '''
+    Copies the lists and tuples in an output held by memoize, sharing everything else.
+    '''
+    if type(result) is list:
+        return [_copyContainers(x) for x in result]
+    if type(result) is tuple:
+        return tuple(_copyContainers(x) for x in result)
+    return result
 
 
 # ==============================================================================
@@ -437,6 +597,7 @@ def CARAutility_invP(u, alpha):
     return( 1.0/(alpha*(1.0-u)) )
 
 
+@memoize
 def approxLognormal(N, mu=0.0, sigma=1.0, tail_N=0, tail_bound=[0.02,0.98], tail_order=np.e):
     '''
     Construct a discrete approximation to a lognormal distribution with underlying
@@ -630,41 +791,72 @@ def makeMarkovApproxToNormal(x_grid,mu,sigma,K=351,bound=3.5):
     p_vec: numpy.array
         A stochastic vector with probability weights for each x in x_grid.
     '''
+    p_vec = makeMarkovApproxToNormalMatrix(x_grid,np.array([mu]),sigma,K,bound)[0,:]
+    return p_vec
+
+def makeMarkovApproxToNormalMatrix(x_grid,mu_vec,sigma,K=351,bound=3.5):
+    '''
+    Creates approximations to normal distributions with each of the means in
+    mu_vec and standard deviation sigma on the values in x_grid, as in
+    makeMarkovApproxToNormal, all at once.  Each draw is located in x_grid with
+    a binary search and its weight is split between the gridpoints on either side
+    of it, so that the cost is O(K log x_n) per mean.  With mu_vec equal to the
+    expected next value from each point of a grid, this is a Markov transition matrix.
+    
+    Parameters
+    ----------
+    x_grid: numpy.array
+        A sorted 1D array of floats representing discrete values that a normally
+        distributed RV could take on.    
+    mu_vec: numpy.array
+        A 1D array of means of the normal distributions to be approximated.
+    sigma: float or numpy.array
+        Standard deviation of the normal distributions to be approximated, either
+        one for all of them or one for each mean in mu_vec.
+    K: int
+        Number of points in each normal distribution to sample.
+    bound: float
+        Truncation bound of the normal distributions, as +/- bound*sigma.
+        
+    Returns
+    -------
+    p_array: numpy.array
+        An array of shape (mu_vec.size,x_grid.size) whose i-th row is a stochastic
+        vector with probability weights for each x in x_grid, given mean mu_vec[i].
+    '''
+    mu_vec = np.asarray(mu_vec,dtype=float).flatten()
+    sigma = np.asarray(sigma,dtype=float).flatten()
     x_n = x_grid.size     # Number of points in the outcome grid
-    lower_bound = -bound  # Lower bound of normal draws to consider, in SD
-    upper_bound = bound   # Upper bound of normal draws to consider, in SD
-    raw_sample = np.linspace(lower_bound,upper_bound,K) # Evenly spaced draws between bounds
-    f_weights = stats.norm.pdf(raw_sample) # Relative probability of each draw
-    sample = mu + sigma*raw_sample # Adjusted bounds, given mean and stdev
-    w_vec = np.zeros(x_n) # A vector of outcome weights
+    m_n = mu_vec.size     # Number of distributions to approximate
+    raw_sample = np.linspace(-bound,bound,K) # Evenly spaced draws between bounds, in SD
+    f_weights = stats.norm.pdf(raw_sample)   # Relative probability of each draw
+    sample = mu_vec[:,np.newaxis] + sigma[:,np.newaxis]*raw_sample # Adjusted draws for each mean
     
     # Find the relative position of each of the draws
     sample_pos = np.searchsorted(x_grid,sample)
-    sample_pos[sample_pos < 1] = 1
-    sample_pos[sample_pos > x_n-1] = x_n-1
+    sample_pos = np.clip(sample_pos,1,x_n-1)
     
-    # Make arrays of the x_grid point directly above and below each draw
+    # Find the weight that each draw puts on the x_grid point directly above it,
+    # keeping the weights in bounds
     bot = x_grid[sample_pos-1]
     top = x_grid[sample_pos]
-    alpha = (sample-bot)/(top-bot)
-
-    # Keep the weights (alpha) in bounds    
-    alpha_clipped = np.clip(alpha,0.,1.)    
+    alpha = np.clip((sample-bot)/(top-bot),0.,1.)
+    
+    # Add up the probability that each draw contributes to the points on either
+    # side of it (accounting for distance), for all of the means at once
+    flat_pos = (sample_pos + x_n*np.arange(m_n)[:,np.newaxis]).flatten()
+    weights_above = (f_weights*alpha).flatten()
+    weights_below = (f_weights*(1.0-alpha)).flatten()
+    w_array = np.bincount(flat_pos,weights_above,minlength=m_n*x_n) + \
+              np.bincount(flat_pos-1,weights_below,minlength=m_n*x_n)
+    w_array = np.reshape(w_array,(m_n,x_n))
     
-    # Loop through each x_grid point and add up the probability that each nearby
-    # draw contributes to it (accounting for distance)
-    for j in range(1,x_n):
-        c = sample_pos == j
-        w_vec[j-1] = w_vec[j-1] + np.dot(f_weights[c],1.0-alpha_clipped[c])
-        w_vec[j] = w_vec[j] + np.dot(f_weights[c],alpha_clipped[c])
-        
     # Reweight the probabilities so they sum to 1
-    W = np.sum(w_vec)
-    p_vec = w_vec/W
+    p_array = w_array/np.sum(w_array,axis=1,keepdims=True)
 
-    # Check for obvious errors, and return p_vec    
-    assert (np.all(p_vec>=0.)) and (np.all(p_vec<=1.)) and (np.isclose(np.sum(p_vec),1.))
-    return p_vec
+    # Check for obvious errors, and return p_array
+    assert np.all(p_array>=0.) and np.all(p_array<=1.) and np.allclose(np.sum(p_array,axis=1),1.)
+    return p_array
 
 def makeMarkovApproxToNormalByMonteCarlo(x_grid,mu,sigma,N_draws = 10000):
     '''
@@ -695,24 +887,27 @@ def makeMarkovApproxToNormalByMonteCarlo(x_grid,mu,sigma,N_draws = 10000):
     # Take random draws from the desired normal distribution
     random_draws = np.random.normal(loc = mu, scale = sigma, size = N_draws)
 
-    # Compute the distance between the draws and points in x_grid
-    distance = np.abs(x_grid[:,np.newaxis] - random_draws[np.newaxis,:])
+    # Find the points in x_grid directly above and below each draw
+    x_n = x_grid.size
+    above = np.clip(np.searchsorted(x_grid,random_draws),1,x_n-1)
+    below = above - 1
     
-    # Find the indices of the points in x_grid that are closest to the draws
-    distance_minimizing_index = np.argmin(distance,axis=0)
+    # Find the index of the point in x_grid that is closest to each draw, taking
+    # the lower point when the draw is equally far from both
+    closer_below = (random_draws - x_grid[below]) <= (x_grid[above] - random_draws)
+    distance_minimizing_index = np.where(closer_below,below,above)
 
     # For each point in x_grid, the approximate probability of that point is the number
     # of Monte Carlo draws that are closest to that point
-    p_vec = np.zeros_like(x_grid)
-    for p_index,p in enumerate(p_vec):
-        p_vec[p_index] = np.sum(distance_minimizing_index==p_index) / N_draws
+    p_vec = np.bincount(distance_minimizing_index,minlength=x_n)/N_draws
 
     # Check for obvious errors, and return p_vec
-    assert (np.all(p_vec>=0.)) and (np.all(p_vec<=1.)) and (np.isclose(np.sum(p_vec)),1.)
+    assert (np.all(p_vec>=0.)) and (np.all(p_vec<=1.)) and (np.isclose(np.sum(p_vec),1.))
     return p_vec
 
 
-def makeTauchenAR1(N, sigma=1.0, rho=0.9, bound=3.0):
+@memoize
+def makeTauchenAR1(N, sigma=1.0, rho=0.9, bound=3.0, prob_cutoff=None):
     '''
     Function to return a discretized version of an AR1 process.
     See http://www.fperri.net/TEACHING/macrotheory08/numerical.pdf for details
@@ -728,12 +923,16 @@ def makeTauchenAR1(N, sigma=1.0, rho=0.9, bound=3.0):
     bound: float
         The highest (lowest) grid point will be bound (-bound) multiplied by the unconditional 
         standard deviation of the process
+    prob_cutoff: float or None
+        If not None, transition probabilities below prob_cutoff are dropped, the
+        rows are rescaled to sum to one, and trans_matrix is returned as a
+        scipy.sparse CSR matrix.
  
     Returns
     -------
     y: np.array
         Grid points on which the discretized process takes values
-    trans_matrix: np.array
+    trans_matrix: np.array or scipy.sparse.csr_matrix
         Markov transition array for the discretized process
 
     Written by Edmund S. Crawley
@@ -742,16 +941,129 @@ def makeTauchenAR1(N, sigma=1.0, rho=0.9, bound=3.0):
     yN = bound*sigma/((1-rho**2)**0.5)
     y = np.linspace(-yN,yN,N)
     d = y[1]-y[0]
-    trans_matrix = np.ones((N,N))
-    for j in range(N):
-        for k_1 in range(N-2):
-            k=k_1+1
-            trans_matrix[j,k] = stats.norm.cdf((y[k] + d/2.0 - rho*y[j])/sigma) - stats.norm.cdf((y[k] - d/2.0 - rho*y[j])/sigma)
-        trans_matrix[j,0] = stats.norm.cdf((y[0] + d/2.0 - rho*y[j])/sigma)
-        trans_matrix[j,N-1] = 1.0 - stats.norm.cdf((y[N-1] - d/2.0 - rho*y[j])/sigma)
-        
+    
+    # Probability of moving from each point (row) to below the midpoint between
+    # each pair of adjacent points (column); each point takes the probability
+    # between the midpoints on either side of it, and the end points the tails
+    cdf_below = stats.norm.cdf((y[np.newaxis,:-1] + d/2.0 - rho*y[:,np.newaxis])/sigma)
+    trans_matrix = np.diff(np.hstack((np.zeros((N,1)),cdf_below,np.ones((N,1)))),axis=1)
+    
+    if prob_cutoff is not None:
+        trans_matrix = truncateTransitions(trans_matrix,prob_cutoff)
+    return y, trans_matrix
+
+@memoize
+def makeRouwenhorstAR1(N, sigma=1.0, rho=0.9, prob_cutoff=None):
+    '''
+    Function to return a discretized version of an AR1 process by the method of
+    Rouwenhorst (1995), which matches the unconditional variance and the
+    autocorrelation of the process exactly for any N, and so works well for
+    highly persistent processes.  See Kopecky and Suen (2010), "Finite State
+    Markov-Chain Approximations to Highly Persistent Processes", for details.
+
+    Parameters
+    ----------
+    N: int
+        Size of discretized grid
+    sigma: float
+        Standard deviation of the error term
+    rho: float
+        AR1 coefficient
+    prob_cutoff: float or None
+        If not None, the transition array is truncated and returned as a sparse
+        matrix, as in makeTauchenAR1.
+ 
+    Returns
+    -------
+    y: np.array
+        Grid points on which the discretized process takes values
+    trans_matrix: np.array or scipy.sparse.csr_matrix
+        Markov transition array for the discretized process
+    '''
+    yN = sigma/((1-rho**2)**0.5)*(N-1)**0.5
+    y = np.linspace(-yN,yN,N)
+    
+    # Build the transition array up from the two state chain, adding one state at a time
+    p = (1.0+rho)/2.0
+    trans_matrix = np.array([[p,1.0-p],[1.0-p,p]])
+    for n in range(3,N+1):
+        trans_next = np.zeros((n,n))
+        trans_next[:-1,:-1] += p*trans_matrix
+        trans_next[:-1,1:] += (1.0-p)*trans_matrix
+        trans_next[1:,:-1] += (1.0-p)*trans_matrix
+        trans_next[1:,1:] += p*trans_matrix
+        trans_next[1:-1,:] /= 2.0 # The interior rows were counted twice
+        trans_matrix = trans_next
+
+    if prob_cutoff is not None:
+        trans_matrix = truncateTransitions(trans_matrix,prob_cutoff)
     return y, trans_matrix
 
+@memoize
+def makeTauchenHusseyAR1(N, sigma=1.0, rho=0.9, prob_cutoff=None):
+    '''
+    Function to return a discretized version of an AR1 process by the method of
+    Tauchen and Hussey (1991), which puts the grid points at the Gauss-Hermite
+    nodes for the distribution of the error term and weights the transitions
+    to them by quadrature.
+
+    Parameters
+    ----------
+    N: int
+        Size of discretized grid
+    sigma: float
+        Standard deviation of the error term
+    rho: float
+        AR1 coefficient
+    prob_cutoff: float or None
+        If not None, the transition array is truncated and returned as a sparse
+        matrix, as in makeTauchenAR1.
+ 
+    Returns
+    -------
+    y: np.array
+        Grid points on which the discretized process takes values
+    trans_matrix: np.array or scipy.sparse.csr_matrix
+        Markov transition array for the discretized process
+    '''
+    nodes, weights = np.polynomial.hermite.hermgauss(N)
+    y = 2.0**0.5*sigma*nodes
+    
+    # Weight each node by the ratio of its density conditional on each point to
+    # its unconditional density, then rescale the rows to sum to one
+    log_ratio = (y[np.newaxis,:]**2 - (y[np.newaxis,:] - rho*y[:,np.newaxis])**2)/(2.0*sigma**2)
+    trans_matrix = weights[np.newaxis,:]*np.exp(log_ratio)
+    trans_matrix /= np.sum(trans_matrix,axis=1,keepdims=True)
+
+    if prob_cutoff is not None:
+        trans_matrix = truncateTransitions(trans_matrix,prob_cutoff)
+    return y, trans_matrix
+
+def truncateTransitions(trans_matrix, prob_cutoff):
+    '''
+    Drops the transition probabilities below prob_cutoff from a Markov transition
+    array, rescales each row to sum to one, and stores the result as a sparse
+    matrix.  For a persistent process on a fine grid, nearly all of the array is
+    negligible, so that the sparse matrix is much faster to multiply by.
+
+    Parameters
+    ----------
+    trans_matrix: np.array
+        Markov transition array, with rows summing to one.
+    prob_cutoff: float
+        Threshold below which transition probabilities are set to zero.  It
+        should be smaller than the largest probability in each row.
+
+    Returns
+    -------
+    trans_sparse: scipy.sparse.csr_matrix
+        The truncated Markov transition array.
+    '''
+    trans_matrix = np.where(trans_matrix >= prob_cutoff,trans_matrix,0.0)
+    trans_matrix /= np.sum(trans_matrix,axis=1,keepdims=True)
+    trans_sparse = sparse.csr_matrix(trans_matrix)
+    return trans_sparse
+
 
 # ================================================================================
 # ==================== Functions for manipulating discrete distributions =========
@@ -903,11 +1215,112 @@ def combineIndepDstns(*distributions):
     P_out = np.prod(np.array(P_temp),axis=0)
 
     assert np.isclose(np.sum(P_out),1),'Probabilities do not sum to 1!'
-    return [P_out,] + X_out 
+    return [P_out,] + X_out
+
+
+class ProductDistribution(object):
+    '''
+    The joint distribution of independent discrete distributions, kept as its
+    separate factors rather than as the full list of combinations made by
+    combineIndepDstns.  Code that works on arrays with one axis per factor can
+    use broadcastValues to get each variable on its factor's axis, and take
+    expectations with expectation, which sums over one factor at a time.  For
+    any other code it behaves like the list that combineIndepDstns would return
+    (probabilities followed by the values of each variable), which is made the
+    first time an element is asked for.
+    '''
+    def __init__(self,*distributions):
+        '''
+        Make a new product distribution.
+
+        Parameters
+        ----------
+        distributions : [np.array] or ProductDistribution
+            Arbitrary number of independent distributions, each a list or tuple
+            whose first vector is probabilities and all subsequent vectors are
+            values (as in combineIndepDstns), or a ProductDistribution whose
+            factors are included in this one.
+
+        Returns
+        -------
+        None
+        '''
+        self.factors = []
+        for dist in distributions:
+            if isinstance(dist,ProductDistribution):
+                self.factors += dist.factors
+            else:
+                assert len(dist[0]) == len(dist[-1]), "len(dist[0]) != len(dist[-1])"
+                self.factors.append([np.asarray(x) for x in dist])
+        self.shape = tuple(len(dist[0]) for dist in self.factors)
+        self.size = int(np.prod(self.shape))
+        self.joint = None
+
+    def __len__(self):
+        '''
+        Returns the number of arrays in the joint distribution: one for the
+        probabilities and one for each variable.
+        '''
+        return 1 + sum(len(dist) - 1 for dist in self.factors)
+
+    def __getitem__(self,index):
+        '''
+        Returns an array (or list of arrays, for a slice) of the joint
+        distribution as made by combineIndepDstns.
+        '''
+        if self.joint is None:
+            self.joint = combineIndepDstns(*self.factors)
+        return self.joint[index]
+
+    def broadcastValues(self,lead=0):
+        '''
+        Returns the values of each variable, shaped to broadcast over an array
+        with one axis for each factor, in order.  Each variable's values lie along
+        the axis of its factor, with length 1 on every other axis.
+
+        Parameters
+        ----------
+        lead : int
+            Number of leading axes of length 1 to put before the factor axes.
+
+        Returns
+        -------
+        values : [np.array]
+            The values of each variable, in the order of the joint distribution.
+        '''
+        values = []
+        for dd, dist in enumerate(self.factors):
+            shape = (1,)*(lead + dd) + (len(dist[0]),) + (1,)*(len(self.factors) - dd - 1)
+            values += [x.reshape(shape) for x in dist[1:]]
+        return values
+
+    def expectation(self,X):
+        '''
+        Returns the expectation of an array over the distribution, taking it over
+        the last factor, then the one before it, and so on.  This costs about one
+        multiplication per element of X, as the weighted sum over the joint
+        probabilities would, but makes no array of the joint probabilities.
+
+        Parameters
+        ----------
+        X : np.array
+            Array whose last axes are the factor axes (as made from the arrays of
+            broadcastValues); leading axes index anything else.
+
+        Returns
+        -------
+        EX : np.array
+            Expectation of X, with its leading axes.
+        '''
+        X = np.broadcast_to(X,X.shape[:(X.ndim - len(self.shape))] + self.shape)
+        for dist in reversed(self.factors):
+            X = np.dot(X,dist[0])
+        return X
 
 # ==============================================================================
 # ============== Functions for generating state space grids  ===================
 # ==============================================================================
+@memoize
 def makeGridExpMult(ming, maxg, ng, timestonest=20):
     '''
     Make a multi-exponentially spaced grid.
@@ -0,0 +1,52 @@
+'''
+A benchmark of accelerated solution of infinite horizon models.  The idiosyncratic
+shocks consumption-saving model is solved for several discount factors, up to
+values near the boundary of the return impatience condition, first by ordinary
+iteration on the one period problem and then with Anderson acceleration of the
+consumption function (accelerate=True).  For each discount factor, the number of
+cycles and solution time of each method are reported, along with the largest
+difference of each consumption function on a grid of market resources from a
+reference solution computed with a much tighter tolerance.
+'''
+import sys
+import os
+sys.path.insert(0, os.path.abspath('../'))
+sys.path.insert(0, os.path.abspath('../ConsumptionSaving'))
+
+import numpy as np
+from time import clock
+from copy import deepcopy
+import ConsumerParameters as Params
+from ConsIndShockModel import IndShockConsumerType
+mystr = lambda number : "{:.4f}".format(number)
+
+if __name__ == '__main__':
+    BaseType = IndShockConsumerType(**Params.init_idiosyncratic_shocks)
+    BaseType.cycles = 0
+    BaseType(vFuncBool = False, CubicBool = False) # Acceleration applies to the linear spline solver only
+    RIC_bound = 1.0/(BaseType.Rfree*BaseType.LivPrb[0]) # Return impatience requires DiscFac below about this
+    mGrid = np.linspace(BaseType.solution_terminal.mNrmMin,50.0,1000)
+
+    for DiscFac in [0.96, 0.98, 0.99, 0.995*RIC_bound, 0.999*RIC_bound]:
+        PlainType = deepcopy(BaseType)
+        PlainType(DiscFac = DiscFac)
+        start_time = clock()
+        PlainType.solve()
+        plain_time = clock() - start_time
+
+        FastType = deepcopy(BaseType)
+        FastType(DiscFac = DiscFac, accelerate = True)
+        start_time = clock()
+        FastType.solve()
+        fast_time = clock() - start_time
+
+        RefType = deepcopy(BaseType)
+        RefType(DiscFac = DiscFac, tolerance = 1e-11)
+        RefType.solve()
+        c_ref = RefType.solution[0].cFunc(mGrid)
+        plain_err = np.max(np.abs(PlainType.solution[0].cFunc(mGrid) - c_ref))
+        fast_err = np.max(np.abs(FastType.solution[0].cFunc(mGrid) - c_ref))
+        print('DiscFac=' + mystr(DiscFac) + ': ' + str(PlainType.solve_cycles) + ' cycles in ' + mystr(plain_time) +
+              ' seconds without acceleration (max error ' + '{:.2e}'.format(plain_err) + '), ' +
+              str(FastType.solve_cycles) + ' cycles in ' + mystr(fast_time) + ' seconds with (max error ' +
+              '{:.2e}'.format(fast_err) + ', final distance ' + '{:.2e}'.format(FastType.solve_distance) + ')')
@@ -0,0 +1,146 @@
+"""
+This file implements unit tests to check ConsIndShockModel.py
+"""
+
+
+# First, bring in the files we want to test
+import sys
+import os
+sys.path.insert(0, os.path.abspath('../'))
+sys.path.insert(0, os.path.abspath('../ConsumptionSaving'))
+import ConsumerParameters as Params
+from ConsIndShockModel import IndShockConsumerType, constructLognormalIncomeProcessUnemployment, makeWorkingIncomeDstn
+from HARKinterpolation import LinearInterp
+from HARKutilities import approxMeanOneLognormal, addDiscreteOutcomeConstantMean, combineIndepDstns
+
+# Bring in modules we need
+import unittest
+import numpy as np
+from copy import copy, deepcopy
+
+class testsForcFuncBank(unittest.TestCase):
+
+    def setUp(self):
+        self.RNG = np.random.RandomState(0)
+
+    def check_controls(self,agent):
+        # Consumption and the MPC found by getControls match each period's cFunc
+        agent.AgentCount = 600
+        agent.t_cycle = self.RNG.randint(agent.T_cycle,size=600)
+        agent.mNrmNow = self.RNG.rand(600)*30.0
+        agent.getControls()
+        for t in range(agent.T_cycle):
+            these = agent.t_cycle == t
+            c, MPC = agent.solution[t].cFunc.eval_with_derivative(agent.mNrmNow[these])
+            self.assertTrue(np.allclose(agent.cNrmNow[these],c))
+            self.assertTrue(np.allclose(agent.MPCnow[these],MPC))
+
+    def test_infinite_horizon(self):
+        agent = IndShockConsumerType(**Params.init_idiosyncratic_shocks)
+        agent(cycles=0)
+        agent.solve()
+        self.assertEqual(agent.cFuncBank.N,1)
+        self.check_controls(agent)
+
+    def test_lifecycle(self):
+        agent = IndShockConsumerType(**Params.init_lifecycle)
+        agent.solve()
+        self.assertEqual(agent.cFuncBank.N,agent.T_cycle)
+        self.check_controls(agent)
+
+    def test_cubic(self):
+        # Cubic spline consumption functions can't be stacked, so getControls loops
+        agent = IndShockConsumerType(**Params.init_lifecycle)
+        agent(CubicBool=True)
+        agent.solve()
+        self.assertTrue(agent.cFuncBank is None)
+        self.check_controls(agent)
+
+    def test_staleness(self):
+        # Replacing the cFunc of any one period makes getControls rebuild the bank
+        agent = IndShockConsumerType(**Params.init_lifecycle)
+        agent.solve()
+        self.assertTrue(agent.cFuncBankIsCurrent())
+        agent.solution = copy(agent.solution)
+        self.assertTrue(agent.cFuncBankIsCurrent())
+        t = agent.T_cycle//2
+        agent.solution[t] = copy(agent.solution[t])
+        agent.solution[t].cFunc = LinearInterp(np.array([0.0,1.0]),np.array([0.0,0.5]))
+        self.assertFalse(agent.cFuncBankIsCurrent())
+        self.check_controls(agent)
+        self.assertTrue(agent.cFuncBankIsCurrent())
+
+class testsForSolveBatch(unittest.TestCase):
+
+    def check_batch(self,agent,DiscFac,CRRA):
+        # Each point's batch solution matches solving the type at that point
+        m = np.linspace(0.0,30.0,301)
+        solutions = agent.solveBatch(DiscFac,CRRA)
+        self.assertEqual(len(solutions),DiscFac.size)
+        cycles = []
+        for p in range(DiscFac.size):
+            agent_p = deepcopy(agent)
+            agent_p(DiscFac=DiscFac[p],CRRA=CRRA[p])
+            agent_p.solve()
+            cycles.append(getattr(agent_p,'solve_cycles',None))
+            self.assertEqual(len(solutions[p]),len(agent_p.solution))
+            for solution, solution_p in zip(solutions[p],agent_p.solution):
+                self.assertTrue(np.allclose(solution.cFunc(m),solution_p.cFunc(m),rtol=1e-10,atol=1e-12))
+                self.assertTrue(np.allclose(solution.cFunc.derivative(m),solution_p.cFunc.derivative(m),rtol=1e-10,atol=1e-12))
+                self.assertAlmostEqual(solution.mNrmMin,solution_p.mNrmMin)
+                self.assertAlmostEqual(solution.MPCmax,solution_p.MPCmax)
+        return cycles
+
+    def test_infinite_horizon(self):
+        agent = IndShockConsumerType(**Params.init_idiosyncratic_shocks)
+        agent(cycles=0)
+        DiscFac = np.array([0.90,0.94,0.96,0.97])
+        CRRA = np.array([1.5,2.0,4.0,3.0])
+        cycles = self.check_batch(agent,DiscFac,CRRA)
+        self.assertTrue(len(set(cycles)) > 1) # The points converged at different cycles
+
+    def test_lifecycle(self):
+        agent = IndShockConsumerType(**Params.init_lifecycle)
+        self.check_batch(agent,np.array([0.90,0.96,0.99]),np.array([1.5,2.0,4.0]))
+
+class testsForIncomeProcess(unittest.TestCase):
+
+    def setUp(self):
+        self.agent = IndShockConsumerType(**Params.init_lifecycle)
+        self.agent(UnempPrbRet=0.01) # Periods 0 and 6 have the same shocks; 7 through 9 are retired
+
+    def test_shared_arrays(self):
+        # Periods with the same shocks share arrays, but each has its own lists
+        IncomeDstn, PermShkDstn, TranShkDstn = constructLognormalIncomeProcessUnemployment(self.agent)
+        for s, t in [(0,6),(7,8),(7,9)]:
+            for Dstn in [IncomeDstn, PermShkDstn, TranShkDstn]:
+                self.assertFalse(Dstn[s] is Dstn[t])
+                self.assertTrue(all(a is b for a, b in zip(Dstn[s],Dstn[t])))
+        self.assertFalse(IncomeDstn[0][0] is IncomeDstn[1][0])
+        working = makeWorkingIncomeDstn(0.1,self.agent.PermShkCount,0.3,self.agent.TranShkCount,
+                                        self.agent.UnempPrb,self.agent.IncUnemp)
+        self.assertTrue(all(np.array_equal(a,b) for a, b in zip(working[0],IncomeDstn[0])))
+
+    def test_matches_per_period(self):
+        # The income process matches building each period on its own
+        agent = self.agent
+        IncomeDstn, PermShkDstn, TranShkDstn = constructLognormalIncomeProcessUnemployment(agent)
+        self.assertEqual(len(IncomeDstn),agent.T_cycle)
+        for t in range(agent.T_cycle):
+            if t >= agent.T_retire:
+                TranShkVals = np.array([agent.IncUnempRet,(1.0-agent.UnempPrbRet*agent.IncUnempRet)/(1.0-agent.UnempPrbRet)])
+                ShkPrbs = np.array([agent.UnempPrbRet,1.0-agent.UnempPrbRet])
+                IncomeDstn_t = [ShkPrbs,np.array([1.0,1.0]),TranShkVals]
+                PermShkDstn_t = [np.array([1.0]),np.array([1.0])]
+                TranShkDstn_t = [ShkPrbs,TranShkVals]
+            else:
+                TranShkDstn_t = approxMeanOneLognormal(N=agent.TranShkCount,sigma=agent.TranShkStd[t],tail_N=0)
+                TranShkDstn_t = addDiscreteOutcomeConstantMean(TranShkDstn_t,p=agent.UnempPrb,x=agent.IncUnemp)
+                PermShkDstn_t = approxMeanOneLognormal(N=agent.PermShkCount,sigma=agent.PermShkStd[t],tail_N=0)
+                IncomeDstn_t = combineIndepDstns(PermShkDstn_t,TranShkDstn_t)
+            for Dstn, Dstn_t in [(IncomeDstn,IncomeDstn_t),(PermShkDstn,PermShkDstn_t),(TranShkDstn,TranShkDstn_t)]:
+                self.assertEqual(len(Dstn[t]),len(Dstn_t))
+                self.assertTrue(all(np.array_equal(a,b) for a, b in zip(Dstn[t],Dstn_t)))
+
+if __name__ == '__main__':
+    unittest.main()
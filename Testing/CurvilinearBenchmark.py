@@ -0,0 +1,55 @@
+'''
+A benchmark of finding the sectors of a million query points in a curvilinear grid
+like those made by the endogenous grid method with two continuous states.  Each
+search in Curvilinear2DInterp walks from sector to sector; the walk starts either
+at the center of the grid (bucket_count=0) or at the sector found in advance for
+the point's cell of a uniform "bucket" grid (the default).  Both are timed on
+points inside the grid and on points scattered over (and beyond) its bounding
+box, and checked to find the same sectors.
+'''
+import sys
+import os
+sys.path.insert(0, os.path.abspath('../'))
+
+import numpy as np
+from time import clock
+from HARKutilities import makeGridExpMult
+from HARKinterpolation import Curvilinear2DInterp
+mystr = lambda number : "{:.3f}".format(number)
+
+if __name__ == '__main__':
+    query_count = 10**6
+    RNG = np.random.RandomState(0)
+    for aCount, pCount in [(48,20),(100,100)]:
+        # A grid of market resources and permanent income, warped by consumption
+        aGrid, pGrid = np.meshgrid(makeGridExpMult(0.001,20.0,aCount,3),np.linspace(0.3,3.0,pCount),indexing='ij')
+        cGrid = (0.5 + 0.3*np.sqrt(aGrid) + 0.05*aGrid)*pGrid**0.9
+        mGrid = aGrid*pGrid + cGrid
+        walk_interp = Curvilinear2DInterp(cGrid,mGrid,pGrid,bucket_count=0)
+        start_time = clock()
+        fast_interp = Curvilinear2DInterp(cGrid,mGrid,pGrid)
+        build_time = clock() - start_time
+
+        # Points inside the grid, at random relative coordinates in random sectors
+        i = RNG.randint(0,aCount-1,query_count)
+        j = RNG.randint(0,pCount-1,query_count)
+        alpha = RNG.rand(query_count)
+        beta = RNG.rand(query_count)
+        weights = [(1-alpha)*(1-beta),alpha*(1-beta),(1-alpha)*beta,alpha*beta]
+        corners = [(i,j),(i+1,j),(i,j+1),(i+1,j+1)]
+        m_inside = sum(weight*mGrid[corner] for weight, corner in zip(weights,corners))
+        p_inside = sum(weight*pGrid[corner] for weight, corner in zip(weights,corners))
+        m_box = RNG.rand(query_count)*1.1*np.max(mGrid) - 0.5
+        p_box = RNG.rand(query_count)*3.2 + 0.2
+
+        for name, m, p in [('inside the grid',m_inside,p_inside),('in the bounding box',m_box,p_box)]:
+            start_time = clock()
+            walk_sectors = walk_interp.findSector(m,p)
+            walk_time = clock() - start_time
+            start_time = clock()
+            fast_sectors = fast_interp.findSector(m,p)
+            fast_time = clock() - start_time
+            assert np.array_equal(walk_sectors,fast_sectors)
+            print(str(aCount) + 'x' + str(pCount) + ' grid, points ' + name + ': ' + mystr(walk_time) +
+                  ' seconds walking from the center, ' + mystr(fast_time) + ' seconds from the bucket grid (built in ' +
+                  mystr(build_time) + ' seconds).')
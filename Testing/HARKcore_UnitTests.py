@@ -0,0 +1,179 @@
+"""
+This file implements unit tests to check HARKcore.py
+"""
+
+
+# First, bring in the files we want to test
+import sys
+import os
+sys.path.insert(0, os.path.abspath('../'))
+sys.path.insert(0, os.path.abspath('../ConsumptionSaving'))
+from HARKcore import HistoryStore, AndersonAccelerator, SolutionCache, AgentType, Market
+from HARKparallel import AgentPool
+
+# Bring in modules we need
+import unittest
+import numpy as np
+from copy import deepcopy
+import ConsumerParameters as Params
+from ConsIndShockModel import IndShockConsumerType
+try:
+    import joblib
+    joblib_available = True
+except ImportError:
+    joblib_available = False
+
+class PeriodCountingType(AgentType):
+    '''
+    A toy AgentType whose only variable is the period it is simulating.
+    '''
+    def reset(self):
+        self.t_sim = 0
+        self.clearHistory()
+
+    def simOnePeriod(self):
+        self.tNow = self.t_sim*np.ones(self.AgentCount)
+
+    def marketAction(self):
+        self.simulate(1)
+
+class testsForHistoryStore(unittest.TestCase):
+
+    def setUp(self):
+        self.var_names = ['aNrmNow','MrkvNow']
+        self.dtypes    = {'MrkvNow' : np.int8}
+        self.T         = 10
+        self.N         = 6
+
+    def fill_store(self,store):
+        """
+        Records rows 0 through T-3 of a known history in a store, skipping a row in
+        the middle and leaving the last two rows blank.
+        """
+        for t in range(self.T-2):
+            if t != 4:
+                store.record(t,[np.arange(self.N) + 0.5*t, t*np.ones(self.N)])
+
+    def check_store(self,store):
+        aNrm_hist = store.getHistory('aNrmNow')
+        Mrkv_hist = store.getHistory('MrkvNow')
+        self.assertEqual(Mrkv_hist.dtype,np.int8)
+        self.assertTrue(np.all(np.isnan(aNrm_hist[[4,self.T-2,self.T-1],:])))
+        self.assertTrue(np.all(Mrkv_hist[[4,self.T-2,self.T-1],:] == 0))
+        self.assertTrue(np.allclose(aNrm_hist[7,:],np.arange(self.N) + 3.5))
+        self.assertTrue(np.all(Mrkv_hist[5,:] == 5))
+        blocks = [block for t_start, block in store.iterChunks('MrkvNow',chunk_size=4)]
+        self.assertEqual([block.shape[0] for block in blocks],[4,4,2])
+        self.assertTrue(np.all(np.concatenate(blocks,axis=0) == Mrkv_hist))
+
+    def test_memory(self):
+        store = HistoryStore(self.var_names,self.T,self.N,dtypes=self.dtypes)
+        self.fill_store(store)
+        self.check_store(store)
+
+    def test_memmap(self):
+        store = HistoryStore(self.var_names,self.T,self.N,dtypes=self.dtypes,backend='memmap',chunk_size=3)
+        self.fill_store(store)
+        self.check_store(store)
+        directory = store.directory
+        self.assertTrue(os.path.isfile(os.path.join(directory,'aNrmNow.npy')))
+        store.close(delete=True)
+        self.assertFalse(os.path.exists(directory))
+
+    def test_memmap_deepcopy(self):
+        # A copy of a memmap store has its own files, so deleting them leaves the
+        # original store intact
+        store = HistoryStore(self.var_names,self.T,self.N,dtypes=self.dtypes,backend='memmap',chunk_size=3)
+        self.fill_store(store)
+        store_copy = deepcopy(store)
+        self.assertNotEqual(store_copy.directory,store.directory)
+        store_copy.record(9,[np.zeros(self.N),np.zeros(self.N)])
+        store_copy.close(delete=True)
+        self.check_store(store)
+        store.close(delete=True)
+
+    def test_market_flush(self):
+        # While a market makes its history, each type's store is only written out
+        # when its buffer fills and once at the end
+        agent = PeriodCountingType(T_sim=10,AgentCount=self.N)
+        agent(time_inv=[],time_vary=[],track_vars=['tNow'],history_backend='memmap',history_chunk_size=4)
+        market = Market(agents=[agent],millRule=lambda : None,act_T=10)
+        flush = HistoryStore.flush
+        rows_written = []
+        def countingFlush(store):
+            if store.buffer_rows > 0:
+                rows_written.append(store.buffer_rows)
+            flush(store)
+        HistoryStore.flush = countingFlush
+        try:
+            market.makeHistory()
+        finally:
+            HistoryStore.flush = flush
+        self.assertEqual(rows_written,[4,4,2])
+        self.assertTrue(np.all(agent.tNow_hist == np.arange(10)[:,np.newaxis]))
+        self.assertFalse(agent.history.held)
+        agent.history.close(delete=True)
+
+class testsForAndersonAccelerator(unittest.TestCase):
+
+    def test_affine_map(self):
+        # Anderson acceleration with enough memory finds the fixed point of an
+        # affine map within a few more steps than the map has dimensions
+        A = np.array([[0.9,0.05,0.0],[0.0,0.95,0.02],[0.01,0.0,0.98]])
+        b = np.array([1.0,-0.5,0.25])
+        x_star = np.linalg.solve(np.eye(3) - A,b)
+        accelerator = AndersonAccelerator(memory=5)
+        x = np.zeros(3)
+        for i in range(6):
+            x = accelerator.update(x,np.dot(A,x) + b)
+        self.assertTrue(np.allclose(x,x_star))
+
+class testsForSolutionCache(unittest.TestCase):
+
+    def setUp(self):
+        self.agent = AgentType(DiscFac=0.96,LivPrb=[0.98],aXtraGrid=np.linspace(0.0,20.0,5),CubicBool=False)
+        self.agent.time_inv = ['DiscFac','aXtraGrid','CubicBool']
+        self.agent.time_vary = ['LivPrb','solution']
+
+    def test_nearest(self):
+        cache = SolutionCache(max_entries=3)
+        for DiscFac in [0.90,0.95,0.97,0.99]:
+            self.agent(DiscFac=DiscFac)
+            cache.store(cache.makeKey(self.agent),np.array([DiscFac]))
+        self.assertEqual(len(cache.entries),3) # The solution for 0.90 was dropped
+        self.agent(DiscFac=0.93)
+        self.assertEqual(cache.makeStart(cache.makeKey(self.agent),self.agent)[0],0.95)
+        self.agent(CubicBool=True) # A different signature has no cached solutions
+        self.assertTrue(cache.makeStart(cache.makeKey(self.agent),self.agent) is None)
+
+    def check_market(self,agent_pool):
+        # Types solved through Market.solveAgents start from the solutions found for
+        # other types, even when they are copied into other processes to be solved
+        agents = []
+        for DiscFac in [0.94,0.95,0.951,0.941]:
+            agent = IndShockConsumerType(**Params.init_idiosyncratic_shocks)
+            agent(cycles=0,DiscFac=DiscFac)
+            agents.append(agent)
+        market = Market(agents=agents[:2])
+        market.agent_pool = agent_pool
+        market.solution_cache = SolutionCache()
+        market.solveAgents()
+        self.assertEqual((market.solution_cache.hits,market.solution_cache.misses),(0,2))
+        market.agents = agents[2:]
+        market.solveAgents()
+        self.assertEqual((market.solution_cache.hits,market.solution_cache.misses),(2,2))
+        self.assertEqual(len(market.solution_cache.entries),4)
+
+    def test_market_pool(self):
+        agent_pool = AgentPool(num_workers=2)
+        try:
+            self.check_market(agent_pool)
+        finally:
+            agent_pool.close()
+
+    @unittest.skipIf(not joblib_available,'joblib is not installed')
+    def test_market_threads(self):
+        self.check_market(None)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,330 @@
+"""
+This file implements unit tests to check HARKinterpolation.py
+"""
+
+
+# First, bring in the files we want to test
+import sys
+import os
+sys.path.insert(0, os.path.abspath('../'))
+from HARKinterpolation import LinearInterp, CubicInterp, LinearInterpStack, BilinearInterp, GridSearch, LowerEnvelope, UpperEnvelope,\
+                              LinearInterpOnInterp1D, BilinearInterpOnInterp1D, LinearInterpOnInterp2D, Curvilinear2DInterp,\
+                              TrilinearInterp, QuadlinearInterp, LowerEnvelope2D, evalFlat, flatForm, mergeSearch
+from HARKjit import numba_available
+from HARKutilities import makeGridExpMult
+import HARKinterpolation
+from copy import copy
+
+# Bring in modules we need
+import unittest
+import numpy as np
+
+class testsForDistance(unittest.TestCase):
+
+    def test_linear_moved_grid(self):
+        # The distance is the largest difference of the functions, not of their gridpoints
+        x = np.linspace(0.0,10.0,11)
+        f = LinearInterp(x,2.0*x)
+        g = LinearInterp(x + 0.5,2.0*x)
+        self.assertAlmostEqual(f.distance(g),1.0)
+        self.assertAlmostEqual(f.distance(LinearInterp(x,2.0*x + 0.1)),0.1)
+
+    def test_stack_matches_unstacked(self):
+        RNG = np.random.RandomState(0)
+        x_lists = [np.sort(RNG.rand(n))*10.0 for n in [5,7,9]]
+        y_lists = [np.cumsum(RNG.rand(x.size)) for x in x_lists]
+        x_lists_alt = [np.sort(RNG.rand(n))*10.0 for n in [6,7,3]]
+        y_lists_alt = [np.cumsum(RNG.rand(x.size)) for x in x_lists_alt]
+        stack = LinearInterpStack(x_lists,y_lists)
+        stack_alt = LinearInterpStack(x_lists_alt,y_lists_alt)
+        unstacked = [stack.unstack(j).distance(stack_alt.unstack(j)) for j in range(3)]
+        self.assertTrue(np.allclose(stack.rowDistance(stack_alt),unstacked))
+
+    def test_bilinear(self):
+        x = np.linspace(0.0,1.0,5)
+        x_alt = np.linspace(0.0,1.5,7)
+        y = np.linspace(0.0,2.0,4)
+        f = lambda x, y : x*y + x
+        fInterp = BilinearInterp(f(*np.meshgrid(x,y,indexing='ij')),x,y)
+        gInterp = BilinearInterp(f(*np.meshgrid(x_alt,y,indexing='ij')) + 0.01,x_alt,y)
+        self.assertAlmostEqual(fInterp.distance(gInterp),0.01)
+
+class testsForCubicInterp(unittest.TestCase):
+
+    def test_cubic_polynomial(self):
+        # A cubic polynomial is interpolated exactly by its levels and slopes at the
+        # gridpoints, and evaluating the level and slope together gives the same as
+        # evaluating them separately
+        f = lambda x : 1.0 + x - 0.5*x**2 + 0.1*x**3
+        dfdx = lambda x : 1.0 - x + 0.3*x**2
+        x_list = np.sort(np.random.RandomState(0).rand(9))*4.0
+        x_list[0] = 0.0
+        fInterp = CubicInterp(x_list,f(x_list),dfdx(x_list),lower_extrap=True)
+        x = np.linspace(-1.0,5.0,61)
+        inside = np.logical_and(x >= 0.0, x <= x_list[-1])
+        self.assertTrue(np.allclose(fInterp(x[inside]),f(x[inside])))
+        self.assertTrue(np.allclose(fInterp.derivative(x[inside]),dfdx(x[inside])))
+        self.assertTrue(np.allclose(fInterp(x[x < 0.0]),1.0 + x[x < 0.0]))
+        y, dydx = fInterp.eval_with_derivative(x)
+        self.assertTrue(np.array_equal(y,fInterp(x)))
+        self.assertTrue(np.array_equal(dydx,fInterp.derivative(x)))
+
+class testsForOutputBuffers(unittest.TestCase):
+
+    def test_out(self):
+        # Evaluating into caller-provided arrays gives the same values, in the shape
+        # and dtype of the arrays, and leaves the inputs unchanged
+        x = np.linspace(0.0,1.0,5)
+        y = np.linspace(0.0,2.0,4)
+        fInterp = BilinearInterp(np.outer(x,y) + x[:,np.newaxis],x,y)
+        gInterp = LinearInterp(x,x**2)
+        x_in = np.random.RandomState(0).rand(12)
+        y_in = 2.0*x_in[::-1].copy()
+        x_copy = x_in.copy()
+        out = np.zeros(12)
+        self.assertTrue(fInterp(x_in,y_in,out=out) is out)
+        self.assertTrue(np.array_equal(out,fInterp(x_in,y_in)))
+        self.assertTrue(np.array_equal(out.reshape((3,4)),fInterp(x_in.reshape((3,4)),y_in.reshape((3,4)))))
+        out_32 = np.zeros((3,4),dtype=np.float32)
+        fInterp.derivativeX(x_in.reshape((3,4)),y_in.reshape((3,4)),out=out_32)
+        self.assertTrue(np.allclose(out_32.flatten(),fInterp.derivativeX(x_in,y_in)))
+        level, slope = np.zeros(12), np.zeros(12)
+        gInterp.eval_with_derivative(x_in,out=(level,slope))
+        self.assertTrue(np.array_equal(level,gInterp(x_in)) and np.array_equal(slope,gInterp.derivative(x_in)))
+        self.assertTrue(np.array_equal(x_in,x_copy))
+
+class testsForGridSearch(unittest.TestCase):
+
+    def test_matches_searchsorted(self):
+        RNG = np.random.RandomState(0)
+        grids = [(np.linspace(-1.0,3.0,40),'uniform',None),
+                 (np.exp(np.linspace(-3.0,3.0,30)),'log',None),
+                 (makeGridExpMult(0.001,20.0,300,2),'exp_mult',2)]
+        for grid, grid_type, timestonest in grids:
+            search = GridSearch(grid)
+            self.assertEqual((search.grid_type,search.timestonest),(grid_type,timestonest))
+            self.assertTrue(search.closed_form)
+            x = np.concatenate((RNG.rand(1000)*(grid[-1] - grid[0] + 2.0) + grid[0] - 1.0,
+                                grid,[np.inf,-np.inf,-5.0]))
+            self.assertTrue(np.array_equal(search(grid,x),np.searchsorted(grid,x)))
+
+    def test_wrong_family(self):
+        grid = np.sort(np.random.RandomState(0).rand(20))
+        self.assertFalse(GridSearch(grid,'uniform').closed_form)
+
+    def test_merge_sorted_rows(self):
+        # Merging sorted rows with the grid gives the same indices as searchsorted, with
+        # ties at gridpoints and infinities and NaNs at the ends of rows, and interpolators
+        # told that their queries are sorted give the same results
+        RNG = np.random.RandomState(0)
+        grid = np.sort(RNG.rand(48))*10.0
+        x = np.sort(RNG.rand(3,3000)*12.0 - 1.0,axis=1)
+        x[0,100:103] = grid[5]
+        x[0,:] = np.sort(x[0,:])
+        x[1,-1] = np.inf
+        x[2,-2:] = np.nan
+        self.assertTrue(np.array_equal(mergeSearch(grid,x.ravel(),3000),np.searchsorted(grid,x.ravel())))
+        self.assertTrue(np.array_equal(mergeSearch(grid,np.sort(x[0])),np.searchsorted(grid,x[0])))
+        for func in [LinearInterp(grid,np.sqrt(grid)),CubicInterp(grid,np.sqrt(grid),0.5/np.sqrt(grid))]:
+            self.assertTrue(np.allclose(func(x,sorted_x=True),func(x),rtol=0.0,atol=0.0,equal_nan=True))
+            self.assertTrue(np.allclose(func.derivative(x,sorted_x=True),func.derivative(x),rtol=0.0,atol=0.0,equal_nan=True))
+
+class testsForInterpOnInterp(unittest.TestCase):
+
+    def setUp(self):
+        self.RNG = np.random.RandomState(0)
+        self.cell_loop_min_points = HARKinterpolation.cell_loop_min_points
+
+    def tearDown(self):
+        HARKinterpolation.cell_loop_min_points = self.cell_loop_min_points
+
+    def check_stacked(self,func,stack_name,arg_count,methods):
+        # The vectorized evaluation through the stack of children, in one pass or
+        # one cell at a time, matches the loop over cells, including extrapolation
+        # outside all of the grids
+        self.assertTrue(getattr(func,stack_name) is not None)
+        func_loop = copy(func)
+        setattr(func_loop,stack_name,None)
+        args = [self.RNG.rand(500)*7.0 - 1.0 for j in range(arg_count)]
+        for min_points in [0,np.inf]:
+            HARKinterpolation.cell_loop_min_points = min_points
+            for method in methods:
+                self.assertTrue(np.allclose(getattr(func,method)(*args),getattr(func_loop,method)(*args),equal_nan=True))
+
+    def test_linear_children(self):
+        makeLinear = lambda n : LowerEnvelope(LinearInterp(np.sort(self.RNG.rand(n))*5.0,np.cumsum(self.RNG.rand(n))),
+                                              LinearInterp(np.array([0.0,1.0]),np.array([0.0,0.8])))
+        func = LinearInterpOnInterp1D([makeLinear(n) for n in [3,8,5,4]],np.array([0.0,0.5,1.5,3.0]))
+        self.check_stacked(func,'xStack',2,['__call__','derivativeX','derivativeY'])
+        func = BilinearInterpOnInterp1D([[makeLinear(n) for n in [3,8,5]] for i in range(4)],
+                                        np.array([0.0,0.5,1.5,3.0]),np.array([1.0,2.0,2.5]))
+        self.check_stacked(func,'xStack',3,['__call__','derivativeX','derivativeY','derivativeZ'])
+
+    def test_bilinear_children(self):
+        makeBilinear = lambda n, m : BilinearInterp(self.RNG.rand(n,m),np.sort(self.RNG.rand(n))*5.0,
+                                                    np.sort(self.RNG.rand(m))*5.0)
+        func = LinearInterpOnInterp2D([makeBilinear(n,m) for n, m in [(2,5),(4,3),(6,6)]],np.array([0.0,1.0,2.0]))
+        self.check_stacked(func,'xyStack',3,['__call__','derivativeX','derivativeY','derivativeZ'])
+
+    def test_nan(self):
+        # Query points with a NaN coordinate give NaN, as the loop over cells does
+        grid = np.linspace(0.0,5.0,6)
+        func = LinearInterpOnInterp1D([LinearInterp(grid,grid*(1.0+j)) for j in range(3)],np.array([0.0,1.0,2.0]))
+        x = np.array([1.0,np.nan,2.0,7.0,0.5])
+        y = np.array([0.5,1.5,np.nan,1.0,1.5])
+        missing = np.array([False,True,True,False,False])
+        for min_points in [0,np.inf]:
+            HARKinterpolation.cell_loop_min_points = min_points
+            for result in [func(x,y),func.derivativeX(x,y),func.derivativeY(x,y)] + list(func.eval_with_gradient(x,y)):
+                self.assertTrue(np.all(np.isnan(result[missing])))
+                self.assertFalse(np.any(np.isnan(result[np.logical_not(missing)])))
+        stack = LinearInterpStack([grid,grid],[grid,2.0*grid])
+        rows = np.array([0,1,1])
+        x = np.array([1.0,np.nan,2.0])
+        self.assertTrue(np.allclose(stack(x,rows),np.array([1.0,np.nan,4.0]),equal_nan=True))
+        self.assertTrue(np.allclose(stack.derivative(x,rows),np.array([1.0,np.nan,2.0]),equal_nan=True))
+
+class testsForGradient(unittest.TestCase):
+
+    def test_matches_separate(self):
+        # The level and all partial derivatives found together match those found
+        # one at a time, including extrapolation outside of the grids
+        RNG = np.random.RandomState(0)
+        grids = [np.sort(RNG.rand(n))*5.0 for n in [4,5,6,7]]
+        makeLinear = lambda n : LinearInterp(np.sort(RNG.rand(n))*5.0,np.cumsum(RNG.rand(n)))
+        bilinear = BilinearInterp(RNG.rand(4,5),grids[0],grids[1])
+        stacked = LinearInterpOnInterp1D([makeLinear(n) for n in [3,8,5]],np.array([0.0,0.5,1.5]))
+        unstacked = copy(stacked)
+        unstacked.xStack = None
+        funcs = [(bilinear,2),(TrilinearInterp(RNG.rand(4,5,6),*grids[:3]),3),(QuadlinearInterp(RNG.rand(4,5,6,7),*grids),4),
+                 (stacked,2),(unstacked,2),(LowerEnvelope2D(bilinear,BilinearInterp(RNG.rand(4,5),grids[0],grids[1])),2)]
+        derivatives = {2 : ['derivativeX','derivativeY'], 3 : ['derivativeX','derivativeY','derivativeZ'],
+                       4 : ['derivativeW','derivativeX','derivativeY','derivativeZ']}
+        for func, arg_count in funcs:
+            args = [RNG.rand(500)*7.0 - 1.0 for j in range(arg_count)]
+            results = func.eval_with_gradient(*args)
+            self.assertEqual(len(results),arg_count+1)
+            self.assertTrue(np.allclose(results[0],func(*args),equal_nan=True))
+            for result, method in zip(results[1:],derivatives[arg_count]):
+                self.assertTrue(np.allclose(result,getattr(func,method)(*args),equal_nan=True))
+
+class testsForEnvelope(unittest.TestCase):
+
+    def test_resolved_matches_generic(self):
+        # An envelope of LinearInterps resolved into a single LinearInterp has the same
+        # levels and derivatives as the generic envelope, including below the bottom
+        # gridpoint of some of the functions and in decay extrapolation
+        RNG = np.random.RandomState(0)
+        x = RNG.rand(1000)*30.0 - 1.0
+        f = LinearInterp(np.linspace(0.0,10.0,12),np.sqrt(np.linspace(0.0,10.0,12)) + 1.0,2.0,0.1)
+        g = LinearInterp(np.array([-0.5,10.0]),np.array([0.0,4.0]))
+        h = LinearInterp(np.sort(RNG.rand(6))*8.0,RNG.rand(6)*3.0)
+        for Envelope, functions in [(LowerEnvelope,[f,LinearInterp(np.array([0.5,1.0]),np.array([0.5,1.0]))]),
+                                    (LowerEnvelope,[g,h]),(UpperEnvelope,[g,h])]:
+            resolved = Envelope(*functions,resolve=True)
+            generic = Envelope(*functions)
+            self.assertTrue(np.allclose(resolved(x),generic(x),equal_nan=True))
+            self.assertTrue(resolved.resolved is not None)
+            self.assertTrue(np.allclose(resolved.derivative(x),generic.derivative(x),equal_nan=True))
+
+    def test_evaluation_does_not_resolve(self):
+        # Evaluating an envelope never changes it, however many points it is evaluated at
+        RNG = np.random.RandomState(0)
+        f = LinearInterp(np.linspace(0.0,10.0,12),np.sqrt(np.linspace(0.0,10.0,12)) + 1.0)
+        g = LinearInterp(np.array([-0.5,10.0]),np.array([0.0,4.0]))
+        envelope = LowerEnvelope(f,g)
+        x = RNG.rand(3000)*12.0
+        y = envelope(x)
+        for j in range(5):
+            self.assertTrue(np.array_equal(envelope(x),y))
+            self.assertTrue(envelope.resolved is None)
+        self.assertTrue(flatForm(envelope)[0] is envelope)
+
+    def test_unknown_keyword(self):
+        f = LinearInterp(np.array([0.0,1.0]),np.array([0.0,1.0]))
+        for Envelope in [LowerEnvelope,UpperEnvelope,LowerEnvelope2D]:
+            self.assertRaises(TypeError,Envelope,f,f,resolve_after=0)
+
+    def test_eval_flat(self):
+        # Evaluating a resolved envelope through its flatForm gives the same levels and
+        # derivatives as the envelope, in the shape of the input, even where the
+        # resolved form does not apply (below the bottom gridpoint of f)
+        x = np.linspace(-1.0,12.0,120).reshape((10,12))
+        f = LinearInterp(np.linspace(0.0,10.0,12),np.sqrt(np.linspace(0.0,10.0,12)) + 1.0)
+        g = LinearInterp(np.array([-0.5,10.0]),np.array([0.0,4.0]))
+        envelope = LowerEnvelope(f,g)
+        resolved = LowerEnvelope(f,g,resolve=True)
+        self.assertTrue(flatForm(resolved)[0] is resolved.resolved)
+        y, dydx = evalFlat(resolved,x,derivative=True)
+        self.assertEqual(y.shape,x.shape)
+        self.assertTrue(np.allclose(evalFlat(resolved,x),envelope(x),equal_nan=True))
+        self.assertTrue(np.allclose(y,envelope.eval_with_derivative(x)[0],equal_nan=True))
+        self.assertTrue(np.allclose(dydx,envelope.derivative(x),equal_nan=True))
+        self.assertTrue(np.isfinite(y[x >= -0.5]).all())
+
+class testsForCurvilinear2DInterp(unittest.TestCase):
+
+    def test_sector_index(self):
+        # Starting the walk from the bucket grid finds the same sectors as starting
+        # from the center of the grid, both inside and outside of the grid
+        aGrid, pGrid = np.meshgrid(makeGridExpMult(0.001,20.0,30,3),np.linspace(0.3,3.0,10),indexing='ij')
+        cGrid = (0.5 + 0.3*np.sqrt(aGrid))*pGrid**0.9
+        mGrid = aGrid*pGrid + cGrid
+        RNG = np.random.RandomState(0)
+        m = RNG.rand(5000)*70.0 - 1.0
+        p = RNG.rand(5000)*3.2 + 0.2
+        walk_interp = Curvilinear2DInterp(cGrid,mGrid,pGrid,bucket_count=0)
+        fast_interp = Curvilinear2DInterp(cGrid,mGrid,pGrid)
+        self.assertTrue(np.array_equal(walk_interp.findSector(m,p),fast_interp.findSector(m,p)))
+        self.assertTrue(np.allclose(walk_interp(m,p),fast_interp(m,p),equal_nan=True))
+
+class testsForJit(unittest.TestCase):
+
+    def setUp(self):
+        # Without Numba the kernels are run as plain Python, which does the same
+        # floating point operations in the same order
+        HARKinterpolation.numba_available = True
+
+    def tearDown(self):
+        HARKinterpolation.numba_available = numba_available
+        HARKinterpolation.interp_backend = 'numpy'
+
+    def check_backends(self,evaluate):
+        # The kernels give exactly the same results as the NumPy code
+        HARKinterpolation.interp_backend = 'numpy'
+        expected = evaluate()
+        HARKinterpolation.interp_backend = 'numba'
+        for result, target in zip(evaluate(),expected):
+            result = np.asarray(result)
+            target = np.asarray(target)
+            self.assertEqual(result.shape,target.shape)
+            self.assertTrue(np.array_equal(np.isnan(result),np.isnan(target)))
+            self.assertTrue(np.array_equal(result[np.logical_not(np.isnan(result))],target[np.logical_not(np.isnan(target))]))
+
+    def test_kernels(self):
+        RNG = np.random.RandomState(0)
+        x = np.concatenate((RNG.rand(1000)*14.0 - 2.0,[np.nan,np.inf,-np.inf,0.0,10.0,np.inf,-np.inf]))
+        y = np.concatenate((RNG.rand(1000)*4.0 - 1.0,[1.0,np.nan,2.0,np.inf,-np.inf,np.inf,-np.inf]))
+        grid = np.concatenate(([0.0],np.sort(RNG.rand(10))*10.0,[10.0]))
+        functions = [LinearInterp(grid,np.sqrt(grid) + 1.0,2.0,0.1),
+                     LinearInterp(grid,np.cumsum(RNG.rand(12)),lower_extrap=True,grid_type='auto'),
+                     CubicInterp(grid,np.sqrt(grid) + 1.0,0.5/np.sqrt(grid + 0.1)),
+                     CubicInterp(grid,np.sqrt(grid) + 1.0,0.5/np.sqrt(grid + 0.1),2.0,0.1,lower_extrap=True)]
+        for func in functions:
+            self.check_backends(lambda : func.eval_with_derivative(x) + (func(x),func.derivative(x)))
+        func = BilinearInterp(RNG.rand(12,7),grid,np.sort(RNG.rand(7))*3.0)
+        self.check_backends(lambda : (func(x,y),func.derivativeX(x,y),func.derivativeY(x,y)))
+        self.check_backends(lambda : func.eval_with_gradient(x,y))
+
+    def test_sectors(self):
+        aGrid, pGrid = np.meshgrid(makeGridExpMult(0.001,20.0,30,3),np.linspace(0.3,3.0,10),indexing='ij')
+        cGrid = (0.5 + 0.3*np.sqrt(aGrid))*pGrid**0.9
+        RNG = np.random.RandomState(0)
+        m = np.concatenate((RNG.rand(3000)*70.0 - 1.0,[np.nan,np.inf,-np.inf,1.0,1.0]))
+        p = np.concatenate((RNG.rand(3000)*3.2 + 0.2,[1.0,1.0,1.0,np.inf,-np.inf]))
+        for bucket_count in [0,None]:
+            make = lambda : Curvilinear2DInterp(cGrid,aGrid*pGrid + cGrid,pGrid,bucket_count=bucket_count)
+            self.check_backends(lambda : make().findSector(m,p) + (make()(m,p),))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,146 @@
+"""
+This file implements unit tests to check HARKparallel.py
+"""
+
+
+# First, bring in the files we want to test
+import sys
+import os
+sys.path.insert(0, os.path.abspath('../'))
+sys.path.insert(0, os.path.abspath('../ConsumptionSaving'))
+from HARKparallel import AgentPool
+from HARKcore import AgentType, Market, HARKobject
+
+# Bring in modules we need
+import unittest
+import threading
+import multiprocessing
+import numpy as np
+from copy import deepcopy
+import ConsumerParameters as Params
+from ConsIndShockModel import PerfForesightConsumerType
+
+def failingSolver(*args,**kwds):
+    raise ValueError('This one period solver always fails.')
+
+class SavingType(AgentType):
+    '''
+    A toy AgentType whose agents save half of their assets plus the aggregate
+    level sown by the market and a random income, one period at a time.
+    '''
+    def reset(self):
+        self.resetRNG()
+        self.t_sim = 0
+        self.aNow = np.zeros(self.AgentCount)
+        self.clearHistory()
+
+    def simOnePeriod(self):
+        self.aNow = 0.5*self.aNow + self.MNow + self.RNG.rand(self.AgentCount)
+
+    def marketAction(self):
+        self.simulate(1)
+
+def averageAssets(aNow):
+    product = HARKobject()
+    product.MNow = np.mean(np.concatenate(aNow))
+    return product
+
+class testsForParallelCultivator(unittest.TestCase):
+
+    def makeMarket(self,track_vars=['MNow']):
+        agents = []
+        for j, AgentCount in enumerate([50,80,30]):
+            agent = SavingType(seed=j,AgentCount=AgentCount,T_sim=12,time_inv=[],time_vary=[],track_vars=['aNow'])
+            agents.append(agent)
+        market = Market(agents=agents,sow_vars=['MNow'],reap_vars=['aNow'],track_vars=track_vars,
+                        millRule=averageAssets,act_T=12)
+        market.MNow_init = 1.0
+        return market
+
+    def test_matches_serial(self):
+        # Cultivating in worker processes sows and reaps the same values as the
+        # serial Market.cultivate, and the workers stop when the history is done
+        serial = self.makeMarket()
+        serial.makeHistory()
+        parallel = self.makeMarket()
+        parallel.cultivate_workers = 2
+        parallel.makeHistory()
+        self.assertTrue(np.array_equal(np.array(parallel.MNow_hist),np.array(serial.MNow_hist)))
+        for agent, agent_serial in zip(parallel.agents,serial.agents):
+            self.assertTrue(np.array_equal(agent.aNow,agent_serial.aNow))
+            self.assertTrue(np.array_equal(agent.aNow_hist,agent_serial.aNow_hist))
+        for aNow, aNow_serial in zip(parallel.aNow,serial.aNow):
+            self.assertTrue(np.array_equal(aNow,aNow_serial))
+        self.assertEqual(multiprocessing.active_children(),[])
+
+    def test_tracked_reap_vars(self):
+        # A tracked reaped variable keeps each period's values, as in the serial run
+        serial = self.makeMarket(track_vars=['MNow','aNow'])
+        serial.makeHistory()
+        parallel = self.makeMarket(track_vars=['MNow','aNow'])
+        parallel.cultivate_workers = 2
+        parallel.makeHistory()
+        self.assertEqual(len(parallel.aNow_hist),parallel.act_T)
+        for t in range(parallel.act_T):
+            self.assertEqual(parallel.MNow_hist[t],serial.MNow_hist[t])
+            for aNow, aNow_serial in zip(parallel.aNow_hist[t],serial.aNow_hist[t]):
+                self.assertTrue(np.array_equal(aNow,aNow_serial))
+        self.assertFalse(np.array_equal(parallel.aNow_hist[0][0],parallel.aNow_hist[-1][0]))
+        self.assertEqual(multiprocessing.active_children(),[])
+
+class testsForAgentPool(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = AgentPool(num_workers=2)
+        self.m = np.linspace(0.0,10.0,11)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def makeAgents(self,count):
+        agents = []
+        for j in range(count):
+            agent = PerfForesightConsumerType(**Params.init_perfect_foresight)
+            agent(DiscFac=0.9 + 0.02*j)
+            agents.append(agent)
+        return agents
+
+    def check_solutions(self,agents):
+        # Solutions from the pool match solving each type here
+        for agent in agents:
+            agent_here = deepcopy(agent)
+            agent_here.solve()
+            self.assertEqual(len(agent.solution),len(agent_here.solution))
+            for solution, solution_here in zip(agent.solution,agent_here.solution):
+                self.assertTrue(np.allclose(solution.cFunc(self.m),solution_here.cFunc(self.m)))
+
+    def test_worker_error(self):
+        # A type that fails in the first worker raises its error, and the other
+        # worker's reply is not left behind to be read by the next call
+        agents = self.makeAgents(3)
+        solver = agents[0].solveOnePeriod
+        agents[0].solveOnePeriod = failingSolver
+        self.assertRaises(ValueError,self.pool.solveAgents,agents)
+        agents[0].solveOnePeriod = solver
+        for agent in agents:
+            agent(DiscFac=agent.DiscFac - 0.01)
+        self.pool.solveAgents(agents)
+        self.check_solutions(agents)
+
+    def test_local_error(self):
+        # A type that cannot be pickled is solved here; when it fails, the workers'
+        # replies are still read before its error is raised
+        agents = self.makeAgents(3)
+        agents[2].lock = threading.Lock()
+        solver = agents[2].solveOnePeriod
+        agents[2].solveOnePeriod = failingSolver
+        self.assertRaises(ValueError,self.pool.solveAgents,agents)
+        agents[2].solveOnePeriod = solver
+        for agent in agents[:2]:
+            agent(DiscFac=agent.DiscFac - 0.01)
+        self.pool.solveAgents(agents)
+        del agents[2].lock
+        self.check_solutions(agents)
+
+if __name__ == '__main__':
+    unittest.main()
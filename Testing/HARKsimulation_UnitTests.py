@@ -0,0 +1,92 @@
+"""
+This file implements unit tests to check HARKsimulation.py
+"""
+
+
+# First, bring in the files we want to test
+import sys
+import os
+sys.path.insert(0, os.path.abspath('../'))
+from HARKsimulation import makeAliasTable, makeAliasTableStack, drawDiscreteStacked, drawUniformByIndex
+
+# Bring in modules we need
+import unittest
+import numpy as np
+from scipy.stats import chi2
+
+class testsForAliasTables(unittest.TestCase):
+
+    def setUp(self):
+        RNG = np.random.RandomState(0)
+        self.P_list = [np.array([0.25,0.25,0.25,0.25]),
+                       np.array([0.0,0.5,0.0,0.3,0.2]),
+                       np.array([0.97,0.01,0.01,0.01]),
+                       RNG.rand(7)*np.array([1.0,0.0,1.0,1.0,0.0,1.0,1.0])]
+        self.P_list = [P/np.sum(P) for P in self.P_list]
+
+    def test_shared_rows(self):
+        # Rows for a probability array that was already tabulated are copies of the
+        # first one's, and equal the rows built for an equal but separate array
+        P_list = [self.P_list[1],self.P_list[3],self.P_list[1],self.P_list[0],self.P_list[3]]
+        AliasPrb, AliasIdx, Counts = makeAliasTableStack(P_list)
+        AliasPrb_new, AliasIdx_new, Counts_new = makeAliasTableStack([np.copy(P) for P in P_list])
+        self.assertTrue(np.array_equal(AliasPrb,AliasPrb_new))
+        self.assertTrue(np.array_equal(AliasIdx,AliasIdx_new))
+        self.assertTrue(np.array_equal(Counts,Counts_new))
+        for j, P in enumerate(P_list):
+            AliasPrb_j, AliasIdx_j = makeAliasTable(P)
+            self.assertTrue(np.array_equal(AliasPrb[j,:P.size],AliasPrb_j))
+            self.assertTrue(np.array_equal(AliasIdx[j,:P.size],AliasIdx_j))
+
+    def test_table_probabilities(self):
+        # The probability of each outcome implied by the table is its probability
+        for P in self.P_list:
+            AliasPrb, AliasIdx = makeAliasTable(P)
+            K = P.size
+            implied = np.bincount(np.arange(K),AliasPrb,minlength=K) + np.bincount(AliasIdx,1.0-AliasPrb,minlength=K)
+            self.assertTrue(np.allclose(implied/K,P,rtol=1e-12,atol=1e-15))
+            self.assertTrue(np.all(implied[P == 0.0] == 0.0))
+
+    def test_frequencies(self):
+        # The frequency of each outcome among many draws matches its probability
+        AliasPrb, AliasIdx, Counts = makeAliasTableStack(self.P_list)
+        draw_count = 100000
+        base_draws = np.random.RandomState(1).rand(draw_count)
+        for j, P in enumerate(self.P_list):
+            events = drawDiscreteStacked(np.zeros(draw_count,dtype=int) + j,AliasPrb,AliasIdx,Counts,base_draws)
+            observed = np.bincount(events,minlength=P.size)
+            expected = P[P > 0.0]*draw_count
+            stat = np.sum((observed[P > 0.0] - expected)**2/expected)
+            self.assertTrue(stat < chi2.ppf(0.999,expected.size-1))
+
+    def test_never_drawn(self):
+        # Outcomes with zero probability and the padding columns of shorter rows
+        # are never drawn, even by the draws at the ends of [0,1)
+        AliasPrb, AliasIdx, Counts = makeAliasTableStack(self.P_list)
+        base_draws = np.concatenate((np.linspace(0.0,1.0,200001)[:-1],[np.nextafter(1.0,0.0)]))
+        for j, P in enumerate(self.P_list):
+            events = drawDiscreteStacked(np.zeros(base_draws.size,dtype=int) + j,AliasPrb,AliasIdx,Counts,base_draws)
+            self.assertTrue(np.all(events < Counts[j]))
+            self.assertTrue(np.all(P[events] > 0.0))
+
+    def test_split_by_period(self):
+        # Each agent's draw depends only on its own distribution and uniform draw,
+        # so drawing for all agents at once matches drawing period by period
+        AliasPrb, AliasIdx, Counts = makeAliasTableStack(self.P_list)
+        RNG = np.random.RandomState(2)
+        agent_count = 5000
+        base_draws = drawUniformByIndex(np.arange(agent_count),seed=3)
+        rows = RNG.randint(len(self.P_list),size=agent_count)
+        events = drawDiscreteStacked(rows,AliasPrb,AliasIdx,Counts,base_draws)
+        for j in range(len(self.P_list)):
+            these = rows == j
+            events_j = drawDiscreteStacked(rows[these],AliasPrb,AliasIdx,Counts,base_draws[these])
+            self.assertTrue(np.array_equal(events[these],events_j))
+        # Moving other agents to different periods leaves an agent's draw unchanged
+        rows_alt = RNG.randint(len(self.P_list),size=agent_count)
+        rows_alt[:100] = rows[:100]
+        events_alt = drawDiscreteStacked(rows_alt,AliasPrb,AliasIdx,Counts,base_draws)
+        self.assertTrue(np.array_equal(events_alt[:100],events[:100]))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -11,6 +11,8 @@ import HARKutilities
 
 # Bring in modules we need
 import unittest
+import shutil
+import tempfile
 import numpy as np
 
 class testsForHARKutilities(unittest.TestCase):
@@ -60,6 +62,168 @@ class testsForHARKutilities(unittest.TestCase):
     def test_CRRAutilityPPPP(self):
         # Test the fourth derivative of the utility function
         self.derivative_func_comparison(HARKutilities.CRRAutilityPPPP,HARKutilities.CRRAutilityPPP)   
+
+class testsForProductDistribution(unittest.TestCase):
+
+    def test_matches_combined(self):
+        # A product distribution acts like the combined list of arrays, and its expectation
+        # over an array with one axis per factor matches the sum over the combined points
+        perm = HARKutilities.approxMeanOneLognormal(5,0.1)
+        tran = HARKutilities.approxMeanOneLognormal(4,0.2)
+        agg = [np.array([0.3,0.7]),np.array([0.98,1.01]),np.array([1.02,0.99])]
+        dstn = HARKutilities.ProductDistribution(HARKutilities.ProductDistribution(perm,tran),agg)
+        combined = HARKutilities.combineIndepDstns(perm,tran,agg)
+        self.assertEqual(len(dstn),len(combined))
+        self.assertEqual(dstn.shape,(5,4,2))
+        for j in range(len(combined)):
+            self.assertTrue(np.array_equal(dstn[j],combined[j]))
+        a = np.linspace(0.0,5.0,7).reshape((7,1,1,1))
+        perm_vals, tran_vals, agg_perm, agg_tran = dstn.broadcastValues(lead=1)
+        X = (a/(perm_vals*agg_perm) + tran_vals*agg_tran)**-2.0
+        self.assertEqual(X.shape,(7,5,4,2))
+        EX = np.sum(combined[0]*(a.reshape((7,1))/(combined[1]*combined[3]) + combined[2]*combined[4])**-2.0,axis=1)
+        self.assertTrue(np.allclose(dstn.expectation(X),EX))
+        self.assertTrue(np.allclose(dstn.expectation(agg_tran),np.dot(agg[0],agg[2])))
+
+class testsForMarkovApproxToNormal(unittest.TestCase):
+
+    def setUp(self):
+        self.x_grid = np.linspace(-3.0,3.0,41)
+
+    def loopedApprox(self,mu,sigma,K=351,bound=3.5):
+        # The original implementation, which loops over the grid points
+        x_grid = self.x_grid
+        x_n = x_grid.size
+        raw_sample = np.linspace(-bound,bound,K)
+        f_weights = HARKutilities.stats.norm.pdf(raw_sample)
+        sample = mu + sigma*raw_sample
+        w_vec = np.zeros(x_n)
+        sample_pos = np.clip(np.searchsorted(x_grid,sample),1,x_n-1)
+        bot = x_grid[sample_pos-1]
+        top = x_grid[sample_pos]
+        alpha_clipped = np.clip((sample-bot)/(top-bot),0.,1.)
+        for j in range(1,x_n):
+            c = sample_pos == j
+            w_vec[j-1] = w_vec[j-1] + np.dot(f_weights[c],1.0-alpha_clipped[c])
+            w_vec[j] = w_vec[j] + np.dot(f_weights[c],alpha_clipped[c])
+        return w_vec/np.sum(w_vec)
+
+    def test_matches_looped(self):
+        for mu in [-4.0,-1.3,0.0,0.7,2.9]:
+            for sigma in [0.05,0.4,2.0]:
+                p_vec = HARKutilities.makeMarkovApproxToNormal(self.x_grid,mu,sigma)
+                self.assertTrue(np.allclose(p_vec,self.loopedApprox(mu,sigma),rtol=0.0,atol=1e-15))
+
+    def test_matrix_rows(self):
+        mu_vec = 0.9*self.x_grid
+        p_array = HARKutilities.makeMarkovApproxToNormalMatrix(self.x_grid,mu_vec,0.3)
+        self.assertEqual(p_array.shape,(41,41))
+        for i in range(mu_vec.size):
+            self.assertTrue(np.allclose(p_array[i,:],self.loopedApprox(mu_vec[i],0.3),rtol=0.0,atol=1e-15))
+
+    def test_monte_carlo_nearest(self):
+        # Each draw counts toward the nearest gridpoint, as with a full distance matrix
+        np.random.seed(0)
+        p_vec = HARKutilities.makeMarkovApproxToNormalByMonteCarlo(self.x_grid,0.2,1.0,N_draws=5000)
+        np.random.seed(0)
+        draws = np.random.normal(loc=0.2,scale=1.0,size=5000)
+        nearest = np.argmin(np.abs(self.x_grid[:,np.newaxis] - draws[np.newaxis,:]),axis=0)
+        self.assertTrue(np.array_equal(p_vec,np.bincount(nearest,minlength=41)/5000.0))
+
+class testsForAR1Discretization(unittest.TestCase):
+
+    def test_tauchen_matches_looped(self):
+        N, sigma, rho = 9, 0.2, 0.9
+        y, trans_matrix = HARKutilities.makeTauchenAR1(N,sigma,rho)
+        d = y[1]-y[0]
+        cdf = HARKutilities.stats.norm.cdf
+        for j in range(N):
+            for k in range(1,N-1):
+                self.assertAlmostEqual(trans_matrix[j,k],cdf((y[k] + d/2.0 - rho*y[j])/sigma) - cdf((y[k] - d/2.0 - rho*y[j])/sigma))
+            self.assertAlmostEqual(trans_matrix[j,0],cdf((y[0] + d/2.0 - rho*y[j])/sigma))
+            self.assertAlmostEqual(trans_matrix[j,N-1],1.0 - cdf((y[N-1] - d/2.0 - rho*y[j])/sigma))
+
+    def test_rouwenhorst_moments(self):
+        # The Rouwenhorst chain has exactly the variance and autocorrelation of the process
+        y, trans_matrix = HARKutilities.makeRouwenhorstAR1(11,0.2,0.95)
+        self.assertTrue(np.allclose(np.sum(trans_matrix,axis=1),1.0))
+        ergodic = np.linalg.matrix_power(trans_matrix.T,5000)[:,0]
+        var = np.dot(ergodic,y**2)
+        self.assertAlmostEqual(var,0.04/(1.0-0.95**2))
+        self.assertAlmostEqual(np.dot(ergodic,y*np.dot(trans_matrix,y))/var,0.95)
+
+    def test_tauchen_hussey_rows(self):
+        y, trans_matrix = HARKutilities.makeTauchenHusseyAR1(15,0.2,0.5)
+        self.assertEqual(trans_matrix.shape,(15,15))
+        self.assertTrue(np.allclose(np.sum(trans_matrix,axis=1),1.0))
+        self.assertTrue(np.allclose(y,-y[::-1]))
+
+    def test_sparse_truncation(self):
+        y, trans_matrix = HARKutilities.makeTauchenAR1(50,0.1,0.9)
+        y, trans_sparse = HARKutilities.makeTauchenAR1(50,0.1,0.9,prob_cutoff=1e-8)
+        self.assertTrue(HARKutilities.sparse.isspmatrix_csr(trans_sparse))
+        self.assertTrue(trans_sparse.nnz < 50*50)
+        self.assertTrue(np.allclose(np.asarray(trans_sparse.sum(axis=1)).flatten(),1.0))
+        self.assertTrue(np.allclose(trans_sparse.toarray(),trans_matrix,atol=1e-6))
+
+class testsForMemoize(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = 0
+        def total(x, scale=1.0):
+            self.calls += 1
+            return [np.sum(x)*scale, [x]]
+        self.total = total
+
+    def test_array_contents(self):
+        # Large arrays whose printed summaries are equal are still told apart
+        total = HARKutilities.memoize(self.total)
+        a = np.arange(5000.0)
+        b = a.copy()
+        b[2500] = 0.0
+        self.assertEqual(str(a),str(b))
+        self.assertEqual(total(a)[0],np.sum(a))
+        self.assertEqual(total(b)[0],np.sum(b))
+        self.assertEqual(total(a.copy())[0],np.sum(a))
+        self.assertEqual(self.calls,2)
+        self.assertEqual(total.cache_info().hits,1)
+
+    def test_eviction(self):
+        total = HARKutilities.memoize(maxsize=2)(self.total)
+        total(np.ones(3))
+        total(np.ones(4))
+        total(np.ones(3)) # Now np.ones(4) is the least recently used
+        total(np.ones(5))
+        self.assertEqual(total.cache_info().size,2)
+        total(np.ones(3))
+        self.assertEqual(self.calls,3)
+        total(np.ones(4))
+        self.assertEqual(self.calls,4)
+        total = HARKutilities.memoize(maxbytes=100)(self.total)
+        total(np.ones(10))
+        total(np.ones(11))
+        self.assertEqual(total.cache_info().size,1)
+
+    def test_lists_copied(self):
+        total = HARKutilities.memoize(self.total)
+        result = total(np.ones(3),scale=2.0)
+        result[1].reverse()
+        result[1].append(None)
+        self.assertEqual(len(total(np.ones(3),scale=2.0)[1]),1)
+        self.assertEqual(self.calls,1)
+
+    def test_disk_cache(self):
+        cache_dir = tempfile.mkdtemp()
+        try:
+            total = HARKutilities.memoize(cache_dir=cache_dir)(self.total)
+            total(np.arange(4.0),scale=3.0)
+            total.cache_clear()
+            result = total(np.arange(4.0),scale=3.0)
+            self.assertEqual(result[0],18.0)
+            self.assertEqual(self.calls,1)
+            self.assertEqual(total.cache_info().disk_hits,1)
+        finally:
+            shutil.rmtree(cache_dir)
             
 if __name__ == '__main__':
     print('testing Harkutilities.py')
@@ -0,0 +1,84 @@
+'''
+A benchmark of evaluating LinearInterpOnInterp1D on the query points that the
+aggregate shocks solver actually gives it.  The points of one period's solve of
+solveConsAggShock are recorded, and evaluated through the packed stack of the
+children in one pass, one cell of the Mgrid at a time by the unpacked children,
+and by the default choice between the two (see cell_loop_min_points).  The same
+is done on randomly drawn points spread over many children, where a single pass
+through the stack is faster.
+'''
+import sys
+import os
+sys.path.insert(0, os.path.abspath('../'))
+sys.path.insert(0, os.path.abspath('../ConsumptionSaving'))
+
+import numpy as np
+from time import clock
+import HARKinterpolation
+from HARKinterpolation import LinearInterp, LinearInterpOnInterp1D
+import ConsumerParameters as Params
+from ConsAggShockModel import AggShockConsumerType, CobbDouglasEconomy, solveConsAggShock
+mystr = lambda number : "{:.1f}".format(number)
+
+def timeEval(function,x,y,reps=5):
+    '''
+    Returns the average time to evaluate a function at x,y, in milliseconds.
+    '''
+    start_time = clock()
+    for j in range(reps):
+        function(x,y)
+    return (clock() - start_time)/reps*1000
+
+def timePaths(function,x,y,name):
+    '''
+    Times a LinearInterpOnInterp1D on the query points x,y through its stack, one
+    cell at a time, and by the default choice, checking that all give the same values.
+    '''
+    default = HARKinterpolation.cell_loop_min_points
+    HARKinterpolation.cell_loop_min_points = np.inf
+    stack_time = timeEval(function,x,y)
+    f_stack = function(x,y)
+    HARKinterpolation.cell_loop_min_points = 0
+    cell_time = timeEval(function,x,y)
+    f_cell = function(x,y)
+    HARKinterpolation.cell_loop_min_points = default
+    default_time = timeEval(function,x,y)
+    assert np.allclose(f_stack,f_cell,equal_nan=True)
+    print(name + ', ' + str(x.size) + ' points: ' + mystr(stack_time) + ' ms through the stack, ' +
+          mystr(cell_time) + ' ms by cells, ' + mystr(default_time) + ' ms by default.')
+
+if __name__ == '__main__':
+    # Solve the aggregate shocks example, then record the points of the largest
+    # LinearInterpOnInterp1D evaluation in one more period's solve
+    os.chdir('../ConsumptionSaving')
+    AggShockExample = AggShockConsumerType(**Params.init_agg_shocks)
+    AggShockExample.cycles = 0
+    EconomyExample = CobbDouglasEconomy(agents=[AggShockExample],**Params.init_cobb_douglas)
+    EconomyExample.makeAggShkHist()
+    AggShockExample.getEconomyData(EconomyExample)
+    AggShockExample.solve()
+    queries = []
+    evaluate = LinearInterpOnInterp1D._evaluate
+    def recordQuery(self,x,y):
+        queries.append((self,x,y))
+        return evaluate(self,x,y)
+    LinearInterpOnInterp1D._evaluate = recordQuery
+    solveConsAggShock(AggShockExample.solution[0],AggShockExample.IncomeDstn[0],AggShockExample.LivPrb[0],
+                      AggShockExample.DiscFac,AggShockExample.CRRA,AggShockExample.PermGroFac[0],
+                      AggShockExample.PermGroFacAgg,AggShockExample.aXtraGrid,AggShockExample.BoroCnstArt,
+                      AggShockExample.Mgrid,AggShockExample.AFunc,AggShockExample.Rfunc,
+                      AggShockExample.wFunc,AggShockExample.DeprFac)
+    LinearInterpOnInterp1D._evaluate = evaluate
+    function, x, y = max(queries,key=lambda query : query[1].size)
+    timePaths(function,x,y,'Aggregate shocks solver, ' + str(len(function.xInterpolators)) + ' children')
+
+    # Random points spread over many children
+    RNG = np.random.RandomState(0)
+    grid = np.linspace(0.0,20.0,25)**1.5
+    for child_count in [13,200]:
+        function = LinearInterpOnInterp1D([LinearInterp(grid,np.sqrt(grid)*(1.0+0.01*j)) for j in range(child_count)],
+                                          np.arange(child_count,dtype=float))
+        for query_count in [10**3,10**4,10**5]:
+            x = RNG.rand(query_count)*80.0
+            y = RNG.rand(query_count)*(child_count-1)
+            timePaths(function,x,y,'Random points, ' + str(child_count) + ' children')
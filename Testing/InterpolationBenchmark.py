@@ -0,0 +1,50 @@
+'''
+A benchmark of evaluating 1D interpolations at a million query points.  LinearInterp
+and CubicInterp find the grid segment of each query point with np.searchsorted by
+default; when the grid comes from a known family (evenly spaced, exponentially
+spaced, or multi-exponentially spaced by makeGridExpMult), they can instead compute
+it in closed form (grid_type='auto').  Both are timed on grids of several families
+and sizes, and checked to give the same values.
+'''
+import sys
+import os
+sys.path.insert(0, os.path.abspath('../'))
+
+import numpy as np
+from time import clock
+from HARKutilities import makeGridExpMult
+from HARKinterpolation import LinearInterp, CubicInterp
+mystr = lambda number : "{:.1f}".format(number)
+
+def timeEval(function,x,reps=5):
+    '''
+    Returns the average time to evaluate a function at x, in milliseconds.
+    '''
+    start_time = clock()
+    for j in range(reps):
+        function(x)
+    return (clock() - start_time)/reps*1000
+
+if __name__ == '__main__':
+    query_count = 10**6
+    RNG = np.random.RandomState(0)
+    x = RNG.rand(query_count)*20.0
+    for grid_size in [48,300,3000]:
+        grids = [('uniform',np.linspace(0.001,20.0,grid_size)),
+                 ('log',np.exp(np.linspace(np.log(0.001),np.log(20.0),grid_size))),
+                 ('exp_mult (1 nest)',makeGridExpMult(0.001,20.0,grid_size,1)),
+                 ('exp_mult (3 nests)',makeGridExpMult(0.001,20.0,grid_size,3))]
+        for grid_name, grid in grids:
+            slow = LinearInterp(grid,np.log(grid),lower_extrap=True)
+            fast = LinearInterp(grid,np.log(grid),lower_extrap=True,grid_type='auto')
+            assert np.allclose(slow(x),fast(x))
+            slow_time = timeEval(slow,x)
+            fast_time = timeEval(fast,x)
+            slow_cubic = CubicInterp(grid,np.log(grid),1.0/grid,lower_extrap=True)
+            fast_cubic = CubicInterp(grid,np.log(grid),1.0/grid,lower_extrap=True,grid_type='auto')
+            assert np.allclose(slow_cubic(x),fast_cubic(x))
+            slow_cubic_time = timeEval(slow_cubic,x)
+            fast_cubic_time = timeEval(fast_cubic,x)
+            print(str(grid_size) + ' point ' + grid_name + ' grid: LinearInterp took ' + mystr(slow_time) +
+                  ' ms with searchsorted and ' + mystr(fast_time) + ' ms with GridSearch; CubicInterp took ' +
+                  mystr(slow_cubic_time) + ' ms and ' + mystr(fast_cubic_time) + ' ms.')
@@ -0,0 +1,67 @@
+'''
+A benchmark of the compiled kernels in HARKjit against the NumPy code in
+HARKinterpolation.  LinearInterp, CubicInterp, BilinearInterp, and the sector search
+of Curvilinear2DInterp are each timed with interp_backend = 'numpy' and 'numba',
+after a first call that compiles the kernels, and checked to give the same values.
+If Numba is not installed, only the NumPy times are reported.
+'''
+import sys
+import os
+sys.path.insert(0, os.path.abspath('../'))
+
+import numpy as np
+from time import clock
+import HARKinterpolation
+from HARKjit import numba_available
+from HARKutilities import makeGridExpMult
+from HARKinterpolation import LinearInterp, CubicInterp, BilinearInterp, Curvilinear2DInterp
+mystr = lambda number : "{:.1f}".format(number)
+
+def timeCall(function,reps=5):
+    '''
+    Returns the shortest time to call a function with no arguments, in milliseconds.
+    '''
+    times = []
+    for j in range(reps):
+        start_time = clock()
+        function()
+        times.append(clock() - start_time)
+    return min(times)*1000
+
+if __name__ == '__main__':
+    query_count = 10**6
+    RNG = np.random.RandomState(0)
+    x = RNG.rand(query_count)*22.0 - 1.0
+    y = RNG.rand(query_count)*3.0
+    grid = makeGridExpMult(0.001,20.0,48,3)
+    y_grid = np.linspace(0.0,3.0,16)
+    aGrid, pGrid = np.meshgrid(makeGridExpMult(0.001,20.0,48,3),np.linspace(0.3,3.0,16),indexing='ij')
+    cGrid = (0.5 + 0.3*np.sqrt(aGrid))*pGrid**0.9
+    m = RNG.rand(query_count)*40.0
+    p = RNG.rand(query_count)*2.6 + 0.35
+
+    linear = LinearInterp(grid,np.log(grid),1.0,0.05)
+    cubic = CubicInterp(grid,np.log(grid),1.0/grid,lower_extrap=True)
+    bilinear = BilinearInterp(np.outer(np.log(grid),y_grid + 1.0),grid,y_grid)
+    curvilinear = Curvilinear2DInterp(cGrid,aGrid*pGrid + cGrid,pGrid)
+    tasks = [('LinearInterp',lambda : linear.eval_with_derivative(x)),
+             ('CubicInterp',lambda : cubic.eval_with_derivative(x)),
+             ('BilinearInterp',lambda : bilinear.eval_with_gradient(x,y)),
+             ('Curvilinear2DInterp.findSector',lambda : curvilinear.findSector(m,p))]
+
+    backends = ['numpy','numba'] if numba_available else ['numpy']
+    if not numba_available:
+        print('Numba is not installed, so only the NumPy kernels are timed.')
+    print('Milliseconds to evaluate at ' + str(query_count) + ' points:')
+    print('{:<32}'.format('') + ''.join(['{:>10}'.format(backend) for backend in backends]))
+    for name, task in tasks:
+        times = []
+        results = []
+        for backend in backends:
+            HARKinterpolation.interp_backend = backend
+            results.append(task())
+            times.append(timeCall(task))
+        for result in results[1:]:
+            assert all(np.allclose(a,b,equal_nan=True) for a, b in zip(result,results[0]))
+        print('{:<32}'.format(name) + ''.join(['{:>10}'.format(mystr(t)) for t in times]))
+    HARKinterpolation.interp_backend = 'numpy'
@@ -0,0 +1,79 @@
+'''
+A benchmark of the consumption function evaluations made in each simulated period.
+An IndShockConsumerType and an AggShockConsumerType are solved and simulated, and
+the time per simulated period is reported.  Then the evaluation each of them makes
+in getControls is timed on its simulated states in three ways: with the states as
+2D arrays (which the evaluation methods copy into flat arrays and reshape back),
+as 1D arrays (which they use without copying), and as 1D arrays with caller-provided
+output arrays (out=), which could be reused from period to period instead of being
+allocated anew.
+'''
+import sys
+import os
+sys.path.insert(0, os.path.abspath('../'))
+sys.path.insert(0, os.path.abspath('../ConsumptionSaving'))
+
+import numpy as np
+from time import clock
+import ConsumerParameters as Params
+from ConsIndShockModel import IndShockConsumerType
+from ConsAggShockModel import AggShockConsumerType, CobbDouglasEconomy
+mystr = lambda number : "{:.2f}".format(number)
+
+def timeCall(function,reps=50):
+    '''
+    Returns the average time to call a function with no arguments, in milliseconds.
+    '''
+    start_time = clock()
+    for j in range(reps):
+        function()
+    return (clock() - start_time)/reps*1000
+
+if __name__ == '__main__':
+    sim_periods = 200
+
+    # Solve and simulate an idiosyncratic shocks consumer type
+    IndShockExample = IndShockConsumerType(**Params.init_idiosyncratic_shocks)
+    IndShockExample(cycles = 0, T_sim = sim_periods, track_vars = ['mNrmNow'])
+    IndShockExample.solve()
+    IndShockExample.initializeSim()
+    start_time = clock()
+    IndShockExample.simulate()
+    sim_time = (clock() - start_time)/sim_periods*1000
+    print('IndShockConsumerType with ' + str(IndShockExample.AgentCount) + ' agents: ' + mystr(sim_time) + ' ms per simulated period.')
+
+    mNrm = IndShockExample.mNrmNow.copy()
+    t_cycle = IndShockExample.t_cycle.copy()
+    cBuffer = np.empty_like(mNrm)
+    MPCbuffer = np.empty_like(mNrm)
+    bank = IndShockExample.cFuncBank
+    shaped_time = timeCall(lambda : bank.eval_with_derivative(mNrm.reshape((10,-1)),t_cycle.reshape((10,-1))))
+    flat_time = timeCall(lambda : bank.eval_with_derivative(mNrm,t_cycle))
+    out_time = timeCall(lambda : bank.eval_with_derivative(mNrm,t_cycle,out=(cBuffer,MPCbuffer)))
+    print('    cFuncBank.eval_with_derivative: ' + mystr(shaped_time) + ' ms on 2D arrays, ' + mystr(flat_time) +
+          ' ms on 1D arrays, ' + mystr(out_time) + ' ms into output buffers.')
+
+    # Solve and simulate an aggregate shocks consumer type in a Cobb-Douglas economy
+    AggShockExample = AggShockConsumerType(**Params.init_agg_shocks)
+    AggShockExample.cycles = 0
+    EconomyExample = CobbDouglasEconomy(agents = [AggShockExample],**Params.init_cobb_douglas)
+    EconomyExample.makeAggShkHist()
+    AggShockExample.getEconomyData(EconomyExample)
+    AggShockExample.solve()
+    EconomyExample.act_T = sim_periods
+    start_time = clock()
+    EconomyExample.makeHistory()
+    sim_time = (clock() - start_time)/sim_periods*1000
+    print('AggShockConsumerType with ' + str(AggShockExample.AgentCount) + ' agents: ' + mystr(sim_time) + ' ms per simulated period.')
+
+    mNrm = AggShockExample.mNrmNow.copy()
+    Magg = AggShockExample.getMaggNow()
+    cFunc = AggShockExample.solution[0].cFunc
+    cBuffer = np.empty_like(mNrm)
+    MPCbuffer = np.empty_like(mNrm)
+    shaped_time = timeCall(lambda : (cFunc(mNrm.reshape((10,-1)),Magg.reshape((10,-1))),
+                                     cFunc.derivativeX(mNrm.reshape((10,-1)),Magg.reshape((10,-1)))))
+    flat_time = timeCall(lambda : (cFunc(mNrm,Magg),cFunc.derivativeX(mNrm,Magg)))
+    out_time = timeCall(lambda : (cFunc(mNrm,Magg,out=cBuffer),cFunc.derivativeX(mNrm,Magg,out=MPCbuffer)))
+    print('    cFunc and cFunc.derivativeX: ' + mystr(shaped_time) + ' ms on 2D arrays, ' + mystr(flat_time) +
+          ' ms on 1D arrays, ' + mystr(out_time) + ' ms into output buffers.')
@@ -0,0 +1,91 @@
+'''
+A benchmark of the per-period "plumbing" overhead of AgentType.simulate and of
+Market.mill: storing tracked variables in their histories and gathering the
+inputs of the millRule.  These used to be done by building code strings and
+running exec/eval every period; they now use attribute getters and history
+arrays that are looked up once per simulation.  Both versions are timed on a
+trivial agent type whose simOnePeriod does no work, so the times measure only
+the overhead.  The old versions are reproduced here for comparison.
+'''
+import sys
+import os
+sys.path.insert(0, os.path.abspath('../'))
+
+import numpy as np
+from time import clock
+from HARKcore import AgentType, Market, HARKobject
+mystr = lambda number : "{:.2f}".format(number)
+
+class IdleType(AgentType):
+    '''
+    An agent type with many tracked variables that does nothing each period.
+    '''
+    def __init__(self,var_count,**kwds):
+        AgentType.__init__(self,solution_terminal=None,**kwds)
+        self.track_vars = ['x' + str(i) for i in range(var_count)]
+        for var_name in self.track_vars:
+            setattr(self,var_name,np.ones(self.AgentCount))
+        self.read_shocks = False
+        self.time_flow = True
+
+    def simOnePeriod(self):
+        pass
+
+    def simulateOld(self,sim_periods):
+        for t in range(sim_periods):
+            self.simOnePeriod()
+            for var_name in self.track_vars:
+                exec('self.' + var_name + '_hist[self.t_sim,:] = self.' + var_name)
+            self.t_sim += 1
+
+def millOld(self):
+    reap_vars_string = ''
+    for name in self.reap_vars:
+        reap_vars_string += ' \'' + name + '\' : self.' + name + ','
+    const_vars_string = ''
+    for name in self.const_vars:
+        const_vars_string += ' \'' + name + '\' : self.' + name + ','
+    mill_dict = eval('{' + reap_vars_string + const_vars_string + '}')
+    product = self.millRule(**mill_dict)
+    for j in range(len(self.sow_vars)):
+        this_var = self.sow_vars[j]
+        setattr(self,this_var,getattr(product,this_var))
+
+if __name__ == '__main__':
+    T_sim = 1000
+    var_count = 20
+
+    # Time the recording of tracked variables in AgentType.simulate
+    MyType = IdleType(var_count,AgentCount=100,T_sim=T_sim)
+    MyType.t_sim = 0
+    MyType.clearHistory()
+    start_time = clock()
+    MyType.simulateOld(T_sim)
+    old_time = clock() - start_time
+
+    MyType.t_sim = 0
+    MyType.clearHistory()
+    start_time = clock()
+    MyType.simulate(T_sim)
+    new_time = clock() - start_time
+    print('Recording ' + str(var_count) + ' tracked variables took ' + mystr(old_time/T_sim*1e6) +
+          ' microseconds per period with exec and ' + mystr(new_time/T_sim*1e6) + ' with precompiled getters.')
+
+    # Time the gathering of millRule inputs in Market.mill
+    reap_vars = ['r' + str(i) for i in range(var_count//2)]
+    const_vars = ['c' + str(i) for i in range(var_count//2)]
+    def millRule(**kwds):
+        return HARKobject()
+    MyMarket = Market(agents=[],reap_vars=reap_vars,const_vars=const_vars,millRule=millRule)
+    for name in reap_vars + const_vars:
+        setattr(MyMarket,name,1.0)
+    start_time = clock()
+    for t in range(T_sim):
+        millOld(MyMarket)
+    old_time = clock() - start_time
+    start_time = clock()
+    for t in range(T_sim):
+        MyMarket.mill()
+    new_time = clock() - start_time
+    print('Gathering ' + str(var_count) + ' millRule inputs took ' + mystr(old_time/T_sim*1e6) +
+          ' microseconds per period with eval and ' + mystr(new_time/T_sim*1e6) + ' with getattr.')
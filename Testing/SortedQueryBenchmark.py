@@ -0,0 +1,51 @@
+'''
+A benchmark of locating sorted query points in the grid of a 1D interpolation.
+np.searchsorted does a binary search for every query point; when the queries are
+sorted (as the rows of next period's market resources in the EGM solver are, or
+the states of simulated agents once they are sorted), mergeSearch merges them with
+the grid instead.  Both are timed on grids of 48 to 200 gridpoints and 10^3 to 10^6
+query points, with the queries sorted as a whole and in rows, along with LinearInterp
+evaluated with and without the sorted_x hint.
+'''
+import sys
+import os
+sys.path.insert(0, os.path.abspath('../'))
+
+import numpy as np
+from time import clock
+from HARKinterpolation import LinearInterp, mergeSearch
+mystr = lambda number : "{:.1f}".format(number)
+
+def timeCall(function,reps):
+    '''
+    Returns the average time to call a function with no arguments, in microseconds.
+    '''
+    start_time = clock()
+    for j in range(reps):
+        function()
+    return (clock() - start_time)/reps*10**6
+
+if __name__ == '__main__':
+    RNG = np.random.RandomState(0)
+    for grid_size in [48,100,200]:
+        grid = np.sort(RNG.rand(grid_size))*20.0
+        func = LinearInterp(grid,np.sqrt(grid),lower_extrap=True)
+        for query_count in [10**3,10**4,10**5,10**6]:
+            reps = max(10**6//query_count,3)
+            x = np.sort(RNG.rand(query_count))*21.0 - 0.5
+            assert np.array_equal(mergeSearch(grid,x),np.searchsorted(grid,x))
+            search_time = timeCall(lambda : np.searchsorted(grid,x),reps)
+            merge_time = timeCall(lambda : mergeSearch(grid,x),reps)
+            eval_time = timeCall(lambda : func(x),reps)
+            sorted_time = timeCall(lambda : func(x,sorted_x=True),reps)
+            print(str(grid_size) + ' gridpoints, ' + str(query_count) + ' sorted queries: searchsorted ' +
+                  mystr(search_time) + ' us, mergeSearch ' + mystr(merge_time) + ' us; LinearInterp ' +
+                  mystr(eval_time) + ' us, with sorted_x ' + mystr(sorted_time) + ' us.')
+            for row_size in [48,1024,8192]:
+                if row_size >= query_count:
+                    continue
+                rows = np.sort(RNG.rand(query_count//row_size,row_size)*21.0 - 0.5,axis=1).ravel()
+                search_time = timeCall(lambda : np.searchsorted(grid,rows),reps)
+                merge_time = timeCall(lambda : mergeSearch(grid,rows,row_size),reps)
+                print('    in rows of ' + str(row_size) + ': searchsorted ' + mystr(search_time) +
+                      ' us, mergeSearch ' + mystr(merge_time) + ' us.')
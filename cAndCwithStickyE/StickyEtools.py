@@ -12,6 +12,7 @@ import matplotlib.pyplot as plt
 from copy import deepcopy
 import subprocess
 from HARKutilities import CRRAutility
+from HARKcore import concatenateHistories, averageHistories
 from HARKinterpolation import LinearInterp
 from StickyEparams import results_dir, tables_dir, figures_dir, UpdatePrb, PermShkAggVar
 UpdatePrbBase = UpdatePrb
@@ -71,42 +72,36 @@ def makeStickyEdataFile(Economy,ignore_periods,description='',filename=None,save
     '''
     # Extract time series data from the economy
     if hasattr(Economy,'agents'): # If this is a heterogeneous agent specification...
-        if len(Economy.agents) > 1:
-            pLvlAll_hist = np.concatenate([this_type.pLvlTrue_hist for this_type in Economy.agents],axis=1)
-            aLvlAll_hist = np.concatenate([this_type.aLvlNow_hist for this_type in Economy.agents],axis=1)
-            cLvlAll_hist = np.concatenate([this_type.cLvlNow_hist for this_type in Economy.agents],axis=1)
-            yLvlAll_hist = np.concatenate([this_type.yLvlNow_hist for this_type in Economy.agents],axis=1)
-        else: # Don't duplicate the data unless necessary (with one type, concatenating is useless)
-            pLvlAll_hist = Economy.agents[0].pLvlTrue_hist
-            aLvlAll_hist = Economy.agents[0].aLvlNow_hist
-            cLvlAll_hist = Economy.agents[0].cLvlNow_hist
-            yLvlAll_hist = Economy.agents[0].yLvlNow_hist
+        # Micro histories are read from each type's HistoryStore a block of periods at a time
+        agents = Economy.agents
         # PermShkAggHist needs to be shifted one period forward
         PlvlAgg_hist = np.cumprod(np.concatenate(([1.0],Economy.PermShkAggHist[:-1]),axis=0))
-        AlvlAgg_hist = np.mean(aLvlAll_hist,axis=1) # Level of aggregate assets
+        AlvlAgg_hist = averageHistories(agents,'aLvlNow') # Level of aggregate assets
         AnrmAgg_hist = AlvlAgg_hist/PlvlAgg_hist # Normalized level of aggregate assets
-        ClvlAgg_hist = np.mean(cLvlAll_hist,axis=1) # Level of aggregate consumption
+        ClvlAgg_hist = averageHistories(agents,'cLvlNow') # Level of aggregate consumption
         CnrmAgg_hist = ClvlAgg_hist/PlvlAgg_hist # Normalized level of aggregate consumption
-        YlvlAgg_hist = np.mean(yLvlAll_hist,axis=1) # Level of aggregate income
+        YlvlAgg_hist = averageHistories(agents,'yLvlNow') # Level of aggregate income
         YnrmAgg_hist = YlvlAgg_hist/PlvlAgg_hist # Normalized level of aggregate income
         
         if calc_micro_stats: # Only calculate stats if requested.  This is a memory hog with many simulated periods
             micro_stat_periods = int((Economy.agents[0].T_sim-ignore_periods)*0.1)
-            not_newborns = (np.concatenate([this_type.t_age_hist[(ignore_periods+1):(ignore_periods+micro_stat_periods),:] for this_type in Economy.agents],axis=1) > 1).flatten()
-            Logc = np.log(cLvlAll_hist[ignore_periods:(ignore_periods+micro_stat_periods),:])
+            t0 = ignore_periods
+            t1 = ignore_periods+micro_stat_periods
+            not_newborns = (concatenateHistories(agents,'t_age',t0+1,t1) > 1).flatten()
+            Logc = np.log(concatenateHistories(agents,'cLvlNow',t0,t1))
             DeltaLogc = (Logc[1:] - Logc[0:-1]).flatten()
             DeltaLogc_trimmed = DeltaLogc[not_newborns]
-            Loga = np.log(aLvlAll_hist[ignore_periods:(ignore_periods+micro_stat_periods),:])
+            Loga = np.log(concatenateHistories(agents,'aLvlNow',t0,t1))
             DeltaLoga = (Loga[1:] - Loga[0:-1]).flatten()
             DeltaLoga_trimmed = DeltaLoga[not_newborns]
-            Logp = np.log(pLvlAll_hist[ignore_periods:(ignore_periods+micro_stat_periods),:])
+            Logp = np.log(concatenateHistories(agents,'pLvlTrue',t0,t1))
             DeltaLogp = (Logp[1:] - Logp[0:-1]).flatten()
             DeltaLogp_trimmed = DeltaLogp[not_newborns]
-            Logy = np.log(yLvlAll_hist[ignore_periods:(ignore_periods+micro_stat_periods),:])
+            Logy = np.log(concatenateHistories(agents,'yLvlNow',t0,t1))
             Logy_trimmed = Logy
             Logy_trimmed[np.isinf(Logy)] = np.nan
-            birth_events = np.concatenate([this_type.t_age_hist == 1 for this_type in Economy.agents],axis=1)
-            vBirth = calcValueAtBirth(cLvlAll_hist[ignore_periods:,:],birth_events[ignore_periods:,:],PlvlAgg_hist[ignore_periods:],Economy.MrkvNow_hist[ignore_periods:],Economy.agents[0].DiscFac,Economy.agents[0].CRRA)
+            birth_events = concatenateHistories(agents,'t_age',ignore_periods) == 1
+            vBirth = calcValueAtBirth(concatenateHistories(agents,'cLvlNow',ignore_periods),birth_events,PlvlAgg_hist[ignore_periods:],Economy.MrkvNow_hist[ignore_periods:],Economy.agents[0].DiscFac,Economy.agents[0].CRRA)
         
         BigTheta_hist = Economy.TranShkAggHist
         if hasattr(Economy,'MrkvNow'):
@@ -15,7 +15,7 @@ from time import clock
 from HARKutilities import approxMeanOneLognormal, combineIndepDstns, approxUniform, \
                           getPercentiles, getLorenzShares, calcSubpopAvg, approxLognormal
 from HARKsimulation import drawDiscrete
-from HARKcore import Market
+from HARKcore import Market, SolutionCache
 #from HARKparallel import multiThreadCommandsFake
 import SetupParamsCSTW as Params
 import ConsIndShockModel as Model
@@ -540,6 +540,9 @@ for j in range(len(EstimationAgentList)):
 # Make an economy for the consumers to live in
 EstimationEconomy = cstwMPCmarket(**Params.init_market)
 EstimationEconomy.agents = EstimationAgentList
+# Share a cache of converged solutions among the AgentTypes, so that each solution during
+# the parameter search starts from the nearest one already found
+EstimationEconomy.solution_cache = SolutionCache()
 EstimationEconomy.KYratioTarget = KY_target
 EstimationEconomy.LorenzTarget = lorenz_target
 EstimationEconomy.LorenzData = lorenz_long_data